@@ -1,38 +1,37 @@
-"""Back-fill message_id into every processed.json entry and per-receipt JSON file."""
-import imaplib, email, json, getpass
-from pathlib import Path
-
-user = input("Gmail address: ")
-password = getpass.getpass("App password: ")
-
-mail = imaplib.IMAP4_SSL("imap.gmail.com")
-mail.login(user, password)
-mail.select('"[Gmail]/All Mail"')
-
-
-def get_message_id(uid):
-    _, data = mail.uid("FETCH", uid, "(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])")
-    msg = email.message_from_bytes(data[0][1])
-    return msg["Message-ID"].strip()
-
-
-root = Path(__file__).parent / "output"
-
-for path in sorted(root.glob("*/*.json")):
-    raw = json.loads(path.read_text())
-    if path.name.endswith("_processed.json"):
-        changed = False
-        for entry in raw:
-            if "message_id" not in entry:
-                entry["message_id"] = get_message_id(entry["uid"])
-                print(f"  {path.parent.name}/{path.name}  uid={entry['uid']}")
-                changed = True
-        if changed:
-            path.write_text(json.dumps(raw, indent=2, ensure_ascii=False))
-    else:
-        if "message_id" not in raw:
-            raw["message_id"] = get_message_id(raw["uid"])
-            path.write_text(json.dumps(raw, indent=2, ensure_ascii=False))
-            print(f"  {path.parent.name}/{path.name}")
-
-mail.logout()
+"""
+Back-fill message_id into every processed.json entry and per-receipt JSON file
+that lacks one, from the UID's Message-ID header.
+
+Runs on archive_rewrite: the header lookups go one FETCH per batch, progress
+is resumable, REWRITE_DRY_RUN=1 only reports. Gmail credentials come from
+GMAIL_USER / GMAIL_APP_PASSWORD, the archive from OUTPUT_DIR.
+"""
+from archive_rewrite import Context, Rewrite, RewriteError, main
+
+
+class AddMessageId(Rewrite):
+    name = "add_message_id"
+    files = ("receipts", "ledgers")
+
+    def needs(self, data) -> list[str]:
+        entries = data if isinstance(data, list) else [data]
+        return [str(e["uid"]) for e in entries if "message_id" not in e and e.get("uid")]
+
+    def _message_id(self, uid: str, ctx: Context) -> str:
+        headers = ctx.headers.get(uid)
+        message_id = (headers["Message-ID"] or "").strip() if headers is not None else ""
+        if not message_id:
+            raise RewriteError(f"no Message-ID for uid {uid}")
+        return message_id
+
+    def apply(self, data, ctx: Context):
+        if isinstance(data, list):
+            return [e if "message_id" in e else {**e, "message_id": self._message_id(str(e["uid"]), ctx)}
+                    for e in data]
+        if "message_id" in data:
+            return data
+        return {**data, "message_id": self._message_id(str(data["uid"]), ctx)}
+
+
+if __name__ == "__main__":
+    main(AddMessageId())
@@ -0,0 +1,274 @@
+"""
+Rewriting the saved archive: visit every receipt file and/or month ledger under
+OUTPUT_DIR, transform it, write it back.
+
+A migration is a Rewrite subclass: which files it visits (`files`), which UIDs'
+headers it wants (`needs`, looked up in one bulk FETCH per batch) and the
+transform itself (`apply`). run() does the rest:
+
+- files go in batches of REWRITE_BATCH (default 50); each batch's header
+  lookups are one IMAP round trip, then the transforms run on a pool of
+  REWRITE_WORKERS threads (default 4), each with its own Gmail connection
+  for the transforms that need one (opened on first use);
+- progress is checkpointed as a job under OUTPUT_DIR/.runs/ (checkpoint.py),
+  so an interrupted run resumes where it stopped, and a file that failed is
+  tried again by the next run;
+- a file whose transform raises RewriteError (or fails in any other way) is
+  recorded and skipped; the run goes on;
+- REWRITE_DRY_RUN=1 writes nothing and reports which fields would change.
+
+The report is printed and saved as OUTPUT_DIR/.runs/rewrite_<name>_<timestamp>.json.
+Files are replaced atomically; ledgers under the same lock process_email
+takes, so a rewrite can run beside a fetch. Each rewritten file is published
+to the change journal (changes.py), so an open viewer picks it up.
+"""
+import glob
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.message import Message
+from typing import Callable
+
+import changes
+from checkpoint import RunCheckpoint
+from mailbox_wrapper import Mailbox
+from models import read_receipt, write_receipt
+from process_email import ledger_lock
+from raw_cache import RawCache
+
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/output")
+
+
+class RewriteError(Exception):
+    """A problem with one file: recorded in the report, the run goes on."""
+
+
+class Context:
+    """What a transform can use besides the file's data."""
+
+    def __init__(self, connect: Callable[[], Mailbox] | None, cache: RawCache | None,
+                 dry_run: bool = False):
+        self._connect = connect
+        self.cache = cache
+        self.dry_run = dry_run          # transforms writing files of their own skip that
+        self.headers: dict[str, Message] = {}
+        self._local = threading.local()
+        self._opened: list[Mailbox] = []
+        self._lock = threading.Lock()
+
+    def mailbox(self) -> Mailbox:
+        """This worker's own Gmail connection, logged into on first use."""
+        mb = getattr(self._local, "mailbox", None)
+        if mb is None:
+            if self._connect is None:
+                raise RewriteError("needs Gmail, but no credentials were given")
+            mb = self._local.mailbox = self._connect()
+            with self._lock:
+                self._opened.append(mb)
+        return mb
+
+    @property
+    def path(self) -> str:
+        """The absolute path of the file this worker is transforming."""
+        return self._local.path
+
+    def close(self) -> None:
+        for mb in self._opened:
+            mb.logout()
+        self._opened.clear()
+
+
+class Rewrite:
+    """One transform over the archive. Subclasses set name and files and
+    implement apply()."""
+
+    name = ""
+    files: tuple[str, ...] = ("receipts",)      # "receipts" and/or "ledgers"
+
+    def needs(self, data) -> list[str]:
+        """UIDs whose headers apply() will read from ctx.headers."""
+        return []
+
+    def apply(self, data, ctx: Context):
+        """Return the file's new content (or the same data if unchanged);
+        raise RewriteError to record a problem with this file."""
+        raise NotImplementedError
+
+
+def archive_files(kinds: tuple[str, ...]) -> list[str]:
+    """Receipt JSON files and/or month ledgers under OUTPUT_DIR, relative paths."""
+    paths = []
+    for p in sorted(glob.glob(os.path.join(OUTPUT_DIR, "*", "*.json"))):
+        kind = "ledgers" if p.endswith("_processed.json") else "receipts"
+        if kind in kinds:
+            paths.append(os.path.relpath(p, OUTPUT_DIR))
+    return paths
+
+
+def changed_fields(old, new) -> list[str]:
+    """Names of what differs between two versions of a file: top-level keys
+    of a receipt, "[].<key>" for ledger entries (by position)."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        return sorted(k for k in old.keys() | new.keys() if old.get(k) != new.get(k))
+    if isinstance(old, list) and isinstance(new, list):
+        fields = set()
+        if len(old) != len(new):
+            fields.add("[] count")
+        for a, b in zip(old, new):
+            fields.update(f"[].{k}" for k in changed_fields(a, b))
+        return sorted(fields)
+    return [] if old == new else ["(whole file)"]
+
+
+def _write(path: str, data) -> None:
+    if not path.endswith("_processed.json"):
+        write_receipt(path, data)       # the body compressed or not, per the setting
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _load(path: str):
+    if not path.endswith("_processed.json"):
+        return read_receipt(path)       # transforms always see "body"
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _rewrite_one(rewrite: Rewrite, rel: str, data, ctx: Context, dry_run: bool) -> list[str]:
+    """Transform and (unless dry_run) write back one file; returns what changed."""
+    path = ctx._local.path = os.path.join(OUTPUT_DIR, rel)
+    snapshot = json.loads(json.dumps(data))
+    new = rewrite.apply(data, ctx)
+    if rel.endswith("_processed.json") and not dry_run:
+        with ledger_lock(path):
+            # Entries appended since the batch was read keep their place.
+            current = _load(path)
+            if current != snapshot:
+                new = rewrite.apply(current, ctx)
+                snapshot = json.loads(json.dumps(current))
+            fields = changed_fields(snapshot, new)
+            if fields:
+                _write(path, new)
+                changes.publish(OUTPUT_DIR, "ledger", os.path.dirname(rel))
+        return fields
+    fields = changed_fields(snapshot, new)
+    if fields and not dry_run:
+        _write(path, new)
+        changes.publish(OUTPUT_DIR, "receipt", os.path.dirname(rel),
+                        base_name=os.path.basename(rel)[:-len(".json")])
+    return fields
+
+
+def run(rewrite: Rewrite, connect: Callable[[], Mailbox] | None = None,
+        workers: int = 4, batch_size: int = 50, dry_run: bool = False) -> dict:
+    """Run a rewrite over the archive; returns the report."""
+    paths = archive_files(rewrite.files)
+    checkpoint = None
+    todo = paths
+    if not dry_run:
+        checkpoint = RunCheckpoint(os.path.join(OUTPUT_DIR, ".runs"), f"rewrite_{rewrite.name}",
+                                   {"rewrite": rewrite.name})
+        if checkpoint.uids is None:
+            checkpoint.set_uids(paths)
+        else:
+            print(f"Resuming rewrite {rewrite.name}: {len(checkpoint.done)} of "
+                  f"{len(checkpoint.uids)} files already done")
+        todo = checkpoint.pending()
+
+    ctx = Context(connect, RawCache.from_env(), dry_run)
+    visited = changed = 0
+    failed: list[dict] = []
+    fields_changed: Counter[str] = Counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(todo), batch_size):
+                batch = todo[start:start + batch_size]
+                loaded = []
+                for rel in batch:
+                    try:
+                        loaded.append((rel, _load(os.path.join(OUTPUT_DIR, rel))))
+                    except (OSError, ValueError) as e:
+                        failed.append({"path": rel, "error": f"unreadable: {e}"})
+
+                uids = sorted({u for _, data in loaded for u in rewrite.needs(data)})
+                if uids:
+                    try:
+                        ctx.headers = ctx.mailbox().headers(uids)
+                    except Exception as e:  # the batch's files fail, not the run
+                        ctx.headers = {}
+                        print(f"header lookup for {len(uids)} UIDs failed: {e}")
+
+                def one(item):
+                    rel, data = item
+                    if checkpoint is not None:
+                        checkpoint.start(rel)
+                    return _rewrite_one(rewrite, rel, data, ctx, dry_run)
+
+                futures = [(rel, pool.submit(one, (rel, data))) for rel, data in loaded]
+                for rel, future in futures:
+                    visited += 1
+                    try:
+                        fields = future.result()
+                    except Exception as e:  # recorded in the report
+                        failed.append({"path": rel, "error": str(e)})
+                        print(f"FAILED {rel}: {e}")
+                        continue
+                    if fields:
+                        changed += 1
+                        fields_changed.update(fields)
+                        print(f"{'would change' if dry_run else 'changed'} {rel}: {', '.join(fields)}")
+                    if checkpoint is not None:
+                        checkpoint.finish(rel)
+    finally:
+        ctx.close()
+    return {"rewrite": rewrite.name, "dry_run": dry_run, "files": len(paths),
+            "visited": visited, "changed": changed, "failed": failed,
+            "fields": dict(fields_changed.most_common())}
+
+
+def print_report(r: dict) -> None:
+    verb = "would change" if r["dry_run"] else "changed"
+    print(f"\n{r['rewrite']}: {r['visited']} of {r['files']} files visited, "
+          f"{r['changed']} {verb}, {len(r['failed'])} failed")
+    for field, n in r["fields"].items():
+        print(f"  {field}: {n}")
+    for failure in r["failed"]:
+        print(f"  FAILED {failure['path']}: {failure['error']}")
+
+
+def connect_from_env() -> Callable[[], Mailbox] | None:
+    """Opens a Mailbox with GMAIL_USER / GMAIL_APP_PASSWORD; None if unset
+    (transforms that need Gmail then fail per file)."""
+    user = os.environ.get("GMAIL_USER")
+    password = os.environ.get("GMAIL_APP_PASSWORD")
+    if not user or not password:
+        return None
+    return lambda: Mailbox(user, password, raw_cache=RawCache.from_env())
+
+
+def main(rewrite: Rewrite) -> None:
+    """Command-line entry for a migration script: settings from the
+    environment, report printed and saved, exit status 1 on any failure."""
+    report = run(
+        rewrite,
+        connect=connect_from_env(),
+        workers=int(os.environ.get("REWRITE_WORKERS") or 4),
+        batch_size=int(os.environ.get("REWRITE_BATCH") or 50),
+        dry_run=os.environ.get("REWRITE_DRY_RUN") == "1",
+    )
+    print_report(report)
+    runs_dir = os.path.join(OUTPUT_DIR, ".runs")
+    os.makedirs(runs_dir, exist_ok=True)
+    path = os.path.join(runs_dir, f"rewrite_{rewrite.name}_{datetime.now():%Y-%m-%dT%H-%M-%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Report: {path}")
+    if report["failed"]:
+        sys.exit(1)
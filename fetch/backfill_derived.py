@@ -0,0 +1,61 @@
+"""
+Back-fill the derived renditions (derived.py: plain text, sanitized HTML,
+snippet, sender domain) for receipts written before Email.write made them, or
+whose body changed since (migrate_html).
+
+Receipts that carry no Content-ID map ("cids") and whose raw message is in the
+raw cache (RAW_CACHE_DIR) get their inline images recovered from it first, so
+cid: images resolve in the sanitized HTML; otherwise cid: references are left
+as they are. No Gmail access is needed.
+
+Runs on archive_rewrite (workers, resume, REWRITE_DRY_RUN=1, failure report).
+"""
+import os
+
+from archive_rewrite import Context, Rewrite, main
+from derived import derive, is_current, write_derived
+from mailbox_wrapper import email_from_raw
+from models import inline_files
+
+
+class BackfillDerived(Rewrite):
+    name = "backfill_derived"
+    files = ("receipts",)
+
+    def _recover_inline(self, data: dict, ctx: Context) -> dict:
+        """The receipt's data with "inline" and "cids" taken from its cached
+        raw message (inline images saved), or unchanged if it isn't cached."""
+        raw = ctx.cache.get(data["message_id"]) if ctx.cache and data.get("message_id") else None
+        if raw is None:
+            return data
+        em = email_from_raw(str(data.get("uid")), raw)
+        stored = set(data.get("attachments", []))
+        attachments = [a for a in em.attachments if a.filename in stored]
+        names, cids = inline_files(attachments, em.inline)
+        if not cids:
+            return data
+        if not ctx.dry_run and names:
+            att_dir = os.path.splitext(ctx.path)[0]
+            os.makedirs(att_dir, exist_ok=True)
+            for image, name in zip(em.inline, names):
+                image.save(os.path.join(att_dir, name))
+        data = {**data, "cids": cids}
+        if names:
+            data["inline"] = names
+        return data
+
+    def apply(self, data: dict, ctx: Context) -> dict:
+        if is_current(ctx.path, data):
+            return data
+        if "cids" not in data:
+            data = self._recover_inline(data, ctx)
+        cids = data.get("cids") or {}
+        if ctx.dry_run:
+            _, _, fields = derive(data, cids, os.path.basename(os.path.splitext(ctx.path)[0]))
+        else:
+            fields = write_derived(ctx.path, data, cids)
+        return {**data, **fields}
+
+
+if __name__ == "__main__":
+    main(BackfillDerived())
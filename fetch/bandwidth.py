@@ -0,0 +1,188 @@
+"""
+A per-account budget for what we download from Gmail, so a large backfill (or
+a cron job run every hour) stops short of Gmail's daily IMAP download limit
+instead of running into it.
+
+Gmail allows about 2500 MB of IMAP downloads per account per day and answers
+beyond that with errors ([OVERQUOTA], "Account exceeded command or bandwidth
+limits") or a dropped connection, for hours. BandwidthBudget records every
+FETCH response's size per account in OUTPUT_DIR/.bandwidth.sqlite3, so the
+count survives across runs and is shared by parallel jobs on one mailbox, and
+allows FETCH_DAILY_MB (default 2000) in any rolling 24 hours. FETCH_DAILY_MB=0
+turns the budget off.
+
+Mailbox (with a budget) charges each FETCH, refuses to start a download the
+budget can't cover (OverBudget) and, on a quota error, records a back-off of
+FETCH_QUOTA_BACKOFF_MINUTES (default 60) during which it downloads nothing
+(QuotaExceeded); later runs see the back-off too. fetch_emails schedules
+against it: sizes come first (RFC822.SIZE, one FETCH per thousand UIDs),
+messages over FETCH_DEFER_MB (default 10) go last so they don't crowd out the
+small ones, a batch that can't be previewed within the budget ends the run,
+and a receipt too large for what's left is deferred to a later run.
+"""
+import contextlib
+import os
+import re
+import sqlite3
+import time
+
+MB = 1 << 20
+DAILY_BYTES = int(float(os.environ.get("FETCH_DAILY_MB") or 2000) * MB)
+DEFER_BYTES = int(float(os.environ.get("FETCH_DEFER_MB") or 10) * MB)
+QUOTA_BACKOFF_SECONDS = float(os.environ.get("FETCH_QUOTA_BACKOFF_MINUTES") or 60) * 60
+WINDOW_SECONDS = 24 * 3600
+
+_QUOTA = re.compile(r"OVERQUOTA|THROTTLED|bandwidth limit|exceeded .*limit", re.IGNORECASE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    account TEXT NOT NULL,
+    ts      REAL NOT NULL,
+    bytes   INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS downloads_account_ts ON downloads (account, ts);
+CREATE TABLE IF NOT EXISTS backoff (
+    account TEXT PRIMARY KEY,
+    until   REAL NOT NULL,
+    reason  TEXT
+);
+"""
+
+
+class BandwidthError(RuntimeError):
+    """Gmail can't be downloaded from right now; what's left waits."""
+
+
+class OverBudget(BandwidthError):
+    def __init__(self, uid: str, size: int, free_at: float):
+        self.uid = uid
+        self.size = size
+        self.free_at = free_at
+        super().__init__(f"UID {uid} ({size / MB:.1f} MB) doesn't fit the bandwidth budget "
+                         f"until {format_time(free_at)}")
+
+
+class QuotaExceeded(BandwidthError):
+    def __init__(self, reason: str, until: float):
+        self.until = until
+        super().__init__(f"Gmail bandwidth quota: {reason}; backing off until {format_time(until)}")
+
+
+def is_quota_error(text) -> bool:
+    """Whether a server message (str, bytes or a response's data list) is
+    Gmail saying the account is over its limits."""
+    if isinstance(text, (list, tuple)):
+        return any(is_quota_error(t) for t in text)
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "replace")
+    return isinstance(text, str) and _QUOTA.search(text) is not None
+
+
+def format_time(ts: float) -> str:
+    if ts == float("inf"):
+        return "never (larger than the daily budget)"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
+
+
+class BandwidthBudget:
+    """Bytes downloaded from one account in the last window_seconds, against
+    daily_bytes. Safe to share between threads and processes on one host."""
+
+    def __init__(self, path: str, account: str, daily_bytes: int = DAILY_BYTES,
+                 window_seconds: float = WINDOW_SECONDS):
+        self.path = path
+        self.account = account.lower()
+        self.daily_bytes = daily_bytes
+        self.window_seconds = window_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            db.execute("DELETE FROM downloads WHERE ts < ?", (time.time() - window_seconds,))
+
+    @classmethod
+    def from_env(cls, output_dir: str, account: str) -> "BandwidthBudget | None":
+        if DAILY_BYTES <= 0:
+            return None
+        return cls(os.path.join(output_dir, ".bandwidth.sqlite3"), account, DAILY_BYTES)
+
+    @contextlib.contextmanager
+    def _db(self):
+        """A connection, committed on success."""
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def charge(self, nbytes: int) -> None:
+        if nbytes > 0:
+            with self._db() as db:
+                db.execute("INSERT INTO downloads (account, ts, bytes) VALUES (?, ?, ?)",
+                           (self.account, time.time(), nbytes))
+
+    def used(self) -> int:
+        with self._db() as db:
+            row = db.execute(
+                "SELECT COALESCE(SUM(bytes), 0) FROM downloads WHERE account = ? AND ts >= ?",
+                (self.account, time.time() - self.window_seconds),
+            ).fetchone()
+        return row[0]
+
+    def remaining(self) -> int:
+        return max(0, self.daily_bytes - self.used())
+
+    def fits(self, nbytes: int) -> bool:
+        return self.used() + nbytes <= self.daily_bytes
+
+    def free_at(self, nbytes: int) -> float:
+        """When enough of the window's downloads will have aged out for
+        `nbytes` more to fit: now if they fit already, inf if they never do."""
+        now = time.time()
+        if nbytes > self.daily_bytes:
+            return float("inf")
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT ts, bytes FROM downloads WHERE account = ? AND ts >= ? ORDER BY ts",
+                (self.account, now - self.window_seconds),
+            ).fetchall()
+        used = sum(b for _, b in rows)
+        for ts, b in rows:
+            if used + nbytes <= self.daily_bytes:
+                break
+            used -= b
+            now = ts + self.window_seconds
+        return now
+
+    def back_off(self, reason: str, seconds: float = QUOTA_BACKOFF_SECONDS) -> float:
+        """Record a quota error: nothing is downloaded from the account for
+        `seconds`. Returns when the back-off ends."""
+        until = time.time() + seconds
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO backoff (account, until, reason) VALUES (?, ?, ?) "
+                "ON CONFLICT (account) DO UPDATE SET until = MAX(until, excluded.until), "
+                "reason = excluded.reason",
+                (self.account, until, reason[:500]),
+            )
+        return until
+
+    def backed_off(self) -> tuple[float, str] | None:
+        """(until, reason) while a back-off is in force, else None."""
+        with self._db() as db:
+            row = db.execute("SELECT until, reason FROM backoff WHERE account = ?",
+                             (self.account,)).fetchone()
+        return row if row and row[0] > time.time() else None
+
+    def summary(self) -> str:
+        return (f"{self.used() / MB:.1f} of {self.daily_bytes / MB:.0f} MB used "
+                f"in the last {self.window_seconds / 3600:g} h for {self.account}")
+
+
+def schedule(uids: list[str], sizes: dict[str, int], defer_bytes: int = DEFER_BYTES) -> list[str]:
+    """The UIDs in fetch order: as given, but messages over defer_bytes after
+    all the others (largest last)."""
+    small = [u for u in uids if sizes.get(u, 0) <= defer_bytes]
+    large = sorted((u for u in uids if sizes.get(u, 0) > defer_bytes), key=lambda u: sizes[u])
+    return small + large
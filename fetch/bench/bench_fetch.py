@@ -0,0 +1,293 @@
+"""
+Throughput benchmark for the fetch pipeline.
+
+Generates a synthetic corpus (corpus.py), then measures three targets, each in
+its own subprocess so peak RSS belongs to that target alone:
+
+  main   fetch_emails.main end to end against the fake IMAP server
+         (fake_imap.py) and the stub Ollama (fake_ollama.py)
+  parse  mailbox_wrapper._parse_full_email over every corpus message
+  write  Email.write of every parsed message into a scratch OUTPUT_DIR
+
+Reports messages/sec, p50/p95 per stage and peak RSS, stores the run as
+results/<timestamp>.json, and with --baseline compares against an earlier run,
+exiting non-zero when a metric regressed past --tolerance.
+
+Usage (from fetch/):
+    python -m bench.bench_fetch [--messages N] [--llm-latency S] \
+        [--large-pdf-mb MB] [--rtt S] [--baseline results/baseline.json]
+"""
+import argparse
+import contextlib
+import functools
+import glob
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest import mock
+
+from bench.corpus import generate
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+TARGETS = ("main", "parse", "write")
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux (bytes on macOS; the benchmark runs in Linux).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimer:
+    """Wraps functions in place and records how long each call took. The
+    wrappers are patched in through `stack` and undone when it closes."""
+
+    def __init__(self, stack: contextlib.ExitStack | None = None):
+        self.samples: dict[str, list[float]] = {}
+        self.counters: dict[str, int] = {}
+        self._stack = stack
+
+    def wrap(self, owner, attr: str, stage: str) -> None:
+        assert self._stack is not None
+        original = getattr(owner, attr)
+        samples = self.samples.setdefault(stage, [])
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - t0)
+
+        self._stack.enter_context(mock.patch.object(owner, attr, timed))
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "count": len(v),
+                "p50_ms": round(_percentile(v, 50) * 1000, 3),
+                "p95_ms": round(_percentile(v, 95) * 1000, 3),
+                "total_s": round(sum(v), 3),
+            }
+            for stage, v in self.samples.items()
+        }
+
+
+# --- targets (run inside the child process) --------------------------------
+
+def _run_main(corpus: str, scratch: str, args) -> tuple[int, StageTimer]:
+    import fetch_emails as fe
+    import mailbox_wrapper
+    import models
+    import process_email as pe
+    from bench.fake_imap import FakeIMAPServer
+    from bench.fake_ollama import FakeOllama
+
+    server = FakeIMAPServer(corpus, rtt=args.rtt)
+    env = {
+        "GMAIL_USER": "bench@example.com",
+        "GMAIL_APP_PASSWORD": "x",
+        "FETCH_SINCE": "2025-01-01",
+    }
+    with contextlib.ExitStack() as stack:
+        def patch(owner, attr, value):
+            stack.enter_context(mock.patch.object(owner, attr, value))
+
+        patch(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+        # The OllamaManager finds the stub already answering and reuses it;
+        # leave the process's signal handling alone.
+        patch(fe.OllamaManager, "handle_signals", lambda self: None)
+        patch(pe, "OUTPUT_DIR", scratch)
+        patch(pe, "_seen_message_ids", None)
+        # Every email goes to the (stub) LLM, so runs stay comparable.
+        patch(pe, "SENDER_HISTORY", False)
+        patch(pe, "DUPLICATES", False)
+        patch(sys, "argv", ["fetch_emails.py"])
+        stack.enter_context(mock.patch.dict(os.environ, env))
+        os.environ.pop("FETCH_BEFORE", None)
+
+        timer = StageTimer(stack)
+        timer.wrap(mailbox_wrapper.Mailbox, "peek", "peek")
+        timer.wrap(mailbox_wrapper.Mailbox, "get", "fetch")
+        timer.wrap(pe, "classify", "classify")
+        timer.wrap(models.Email, "write", "write")
+
+        stub = stack.enter_context(FakeOllama(latency=args.llm_latency, jitter=0.2))
+        patch(pe, "OLLAMA_URL", stub.url)
+        devnull = stack.enter_context(open(os.devnull, "w"))
+        stack.enter_context(contextlib.redirect_stdout(devnull))
+        fe.main()
+    timer.counters["imap_bytes"] = server.bytes_sent
+    return len(glob.glob(os.path.join(corpus, "*.eml"))), timer
+
+
+def _run_parse(corpus: str, scratch: str, args) -> tuple[int, StageTimer]:
+    from mailbox_wrapper import _parse_full_email
+
+    timer = StageTimer()
+    paths = sorted(glob.glob(os.path.join(corpus, "*.eml")))
+    for p in paths:
+        with open(p, "rb") as f:
+            raw = f.read()
+        t0 = time.perf_counter()
+        _parse_full_email(raw)
+        timer.record("parse", time.perf_counter() - t0)
+    return len(paths), timer
+
+
+def _run_write(corpus: str, scratch: str, args) -> tuple[int, StageTimer]:
+    from mailbox_wrapper import _build_email
+
+    timer = StageTimer()
+    paths = sorted(glob.glob(os.path.join(corpus, "*.eml")))
+    for p in paths:
+        with open(p, "rb") as f:
+            em = _build_email(os.path.basename(p)[: -len(".eml")], f.read(), "")
+        em.classification = {"is_receipt": True, "confidence": 1.0, "reason": "bench"}
+        out = os.path.join(scratch, f"{em.uid}.json")
+        t0 = time.perf_counter()
+        em.write(out)
+        timer.record("write", time.perf_counter() - t0)
+    return len(paths), timer
+
+
+def run_target(target: str, corpus: str, args) -> dict:
+    """Measure one target in this process and return its result dict."""
+    runner = {"main": _run_main, "parse": _run_parse, "write": _run_write}[target]
+    with tempfile.TemporaryDirectory(prefix=f"bench-{target}-") as scratch:
+        t0 = time.perf_counter()
+        messages, timer = runner(corpus, scratch, args)
+        seconds = time.perf_counter() - t0
+    return {
+        "messages": messages,
+        "seconds": round(seconds, 3),
+        "messages_per_sec": round(messages / seconds, 2) if seconds else 0.0,
+        "stages": timer.summary(),
+        **timer.counters,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+# --- orchestration ---------------------------------------------------------
+
+def _child(target: str, corpus: str, args) -> dict:
+    """Run one target in a fresh interpreter; its last stdout line is JSON."""
+    cmd = [
+        sys.executable, "-m", "bench.bench_fetch", "--target", target,
+        "--corpus", corpus, "--llm-latency", str(args.llm_latency),
+        "--rtt", str(args.rtt),
+    ]
+    fetch_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run(cmd, cwd=fetch_dir, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Human-readable regressions of `current` against `baseline`."""
+    regressions = []
+    for target, cur in current["targets"].items():
+        base = baseline.get("targets", {}).get(target)
+        if not base:
+            continue
+        if base["messages_per_sec"] and (
+            cur["messages_per_sec"] < base["messages_per_sec"] * (1 - tolerance)
+        ):
+            regressions.append(
+                f"{target}: messages/sec {base['messages_per_sec']} -> {cur['messages_per_sec']}")
+        if cur["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{target}: peak RSS {base['peak_rss_mb']} MB -> {cur['peak_rss_mb']} MB")
+        for stage, s in cur["stages"].items():
+            b = base["stages"].get(stage)
+            if b and b["p95_ms"] and s["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{target}/{stage}: p95 {b['p95_ms']} ms -> {s['p95_ms']} ms")
+    return regressions
+
+
+def _print_report(result: dict) -> None:
+    for target, r in result["targets"].items():
+        print(f"\n{target}: {r['messages']} messages in {r['seconds']}s "
+              f"({r['messages_per_sec']} msg/s), peak RSS {r['peak_rss_mb']} MB")
+        for stage, s in r["stages"].items():
+            print(f"  {stage:<9} n={s['count']:<6} p50 {s['p50_ms']:>9.2f} ms"
+                  f"  p95 {s['p95_ms']:>9.2f} ms  total {s['total_s']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--large-pdf-mb", type=float, default=15.0)
+    parser.add_argument("--llm-latency", type=float, default=0.05,
+                        help="mean seconds per stub LLM call")
+    parser.add_argument("--rtt", type=float, default=0.0,
+                        help="seconds of simulated IMAP round trip per command")
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--out", default=RESULTS_DIR)
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    # Internal: run a single target in this process (used by the children).
+    parser.add_argument("--target", choices=TARGETS, help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.target:
+        print(json.dumps(run_target(args.target, args.corpus, args)))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench-corpus-") as corpus:
+        print(f"Generating {args.messages} messages...")
+        generate(corpus, args.messages, args.large_pdf_mb)
+        result = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "params": {
+                "messages": args.messages,
+                "large_pdf_mb": args.large_pdf_mb,
+                "llm_latency": args.llm_latency,
+                "rtt": args.rtt,
+            },
+            "targets": {},
+        }
+        for target in args.targets.split(","):
+            print(f"Running {target}...")
+            result["targets"][target] = _child(target, corpus, args)
+
+    _print_report(result)
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) vs {args.baseline}:")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print(f"\nNo regressions vs {args.baseline} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
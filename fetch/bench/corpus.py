@@ -0,0 +1,166 @@
+"""
+Synthetic mailbox corpus for the fetch benchmarks.
+
+Writes N realistic RFC822 messages as <uid>.eml files plus a manifest.json
+(uid -> Gmail labels) into a directory. The mix mirrors what the pipeline sees
+in a real mailbox: plain-only newsletters, multipart/alternative receipts,
+Hebrew mail in the visual "-i"/"-e" charsets decode_header_value has to strip,
+and invoices carrying PDF attachments, a few of them large.
+
+Deterministic for a given seed, so two benchmark runs parse the same bytes.
+
+Usage (from fetch/):
+    python -m bench.corpus <dir> [--messages N] [--large-pdf-mb MB] [--seed S]
+"""
+import argparse
+import base64
+import json
+import os
+import random
+from email.message import Message
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.nonmultipart import MIMENonMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+# Subjects the fake LLM treats as receipts (see fake_ollama.py); the rest are
+# noise. Roughly one in ten messages gets a receipt subject, like a real inbox.
+RECEIPT_SUBJECTS = [
+    "Your receipt from Example Store",
+    "Invoice #{n} for your subscription",
+    "Order confirmation {n}",
+    "חשבונית מס קבלה {n}",
+    "קבלה על תשלום {n}",
+]
+NOISE_SUBJECTS = [
+    "Weekly newsletter #{n}",
+    "You have a new follower",
+    "Security alert for your account",
+    "Re: lunch on Thursday?",
+    "מבצעים חמים לסוף השבוע {n}",
+    "Your package is on its way",
+]
+SENDERS = [
+    "Example Store <orders@store.example.com>",
+    "Ride Co <receipts@ride.example.net>",
+    "חברת החשמל <bills@iec.example.co.il>",
+    "Newsletter <news@marketing.example.org>",
+    "Friend <friend@example.com>",
+]
+LABELS = ["\\Important", "\\Inbox", "Receipts", "Travel"]
+
+_LOREM = (
+    "Thank you for your purchase. Your order has been received and is being "
+    "processed. Total charged to your card ending 4242 "
+)
+_HEBREW = "תודה על הרכישה. ההזמנה שלך התקבלה ומטופלת. סך הכל לתשלום "
+
+
+def _visual_header(text: str, charset: str) -> str:
+    """RFC 2047 encoded-word in a visual Hebrew charset (iso-8859-8-i/-e)."""
+    payload = base64.b64encode(text.encode("iso-8859-8")).decode()
+    return f"=?{charset}?B?{payload}?="
+
+
+def _visual_text(text: str, subtype: str, charset: str) -> MIMENonMultipart:
+    """A text part whose declared charset ends in -i/-e, as Israeli senders do."""
+    part = MIMENonMultipart("text", subtype, charset=charset)
+    part.set_payload(base64.encodebytes(text.encode("iso-8859-8")).decode())
+    part["Content-Transfer-Encoding"] = "base64"
+    return part
+
+
+def _fake_pdf(rng: random.Random, size: int) -> bytes:
+    head = b"%PDF-1.4\n"
+    return head + rng.randbytes(max(size - len(head), 0))
+
+
+def make_message(
+    rng: random.Random, n: int, when: datetime, large_pdf_bytes: int
+) -> tuple[bytes, list[str]]:
+    """One synthetic message (raw bytes) and its Gmail labels."""
+    is_receipt = rng.random() < 0.1
+    subject = rng.choice(RECEIPT_SUBJECTS if is_receipt else NOISE_SUBJECTS).format(n=n)
+    sender = rng.choice(SENDERS)
+    hebrew = any("֐" <= c <= "׿" for c in subject)
+    words = rng.randint(50, 800)
+    text = ((_HEBREW if hebrew else _LOREM) * (words // 20 + 1))[: words * 6]
+    html = f"<html><body dir='auto'><h1>{subject}</h1><p>{text}</p></body></html>"
+
+    kind = rng.random()
+    msg: Message
+    if hebrew and kind < 0.5:
+        # Visual-Hebrew mail: -i/-e charsets on both the subject and the body.
+        charset = rng.choice(["iso-8859-8-i", "iso-8859-8-e"])
+        msg = MIMEMultipart("alternative")
+        msg.attach(_visual_text(text, "plain", charset))
+        msg.attach(_visual_text(html, "html", charset))
+        subject_header = _visual_header(subject, charset)
+    elif kind < 0.3:
+        msg = MIMEText(text, "plain", "utf-8")
+        subject_header = subject
+    else:
+        msg = MIMEMultipart("alternative")
+        msg.attach(MIMEText(text, "plain", "utf-8"))
+        msg.attach(MIMEText(html, "html", "utf-8"))
+        subject_header = subject
+
+    if is_receipt and rng.random() < 0.7:
+        # Receipts usually carry a PDF; one in ten of those is a big statement.
+        size = large_pdf_bytes if rng.random() < 0.1 else rng.randint(20_000, 200_000)
+        outer = MIMEMultipart("mixed")
+        outer.attach(msg)
+        pdf = MIMEApplication(_fake_pdf(rng, size), "pdf")
+        pdf.add_header("Content-Disposition", "attachment", filename=f"invoice-{n}.pdf")
+        outer.attach(pdf)
+        msg = outer
+
+    # Fixed boundaries, so the same seed yields byte-identical messages.
+    for i, part in enumerate(msg.walk()):
+        if part.is_multipart():
+            part.set_boundary(f"=_bench_{n}_{i}_{rng.getrandbits(32):08x}")
+
+    msg["Subject"] = subject_header
+    msg["From"] = sender
+    msg["To"] = "me@example.com"
+    msg["Date"] = format_datetime(when)
+    msg["Message-ID"] = f"<bench-{n}@corpus.example>"
+    labels = rng.sample(LABELS, rng.randint(0, 2))
+    if is_receipt:
+        labels.append("Receipts")
+    return msg.as_bytes(), sorted(set(labels))
+
+
+def generate(
+    out_dir: str, messages: int = 500, large_pdf_mb: float = 15.0, seed: int = 1
+) -> None:
+    """Write the corpus (<uid>.eml + manifest.json) into out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 24, tzinfo=timezone.utc)
+    manifest = {}
+    for n in range(1, messages + 1):
+        when = start + timedelta(minutes=37 * n)
+        raw, labels = make_message(rng, n, when, int(large_pdf_mb * 1024 * 1024))
+        uid = str(1000 + n)
+        with open(os.path.join(out_dir, f"{uid}.eml"), "wb") as f:
+            f.write(raw)
+        manifest[uid] = labels
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--large-pdf-mb", type=float, default=15.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    generate(args.out_dir, args.messages, args.large_pdf_mb, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+A local stand-in for Gmail's IMAP server, serving a corpus directory written
+by corpus.py.
+
+It sits at the imaplib level: FakeIMAPServer.connect is installed in place of
+imaplib.IMAP4_SSL, and uid() answers with the same (status, data) shapes
+imaplib hands back from a real server, so Mailbox runs its normal code path
+(label parsing, RFC822 parsing, reconnect handling) over the synthetic bytes.
+FETCH takes comma-separated UID sets and the items Mailbox asks for, including
+BODYSTRUCTURE (derived from the parsed message), headers and partial sections
+(BODY.PEEK[n]<offset.length>); `bytes_sent` counts the literal bytes served.
+Messages are read from disk per fetch, so the corpus never sits in memory and
+peak RSS reflects the pipeline, not the fixture.
+"""
+import email
+import json
+import os
+import re
+import time
+from urllib.parse import quote
+
+
+class FakeIMAPServer:
+    """Serves <uid>.eml files. `rtt` adds a per-command round-trip delay."""
+
+    def __init__(self, corpus_dir: str, rtt: float = 0.0):
+        self._dir = corpus_dir
+        self._rtt = rtt
+        with open(os.path.join(corpus_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            self._labels: dict[str, list[str]] = json.load(f)
+        self.bytes_sent = 0
+        self.commands = 0
+
+    def connect(self, host: str = "") -> "FakeIMAPServer":
+        """Drop-in for imaplib.IMAP4_SSL(host)."""
+        return self
+
+    # --- the imaplib surface Mailbox uses ----------------------------------
+
+    def login(self, user, password):
+        return "OK", [b"LOGIN completed"]
+
+    def select(self, folder):
+        return "OK", [str(len(self._labels)).encode()]
+
+    def logout(self):
+        return "BYE", [b""]
+
+    def uid(self, command, *args):
+        self.commands += 1
+        if self._rtt:
+            time.sleep(self._rtt)
+        if command == "SEARCH":
+            # Inbox categories aren't modelled: a category search finds nothing.
+            if (getattr(self, "literal", None) or b"").startswith(b"category:"):
+                return "OK", [b""]
+            uids = " ".join(sorted(self._labels, key=int))
+            return "OK", [uids.encode()]
+        if command == "FETCH":
+            return self._fetch(args[0], args[1])
+        return "BAD", [f"unsupported {command}".encode()]
+
+    # --- FETCH -------------------------------------------------------------
+
+    def _raw(self, uid: str) -> bytes:
+        with open(os.path.join(self._dir, f"{uid}.eml"), "rb") as f:
+            return f.read()
+
+    def _labels_item(self, uid: str) -> str:
+        quoted = " ".join(
+            label if label.startswith("\\") else '"' + label.replace('"', '\\"') + '"'
+            for label in self._labels.get(uid, [])
+        )
+        return f"X-GM-LABELS ({quoted})"
+
+    def _fetch(self, uid_set: str, items: str):
+        names = _ITEM.findall(items.strip()[1:-1] if items.startswith("(") else items)
+        unsupported = [n for n in names if not _supported(n)]
+        if unsupported:
+            return "BAD", [f"unsupported FETCH {' '.join(unsupported)}".encode()]
+        data: list = []
+        for uid in uid_set.split(","):
+            if uid not in self._labels:
+                continue
+            raw = self._raw(uid)
+            msg = email.message_from_bytes(raw)
+            text = f"{uid} ("
+            for n, name in enumerate(names):
+                text += " " if n else ""
+                value = self._item(uid, raw, msg, name)
+                if isinstance(value, bytes):
+                    key = name.replace("BODY.PEEK[", "BODY[")
+                    key = re.sub(r"<(\d+)\.\d+>$", r"<\1>", key)
+                    data.append((f"{text}{key} {{{len(value)}}}".encode(), value))
+                    self.bytes_sent += len(value)
+                    text = ""
+                else:
+                    text += f"{name} {value}"
+            data.append((text + ")").encode())
+        return "OK", data or [None]
+
+    def _item(self, uid: str, raw: bytes, msg, name: str):
+        """One FETCH item: bytes for a literal, str for everything else."""
+        if name == "UID":
+            return uid
+        if name == "X-GM-LABELS":
+            return self._labels_item(uid)[len("X-GM-LABELS "):]
+        if name == "RFC822.SIZE":
+            return str(len(raw))
+        if name == "RFC822":
+            return raw
+        if name == "BODYSTRUCTURE":
+            return _bodystructure(msg)
+        if name == "BODY.PEEK[HEADER]":
+            end = raw.find(b"\r\n\r\n")
+            return raw[: end + 4] if end >= 0 else raw[: raw.find(b"\n\n") + 2]
+        m = _FIELDS.fullmatch(name)
+        if m:
+            lines = [f"{field}: {msg[field]}\r\n" for field in m.group("fields").split()
+                     if msg[field] is not None]
+            return ("".join(lines) + "\r\n").encode()
+        m = _SECTION.fullmatch(name)
+        assert m, name
+        body = _section_body(msg, m.group("section")) if m.group("section") else raw
+        if m.group("offset") is None:
+            return body
+        offset, length = int(m.group("offset")), int(m.group("length"))
+        return body[offset:offset + length]
+
+
+_ITEM = re.compile(r"BODY\.PEEK\[[^\]]*\](?:<\d+\.\d+>)?|[^\s()]+")
+_FIELDS = re.compile(r"BODY\.PEEK\[HEADER\.FIELDS \((?P<fields>[^)]*)\)\]")
+_SECTION = re.compile(r"BODY\.PEEK\[(?P<section>[\d.]*)\](?:<(?P<offset>\d+)\.(?P<length>\d+)>)?")
+
+
+def _supported(name: str) -> bool:
+    return name in (
+        "UID", "X-GM-LABELS", "RFC822.SIZE", "RFC822", "BODYSTRUCTURE",
+        "BODY.PEEK[HEADER]",
+    ) or bool(_FIELDS.fullmatch(name) or _SECTION.fullmatch(name))
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _param_list(params: list[tuple]) -> str:
+    if not params:
+        return "NIL"
+    items = []
+    for key, value in params:
+        if isinstance(value, tuple):    # RFC 2231: send it back encoded, as Gmail does
+            charset, lang, text = value
+            items += [_quote(key.upper() + "*"),
+                      _quote(f"{charset or ''}'{lang or ''}'{quote(text, safe='')}")]
+        else:
+            items += [_quote(key.upper()), _quote(str(value))]
+    return "(" + " ".join(items) + ")"
+
+
+def _section_body(msg, section: str) -> bytes:
+    """The still-encoded body of BODY[<section>]."""
+    part = msg
+    for index in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+    raw = part.as_bytes()
+    for sep in (b"\r\n\r\n", b"\n\n"):
+        if sep in raw:
+            return raw.split(sep, 1)[1]
+    return b""
+
+
+def _bodystructure(part, section: str = "") -> str:
+    """The BODYSTRUCTURE Gmail would send for a parsed message."""
+    if part.is_multipart():
+        children = "".join(
+            _bodystructure(child, f"{section}.{i}" if section else str(i))
+            for i, child in enumerate(part.get_payload(), 1)
+        )
+        return (f"({children} {_quote(part.get_content_subtype().upper())} "
+                f"{_param_list(part.get_params()[1:])} NIL NIL)")
+    body = _section_body(part, "1")
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        _param_list(part.get_params()[1:] if part.get_params() else []),
+        _quote(part["Content-ID"]) if part["Content-ID"] else "NIL",
+        "NIL",
+        _quote((part.get("Content-Transfer-Encoding") or "7bit").upper()),
+        str(len(body)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(body.count(b"\n")))
+    disposition = part.get_content_disposition()
+    if disposition:
+        disp_params = part.get_params(header="content-disposition")[1:]
+        fields += ["NIL", f"({_quote(disposition.upper())} {_param_list(disp_params)})"]
+    else:
+        fields += ["NIL", "NIL"]
+    return "(" + " ".join(fields + ["NIL", "NIL"]) + ")"
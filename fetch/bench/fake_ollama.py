@@ -0,0 +1,103 @@
+"""
+A stub Ollama HTTP server for benchmarks and end-to-end tests.
+
+Answers /api/tags and /api/generate on a local port like the real server, after
+a configurable delay standing in for model latency. The verdict is a keyword
+match on the prompt's Subject line, so the corpus's receipt subjects come back
+as receipts and everything else as noise.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RECEIPT_WORDS = ("receipt", "invoice", "order confirmation", "חשבונית", "קבלה")
+
+
+def verdict_for(prompt: str) -> dict:
+    m = re.search(r"^Subject: (.*)$", prompt, re.MULTILINE)
+    subject = (m.group(1) if m else "").lower()
+    if any(w in subject for w in RECEIPT_WORDS):
+        return {"is_receipt": True, "confidence": 0.9, "reason": "stub: receipt subject"}
+    return {"is_receipt": False, "confidence": 0.8, "reason": "stub: no receipt words"}
+
+
+class FakeOllama:
+    """Runs the stub on 127.0.0.1:<port> in a background thread.
+
+    `latency` is the mean seconds per /api/generate call; `jitter` is the
+    +/- fraction applied uniformly around it.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.generate_calls = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        assert isinstance(host, str)
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllama":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOllama":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _delay(self) -> float:
+        spread = self.latency * self.jitter
+        return max(self.latency + random.uniform(-spread, spread), 0.0)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload: dict) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._reply({"models": []})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                with stub._lock:
+                    stub.generate_calls += 1
+                time.sleep(stub._delay())
+                verdict = verdict_for(request.get("prompt", ""))
+                self._reply({
+                    "model": request.get("model"),
+                    "response": json.dumps(verdict),
+                    "done": True,
+                })
+
+        return Handler
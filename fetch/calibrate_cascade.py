@@ -0,0 +1,82 @@
+"""
+Calibration report for the classifier cascade (see process_email.classify_cascade).
+
+Reads every month's ledger under OUTPUT_DIR and uses the entries that carry a
+cascade trace with both tiers timed, i.e. emails processed with
+CLASSIFY_CASCADE_CALIBRATE=1. The ledger's is_receipt is the truth: the full
+model's verdict, or a manual correction by import_labeled.
+
+For each gray band [t, 1 - t] it replays the cascade: emails whose fast-model
+P(receipt) falls in the band take the full verdict, the rest the fast one. It
+prints accuracy and receipt recall against the truth, the share escalated and
+the LLM seconds saved against running the full model on everything. t = 0.5
+is the fast model alone, t = 0 the full model alone.
+
+Usage (from fetch/, OUTPUT_DIR pointing at the output folder):
+    python calibrate_cascade.py [t ...]
+"""
+import glob
+import json
+import os
+import sys
+
+import process_email as pe
+
+DEFAULT_THRESHOLDS = [0.5, 0.4, 0.3, 0.2, 0.15, 0.1, 0.05, 0.0]
+
+
+def load_traces() -> list[dict]:
+    """Ledger entries with a fast P(receipt) and both tiers' timings."""
+    entries = []
+    for p in sorted(glob.glob(os.path.join(pe.OUTPUT_DIR, "*", "*_processed.json"))):
+        with open(p, "r", encoding="utf-8") as f:
+            for entry in json.load(f):
+                trace = entry.get("cascade") or {}
+                if "fast_p" in trace and "full_s" in trace:
+                    entries.append(entry)
+    return entries
+
+
+def replay(entries: list[dict], t: float) -> dict:
+    low, high = min(t, 1 - t), max(t, 1 - t)
+    correct = caught = receipts = escalated = 0
+    full_s = cascade_s = 0.0
+    for entry in entries:
+        trace, truth = entry["cascade"], bool(entry["is_receipt"])
+        escalate = low <= trace["fast_p"] <= high
+        verdict = truth if escalate else trace["fast_p"] > 0.5
+        correct += verdict == truth
+        receipts += truth
+        caught += truth and verdict
+        escalated += escalate
+        full_s += trace["full_s"]
+        cascade_s += trace["fast_s"] + (trace["full_s"] if escalate else 0.0)
+    n = len(entries)
+    return {
+        "band": [low, high],
+        "accuracy": round(correct / n, 4) if n else None,
+        "recall": round(caught / receipts, 4) if receipts else None,
+        "escalated": round(escalated / n, 4) if n else None,
+        "llm_s": round(cascade_s, 1),
+        "llm_s_saved": round(full_s - cascade_s, 1),
+    }
+
+
+def main():
+    thresholds = [float(a) for a in sys.argv[1:]] or DEFAULT_THRESHOLDS
+    entries = load_traces()
+    if not entries:
+        sys.exit(f"No calibration data in {pe.OUTPUT_DIR}: process some emails with "
+                 f"CLASSIFY_FAST_MODEL set and CLASSIFY_CASCADE_CALIBRATE=1 first")
+    full_s = sum(e["cascade"]["full_s"] for e in entries)
+    print(f"{len(entries)} emails with both tiers timed; full model alone: {full_s:.0f} LLM-s\n")
+    print(f"{'band':>13}  {'accuracy':>8}  {'recall':>7}  {'escalated':>9}  {'LLM-s':>8}  {'saved':>8}")
+    for t in thresholds:
+        r = replay(entries, t)
+        recall = f"{r['recall']:.1%}" if r["recall"] is not None else "-"
+        print(f"[{r['band'][0]:.2f}, {r['band'][1]:.2f}]  {r['accuracy']:>8.1%}  {recall:>7}  "
+              f"{r['escalated']:>9.1%}  {r['llm_s']:>8.0f}  {r['llm_s_saved']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+The change journal: one JSON line appended to OUTPUT_DIR/.changes.jsonl each
+time the pipeline updates a month's ledger or writes a receipt, so the viewer
+can stream new receipts to the browser instead of rescanning month folders.
+
+    {"event": "ledger", "month": "2025-03", "time": 1741000000.0}
+    {"event": "receipt", "month": "2025-03", "base_name": "2025-03-03T10-00-00_1234", "time": ...}
+
+Lines carry only what changed, not the data; readers load the receipt file
+itself. Writers append under an flock on the journal, so concurrent fetches
+(multi_fetch, watch, import_labeled) never interleave lines. Past MAX_BYTES the
+journal is renamed to .changes.jsonl.1 (replacing the previous one) and a fresh
+one started; a reader holding the old file open finishes it, then moves on.
+
+Publishing is best effort: a journal that can't be written is reported and
+the pipeline carries on.
+"""
+import fcntl
+import json
+import os
+import time
+
+JOURNAL_NAME = ".changes.jsonl"
+MAX_BYTES = 4 * 1024 * 1024
+
+
+def journal_path(output_dir: str) -> str:
+    return os.path.join(output_dir, JOURNAL_NAME)
+
+
+def publish(output_dir: str, event: str, month: str, **fields) -> None:
+    """Append one change to output_dir's journal."""
+    line = json.dumps({"event": event, "month": month, **fields, "time": time.time()},
+                      ensure_ascii=False) + "\n"
+    path = journal_path(output_dir)
+    try:
+        while True:
+            with open(path, "a", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # Another writer may have rotated the file while we waited.
+                if not os.path.exists(path) or os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                    continue
+                if os.fstat(f.fileno()).st_size >= MAX_BYTES:
+                    os.replace(path, path + ".1")
+                    continue
+                f.write(line)
+                return
+    except OSError as e:
+        print(f"change journal: could not record {event} {month}: {e}")
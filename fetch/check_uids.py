@@ -1,33 +1,34 @@
-import imaplib, email, json, glob, getpass
+"""
+Check that the saved receipts' UIDs still point at the same emails: each
+receipt's stored From and Date against the headers Gmail returns for its UID.
+A UIDVALIDITY change shows up as mismatches.
 
-user = input("Gmail address: ")
-password = getpass.getpass("App password: ")
+Read-only. Runs on archive_rewrite (one header FETCH per batch of receipts);
+every mismatch is listed in the report. Gmail credentials come from
+GMAIL_USER / GMAIL_APP_PASSWORD, the archive from OUTPUT_DIR.
+"""
+from archive_rewrite import Context, Rewrite, RewriteError, main
 
-sample = sorted(f for f in glob.glob("fetch/output/*/*.json") if not f.endswith("_processed.json"))[:10]
 
-print(f"Connecting to Gmail as {user}...")
-mail = imaplib.IMAP4_SSL("imap.gmail.com")
-mail.login(user, password)
-mail.select('"[Gmail]/All Mail"')
+class CheckUids(Rewrite):
+    name = "check_uids"
+    files = ("receipts",)
 
-print(f"UIDVALIDITY now: {mail.response('UIDVALIDITY')[1]}")
-print(f"Spot-checking {len(sample)} receipts\n")
+    def needs(self, data: dict) -> list[str]:
+        return [str(data["uid"])]
 
-for path in sample:
-    with open(path) as f:
-        stored = json.load(f)
-    uid = stored["uid"]
-    _, data = mail.uid("FETCH", uid, "(BODY.PEEK[HEADER.FIELDS (FROM DATE)])")
-    msg = email.message_from_bytes(data[0][1])
-    fetched_from = msg["From"].strip()
-    fetched_date = msg["Date"].strip()
-    stored_from = stored["from"].strip()
-    stored_date = stored["date"].strip()
-    if fetched_from == stored_from and fetched_date == stored_date:
-        print(f"OK    uid={uid}")
-    else:
-        print(f"DIFF  uid={uid}")
-        print(f"  stored  from={stored_from!r} date={stored_date!r}")
-        print(f"  fetched from={fetched_from!r} date={fetched_date!r}")
+    def apply(self, data: dict, ctx: Context) -> dict:
+        uid = str(data["uid"])
+        headers = ctx.headers.get(uid)
+        if headers is None:
+            raise RewriteError(f"uid {uid} not in mailbox")
+        fetched = ((headers["From"] or "").strip(), (headers["Date"] or "").strip())
+        stored = (data.get("from", "").strip(), data.get("date", "").strip())
+        if fetched != stored:
+            raise RewriteError(f"uid {uid}: stored from={stored[0]!r} date={stored[1]!r}, "
+                               f"fetched from={fetched[0]!r} date={fetched[1]!r}")
+        return data
 
-mail.logout()
+
+if __name__ == "__main__":
+    main(CheckUids())
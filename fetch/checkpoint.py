@@ -0,0 +1,120 @@
+"""
+Resumable fetch runs.
+
+A run is a job: a name (FETCH_JOB, defaulting to its date range) plus the
+search parameters it was started with. Its state lives under
+OUTPUT_DIR/.runs/ in two files:
+
+- <job>.json      the parameters and the UID list the search returned, written
+                  once when the job starts;
+- <job>.progress  an append-only log, one "start <uid>" / "done <uid>" line per
+                  step, so recording progress costs one small write per email.
+
+A restart with the same job name reuses the stored UID list instead of
+searching again and skips every UID already done; a UID that was started but
+never finished (the run died mid-email) is redone first. Once every UID is done
+the job is complete and the next run of that name starts over with a fresh
+search, so an open-ended incremental run still picks up new mail.
+
+Jobs with different date ranges are independent, so several shards of a
+backfill can run side by side, each resumable on its own. So are jobs with
+different candidate queries (FETCH_QUERY): the default name carries a short
+hash of the query.
+"""
+import hashlib
+import json
+import os
+from datetime import date
+
+
+def default_job_name(since: date, before: date | None, query: str = "") -> str:
+    name = f"{since.isoformat()}_{before.isoformat() if before else 'open'}"
+    if query:
+        name += "_q" + hashlib.sha1(query.encode("utf-8")).hexdigest()[:8]
+    return name
+
+
+class RunCheckpoint:
+    """The persisted state of one fetch job."""
+
+    def __init__(self, runs_dir: str, job: str, params: dict):
+        self.job = job
+        self.params = params
+        self.uids: list[str] | None = None
+        self.done: set[str] = set()
+        self.in_flight: list[str] = []
+        self._snapshot_path = os.path.join(runs_dir, f"{job}.json")
+        self._progress_path = os.path.join(runs_dir, f"{job}.progress")
+        os.makedirs(runs_dir, exist_ok=True)
+        self._load()
+
+    # --- loading -----------------------------------------------------------
+
+    def _load(self) -> None:
+        if not os.path.exists(self._snapshot_path):
+            return
+        with open(self._snapshot_path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot["params"] != self.params:
+            raise ValueError(
+                f"checkpoint {self.job!r} was started with {snapshot['params']}, "
+                f"not {self.params}; pick another FETCH_JOB or delete "
+                f"{self._snapshot_path}"
+            )
+        started: dict[str, None] = {}
+        if os.path.exists(self._progress_path):
+            with open(self._progress_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    step, _, uid = line.strip().partition(" ")
+                    if step == "start":
+                        started[uid] = None
+                    elif step == "done":
+                        self.done.add(uid)
+                        started.pop(uid, None)
+        uids = snapshot["uids"]
+        if self.done.issuperset(uids):
+            # Finished job: forget it so this run searches afresh.
+            self.reset()
+            return
+        self.uids = uids
+        self.in_flight = list(started)
+
+    def reset(self) -> None:
+        for path in (self._snapshot_path, self._progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.uids = None
+        self.done = set()
+        self.in_flight = []
+
+    # --- recording ---------------------------------------------------------
+
+    def set_uids(self, uids: list[str]) -> None:
+        """Store the search result this job will work through."""
+        self.uids = list(uids)
+        tmp = self._snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"params": self.params, "uids": self.uids}, f)
+        os.replace(tmp, self._snapshot_path)
+
+    def _append(self, step: str, uid: str) -> None:
+        with open(self._progress_path, "a", encoding="utf-8") as f:
+            f.write(f"{step} {uid}\n")
+
+    def start(self, uid: str) -> None:
+        self._append("start", uid)
+
+    def finish(self, uid: str) -> None:
+        self.done.add(uid)
+        self._append("done", uid)
+
+    def interrupted(self) -> list[str]:
+        """UIDs a previous run started but never finished."""
+        return [u for u in self.in_flight if u not in self.done]
+
+    def pending(self) -> list[str]:
+        """UIDs still to do: interrupted ones first, then the rest in order."""
+        assert self.uids is not None
+        interrupted = self.interrupted()
+        first = set(interrupted)
+        return interrupted + [u for u in self.uids if u not in self.done and u not in first]
@@ -0,0 +1,108 @@
+"""
+A classification worker for a fetch run in queue mode (work_queue.py): leases
+emails from the queue, classifies them against its own Ollama (OLLAMA_URL,
+with the same models and cascade settings as the fetch run) and acks the
+verdicts. Start as many as there are Ollama servers to keep busy, on this host
+or others; the fetch run writes the results.
+
+CLASSIFY_QUEUE is the queue's file (a worker on the fetch run's host) or the
+http:// URL the fetch run serves it on (CLASSIFY_QUEUE_PORT; other hosts, with
+CLASSIFY_QUEUE_TOKEN if the run set one). WORKER_ID names the worker in the
+queue (default <host>-<pid>). WORKER_EXIT_IDLE=1 exits once the queue is empty
+instead of waiting for more. A queue that can't be reached (the fetch run not
+started yet, gone, or a network blip) is retried, not fatal; an item whose
+ack is lost goes to another worker once its lease lapses.
+"""
+import os
+import socket
+import sys
+import time
+
+import requests
+
+import process_email as pe
+from models import Attachment, Email
+from ollama_manager import OllamaManager
+from work_queue import open_queue
+
+POLL_SECONDS = float(os.environ.get("WORKER_POLL_SECONDS") or 1.0)
+
+
+def _email(payload: dict) -> Email:
+    """The preview a queue item carries, as much of an Email as classify reads."""
+    return Email(
+        uid=payload["uid"], message_id=payload["message_id"], date="",
+        from_=payload["from"], subject=payload["subject"], body="",
+        attachments=[Attachment(name) for name in payload["attachments"]],
+        labels=[], headers={}, text=payload["text"], partial=True,
+    )
+
+
+def run(queue, worker: str, url: str = "", call=None, stop=lambda: False,
+        exit_idle: bool = False, poll: float = POLL_SECONDS) -> int:
+    """Lease, classify and ack until stop() (or, with exit_idle, until the
+    queue has nothing left to lease). `call` runs each classification (an
+    OllamaManager's call, which restarts a server that died). Returns how many
+    emails this worker classified."""
+    call = call or (lambda fn, *a, **k: fn(*a, **k))
+    done = 0
+    while not stop():
+        try:
+            item = queue.lease(worker)
+        except requests.RequestException as e:
+            print(f"[{worker}] queue unreachable: {e}")
+            time.sleep(poll)
+            continue
+        if item is None:
+            if exit_idle:
+                break
+            time.sleep(poll)
+            continue
+        key, payload = item
+        t0 = time.time()
+        try:
+            classification, cascade = call(pe.classify_cascade, _email(payload),
+                                           payload["attachments"], url=url)
+        except Exception as e:  # anything the LLM or the network threw: retry elsewhere
+            print(f"[{worker}] {key}: {e}")
+            try:
+                queue.fail(key, worker, f"{type(e).__name__}: {e}")
+            except requests.RequestException as qe:
+                print(f"[{worker}] queue unreachable: {qe}")
+                time.sleep(poll)
+            continue
+        try:
+            queue.ack(key, worker, {"classification": classification, "cascade": cascade,
+                                    "worker": worker})
+        except requests.RequestException as e:
+            print(f"[{worker}] {key}: verdict not acked, queue unreachable: {e}")
+            time.sleep(poll)
+            continue
+        done += 1
+        print(f"[{worker}] {key}: {classification.get('is_receipt')} "
+              f"in {time.time() - t0:.1f}s")
+    return done
+
+
+def main():
+    location = os.environ.get("CLASSIFY_QUEUE")
+    if not location:
+        print("Set CLASSIFY_QUEUE to the queue's file or URL", file=sys.stderr)
+        sys.exit(1)
+    queue = open_queue(location, os.environ.get("CLASSIFY_QUEUE_TOKEN") or "")
+    worker = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+    ollama = OllamaManager(pe.OLLAMA_URL, pe.CLASSIFY_MODEL, pe.OLLAMA_KEEP_ALIVE,
+                           extra_models=(pe.CLASSIFY_FAST_MODEL,)).start()
+    ollama.handle_signals()
+    print(f"Worker {worker} classifying from {location} with Ollama at {pe.OLLAMA_URL}")
+    try:
+        done = run(queue, worker, pe.OLLAMA_URL, call=ollama.call, stop=lambda: ollama.stopping,
+                   exit_idle=os.environ.get("WORKER_EXIT_IDLE") == "1")
+    finally:
+        ollama.shutdown()
+    print(f"\nWorker {worker}: {done} emails classified. {pe.llm_stats_line()}")
+
+
+if __name__ == "__main__":
+    main()
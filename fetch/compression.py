@@ -0,0 +1,72 @@
+"""
+Optional compression of receipt bodies on disk (RECEIPT_COMPRESSION=1).
+
+Marketing-heavy HTML makes a receipt's body most of its size, so with this on
+the body goes to its own compressed file beside the receipt JSON,
+
+    <base_name>.json              metadata, "body_file": "<base_name>.body.html.zst"
+    <base_name>.body.html.zst     the HTML body
+    <base_name>.html.zst          the sanitized rendition (derived.py)
+
+compressed with zstd when the zstandard package is installed, gzip (.gz)
+otherwise. Whichever way a receipt was written, models.read_receipt gives back
+the same dict, with "body" filled in; turning the setting off again only
+affects receipts written from then on. The viewer can send the compressed files
+as they are, with a Content-Encoding header, to browsers that accept it.
+"""
+import gzip
+import os
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip is the fallback
+    zstandard = None
+
+ENABLED = os.environ.get("RECEIPT_COMPRESSION") == "1"
+EXT = ".zst" if zstandard is not None else ".gz"
+EXTS = (".zst", ".gz")
+
+
+def compress(data: bytes) -> bytes:
+    if EXT == ".zst":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def decompress(data: bytes, ext: str) -> bytes:
+    if ext == ".gz":
+        return gzip.decompress(data)
+    if zstandard is None:
+        raise RuntimeError("reading a .zst file needs the zstandard package")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def write_file(path: str, data: bytes) -> None:
+    """Atomically write `data` to `path` (which names its compression, if any)."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(compress(data) if path.endswith(EXTS) else data)
+    os.replace(tmp, path)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    ext = os.path.splitext(path)[1]
+    return decompress(data, ext) if ext in EXTS else data
+
+
+def existing(path: str) -> str | None:
+    """`path` itself or a compressed version of it, whichever is on disk."""
+    for candidate in (path, *(path + ext for ext in EXTS)):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def remove_variants(path: str, keep: str | None = None) -> None:
+    """Delete `path` and its compressed versions, except `keep`: what a
+    rewrite in the other format leaves behind."""
+    for candidate in (path, *(path + ext for ext in EXTS)):
+        if candidate != keep and os.path.isfile(candidate):
+            os.remove(candidate)
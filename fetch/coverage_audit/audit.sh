@@ -0,0 +1,39 @@
+#!/bin/bash
+# Measure the recall a candidate query (FETCH_QUERY) would lose.
+# Usage:
+#   FETCH_QUERY='-category:social {category:purchases has:attachment}' \
+#   FETCH_SINCE=2025-01-01 FETCH_BEFORE=2025-04-01 [AUDIT_SAMPLE=200] \
+#     ./fetch/coverage_audit/audit.sh <gmail-address> <app-password>
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+if [ $# -lt 2 ]; then
+  echo "Usage: ./fetch/coverage_audit/audit.sh <gmail-address> <app-password>"
+  exit 1
+fi
+
+# Same image as run.sh (it classifies the sample); the audit script is
+# mounted in from this subfolder.
+"$SCRIPT_DIR/../run.sh" --build-only
+
+GPU_FLAG=""
+if docker info --format '{{.Runtimes}}' | grep -q nvidia; then
+  GPU_FLAG="--gpus all"
+fi
+
+docker run --rm $GPU_FLAG \
+  -e GMAIL_USER="$1" \
+  -e GMAIL_APP_PASSWORD="$2" \
+  -e OLLAMA_NO_CLOUD=1 \
+  -e CLASSIFY_FAST_MODEL="$CLASSIFY_FAST_MODEL" \
+  -e CLASSIFY_GRAY_BAND="$CLASSIFY_GRAY_BAND" \
+  -e FETCH_QUERY="$FETCH_QUERY" \
+  -e FETCH_SINCE="$FETCH_SINCE" \
+  -e FETCH_BEFORE="$FETCH_BEFORE" \
+  -e AUDIT_SAMPLE="$AUDIT_SAMPLE" \
+  -e AUDIT_SEED="$AUDIT_SEED" \
+  -v "$SCRIPT_DIR/coverage_audit.py:/app/coverage_audit.py:ro" \
+  -v "$HOME/.ollama/models:/root/.ollama/models:ro" \
+  -v "$SCRIPT_DIR/../../output:/output" \
+  gmail-fetch python -u coverage_audit.py
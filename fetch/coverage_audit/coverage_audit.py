@@ -0,0 +1,150 @@
+"""
+Measure what a candidate query (FETCH_QUERY) would cost in recall.
+
+For the date range (FETCH_SINCE / FETCH_BEFORE) it compares everything in the
+mailbox with what the X-GM-RAW query returns. The excluded set is checked two
+ways:
+
+- against the ledgers: receipts already on record in the range that the query
+  would have dropped (exact, no LLM time);
+- by sampling: AUDIT_SAMPLE excluded emails (default 200, seeded by
+  AUDIT_SEED) are previewed and classified like a normal run, and the receipt
+  rate in the sample is scaled up to the whole excluded set, with a 95% upper
+  bound. Sampled emails that already have a ledger verdict reuse it.
+
+The report is printed and saved as OUTPUT_DIR/.audit/coverage_<timestamp>.json,
+including the sampled receipts, so the query can be widened to catch them.
+"""
+import glob
+import json
+import math
+import os
+import random
+import sys
+from datetime import datetime
+
+import fetch_emails as fe
+import process_email as pe
+from mailbox_wrapper import Mailbox
+
+
+def _ledger() -> dict[str, dict]:
+    """uid -> ledger entry, over every month's _processed.json."""
+    entries: dict[str, dict] = {}
+    for p in glob.glob(os.path.join(pe.OUTPUT_DIR, "*", "*_processed.json")):
+        with open(p, "r", encoding="utf-8") as f:
+            for entry in json.load(f):
+                entries[str(entry.get("uid"))] = entry
+    return entries
+
+
+def wilson_upper(k: int, n: int, z: float = 1.96) -> float:
+    """Upper end of the Wilson score interval for k successes out of n."""
+    if n == 0:
+        return 1.0
+    p = k / n
+    centre = p + z * z / (2 * n)
+    spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return min(1.0, (centre + spread) / (1 + z * z / n))
+
+
+def audit(mb: Mailbox, query: str, since, before, sample_size: int, seed: int, classify_preview) -> dict:
+    """Compare the query's candidates with the whole range; classify_preview(em)
+    returns a classification dict for a sampled email with no ledger verdict."""
+    everything = mb.search_dates(since, before)
+    candidates = set(mb.search_raw(query, since, before))
+    excluded = [uid for uid in everything if uid not in candidates]
+
+    ledger = _ledger()
+    known = [uid for uid in everything if ledger.get(uid, {}).get("is_receipt")]
+    known_missed = [uid for uid in known if uid not in candidates]
+
+    sample = random.Random(seed).sample(excluded, min(sample_size, len(excluded)))
+    receipts = []
+    classified = 0
+    for batch in fe.batches(sample):
+        previews = mb.peek(batch, fe.PREVIEW_BYTES)
+        for uid in batch:
+            em = previews.get(uid)
+            if em is None:
+                continue
+            if uid in ledger:
+                is_receipt = bool(ledger[uid].get("is_receipt"))
+            else:
+                is_receipt = bool(classify_preview(em)["is_receipt"])
+                classified += 1
+            if is_receipt:
+                receipts.append({"uid": uid, "from": em.from_, "subject": em.subject})
+
+    n, k = len(sample), len(receipts)
+    return {
+        "query": query,
+        "since": since.isoformat(),
+        "before": before.isoformat() if before else None,
+        "total": len(everything),
+        "candidates": len(everything) - len(excluded),
+        "excluded": len(excluded),
+        "ledger_receipts": len(known),
+        "ledger_receipts_excluded": len(known_missed),
+        "ledger_recall": round(1 - len(known_missed) / len(known), 4) if known else None,
+        "sampled": n,
+        "sampled_classified": classified,
+        "sampled_receipts": receipts,
+        "est_missed_receipts": round(k / n * len(excluded), 1) if n else 0.0,
+        "est_missed_receipts_95": round(wilson_upper(k, n) * len(excluded), 1) if n else 0.0,
+    }
+
+
+def _print_report(r: dict) -> None:
+    share = r["candidates"] / r["total"] if r["total"] else 0.0
+    print(f"\nQuery:      {r['query']}")
+    print(f"Range:      {r['since']} .. {r['before'] or 'now'}")
+    print(f"Candidates: {r['candidates']} of {r['total']} emails ({share:.1%}); "
+          f"{r['excluded']} excluded")
+    if r["ledger_receipts"]:
+        print(f"Ledger:     {r['ledger_receipts_excluded']} of {r['ledger_receipts']} known "
+              f"receipts excluded (recall {r['ledger_recall']:.1%})")
+    print(f"Sample:     {len(r['sampled_receipts'])} receipts in {r['sampled']} excluded emails "
+          f"({r['sampled_classified']} classified now)")
+    print(f"Estimate:   ~{r['est_missed_receipts']} receipts excluded "
+          f"(95% upper bound {r['est_missed_receipts_95']})")
+    for rec in r["sampled_receipts"]:
+        print(f"  missed uid {rec['uid']}: {rec['from']} | {rec['subject']}")
+
+
+def main():
+    user = os.environ.get("GMAIL_USER")
+    password = os.environ.get("GMAIL_APP_PASSWORD")
+    if not user or not password:
+        sys.exit("Set GMAIL_USER and GMAIL_APP_PASSWORD environment variables")
+    query = fe.candidate_query()
+    if not query:
+        sys.exit("Set FETCH_QUERY to the candidate query to audit")
+
+    since, before = fe.date_range()
+    sample_size = int(os.environ.get("AUDIT_SAMPLE") or 200)
+    seed = int(os.environ.get("AUDIT_SEED") or 0)
+
+    print(f"Connecting to Gmail as {user}...")
+    mb = Mailbox(user, password)
+    ollama = fe.start_ollama()
+
+    def classify_preview(em):
+        names = [a.filename for a in em.attachments]
+        return ollama.call(pe.classify_cascade, em, names)[0]
+
+    report = audit(mb, query, since, before, sample_size, seed, classify_preview)
+    mb.logout()
+    ollama.shutdown()
+
+    _print_report(report)
+    audit_dir = os.path.join(pe.OUTPUT_DIR, ".audit")
+    os.makedirs(audit_dir, exist_ok=True)
+    path = os.path.join(audit_dir, f"coverage_{datetime.now():%Y-%m-%dT%H-%M-%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
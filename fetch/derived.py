@@ -0,0 +1,185 @@
+"""
+Renditions of a receipt made once, when it is written, so readers don't
+rework the stored HTML each time.
+
+Beside <base_name>.json in the month folder:
+
+- <base_name>.txt   the body as plain text (tags stripped, block elements on
+                    their own lines), for search and previews;
+- <base_name>.html  the body sanitized for display: no scripts, frames,
+                    event handlers or javascript: links, and every cid: image
+                    pointing at its stored file (<base_name>/<file>), so the
+                    page also opens straight from disk. Compressed
+                    (.html.zst / .html.gz) with RECEIPT_COMPRESSION=1.
+
+and in the receipt JSON itself "snippet" (the first SNIPPET_CHARS of the
+text), "sender_domain" and "derived" (DERIVED_VERSION, so a backfill knows
+what is current). models.Email.write produces all of it; backfill_derived.py
+brings receipts written before (or by an older version) up to date.
+"""
+import os
+import re
+
+import compression
+from email.utils import parseaddr
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import quote
+
+DERIVED_VERSION = 1
+SNIPPET_CHARS = 200
+
+# Elements dropped with everything inside them.
+_DROP = {"script", "noscript", "iframe", "frame", "frameset", "object", "embed", "applet",
+         "template"}
+# Dropped themselves, content kept (or void).
+_STRIP = {"base", "link", "meta", "form", "input", "button", "select", "textarea"}
+# Never rendered as text.
+_HIDDEN = {"head", "style", "title"} | _DROP
+# Start a new line in the text rendition.
+_BLOCK = {"p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5",
+          "h6", "hr", "blockquote", "pre", "section", "article", "header", "footer"}
+_VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source",
+         "track", "wbr"}
+_URL_ATTRS = {"href", "src", "background", "action", "formaction", "poster", "srcset"}
+_UNSAFE_URL = re.compile(r"^\s*(javascript|vbscript|data:text/html)", re.IGNORECASE)
+
+
+def sender_domain(from_: str) -> str:
+    address = parseaddr(from_ or "")[1].lower()
+    return address.rpartition("@")[2] if "@" in address else ""
+
+
+class _Text(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: list[str] = []
+        self._hidden = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HIDDEN and tag not in _VOID:
+            self._hidden += 1
+        elif tag in _BLOCK:
+            self.out.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _HIDDEN and tag not in _VOID:
+            self._hidden = max(self._hidden - 1, 0)
+        elif tag in _BLOCK:
+            self.out.append("\n")
+        elif tag == "td":
+            self.out.append(" ")
+
+    def handle_data(self, data):
+        if not self._hidden:
+            self.out.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """The visible text of an HTML body, one line per block, whitespace
+    collapsed and empty lines dropped."""
+    parser = _Text()
+    parser.feed(html or "")
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.out).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def snippet(text: str) -> str:
+    return " ".join(text.split())[:SNIPPET_CHARS]
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self, cids: dict[str, str]):
+        super().__init__(convert_charrefs=False)
+        self.cids = cids
+        self.out: list[str] = []
+        self._dropping = 0
+
+    def _attrs(self, attrs) -> str:
+        kept = []
+        for name, value in attrs:
+            name = name.lower()
+            if name.startswith("on") or name == "srcdoc":
+                continue
+            if value is not None and name in _URL_ATTRS:
+                if _UNSAFE_URL.match(value):
+                    continue
+                if value.lower().startswith("cid:"):
+                    value = self.cids.get(value[4:].strip("<>"), value)
+            kept.append(name if value is None else f'{name}="{escape(value, quote=True)}"')
+        return "".join(" " + a for a in kept)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _DROP:
+            if tag not in _VOID:
+                self._dropping += 1
+            return
+        if self._dropping or tag in _STRIP:
+            return
+        self.out.append(f"<{tag}{self._attrs(attrs)}>")
+
+    def handle_startendtag(self, tag, attrs):
+        if self._dropping or tag in _DROP or tag in _STRIP:
+            return
+        self.out.append(f"<{tag}{self._attrs(attrs)} />")
+
+    def handle_endtag(self, tag):
+        if tag in _DROP:
+            self._dropping = max(self._dropping - 1, 0)
+        elif not self._dropping and tag not in _STRIP and tag not in _VOID:
+            self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if not self._dropping:
+            self.out.append(data)
+
+    def handle_entityref(self, name):
+        if not self._dropping:
+            self.out.append(f"&{name};")
+
+    def handle_charref(self, name):
+        if not self._dropping:
+            self.out.append(f"&#{name};")
+
+
+def sanitize_html(html: str, cids: dict[str, str] | None = None) -> str:
+    """The body without active content; src="cid:<id>" becomes cids[<id>]
+    (ids without angle brackets) where known."""
+    parser = _Sanitizer(cids or {})
+    parser.feed(html or "")
+    parser.close()
+    return "".join(parser.out)
+
+
+def derive(data: dict, cids: dict[str, str], base_name: str) -> tuple[str, str, dict]:
+    """(text, sanitized html, JSON fields) for a receipt's data. cids maps a
+    Content-ID to the image's file name in the receipt's attachment folder."""
+    text = html_to_text(data.get("body") or "")
+    html = sanitize_html(data.get("body") or "",
+                         {cid: f"{quote(base_name)}/{quote(name)}" for cid, name in cids.items()})
+    fields = {
+        "snippet": snippet(text),
+        "sender_domain": sender_domain(data.get("from") or ""),
+        "derived": DERIVED_VERSION,
+    }
+    return text, html, fields
+
+
+def write_derived(path: str, data: dict, cids: dict[str, str]) -> dict:
+    """Write the .txt and .html renditions of the receipt JSON at `path` (its
+    data given) and return the fields that go into the JSON."""
+    base = os.path.splitext(path)[0]
+    text, html, fields = derive(data, cids, os.path.basename(base))
+    compression.write_file(base + ".txt", text.encode("utf-8"))
+    html_path = base + ".html" + (compression.EXT if compression.ENABLED else "")
+    compression.write_file(html_path, html.encode("utf-8"))
+    compression.remove_variants(base + ".html", keep=html_path)
+    return fields
+
+
+def is_current(path: str, data: dict) -> bool:
+    """Whether the receipt at `path` has this version's renditions."""
+    base = os.path.splitext(path)[0]
+    return (data.get("derived") == DERIVED_VERSION
+            and os.path.isfile(base + ".txt") and compression.existing(base + ".html") is not None)
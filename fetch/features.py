@@ -0,0 +1,83 @@
+"""
+What the ledger remembers about each email, and the tokens learned models
+read from it.
+
+process_email stores ledger_features(email) on every ledger entry, so a
+non-receipt (which leaves no receipt file behind) can still be learned from.
+Receipt files carry the same fields; example_from_receipt() reads one back
+into the same shape.
+"""
+import re
+from email.utils import parseaddr
+from html import unescape
+
+from models import HEADER_FIELDS, Email
+
+SNIPPET_CHARS = 400
+BODY_WORDS = 60
+
+# Ledger "source"s that are themselves shortcuts around the LLM (learned.py,
+# sender_history.py, fingerprint.py). Neither model learns from them, so no
+# shortcut trains on its own or another's output.
+AUTOMATIC_SOURCES = {"learned", "sender_history", "duplicate"}
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_TAG = re.compile(r"<[^>]+>")
+
+
+def sender(from_: str) -> tuple[str, str]:
+    """(address, domain), lower-cased; ("", "") if From has no address."""
+    address = parseaddr(from_)[1].lower()
+    return address, address.rpartition("@")[2] if "@" in address else ""
+
+
+def ledger_features(email: Email) -> dict:
+    return {
+        "from": email.from_,
+        "subject": email.subject,
+        "attachments": [a.filename for a in email.attachments],
+        "headers": sorted(k for k, v in email.headers.items() if v),
+        "snippet": " ".join(email.text.split())[:SNIPPET_CHARS],
+    }
+
+
+def example_from_receipt(data: dict) -> dict:
+    """A receipt JSON (models.Email.write) as ledger_features() would have
+    recorded it; the snippet comes from the stored HTML body."""
+    text = unescape(_TAG.sub(" ", data.get("body") or ""))
+    return {
+        "from": data.get("from", ""),
+        "subject": data.get("subject", ""),
+        "attachments": data.get("attachments", []),
+        "headers": sorted(k for k in HEADER_FIELDS.values() if data.get(k)),
+        "snippet": " ".join(text.split())[:SNIPPET_CHARS],
+    }
+
+
+def subject_template(subject: str) -> str:
+    """The subject with numbers and forwarding prefixes taken out, so
+    "Invoice #1043 for March" and "Invoice #1102 for April" share a template
+    modulo the month word."""
+    s = re.sub(r"^((re|fwd?|fw)\s*:\s*)+", "", subject.strip().lower())
+    s = re.sub(r"\d[\d.,/:-]*", "#", s)
+    return " ".join(s.split())
+
+
+def tokens(example: dict) -> list[str]:
+    """Named features of one example: sender, subject words and template,
+    which headers are present, attachment extensions, body words/bigrams."""
+    address, domain = sender(example.get("from", ""))
+    out = [f"addr:{address}", f"dom:{domain}"]
+    if domain.count(".") > 1:
+        out.append("dom:" + ".".join(domain.split(".")[-2:]))
+    subject_words = _WORD.findall(subject_template(example.get("subject", "")))
+    out += [f"subj:{w}" for w in subject_words]
+    out += [f"subj2:{a}_{b}" for a, b in zip(subject_words, subject_words[1:])]
+    out += [f"hdr:{h}" for h in example.get("headers", [])]
+    attachments = example.get("attachments", [])
+    out.append(f"natt:{min(len(attachments), 3)}")
+    out += [f"ext:{name.rpartition('.')[2].lower()}" for name in attachments if "." in name]
+    body = _WORD.findall(example.get("snippet", "").lower())[:BODY_WORDS]
+    out += [f"b:{w}" for w in body]
+    out += [f"b2:{a}_{b}" for a, b in zip(body, body[1:])]
+    return out
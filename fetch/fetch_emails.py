@@ -1,17 +1,255 @@
 import os
-import subprocess
 import sys
 import time
 from datetime import date
 
-import requests
-
+import bandwidth
+import learned
+import priority
+import process_email as pe
+from bandwidth import MB, BandwidthBudget, OverBudget, QuotaExceeded, format_time
+from checkpoint import RunCheckpoint, default_job_name
+from ollama_manager import OllamaManager
 from process_email import process_email, _get_seen_message_ids
 from mailbox_wrapper import Mailbox
+from models import Email
+from raw_cache import RawCache
+from work_queue import QueueServer, WorkQueue
+
+# Emails previewed per round trip, and how much of each one's plain text the
+# preview reads. The classifier looks at the first 5000 words at most, so the
+# default keeps its input the same as a full fetch for all but long emails.
+PEEK_BATCH = int(os.environ.get("FETCH_PEEK_BATCH") or 50)
+PREVIEW_BYTES = int(os.environ.get("FETCH_PREVIEW_BYTES") or 32768)
+
+# A receipt's parts are downloaded in chunks of this size, its attachments
+# streamed to a spool under OUTPUT_DIR and moved into place when written.
+CHUNK_BYTES = int(os.environ.get("FETCH_CHUNK_BYTES") or 1 << 20)
+
+# Queue mode (work_queue.py): with CLASSIFY_QUEUE set to a file, emails that
+# need the LLM are queued for classify_worker.py processes instead of being
+# classified here, and this run applies the verdicts; at most
+# CLASSIFY_QUEUE_AHEAD wait at a time. CLASSIFY_QUEUE_PORT also serves the
+# queue over HTTP (on CLASSIFY_QUEUE_BIND, loopback unless set; any other
+# address needs CLASSIFY_QUEUE_TOKEN) to workers on other hosts.
+QUEUE_PATH = os.environ.get("CLASSIFY_QUEUE") or ""
+QUEUE_AHEAD = int(os.environ.get("CLASSIFY_QUEUE_AHEAD") or 64)
+QUEUE_PORT = int(os.environ.get("CLASSIFY_QUEUE_PORT") or 0)
+QUEUE_BIND = os.environ.get("CLASSIFY_QUEUE_BIND") or "127.0.0.1"
+QUEUE_TOKEN = os.environ.get("CLASSIFY_QUEUE_TOKEN") or ""
+QUEUE_POLL_SECONDS = 0.5
+QUEUE_REPORT_SECONDS = 30
+
+# What previewing one message costs besides its text: headers, labels and
+# BODYSTRUCTURE, for checking a batch against the bandwidth budget.
+PEEK_OVERHEAD_BYTES = 8192
+
+
+def date_range() -> tuple[date, date | None]:
+    """Optional date range (YYYY-MM-DD). Defaults to the original start, no end."""
+    since_env = os.environ.get("FETCH_SINCE")
+    before_env = os.environ.get("FETCH_BEFORE")
+    since = date.fromisoformat(since_env) if since_env else date(2025, 1, 24)
+    before = date.fromisoformat(before_env) if before_env else None
+    return since, before
+
+
+def candidate_query() -> str:
+    """Optional Gmail search (X-GM-RAW syntax) narrowing the date range to
+    likely receipts server-side. Measure what it drops with coverage_audit
+    before relying on it."""
+    return (os.environ.get("FETCH_QUERY") or "").strip()
+
+
+def open_checkpoint(job: str, since: date, before: date | None, query: str = "") -> RunCheckpoint:
+    """The job's checkpoint: a resumed run reuses its UID snapshot and skips
+    the UIDs it already finished. Different date ranges are separate jobs."""
+    params = {"since": since.isoformat(), "before": before.isoformat() if before else None}
+    if query:
+        params["query"] = query
+    try:
+        return RunCheckpoint(os.path.join(pe.OUTPUT_DIR, ".runs"), job, params)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+def snapshot_uids(
+    mb: Mailbox, checkpoint: RunCheckpoint, since: date, before: date | None, query: str = ""
+) -> list[str]:
+    """Search the range (narrowed by the candidate query, if any), or reuse
+    the UID list of a job being resumed."""
+    if checkpoint.uids is None:
+        if query:
+            checkpoint.set_uids(mb.search_raw(query, since, before))
+        else:
+            checkpoint.set_uids(mb.search_dates(since, before))
+        matching = f" matching {query!r}" if query else ""
+        print(f"Found {len(checkpoint.uids or [])} emails since {since}{matching} "
+              f"(job {checkpoint.job})\n")
+    else:
+        print(f"Resuming job {checkpoint.job}: {len(checkpoint.done)} of "
+              f"{len(checkpoint.uids)} emails already done\n")
+    return checkpoint.uids or []
+
+
+def open_mailbox(user: str, password: str) -> Mailbox:
+    """The account's Mailbox, downloading within its bandwidth budget
+    (bandwidth.py) unless FETCH_DAILY_MB=0."""
+    return Mailbox(user, password, spool_dir=os.path.join(pe.OUTPUT_DIR, ".spool"),
+                   chunk_size=CHUNK_BYTES, raw_cache=RawCache.from_env(),
+                   budget=BandwidthBudget.from_env(pe.OUTPUT_DIR, user))
+
+
+def schedule_pending(
+    mb: Mailbox, checkpoint: RunCheckpoint
+) -> tuple[list[str], dict[str, int], dict[str, float]]:
+    """The checkpoint's pending UIDs in fetch order, their sizes (when the
+    mailbox has a budget) and their priority scores: any a previous run was
+    interrupted in first, then likely receipts (priority.py, unless
+    FETCH_PRIORITY=0), and with a budget, oversized messages last."""
+    pending = checkpoint.pending()
+    sizes: dict[str, int] = {}
+    scores: dict[str, float] = {}
+    if priority.PRIORITY and pending:
+        ranked, envelopes, scores = priority.rank(mb, pending, pe._get_sender_history())
+        interrupted = checkpoint.interrupted()
+        first = set(interrupted)
+        pending = interrupted + [u for u in ranked if u not in first]
+        sizes = {uid: env["size"] for uid, env in envelopes.items()}
+        print(priority.describe(pending, envelopes, scores) + "\n")
+    if mb.budget is None:
+        return pending, sizes, scores
+    if not sizes:
+        sizes = mb.sizes(pending)
+    order = bandwidth.schedule(pending, sizes, bandwidth.DEFER_BYTES)
+    large = sum(1 for u in pending if sizes.get(u, 0) > bandwidth.DEFER_BYTES)
+    print(f"Bandwidth: {mb.budget.summary()}; {len(pending)} emails to go, "
+          f"{sum(sizes.values()) / MB:.1f} MB in full"
+          + (f", {large} large ones last" if large else ""))
+    return order, sizes, scores
+
+
+def peek_cost(batch: list[str], sizes: dict[str, int]) -> int:
+    return sum(min(sizes.get(u, 0), PREVIEW_BYTES + PEEK_OVERHEAD_BYTES) for u in batch)
+
+
+def affordable(mb: Mailbox, batch: list[str], sizes: dict[str, int]) -> list[str]:
+    """The longest start of the batch the budget can preview (all of it
+    without a budget); empty once the budget is used up."""
+    if mb.budget is None:
+        return batch
+    room = mb.budget.remaining()
+    for n, uid in enumerate(batch):
+        room -= peek_cost([uid], sizes)
+        if room < 0:
+            return batch[:n]
+    return batch
+
+
+def budget_used_up(mb: Mailbox, uid: str, sizes: dict[str, int]) -> str:
+    """Why affordable() came back empty, for the log."""
+    budget = mb.budget
+    assert budget is not None
+    return (f"budget used up ({budget.summary()}); the rest waits for a later "
+            f"run, from {format_time(budget.free_at(peek_cost([uid], sizes)))}")
+
+
+def priority_range(batch: list[str], scores: dict[str, float]) -> str:
+    """The batch's range of priority scores for the peek line, if it has any."""
+    values = [scores[uid] for uid in batch if uid in scores]
+    return f" (priority {max(values):+.1f} to {min(values):+.1f})" if values else ""
+
+
+def batches(uids: list[str], size: int = PEEK_BATCH):
+    for start in range(0, len(uids), size):
+        yield uids[start:start + size]
+
+
+def start_ollama() -> OllamaManager:
+    """Reuse or start the Ollama server and load the classifier's model(s)."""
+    return OllamaManager(pe.OLLAMA_URL, pe.CLASSIFY_MODEL, pe.OLLAMA_KEEP_ALIVE,
+                         extra_models=(pe.CLASSIFY_FAST_MODEL,)).start()
+
+
+def defer(em: Email, index: int, total: int, error: Exception) -> None:
+    """Put off an email whose receipt can't be downloaded now (bandwidth.py):
+    forgotten as seen and left unfinished in the checkpoint, so the next run
+    takes it up again."""
+    print(f"[{index}/{total}] deferred {em.message_id}: {error}")
+    _get_seen_message_ids().discard(em.message_id)
+
+
+def queue_key(em: Email) -> str:
+    return em.message_id or f"{em.account}/{em.uid}"
+
+
+class QueuedClassification:
+    """The fetch run's side of queue mode: hands the emails that need the LLM
+    to the workers and, as the run's only writer, applies their verdicts
+    (process_email) and finishes them in the checkpoint."""
+
+    def __init__(self, queue: WorkQueue, checkpoint: RunCheckpoint, fetch_full, total: int,
+                 stopping=lambda: False):
+        self.queue = queue
+        self.checkpoint = checkpoint
+        self.fetch_full = fetch_full
+        self.total = total
+        self.stopping = stopping
+        self.waiting: dict[str, tuple[Email, int]] = {}
+        self.failed: list[str] = []
+        self.deferred: list[str] = []
+        self.receipts = 0
+        self._reported = time.time()
+
+    def submit(self, em: Email, index: int) -> None:
+        """Queue an email, first waiting while QUEUE_AHEAD others are."""
+        key = queue_key(em)
+        if key in self.waiting:
+            print(f"[{index}/{self.total}] skip (already queued) {key}")
+            self.checkpoint.finish(em.uid)
+            return
+        self.waiting[key] = (em, index)
+        self.queue.put(key, {
+            "uid": em.uid, "message_id": em.message_id, "from": em.from_,
+            "subject": em.subject, "attachments": [a.filename for a in em.attachments],
+            "text": em.text,
+        })
+        self.drain(QUEUE_AHEAD - 1)
+
+    def drain(self, until: int = 0) -> None:
+        """Apply verdicts as they come back until at most `until` emails are
+        waiting, or the run is stopping (what's left is redone next run,
+        from the queue if the workers got to it)."""
+        while self.waiting:
+            for key, (state, result) in self.queue.finished(list(self.waiting)).items():
+                em, index = self.waiting.pop(key)
+                if state == "failed":
+                    print(f"[{index}/{self.total}] classification failed for {key}: {result}")
+                    self.failed.append(em.uid)
+                    continue
+                assert isinstance(result, dict)
+                em.classification = result["classification"]
+                try:
+                    process_email(em, index=index, total=self.total, fetch_full=self.fetch_full,
+                                  cascade=result.get("cascade"))
+                except (OverBudget, QuotaExceeded) as e:
+                    # The verdict stays queued for the next run to apply.
+                    defer(em, index, self.total, e)
+                    self.deferred.append(em.uid)
+                    continue
+                self.queue.remove(key)
+                self.checkpoint.finish(em.uid)
+                self.receipts += bool(em.classification["is_receipt"])
+            if len(self.waiting) <= until or self.stopping():
+                return
+            if time.time() - self._reported > QUEUE_REPORT_SECONDS:
+                self._reported = time.time()
+                print(f"Waiting on {len(self.waiting)} classifications; queue: "
+                      f"{self.queue.counts()}")
+            time.sleep(QUEUE_POLL_SECONDS)
 
 
 def main():
-    skip = int(sys.argv[1]) if len(sys.argv) > 1 else 0
     user = os.environ.get("GMAIL_USER")
     password = os.environ.get("GMAIL_APP_PASSWORD")
 
@@ -19,55 +257,120 @@ def main():
         print("Set GMAIL_USER and GMAIL_APP_PASSWORD environment variables", file=sys.stderr)
         sys.exit(1)
 
-    # Optional date range (YYYY-MM-DD). Defaults to the original start, no end.
-    since_env = os.environ.get("FETCH_SINCE")
-    before_env = os.environ.get("FETCH_BEFORE")
-    since = date.fromisoformat(since_env) if since_env else date(2025, 1, 24)
-    before = date.fromisoformat(before_env) if before_env else None
+    since, before = date_range()
+    query = candidate_query()
+    job = os.environ.get("FETCH_JOB") or default_job_name(since, before, query)
+    checkpoint = open_checkpoint(job, since, before, query)
 
     print(f"Connecting to Gmail as {user}...")
-    mb = Mailbox(user, password)
-    uids = mb.search_dates(since, before)
-    print(f"Found {len(uids)} emails since {since}\n")
+    try:
+        mb = open_mailbox(user, password)
+    except QuotaExceeded as e:
+        sys.exit(str(e))
+    uids = snapshot_uids(mb, checkpoint, since, before, query)
 
-    ollama_proc = subprocess.Popen(["ollama", "serve"])
-
-    print("\n*****\nWaiting for Ollama...\n*****\n")
-    while True:
-        try:
-            requests.get("http://localhost:11434/api/tags", timeout=2)
-            break
-        except requests.ConnectionError:
-            time.sleep(0.5)
-    print("\n*****\nOllama is up. Loading model...\n*****\n")
-    requests.post(
-        "http://localhost:11434/api/generate",
-        json={"model": "phi3.5", "prompt": "hi", "stream": False},
-        timeout=600,
-    )
-    print("\n*****\nModel loaded.\n*****\n")
+    queue = server = queued = None
+    if QUEUE_PATH:
+        # The workers classify; the manager is only here for its signals.
+        queue = WorkQueue(QUEUE_PATH)
+        ollama = OllamaManager(pe.OLLAMA_URL, pe.CLASSIFY_MODEL)
+        if QUEUE_PORT:
+            try:
+                server = QueueServer(queue, QUEUE_BIND, QUEUE_PORT, QUEUE_TOKEN).start()
+            except ValueError as e:
+                sys.exit(str(e))
+        print(f"Queueing classifications in {QUEUE_PATH}"
+              + (f", served at {server.url}" if server else ""))
+    else:
+        ollama = start_ollama()
+    ollama.handle_signals()
+    model = learned.maybe_retrain()
 
     total = len(uids)
-    for i, uid in enumerate(uids[skip:], skip + 1):
+    out_of_bandwidth = False
+    if queue is not None:
+        queued = QueuedClassification(queue, checkpoint, mb.get, total,
+                                      stopping=lambda: ollama.stopping)
+    try:
+        pending, sizes, scores = schedule_pending(mb, checkpoint)
+    except QuotaExceeded as e:
+        print(f"{e}. The rest waits for a later run.")
+        pending, sizes, scores = [], {}, {}
+        out_of_bandwidth = True
+    # Progress counts in the order of work, which the priority has changed.
+    position = {uid: i for i, uid in enumerate(pending, total - len(pending) + 1)}
+    deferred: list[str] = []
+    receipts = 0
+    for batch in batches(pending):
+        if ollama.stopping:
+            break
+        batch, rest = affordable(mb, batch, sizes), batch
+        if not batch:
+            print(f"Bandwidth {budget_used_up(mb, rest[0], sizes)}.")
+            out_of_bandwidth = True
+            break
         t_fetch = time.time()
+        try:
+            previews = mb.peek(batch, PREVIEW_BYTES)
+        except QuotaExceeded as e:
+            print(f"{e}. The rest waits for a later run.")
+            out_of_bandwidth = True
+            break
+        decided = learned.prejudge(model, previews)
+        found = receipts + (queued.receipts if queued is not None else 0)
+        print(f"peek {len(batch)} emails{priority_range(batch, scores)}: "
+              f"{time.time() - t_fetch:.2f}s, {decided} decided by the learned model; "
+              f"{position[batch[0]] - 1}/{total} done, {found} receipts so far")
 
-        message_id = mb.message_id_of(uid)
-        if message_id in _get_seen_message_ids():
-            print(f"[{i}/{total}] skip {message_id} ({time.time() - t_fetch:.2f}s)")
-            continue
-        print(f"[{i}/{total}] processing {message_id}")
-
-        em = mb.get(uid)
-        if em is None:
-            continue
-        print(f"fetch+parse: {time.time() - t_fetch:.2f}s")
+        for uid in batch:
+            if ollama.stopping:
+                break
+            i = position[uid]
+            checkpoint.start(uid)
+            em = previews.get(uid)
+            if em is None:
+                checkpoint.finish(uid)
+                continue
+            if em.message_id in _get_seen_message_ids():
+                print(f"[{i}/{total}] skip {em.message_id}")
+                checkpoint.finish(uid)
+                continue
+            print(f"[{i}/{total}] processing {em.message_id}"
+                  + (f" (priority {scores[uid]:+.1f})" if uid in scores else ""))
+            if queued is not None and pe.needs_llm(em):
+                queued.submit(em, i)     # finished once its verdict is applied
+                continue
 
-        process_email(em, index=i, total=total)
+            # Only receipts are downloaded in full (mb.get), after classifying.
+            try:
+                ollama.call(process_email, em, index=i, total=total, fetch_full=mb.get)
+            except (OverBudget, QuotaExceeded) as e:
+                defer(em, i, total, e)
+                deferred.append(uid)
+                continue
+            checkpoint.finish(uid)
+            receipts += bool(em.classification and em.classification["is_receipt"])
 
+    if queued is not None:
+        queued.drain()
+        if server is not None:
+            server.stop()
+        if queued.failed:
+            print(f"{len(queued.failed)} emails failed classification; the next run retries them.")
+        deferred += queued.deferred
+        receipts += queued.receipts
+    if deferred:
+        print(f"{len(deferred)} receipts deferred for bandwidth; the next run fetches them.")
+    if mb.budget is not None:
+        print(f"Bandwidth: {mb.budget.summary()}")
     mb.logout()
-    ollama_proc.terminate()
-    ollama_proc.wait()
-    print(f"\nDone. {len(uids)} emails processed.")
+    interrupted = ollama.stopping or out_of_bandwidth or bool(deferred)
+    ollama.shutdown()
+    print(pe.llm_stats_line())
+    if interrupted:
+        print(f"\nStopped; {len(checkpoint.pending())} emails left for the next run of job {job}.")
+        return
+    print(f"\nDone. {len(uids)} emails processed, {receipts} receipts in this run.")
 
 
 if __name__ == "__main__":
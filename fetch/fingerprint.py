@@ -0,0 +1,205 @@
+"""
+Near-duplicate detection: the same receipt forwarded to ourselves, sent again
+by a shop, or arriving in two of the accounts we fetch.
+
+fingerprint() sums an email up as its normalized subject (forwarding prefixes
+taken out), sender address, attachment names, the numbers it mentions, and a
+64-bit SimHash of its text (word shingles, with quoting and forwarded-message
+header lines dropped, so a forwarded copy hashes like the original). Once a
+receipt is downloaded in full, the fingerprint also gets the SHA-256 of each
+attachment. process_email stores it on the email's ledger entry.
+
+DuplicateIndex holds the fingerprints of the ledgers, built on first use like
+SenderHistory. Lookup splits the SimHash into max_distance + 1 bands: two
+hashes at most max_distance bits apart agree on at least one band, so only
+emails sharing a band bucket are compared. An email is a duplicate of an
+earlier one when all of these hold:
+
+- they are at most window_days apart;
+- the SimHashes differ in at most max_distance bits;
+- they have the same attachment names (and, when both have them, the same
+  attachment hashes);
+- both mention numbers, and those of one are all in the other: a monthly bill
+  with a new amount, date or invoice number is not a duplicate of last
+  month's;
+- they share the normalized subject or the sender.
+
+Emails with too little text to hash never match. The duplicate gets the
+original's verdict ("source": "duplicate") without the LLM, and a receipt is
+stored as a link to the original instead of a second copy.
+"""
+import hashlib
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from features import sender
+from models import Attachment, Email
+
+MAX_NUMBERS = 200       # kept per fingerprint; long statements list more
+MIN_WORDS = 20          # fewer words than this aren't worth a SimHash
+SHINGLE = 3
+HASH_CHUNK_BYTES = 1 << 20
+
+_WORD = re.compile(r"[^\W\d_]+", re.UNICODE)
+_NUMBER = re.compile(r"\d[\d.,]*\d|\d")
+_PREFIX = re.compile(r"^((re|fwd?|fw|aw|wg|tr|sv)\s*:\s*|\[[^\]]*\]\s*)+", re.IGNORECASE)
+_FORWARD_LINE = re.compile(
+    r"^\s*(-+\s*(forwarded|original) message\s*-+|begin forwarded message:?"
+    r"|(from|sent|date|to|cc|subject)\s*:.*)\s*$",
+    re.IGNORECASE,
+)
+_BITS = np.arange(64, dtype=np.uint64)
+
+
+def normalize_subject(subject: str) -> str:
+    """Lower-cased, whitespace collapsed, Re:/Fwd:/[tag] prefixes removed."""
+    return " ".join(_PREFIX.sub("", subject.strip()).lower().split())
+
+
+def _content(text: str) -> str:
+    """The text without quote markers and forwarded-message header lines."""
+    lines = (line.lstrip("> ") for line in text.splitlines())
+    return "\n".join(line for line in lines if not _FORWARD_LINE.match(line))
+
+
+def simhash(text: str) -> int | None:
+    """64-bit SimHash over word shingles, or None for a text too short."""
+    words = _WORD.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    shingles: dict[str, int] = {}
+    for i in range(len(words) - SHINGLE + 1):
+        key = " ".join(words[i:i + SHINGLE])
+        shingles[key] = shingles.get(key, 0) + 1
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(k.encode(), digest_size=8).digest(), "big")
+         for k in shingles],
+        dtype=np.uint64,
+    )
+    bits = ((hashes[:, None] >> _BITS) & np.uint64(1)).astype(np.int64)
+    weights = np.array(list(shingles.values()), dtype=np.int64)[:, None]
+    votes = (weights * (2 * bits - 1)).sum(axis=0)
+    return sum(1 << i for i in range(64) if votes[i] > 0)
+
+
+def numbers(text: str) -> list[str]:
+    return sorted({n for n in _NUMBER.findall(text)})[:MAX_NUMBERS]
+
+
+def fingerprint(email: Email) -> dict:
+    """What the ledger keeps to recognize this email's duplicates. Works on a
+    preview: attachments are compared by name until attachment_hashes()."""
+    content = _content(email.text)
+    h = simhash(content)
+    return {
+        "subject": normalize_subject(email.subject),
+        "sender": sender(email.from_)[0],
+        "simhash": f"{h:016x}" if h is not None else None,
+        "numbers": numbers(f"{email.subject}\n{content}"),
+        "attachments": sorted(a.filename for a in email.attachments),
+    }
+
+
+def _sha256(attachment: Attachment) -> str:
+    """A spooled attachment is hashed from its file a chunk at a time, so a
+    30 MB statement is never read into memory whole."""
+    if attachment.path is None:
+        return hashlib.sha256(attachment.content).hexdigest()
+    digest = hashlib.sha256()
+    with open(attachment.path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def attachment_hashes(email: Email) -> list[str]:
+    """SHA-256 of each attachment of a full email, sorted."""
+    return sorted(_sha256(a) for a in email.attachments)
+
+
+def _when(timestamp: str) -> datetime | None:
+    try:
+        return datetime.strptime(timestamp, "%Y-%m-%dT%H-%M-%S")
+    except (TypeError, ValueError):
+        return None
+
+
+class DuplicateIndex:
+    def __init__(self, max_distance: int = 3, window_days: float = 7):
+        self.max_distance = max_distance
+        self.window = timedelta(days=window_days)
+        bands = max_distance + 1
+        self._bands = [(64 * i // bands, 64 * (i + 1) // bands) for i in range(bands)]
+        self._buckets: dict[tuple[int, int], list[dict]] = {}
+        self.size = 0
+
+    def _keys(self, h: int) -> list[tuple[int, int]]:
+        return [(i, (h >> lo) & ((1 << (hi - lo)) - 1)) for i, (lo, hi) in enumerate(self._bands)]
+
+    def add_entry(self, entry: dict) -> None:
+        """Index a ledger entry that has a fingerprint with a SimHash and is
+        not itself a duplicate (its duplicates link to the original)."""
+        fp = entry.get("fingerprint")
+        when = _when(entry.get("timestamp") or "")
+        if not fp or not fp.get("simhash") or entry.get("duplicate_of") or when is None:
+            return
+        h = int(fp["simhash"], 16)
+        item = {
+            "message_id": entry.get("message_id"),
+            "is_receipt": entry.get("is_receipt"),
+            # Where its receipt file is: <month>/<base_name>, as the viewer names it.
+            "original": f"{entry['timestamp'][:7]}/{entry['timestamp']}_{entry['uid']}"
+                        if entry.get("is_receipt") else None,
+            "when": when,
+            "simhash": h,
+            "fingerprint": fp,
+        }
+        for key in self._keys(h):
+            self._buckets.setdefault(key, []).append(item)
+        self.size += 1
+
+    def _matches(self, fp: dict, other: dict) -> bool:
+        if fp["attachments"] != other["attachments"]:
+            return False
+        if fp.get("hashes") and other.get("hashes") and fp["hashes"] != other["hashes"]:
+            return False
+        a, b = set(fp["numbers"]), set(other["numbers"])
+        if not (a and b and (a <= b or b <= a)):
+            return False
+        return fp["subject"] == other["subject"] or bool(fp["sender"] and fp["sender"] == other["sender"])
+
+    def find(self, fp: dict, when: datetime) -> dict | None:
+        """The earlier email `fp` (of an email dated `when`) duplicates, as
+        {message_id, is_receipt, original, distance}, or None."""
+        if not fp.get("simhash"):
+            return None
+        h = int(fp["simhash"], 16)
+        when = when.replace(tzinfo=None)
+        best, seen = None, set()
+        for key in self._keys(h):
+            for item in self._buckets.get(key, ()):
+                if id(item) in seen:
+                    continue
+                seen.add(id(item))
+                distance = bin(h ^ item["simhash"]).count("1")
+                if (distance > self.max_distance or abs(when - item["when"]) > self.window
+                        or not self._matches(fp, item["fingerprint"])):
+                    continue
+                if best is None or (distance, item["when"]) < (best["distance"], best["when"]):
+                    best = {**item, "distance": distance}
+        if best is None:
+            return None
+        return {k: best[k] for k in ("message_id", "is_receipt", "original", "distance")}
+
+    def verdict(self, match: dict) -> dict:
+        """The classification a duplicate gets from its original."""
+        return {
+            "is_receipt": match["is_receipt"],
+            "confidence": round(1 - match["distance"] / 64, 3),
+            "reason": f"duplicate of {match['message_id']}",
+            "source": "duplicate",
+            "duplicate_of": match["message_id"],
+            **({"original": match["original"]} if match["original"] else {}),
+        }
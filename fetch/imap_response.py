@@ -0,0 +1,222 @@
+"""
+Parsing of IMAP FETCH responses beyond the single-message shapes Mailbox.get
+handles inline: bulk responses covering many messages, BODYSTRUCTURE trees,
+and section literals.
+
+imaplib hands a FETCH response back as a flat list mixing plain bytes lines and
+(text, literal) tuples; parse_fetch() turns that into one dict per message,
+keyed by item name ("UID", "X-GM-LABELS", "BODYSTRUCTURE", "BODY[1]<0>", ...).
+body_parts() flattens a BODYSTRUCTURE into the leaf parts with their section
+numbers, which is what partial and part-level fetches address.
+"""
+import re
+from itertools import takewhile
+from dataclasses import dataclass, field
+from urllib.parse import unquote
+
+_TOKEN = re.compile(
+    rb"""\s*(?:
+        (?P<open>\()
+      | (?P<close>\))
+      | "(?P<quoted>(?:[^"\\]|\\.)*)"
+      | \{(?P<literal>\d+)\}\s*$
+      | (?P<atom>[^\s()"\[]+(?:\[[^\]]*\])?(?:<[\d.]+>)?)
+    )""",
+    re.VERBOSE,
+)
+
+
+class _Literal(bytes):
+    """A literal's payload, kept distinct from atoms while parsing."""
+
+
+_OPEN, _CLOSE = object(), object()
+
+
+def _tokenize(text: bytes, tokens: list) -> None:
+    pos = 0
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m:
+            if text[pos:].strip():
+                raise ValueError(f"unparseable FETCH response near {text[pos:pos + 40]!r}")
+            break
+        pos = m.end()
+        if m.group("open"):
+            tokens.append(_OPEN)
+        elif m.group("close"):
+            tokens.append(_CLOSE)
+        elif m.group("quoted") is not None:
+            tokens.append(re.sub(rb"\\(.)", rb"\1", m.group("quoted")).decode("utf-8", "replace"))
+        elif m.group("atom"):
+            atom = m.group("atom").decode("utf-8", "replace")
+            tokens.append(None if atom.upper() == "NIL" else atom)
+        # A {n} literal marker carries no value; the literal follows as data.
+
+
+def _nest(tokens: list):
+    """Turn the flat token list into nested lists (one per parenthesis)."""
+    stack: list[list] = [[]]
+    for tok in tokens:
+        if tok is _OPEN:
+            stack.append([])
+        elif tok is _CLOSE:
+            done = stack.pop()
+            stack[-1].append(done)
+        else:
+            stack[-1].append(tok)
+    if len(stack) != 1:
+        raise ValueError("unbalanced parentheses in FETCH response")
+    return stack[0]
+
+
+def _nested_value(value):
+    """A literal inside a parenthesized item (a BODYSTRUCTURE filename, a
+    non-ASCII label) is a string like its quoted neighbours."""
+    if isinstance(value, list):
+        return [_nested_value(v) for v in value]
+    if isinstance(value, _Literal):
+        return bytes(value).decode("utf-8", "replace")
+    return value
+
+
+def parse_fetch(data: list) -> list[dict]:
+    """imaplib FETCH data -> [{item name: value}], one dict per message.
+
+    Values are strings for atoms, bytes for literals (message sections) and
+    nested lists for parenthesized items such as X-GM-LABELS and BODYSTRUCTURE,
+    in which literals are strings too.
+    """
+    tokens: list = []
+    for piece in data:
+        if piece is None:
+            continue
+        if isinstance(piece, tuple):
+            _tokenize(piece[0], tokens)
+            tokens.append(_Literal(piece[1]))
+        else:
+            _tokenize(piece, tokens)
+    nested = _nest(tokens)
+
+    messages = []
+    # Top level alternates: sequence number, (item value item value ...).
+    for items in nested[1::2]:
+        if not isinstance(items, list):
+            continue
+        messages.append({
+            str(items[i]).upper(): (bytes(v) if isinstance(v, _Literal) else _nested_value(v))
+            for i, v in zip(range(0, len(items), 2), items[1::2])
+        })
+    return messages
+
+
+# --- BODYSTRUCTURE -------------------------------------------------------------
+
+@dataclass
+class BodyPart:
+    section: str                    # "1", "2.1", ... as used in BODY[<section>]
+    content_type: str               # lower-case "type/subtype"
+    params: dict = field(default_factory=dict)
+    encoding: str = "7bit"
+    size: int = 0
+    disposition: str = ""           # lower-case "attachment" / "inline" / ""
+    disposition_params: dict = field(default_factory=dict)
+    content_id: str = ""            # Content-ID without the <>
+
+    @property
+    def charset(self) -> str:
+        return self.params.get("charset", "")
+
+    @property
+    def filename(self) -> str:
+        """The raw (possibly RFC 2047-encoded) filename, from the disposition's
+        filename or the type's name parameter, RFC 2231 continuations joined."""
+        for params in (self.disposition_params, self.params):
+            for key in ("filename", "name"):
+                if key in params:
+                    return params[key]
+        return ""
+
+    @property
+    def is_attachment(self) -> bool:
+        return self.disposition == "attachment"
+
+    @property
+    def is_embedded_image(self) -> bool:
+        """An image the HTML body shows by cid: rather than an attachment."""
+        return (self.content_type.startswith("image/") and bool(self.content_id)
+                and not self.is_attachment)
+
+
+def _params(value) -> dict:
+    """A ("KEY" "value" ...) list -> {key: value}, RFC 2231 (key*, key*0*)
+    parameters decoded and joined under the bare key."""
+    if not isinstance(value, list):
+        return {}
+    raw = [(str(k).lower(), v or "") for k, v in zip(value[::2], value[1::2])]
+    plain = {k: v for k, v in raw if "*" not in k}
+    extended: dict[str, list[tuple[str, str]]] = {}
+    for k, v in raw:
+        if "*" in k:
+            extended.setdefault(k.split("*")[0], []).append((k, v))
+    for name, pieces in extended.items():
+        # filename*0*=utf-8''a, filename*1*=b -> one RFC 2231 value.
+        pieces.sort(key=lambda kv: int(kv[0].split("*")[1] or 0))
+        joined = "".join(v for _, v in pieces)
+        if pieces[0][0].endswith("*"):
+            if joined.count("'") >= 2:
+                charset, _lang, joined = joined.split("'", 2)
+            else:
+                charset = ""
+            joined = unquote(joined, encoding=charset or "utf-8", errors="replace")
+        plain[name] = joined
+    return plain
+
+
+def _leaf(node: list, section: str) -> BodyPart:
+    type_, subtype = str(node[0]).lower(), str(node[1]).lower()
+    # Where the extension data starts depends on the part's type.
+    if type_ == "text":
+        ext = 8
+    elif (type_, subtype) == ("message", "rfc822"):
+        ext = 10
+    else:
+        ext = 7
+    disposition, disp_params = "", {}
+    disp = node[ext + 1] if len(node) > ext + 1 else None
+    if isinstance(disp, list) and disp:
+        disposition = str(disp[0]).lower()
+        disp_params = _params(disp[1] if len(disp) > 1 else None)
+    return BodyPart(
+        section=section,
+        content_type=f"{type_}/{subtype}",
+        params=_params(node[2]),
+        encoding=str(node[5] or "7bit").lower(),
+        size=int(node[6] or 0),
+        disposition=disposition,
+        disposition_params=disp_params,
+        content_id=str(node[3] or "").strip().strip("<>"),
+    )
+
+
+def body_parts(structure: list, prefix: str = "") -> list[BodyPart]:
+    """Every leaf part of a BODYSTRUCTURE, depth-first, with section numbers.
+
+    A single-part message is section "1"; children of a multipart are numbered
+    from 1 under their parent. An attached message/rfc822 is walked into, as
+    email's walk() would: its body's parts are numbered under it (a
+    single-part body is "<section>.1").
+    """
+    if isinstance(structure[0], list):
+        # Children come first; the subtype and extension data follow them.
+        children = list(takewhile(lambda c: isinstance(c, list), structure))
+        parts = []
+        for i, child in enumerate(children, 1):
+            parts.extend(body_parts(child, f"{prefix}.{i}" if prefix else str(i)))
+        return parts
+    section = prefix or "1"
+    nested = structure[8] if len(structure) > 8 else None
+    if (str(structure[0]).lower(), str(structure[1]).lower()) == ("message", "rfc822") and (
+            isinstance(nested, list) and nested):
+        return body_parts(nested, section if isinstance(nested[0], list) else f"{section}.1")
+    return [_leaf(structure, section)]
@@ -19,6 +19,9 @@ fi
 docker build -t gmail-import -f - . <<'EOF'
 FROM python:3.12-slim
 
+# Reads and writes the raw cache (RAW_CACHE_DIR) in the fetch run's format.
+RUN pip install --no-cache-dir zstandard
+
 WORKDIR /app
 COPY *.py .
 COPY import_labeled/import_labeled.py .
@@ -28,6 +31,8 @@ EOF
 docker run --rm \
   -e GMAIL_USER="$1" \
   -e GMAIL_APP_PASSWORD="$2" \
+  -e RAW_CACHE_DIR="$RAW_CACHE_DIR" \
+  -e RECEIPT_COMPRESSION="$RECEIPT_COMPRESSION" \
   -e RECEIPT_LABELS="$RECEIPT_LABELS" \
   -e FETCH_SINCE="$FETCH_SINCE" \
   -e FETCH_BEFORE="$FETCH_BEFORE" \
@@ -5,7 +5,7 @@ Finds emails carrying a receipt label (RECEIPT_LABELS, comma-separated) within
 the date range (FETCH_SINCE / FETCH_BEFORE, YYYY-MM-DD) and imports any that
 aren't already saved as receipts: written with a manual classification
 (source: "manual") and their _processed.json ledger entry set to
-is_receipt: true. Already-saved receipts are skipped.
+is_receipt: true, source: "manual". Already-saved receipts are skipped.
 """
 import glob
 import json
@@ -14,7 +14,9 @@ import sys
 from datetime import date, datetime
 from email.utils import parsedate_to_datetime
 
+import changes
 from mailbox_wrapper import Mailbox
+from raw_cache import RawCache
 
 OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/output")
 
@@ -66,13 +68,20 @@ def _save_imported(email) -> None:
             "message_id": email.message_id,
             "timestamp": timestamp,
             "is_receipt": True,
+            "source": "manual",
         })
     else:
-        entry.update({"uid": email.uid, "timestamp": timestamp, "is_receipt": True})
+        # "source": "manual" also overrides a verdict the learned model or
+        # sender history made, so their next training counts the correction.
+        entry.update({"uid": email.uid, "timestamp": timestamp, "is_receipt": True,
+                      "source": "manual"})
     with open(processed_path, "w", encoding="utf-8") as f:
         json.dump(processed, f, indent=2, ensure_ascii=False)
+    changes.publish(OUTPUT_DIR, "ledger", month)
 
-    email.write(os.path.join(month_dir, f"{timestamp}_{email.uid}.json"))
+    base_name = f"{timestamp}_{email.uid}"
+    email.write(os.path.join(month_dir, f"{base_name}.json"))
+    changes.publish(OUTPUT_DIR, "receipt", month, base_name=base_name)
 
 
 def main():
@@ -93,7 +102,8 @@ def main():
     since = date.fromisoformat(since_env) if since_env else date(2025, 1, 24)
     before = date.fromisoformat(before_env) if before_env else None
 
-    mb = Mailbox(user, password)
+    mb = Mailbox(user, password, spool_dir=os.path.join(OUTPUT_DIR, ".spool"),
+                 raw_cache=RawCache.from_env())
 
     # Every message carrying one of the labels in the date range (UIDs, deduped).
     uids: set[str] = set()
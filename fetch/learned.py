@@ -0,0 +1,308 @@
+"""
+A small classifier learned from our own history, in front of the LLM.
+
+Training data is what the pipeline has already decided: every ledger entry
+that carries features (process_email records them) labelled with its
+is_receipt, which import_labeled's manual corrections override, plus the
+receipt files from before features were recorded. Verdicts the learned model
+or sender history made themselves are left out, so it never trains on its own
+output.
+
+The model is logistic regression over hashed tokens (features.tokens: sender
+address and domain, subject words, which headers are present, attachment
+extensions, body words and bigrams). Picked by Message-ID hash, 15% of the
+examples are kept out of the fit for calibration: on them two thresholds are
+chosen so that what the model decides on its own is right at least
+LEARNED_PRECISION of the time (default 0.99) in each direction. Everything
+between them goes to the LLM. Another 15% is held out from both, and the
+report (accuracy, and how much and how well the thresholds decide) is
+measured on those alone.
+
+The model lives in OUTPUT_DIR/.model/ with a JSON report of the held-out
+accuracy. A fetch retrains it when it is older than LEARNED_RETRAIN_DAYS
+(default 7). LEARNED_CLASSIFIER=0 turns it off.
+
+Usage (from fetch/, OUTPUT_DIR pointing at the output folder):
+    python learned.py        # train now and print the held-out report
+"""
+import glob
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+import process_email as pe
+from features import AUTOMATIC_SOURCES, example_from_receipt, ledger_features, tokens
+from models import Email, read_receipt
+
+N_BUCKETS = 1 << 18
+CALIBRATION_SHARE = 0.15
+HOLDOUT_SHARE = 0.15
+MIN_EXAMPLES = 200
+MIN_PER_CLASS = 20
+
+PRECISION = float(os.environ.get("LEARNED_PRECISION") or 0.99)
+RETRAIN_DAYS = float(os.environ.get("LEARNED_RETRAIN_DAYS") or 7)
+ENABLED = os.environ.get("LEARNED_CLASSIFIER") != "0"
+
+
+def model_dir() -> str:
+    return os.path.join(pe.OUTPUT_DIR, ".model")
+
+
+def load_examples() -> list[tuple[str, dict, bool]]:
+    """(message_id, features, is_receipt) for every email we have a trusted
+    verdict and features for."""
+    examples: dict[str, tuple[dict, bool]] = {}
+    verdicts: dict[str, bool] = {}
+    for p in sorted(glob.glob(os.path.join(pe.OUTPUT_DIR, "*", "*_processed.json"))):
+        with open(p, "r", encoding="utf-8") as f:
+            for entry in json.load(f):
+                mid = entry.get("message_id")
+                if not mid:
+                    continue
+                verdicts[mid] = bool(entry.get("is_receipt"))
+                if entry.get("features") and entry.get("source") not in AUTOMATIC_SOURCES:
+                    examples[mid] = (entry["features"], bool(entry.get("is_receipt")))
+
+    for p in sorted(glob.glob(os.path.join(pe.OUTPUT_DIR, "*", "*.json"))):
+        if p.endswith("_processed.json"):
+            continue
+        data = read_receipt(p)
+        mid = data.get("message_id")
+        source = (data.get("classification") or {}).get("source")
+        if not mid or source in AUTOMATIC_SOURCES:
+            continue
+        if mid in examples:
+            # A manual import flips the ledger entry but keeps its features.
+            examples[mid] = (examples[mid][0], verdicts.get(mid, True))
+        else:
+            examples[mid] = (example_from_receipt(data), verdicts.get(mid, True))
+    return [(mid, feats, label) for mid, (feats, label) in examples.items()]
+
+
+def _hash(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8")) % N_BUCKETS
+
+
+def vectorize(examples: list[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sparse rows as (row ids, bucket ids, values); each row's distinct
+    buckets are weighted 1/sqrt(count) so long emails don't dominate."""
+    rows, cols, vals = [], [], []
+    for i, ex in enumerate(examples):
+        buckets = sorted({_hash(t) for t in tokens(ex)})
+        rows.extend([i] * len(buckets))
+        cols.extend(buckets)
+        vals.extend([1 / np.sqrt(len(buckets))] * len(buckets))
+    return (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64),
+            np.array(vals, dtype=np.float64))
+
+
+def _logits(w: np.ndarray, b: float, x, n: int) -> np.ndarray:
+    rows, cols, vals = x
+    return np.bincount(rows, weights=w[cols] * vals, minlength=n) + b
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+
+def fit(examples: list[dict], labels: list[bool], epochs: int = 300,
+        lr: float = 0.5, l2: float = 1e-5) -> tuple[np.ndarray, float]:
+    """Class-balanced L2 logistic regression by full-batch gradient descent
+    (with momentum) over the hashed features."""
+    x = vectorize(examples)
+    rows, cols, vals = x
+    y = np.array(labels, dtype=np.float64)
+    n = len(y)
+    pos = max(y.sum(), 1.0)
+    sample_w = np.where(y == 1, n / (2 * pos), n / (2 * max(n - pos, 1.0))) / n
+
+    w, b = np.zeros(N_BUCKETS), 0.0
+    vw, vb = np.zeros(N_BUCKETS), 0.0
+    for _ in range(epochs):
+        err = (_sigmoid(_logits(w, b, x, n)) - y) * sample_w
+        gw = np.bincount(cols, weights=err[rows] * vals, minlength=N_BUCKETS) + l2 * w
+        vw = 0.9 * vw + gw
+        vb = 0.9 * vb + err.sum()
+        w -= lr * vw
+        b -= lr * vb
+    return w, b
+
+
+def thresholds(p: np.ndarray, y: np.ndarray, precision: float) -> tuple[float, float]:
+    """(lo, hi): the widest cut-offs at which P(receipt) >= hi is a receipt
+    and <= lo is not, each at least `precision` of the time on (p, y).
+    Where no cut-off qualifies the model never decides that way."""
+    n = np.arange(1, len(p) + 1)
+    order = np.argsort(-p)
+    ok = np.nonzero(np.cumsum(y[order]) / n >= precision)[0]
+    hi = float(p[order][ok[-1]]) if len(ok) else 1.01
+    order = np.argsort(p)
+    ok = np.nonzero(np.cumsum(1 - y[order]) / n >= precision)[0]
+    lo = float(p[order][ok[-1]]) if len(ok) else -0.01
+    return lo, hi
+
+
+def _split(mid: str) -> str:
+    """"train", "calibrate" or "test", fixed per Message-ID."""
+    bucket = zlib.crc32(mid.encode("utf-8")) % 100
+    if bucket < CALIBRATION_SHARE * 100:
+        return "calibrate"
+    if bucket < (CALIBRATION_SHARE + HOLDOUT_SHARE) * 100:
+        return "test"
+    return "train"
+
+
+class LearnedModel:
+    def __init__(self, weights: np.ndarray, bias: float, lo: float, hi: float, report: dict):
+        self.weights = weights
+        self.bias = bias
+        self.lo = lo
+        self.hi = hi
+        self.report = report
+
+    def predict(self, examples: list[dict]) -> np.ndarray:
+        """P(receipt) for a batch of feature dicts, in one vectorized pass."""
+        if not examples:
+            return np.zeros(0)
+        return _sigmoid(_logits(self.weights, self.bias, vectorize(examples), len(examples)))
+
+    def judge(self, emails: list[Email]) -> dict[str, dict]:
+        """uid -> classification for the emails the model is sure about."""
+        probs = self.predict([ledger_features(em) for em in emails])
+        verdicts = {}
+        for em, p in zip(emails, probs):
+            if p >= self.hi or p <= self.lo:
+                verdicts[em.uid] = {
+                    "is_receipt": bool(p >= self.hi),
+                    "confidence": round(float(max(p, 1 - p)), 3),
+                    "reason": f"learned model, P(receipt) {p:.3f}",
+                    "source": "learned",
+                }
+        return verdicts
+
+    def save(self) -> str:
+        os.makedirs(model_dir(), exist_ok=True)
+        path = os.path.join(model_dir(), "learned.npz")
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, weights=self.weights.astype(np.float32),
+                            bias=self.bias, lo=self.lo, hi=self.hi)
+        os.replace(tmp, path)
+        with open(os.path.join(model_dir(), "learned.json"), "w", encoding="utf-8") as f:
+            json.dump(self.report, f, indent=2)
+        return path
+
+    @classmethod
+    def load(cls) -> "LearnedModel | None":
+        path = os.path.join(model_dir(), "learned.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            weights = data["weights"].astype(np.float64)
+            bias, lo, hi = float(data["bias"]), float(data["lo"]), float(data["hi"])
+        report = {}
+        report_path = os.path.join(model_dir(), "learned.json")
+        if os.path.exists(report_path):
+            with open(report_path, "r", encoding="utf-8") as f:
+                report = json.load(f)
+        return cls(weights, bias, lo, hi, report)
+
+
+def train(examples: list[tuple[str, dict, bool]], precision: float = PRECISION) -> LearnedModel | None:
+    """Fit on the training split, pick the thresholds on the calibration
+    split and measure on the held-out one, which neither step has seen. None
+    if there's too little data."""
+    splits: dict[str, list[tuple[dict, bool]]] = {"train": [], "calibrate": [], "test": []}
+    for mid, f, label in examples:
+        splits[_split(mid)].append((f, label))
+    train_set, calibration_set, test_set = splits["train"], splits["calibrate"], splits["test"]
+    receipts = sum(y for _, _, y in examples)
+    if (len(examples) < MIN_EXAMPLES or receipts < MIN_PER_CLASS
+            or len(examples) - receipts < MIN_PER_CLASS or not calibration_set or not test_set):
+        return None
+
+    t0 = time.time()
+    w, b = fit([f for f, _ in train_set], [y for _, y in train_set])
+    model = LearnedModel(w, b, -0.01, 1.01, {})
+    model.lo, model.hi = thresholds(
+        model.predict([f for f, _ in calibration_set]),
+        np.array([y for _, y in calibration_set], dtype=np.float64), precision)
+    p = model.predict([f for f, _ in test_set])
+    y = np.array([y for _, y in test_set], dtype=np.float64)
+
+    predicted = p >= 0.5
+    decided = (p >= model.hi) | (p <= model.lo)
+    tp = float(np.sum(predicted & (y == 1)))
+    model.report = {
+        "trained_at": time.time(),
+        "train_seconds": round(time.time() - t0, 2),
+        "examples": len(examples),
+        "receipts": int(receipts),
+        "calibration": len(calibration_set),
+        "held_out": len(test_set),
+        "accuracy": round(float(np.mean(predicted == (y == 1))), 4),
+        "precision": round(tp / max(float(predicted.sum()), 1.0), 4),
+        "recall": round(tp / max(float(y.sum()), 1.0), 4),
+        "target_precision": precision,
+        "lo": round(model.lo, 4),
+        "hi": round(model.hi, 4),
+        "coverage": round(float(decided.mean()), 4),
+        "decided_accuracy": (round(float(np.mean((p[decided] >= 0.5) == (y[decided] == 1))), 4)
+                             if decided.any() else None),
+    }
+    return model
+
+
+def print_report(r: dict) -> None:
+    print(f"Learned model: {r['examples']} examples ({r['receipts']} receipts), "
+          f"{r.get('calibration', 0)} for calibration, {r['held_out']} held out")
+    print(f"  held-out accuracy {r['accuracy']:.1%}, precision {r['precision']:.1%}, "
+          f"recall {r['recall']:.1%}")
+    decided = r["decided_accuracy"]
+    print(f"  decides {r['coverage']:.1%} alone (P <= {r['lo']:.3f} or >= {r['hi']:.3f}), "
+          f"{'-' if decided is None else f'{decided:.1%}'} right; the rest goes to the LLM")
+
+
+def maybe_retrain(max_age_days: float = RETRAIN_DAYS) -> LearnedModel | None:
+    """The saved model, retrained first if it is missing or older than
+    max_age_days. None when turned off or there isn't enough history yet."""
+    if not ENABLED:
+        return None
+    model = LearnedModel.load()
+    if model is None or (time.time() - model.report.get("trained_at", 0)) / 86400 >= max_age_days:
+        fresh = train(load_examples())
+        if fresh is not None:
+            fresh.save()
+            print_report(fresh.report)
+            model = fresh
+    return model
+
+
+def prejudge(model: LearnedModel | None, previews: dict[str, Email]) -> int:
+    """Stamp the model's confident verdicts onto a batch of previews, which
+    process_email then records without asking the LLM. Returns how many."""
+    if model is None or not previews:
+        return 0
+    verdicts = model.judge(list(previews.values()))
+    for uid, classification in verdicts.items():
+        previews[uid].classification = classification
+    return len(verdicts)
+
+
+def main():
+    examples = load_examples()
+    model = train(examples)
+    if model is None:
+        print(f"Not enough history to train: {len(examples)} examples "
+              f"(need {MIN_EXAMPLES}, at least {MIN_PER_CLASS} of each class)")
+        return
+    path = model.save()
+    print_report(model.report)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
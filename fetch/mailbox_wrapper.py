@@ -4,16 +4,59 @@ Gmail IMAP handling, wrapped in one class.
 Message-ID stays the durable id we store/dedup on; UID is the transient handle
 IMAP needs to actually fetch a message. Every method here addresses messages by
 UID and reconnects automatically if the server drops the connection.
+
+Reading comes in two depths: peek() gets just enough of a batch of messages to
+classify them (headers, labels, attachment names and the start of the plain
+text), get() downloads one whole message once it is known to be worth keeping.
+get() goes part by part as BODYSTRUCTURE lays them out, each in bounded chunks
+(BODY.PEEK[n]<offset.length>) decoded as they arrive, and can stream
+attachments to a spool directory, so a 30 MB statement never sits in memory.
+
+With a BandwidthBudget (bandwidth.py), every FETCH is charged to it, get()
+won't start a message the budget can't cover, and a quota error from Gmail
+starts a back-off instead of a reconnect.
 """
 
+import binascii
 import email
 import imaplib
+import io
+import os
+import quopri
 import re
+import select
+import shutil
+import tempfile
+import threading
+import time
 from datetime import date
+from typing import Callable, Generator, Iterable, Iterator
 from email.header import decode_header
+from email.message import Message
 from html import escape
 
+from bandwidth import BandwidthBudget, OverBudget, QuotaExceeded, is_quota_error
+from imap_response import BodyPart, body_parts, parse_fetch
 from models import Email, Attachment, HEADER_FIELDS
+from raw_cache import RawCache
+
+_EXISTS = re.compile(rb"\* \d+ EXISTS\b", re.IGNORECASE)
+
+# Everything peek() needs besides the text itself, in one FETCH per batch.
+PEEK_ITEMS = "(UID X-GM-LABELS RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER])"
+
+
+# UIDs per FETCH when asking for sizes or envelopes only.
+SIZES_BATCH = 1000
+ENVELOPE_FIELDS = "BODY[HEADER.FIELDS (FROM SUBJECT CONTENT-TYPE)]"
+ENVELOPE_ITEMS = f"(UID X-GM-LABELS RFC822.SIZE {ENVELOPE_FIELDS.replace('BODY[', 'BODY.PEEK[')})"
+
+
+def _response_bytes(data) -> int:
+    """What a command's response data weighs on the wire, near enough."""
+    return sum(len(piece) for item in data or []
+               for piece in (item if isinstance(item, tuple) else (item,))
+               if isinstance(piece, bytes))
 
 
 def _imap_date(d: date) -> str:
@@ -37,6 +80,67 @@ def decode_header_value(value: str | None) -> str:
     return "".join(decoded)
 
 
+def _decode_text(payload: bytes, charset: str | None) -> str:
+    charset = charset or "utf-8"
+    if charset.lower().endswith(("-i", "-e")):
+        charset = charset[:-2]
+    if charset == "unknown-8bit":
+        charset = "utf-8"
+    return payload.decode(charset, errors="replace")
+
+
+def _decode_truncated(data: bytes, encoding: str) -> bytes:
+    """Undo a transfer encoding on the first N bytes of a part, dropping
+    whatever the cut left incomplete (a partial base64 quantum, a dangling
+    quoted-printable escape)."""
+    if encoding == "base64":
+        data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        data = data[: len(data) // 4 * 4]
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error:
+            return b""
+    if encoding == "quoted-printable":
+        return quopri.decodestring(re.sub(rb"=[0-9A-Fa-f]?$", b"", data))
+    return data
+
+
+class _TransferDecoder:
+    """Undo a part's Content-Transfer-Encoding chunk by chunk. Whatever a chunk
+    boundary leaves incomplete (a base64 quantum, a quoted-printable line) is
+    carried into the next feed()."""
+
+    def __init__(self, encoding: str):
+        self._encoding = encoding
+        self._carry = b""
+
+    def feed(self, data: bytes) -> bytes:
+        if self._encoding == "base64":
+            data = self._carry + re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+            cut = len(data) // 4 * 4
+            self._carry = data[cut:]
+            return binascii.a2b_base64(data[:cut]) if cut else b""
+        if self._encoding == "quoted-printable":
+            data = self._carry + data
+            cut = data.rfind(b"\n") + 1
+            self._carry = data[cut:]
+            return binascii.a2b_qp(data[:cut])
+        return data
+
+    def flush(self) -> bytes:
+        tail, self._carry = self._carry, b""
+        if not tail:
+            return b""
+        if self._encoding == "base64":
+            try:
+                return binascii.a2b_base64(tail + b"=" * (-len(tail) % 4))
+            except binascii.Error:      # a stray trailing character, not data
+                return b""
+        if self._encoding == "quoted-printable":
+            return binascii.a2b_qp(tail)
+        return tail
+
+
 def _parse_full_email(raw: bytes) -> tuple[str, str, list[Attachment]]:
     msg = email.message_from_bytes(raw)
     body_parts: list[str] = []
@@ -51,16 +155,11 @@ def _parse_full_email(raw: bytes) -> tuple[str, str, list[Attachment]]:
             filename = decode_header_value(part.get_filename()) or "unnamed"
             payload = part.get_payload(decode=True)
             if isinstance(payload, bytes):
-                attachments.append(Attachment(filename, payload))
+                attachments.append(Attachment(filename, payload, content_id=_content_id(part)))
         elif content_type in ("text/plain", "text/html"):
             payload = part.get_payload(decode=True)
             if isinstance(payload, bytes):
-                charset = part.get_content_charset() or "utf-8"
-                if charset.lower().endswith(("-i", "-e")):
-                    charset = charset[:-2]
-                if charset == "unknown-8bit":
-                    charset = "utf-8"
-                decoded = payload.decode(charset, errors="replace")
+                decoded = _decode_text(payload, part.get_content_charset())
                 if content_type == "text/plain":
                     body_parts.append(decoded)
                 else:
@@ -69,6 +168,30 @@ def _parse_full_email(raw: bytes) -> tuple[str, str, list[Attachment]]:
     return "\n".join(body_parts), "\n".join(html_parts), attachments
 
 
+def _content_id(part: Message) -> str:
+    return str(part.get("Content-ID") or "").strip().strip("<>")
+
+
+def _cid_filename(content_id: str) -> str:
+    """A file name for an unnamed inline image: its Content-ID's local part."""
+    return content_id.split("@")[0].replace("/", "_") or "inline"
+
+
+def _embedded_images(msg: Message) -> list[Attachment]:
+    """Images the HTML body shows by cid: (a Content-ID, not an attachment)."""
+    images = []
+    for part in msg.walk():
+        content_id = _content_id(part)
+        if (part.get_content_maintype() != "image" or not content_id
+                or "attachment" in str(part.get("Content-Disposition") or "")):
+            continue
+        payload = part.get_payload(decode=True)
+        if isinstance(payload, bytes):
+            filename = decode_header_value(part.get_filename()) or _cid_filename(content_id)
+            images.append(Attachment(filename, payload, content_id=content_id))
+    return images
+
+
 def _parse_labels(prefix: str) -> list[str]:
     """Pull the Gmail labels out of an X-GM-LABELS fetch response prefix."""
     m = re.search(r"X-GM-LABELS \((.*?)\)", prefix)
@@ -80,49 +203,242 @@ def _parse_labels(prefix: str) -> list[str]:
     ]
 
 
+def _header_fields(msg: Message) -> dict:
+    return {
+        "message_id": msg["Message-ID"] or "",
+        "date": msg["Date"] or "",
+        "from_": decode_header_value(msg["From"]),
+        "subject": decode_header_value(msg["Subject"]),
+        "headers": {
+            key: decode_header_value(msg[header])
+            for header, key in HEADER_FIELDS.items()
+        },
+    }
+
+
 def _build_email(uid: str, raw: bytes, prefix: str) -> Email:
     """Parse fetched bytes (+ the X-GM-LABELS response prefix) into an Email."""
     text, html, attachments = _parse_full_email(raw)
     msg = email.message_from_bytes(raw)
     return Email(
         uid=uid,
-        message_id=msg["Message-ID"] or "",
-        date=msg["Date"] or "",
-        from_=decode_header_value(msg["From"]),
-        subject=decode_header_value(msg["Subject"]),
         body=html or f"<pre>{escape(text)}</pre>",
         attachments=attachments,
         labels=_parse_labels(prefix),
-        headers={
-            key: decode_header_value(msg[header])
-            for header, key in HEADER_FIELDS.items()
-        },
         text=text,
+        inline=_embedded_images(msg),
+        **_header_fields(msg),
+    )
+
+
+def email_from_raw(uid: str, raw: bytes) -> Email:
+    """Parse raw RFC822 bytes (e.g. from a RawCache) into an Email. Labels
+    live on the server, not in the message, so they come back empty."""
+    return _build_email(uid, raw, "")
+
+
+def _preview_text_part(parts: list[BodyPart]) -> BodyPart | None:
+    """The part peek() previews: the first plain-text part that isn't an
+    attachment, i.e. the start of what _parse_full_email puts in .text."""
+    return next(
+        (p for p in parts if p.content_type == "text/plain" and not p.is_attachment),
+        None,
     )
 
 
+def _build_preview(uid: str, header: bytes, labels: list | None, parts: list[BodyPart],
+                   text: str) -> Email:
+    """An Email with everything classify() reads, but no body and attachments
+    known by name only (partial=True: not to be written)."""
+    return Email(
+        uid=uid,
+        body="",
+        attachments=[
+            Attachment(decode_header_value(p.filename) or "unnamed", b"")
+            for p in parts if p.is_attachment
+        ],
+        labels=[str(label) for label in labels or []],
+        text=text,
+        partial=True,
+        **_header_fields(email.message_from_bytes(header)),
+    )
+
+
+def _part_from_headers(headers: Message) -> BodyPart:
+    """What BODYSTRUCTURE would say about a part, from its own MIME headers."""
+    filename = headers.get_filename()
+    return BodyPart(
+        section="",
+        content_type=headers.get_content_type(),
+        params={"charset": headers.get_content_charset() or ""},
+        encoding=str(headers.get("Content-Transfer-Encoding") or "7bit").strip().lower(),
+        disposition=headers.get_content_disposition() or "",
+        disposition_params={"filename": filename} if filename else {},
+        content_id=_content_id(headers),
+    )
+
+
+class _RawParts:
+    """The leaf parts of a raw message, read line by line from a binary file
+    (a RawCache entry) so that only one line is ever held. Iterating yields
+    each part, from its headers, before its body is read; read() passes the
+    body, decoded, to a sink, and a body that isn't read is skipped. Attached
+    messages are walked into, as body_parts() does."""
+
+    LINE_BYTES = 1 << 16
+
+    def __init__(self, f: io.BufferedIOBase) -> None:
+        self._f = f
+        self._part: BodyPart | None = None
+        self._boundaries: tuple[bytes, ...] = ()
+        self._end: bytes | None = None
+
+    def __iter__(self) -> Iterator[BodyPart]:
+        yield from self._entity(())
+
+    def read(self, part: BodyPart, sink: Callable[[bytes], object]) -> bool:
+        assert part is self._part and self._end is None
+        decoder = _TransferDecoder(part.encoding)
+        self._end = self._body(self._boundaries, lambda data: sink(decoder.feed(data)))
+        sink(decoder.flush())
+        return True
+
+    @staticmethod
+    def _delimiter(line: bytes, boundaries: tuple[bytes, ...]) -> tuple[bytes, bool] | None:
+        """(boundary, closing) if line is a delimiter of one of boundaries."""
+        if not line.startswith(b"--"):
+            return None
+        rest = line[2:].rstrip()
+        for boundary in boundaries:
+            if rest == boundary:
+                return boundary, False
+            if rest == boundary + b"--":
+                return boundary, True
+        return None
+
+    def _headers(self) -> Message:
+        lines: list[bytes] = []
+        while True:
+            line = self._f.readline()
+            if not line or not line.strip():
+                return email.message_from_bytes(b"".join(lines))
+            lines.append(line)
+
+    def _body(self, boundaries: tuple[bytes, ...],
+              sink: Callable[[bytes], object] | None) -> bytes:
+        """Read up to the next delimiter of boundaries, passing the lines in
+        between to sink (if any); the delimiter line, or b"" at the end. The
+        line break before a delimiter belongs to it, so each is held back
+        until the next line shows it isn't the last."""
+        ending = b""
+        at_start = True
+        while True:
+            line = self._f.readline(self.LINE_BYTES)
+            if not line or (at_start and self._delimiter(line, boundaries)):
+                return line
+            content = line.rstrip(b"\r\n")
+            if sink is not None:
+                sink(ending + content)
+            ending = line[len(content):]
+            at_start = line.endswith(b"\n")
+
+    def _entity(self, boundaries: tuple[bytes, ...]) -> Generator[BodyPart, None, bytes]:
+        """Yield the leaves of the entity at the current line; returns the
+        line that ends it (a delimiter of boundaries, or b"")."""
+        headers = self._headers()
+        boundary = headers.get_boundary()
+        if headers.get_content_maintype() == "multipart" and boundary:
+            own = boundary.encode("ascii", "surrogateescape")
+            inner = (*boundaries, own)
+            line = self._body(inner, None)                  # the preamble
+            while self._delimiter(line, inner) == (own, False):
+                line = yield from self._entity(inner)
+            if self._delimiter(line, inner) == (own, True):
+                return self._body(boundaries, None)         # the epilogue
+            return line
+        if headers.get_content_type() == "message/rfc822":
+            return (yield from self._entity(boundaries))
+        self._part, self._boundaries, self._end = _part_from_headers(headers), boundaries, None
+        yield self._part
+        if self._end is None:
+            self._end = self._body(boundaries, None)
+        return self._end
+
+
+class _LineReader:
+    """CRLF lines straight off the connection's socket, with a timeout."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._buf = b""
+
+    def readline(self, timeout: float) -> bytes | None:
+        """The next line, or None if none arrived within timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self._buf:
+            # TLS may hold decrypted bytes select() can't see.
+            pending = getattr(self._sock, "pending", lambda: 0)()
+            remaining = deadline - time.monotonic()
+            if not pending and (remaining <= 0 or not select.select([self._sock], [], [], remaining)[0]):
+                return None
+            data = self._sock.recv(65536)
+            if not data:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            self._buf += data
+        line, _, self._buf = self._buf.partition(b"\n")
+        return line + b"\n"
+
+
 class Mailbox:
     """A logged-in Gmail IMAP connection that yields Email objects."""
 
     def __init__(
-        self, user: str, password: str, folder: str = '"[Gmail]/All Mail"'
+        self,
+        user: str,
+        password: str,
+        folder: str = '"[Gmail]/All Mail"',
+        spool_dir: str | None = None,
+        chunk_size: int = 1 << 20,
+        raw_cache: RawCache | None = None,
+        budget: BandwidthBudget | None = None,
     ):
         self._user = user
         self._password = password
         self._folder = folder
+        self._chunk_size = chunk_size
+        # Attachments are streamed into a private directory under spool_dir
+        # (removed on logout) when given, else kept in memory.
+        self._spool: str | None = None
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            self._spool = tempfile.mkdtemp(prefix="mailbox-", dir=spool_dir)
+        # With a raw cache, get() keeps each message's raw bytes there and
+        # reads a cached message from disk instead of downloading it.
+        self._raw_cache = raw_cache
+        self.budget = budget
         self._mail: imaplib.IMAP4_SSL | None = None
+        # One command at a time: a fetcher thread and the classifier (fetching
+        # a receipt's full message) may share the connection.
+        self._lock = threading.Lock()
         self.connect()
 
     # --- lifecycle ---------------------------------------------------------
 
     def connect(self) -> None:
         self._mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        self._mail.login(self._user, self._password)
+        try:
+            self._mail.login(self._user, self._password)
+        except imaplib.IMAP4.error as e:
+            if is_quota_error(str(e)):
+                raise self._quota_exceeded(str(e))
+            raise
         self._mail.select(self._folder)
 
     def logout(self) -> None:
         if self._mail is not None:
             self._mail.logout()
+        if self._spool is not None:
+            shutil.rmtree(self._spool, ignore_errors=True)
 
     def __enter__(self) -> "Mailbox":
         return self
@@ -130,22 +446,174 @@ class Mailbox:
     def __exit__(self, *exc) -> None:
         self.logout()
 
-    def _uid(self, command: str, *args):
-        """Run a UID command, reconnecting once if the connection was dropped."""
-        assert self._mail is not None
-        try:
-            return self._mail.uid(command, *args)
-        except imaplib.IMAP4.abort as e:
-            print(f"IMAP aborted: {e}. Reconnecting...")
-            self.connect()
+    def _uid(self, command: str, *args, literal: bytes | None = None):
+        """Run a UID command, reconnecting once if the connection was dropped.
+        A literal is sent after the last argument (imaplib's `literal`). With
+        a budget, the response is charged to it, and a quota error raises
+        QuotaExceeded (after recording the back-off) instead."""
+        with self._lock:
             assert self._mail is not None
-            return self._mail.uid(command, *args)
+            try:
+                # imaplib sends bytes literals too; its stub says str.
+                self._mail.literal = literal  # type: ignore[assignment]
+                status, data = self._mail.uid(command, *args)
+            except imaplib.IMAP4.abort as e:
+                if is_quota_error(str(e)):
+                    raise self._quota_exceeded(str(e))
+                print(f"IMAP aborted: {e}. Reconnecting...")
+                self.connect()
+                assert self._mail is not None
+                self._mail.literal = literal  # type: ignore[assignment]
+                status, data = self._mail.uid(command, *args)
+        if status != "OK" and is_quota_error(data):
+            raise self._quota_exceeded(b" ".join(d for d in data if isinstance(d, bytes)).decode(
+                "utf-8", "replace"))
+        if self.budget is not None:
+            self.budget.charge(_response_bytes(data))
+        return status, data
+
+    # --- the bandwidth budget ------------------------------------------------
+
+    def _quota_exceeded(self, reason: str) -> QuotaExceeded:
+        """The error for a quota response, with the back-off recorded."""
+        if self.budget is None:
+            return QuotaExceeded(reason, time.time())
+        return QuotaExceeded(reason, self.budget.back_off(reason))
+
+    def _check_backoff(self) -> None:
+        """Raise QuotaExceeded while an earlier quota error's back-off lasts."""
+        backoff = self.budget.backed_off() if self.budget is not None else None
+        if backoff is not None:
+            raise QuotaExceeded(backoff[1] or "earlier quota error", backoff[0])
+
+    def _check_fits(self, uid: str, item: dict) -> None:
+        """Raise OverBudget if downloading the message (RFC822.SIZE) would
+        take the budget over."""
+        size = int(item.get("RFC822.SIZE") or 0)
+        if self.budget is not None and not self.budget.fits(size):
+            raise OverBudget(uid, size, self.budget.free_at(size))
+
+    def sizes(self, uids: list[str]) -> dict[str, int]:
+        """RFC822.SIZE of many messages, a few bytes each: {uid: bytes}."""
+        self._check_backoff()
+        found: dict[str, int] = {}
+        for start in range(0, len(uids), SIZES_BATCH):
+            status, data = self._uid(
+                "FETCH", ",".join(uids[start:start + SIZES_BATCH]), "(UID RFC822.SIZE)")
+            if status != "OK":
+                continue
+            for item in parse_fetch(data):
+                if item.get("UID") and item.get("RFC822.SIZE") is not None:
+                    found[item["UID"]] = int(item["RFC822.SIZE"])
+        return found
+
+    def envelopes(self, uids: list[str]) -> dict[str, dict]:
+        """What a message can be judged by before previewing it, a few hundred
+        bytes each: {uid: {from, subject, labels, size, attachments}}, where
+        attachments means a multipart/mixed (or bare application/*) body."""
+        self._check_backoff()
+        found: dict[str, dict] = {}
+        for start in range(0, len(uids), SIZES_BATCH):
+            status, data = self._uid(
+                "FETCH", ",".join(uids[start:start + SIZES_BATCH]), ENVELOPE_ITEMS)
+            if status != "OK":
+                continue
+            for item in parse_fetch(data):
+                raw = item.get(ENVELOPE_FIELDS)
+                if not item.get("UID") or not isinstance(raw, bytes):
+                    continue
+                msg = email.message_from_bytes(raw)
+                content_type = msg.get_content_type()
+                found[item["UID"]] = {
+                    "from": decode_header_value(msg["From"]),
+                    "subject": decode_header_value(msg["Subject"]),
+                    "labels": [str(label) for label in item.get("X-GM-LABELS") or []],
+                    "size": int(item.get("RFC822.SIZE") or 0),
+                    "attachments": (content_type == "multipart/mixed"
+                                    or content_type.startswith("application/")),
+                }
+        return found
+
+    def categories(self, uids: list[str], names) -> dict[str, list[str]]:
+        """Which of Gmail's inbox categories (purchases, social, ...) each
+        message is in: {uid: [names]}. IMAP doesn't list them among the
+        labels, so it is one X-GM-RAW search per category over the UID span.
+        A refused search means no categories at all (they only order the
+        work) rather than some."""
+        if not uids:
+            return {}
+        self._check_backoff()
+        numbers = [int(u) for u in uids]
+        span = f"{min(numbers)}:{max(numbers)}"
+        wanted = set(uids)
+        found: dict[str, list[str]] = {}
+        for name in names:
+            try:
+                matches = self._search("UID", span, "X-GM-RAW",
+                                       literal=f"category:{name}".encode())
+            except (RuntimeError, imaplib.IMAP4.error) as e:   # a NO, or a BAD
+                print(f"Inbox categories unavailable ({e}); ranking without them")
+                return {}
+            for uid in matches:
+                if uid in wanted:
+                    found.setdefault(uid, []).append(name)
+        return found
+
+    # --- waiting for new mail ----------------------------------------------
+
+    def idle(self, timeout: float, stop=None) -> bool:
+        """Wait in IMAP IDLE (RFC 2177) until the server announces new mail
+        (an untagged EXISTS) or timeout seconds pass; stop(), checked every
+        second, ends the wait early. True if new mail arrived.
+
+        A dropped connection is re-established and reported as new mail, since
+        whatever arrived meanwhile went unannounced."""
+        with self._lock:
+            try:
+                return self._idle(timeout, stop)
+            except (OSError, imaplib.IMAP4.abort) as e:
+                print(f"IMAP IDLE dropped: {e}. Reconnecting...")
+                self.connect()
+                return True
+
+    def _idle(self, timeout: float, stop) -> bool:
+        # imaplib has no IDLE before Python 3.14: speak it on the socket.
+        mail = self._mail
+        assert mail is not None
+        tag = mail._new_tag()
+        mail.tagged_commands.pop(tag, None)
+        mail.send(tag + b" IDLE\r\n")
+        reader = _LineReader(mail.sock)
+        line = reader.readline(30)
+        if line is None or not line.startswith(b"+"):
+            raise imaplib.IMAP4.abort(f"IDLE refused: {line!r}")
+
+        new_mail = False
+        deadline = time.monotonic() + timeout
+        while not new_mail and time.monotonic() < deadline and not (stop and stop()):
+            line = reader.readline(min(1.0, deadline - time.monotonic()))
+            new_mail = line is not None and _EXISTS.match(line) is not None
+
+        mail.send(b"DONE\r\n")
+        while True:
+            line = reader.readline(30)
+            if line is None:
+                raise imaplib.IMAP4.abort("no reply to IDLE DONE")
+            if _EXISTS.match(line):
+                new_mail = True
+            if line.startswith(tag + b" "):
+                if not line[len(tag) + 1:].upper().startswith(b"OK"):
+                    raise imaplib.IMAP4.abort(f"IDLE failed: {line!r}")
+                return new_mail
 
     # --- finding messages (all return UIDs) --------------------------------
 
-    def _search(self, *criteria: str) -> list[str]:
-        # None is the IMAP "no charset" slot; the imaplib stub mistypes it.
-        status, data = self._uid("SEARCH", None, *criteria)  # type: ignore[arg-type]
+    def _search(self, *criteria: str, literal: bytes | None = None) -> list[str]:
+        if literal is not None:
+            status, data = self._uid("SEARCH", "CHARSET", "UTF-8", *criteria, literal=literal)
+        else:
+            # None is the IMAP "no charset" slot; the imaplib stub mistypes it.
+            status, data = self._uid("SEARCH", None, *criteria)  # type: ignore[arg-type]
         if status != "OK":
             raise RuntimeError(f"IMAP search failed: {status}")
         return [u.decode() for u in (data[0] or b"").split()]
@@ -156,6 +624,24 @@ class Mailbox:
             criteria += ["BEFORE", _imap_date(before)]
         return self._search(*criteria)
 
+    def search_raw(
+        self, query: str, since: date | None = None, before: date | None = None
+    ) -> list[str]:
+        """Gmail's own search syntax (X-GM-RAW), as typed in the search box,
+        e.g. "-category:social {has:attachment subject:invoice}". The query is
+        sent as a UTF-8 literal, so non-ASCII terms work."""
+        criteria = []
+        if since:
+            criteria += ["SINCE", _imap_date(since)]
+        if before:
+            criteria += ["BEFORE", _imap_date(before)]
+        return self._search(*criteria, "X-GM-RAW", literal=query.encode("utf-8"))
+
+    def search_after(self, uid: int) -> list[str]:
+        """UIDs above `uid`: what arrived since. ("n:*" always matches the
+        newest message, even below n, so that one is filtered out.)"""
+        return [u for u in self._search("UID", f"{uid + 1}:*") if int(u) > uid]
+
     def search_message_id(self, message_id: str) -> str | None:
         uids = self._search("HEADER", "Message-ID", message_id)
         return uids[-1] if uids else None
@@ -185,16 +671,178 @@ class Mailbox:
             return ""
         return email.message_from_bytes(raw)["Message-ID"] or ""
 
-    def get(self, uid: str) -> Email | None:
-        """Fetch and parse a full email into an Email."""
-        status, msg_data = self._uid("FETCH", uid, "(X-GM-LABELS RFC822)")
+    def headers(self, uids: list[str], fields: tuple[str, ...] = ("MESSAGE-ID", "FROM", "DATE")
+                ) -> dict[str, Message]:
+        """Selected header fields of many messages in one FETCH:
+        {uid: parsed headers}. UIDs the server doesn't have are missing."""
+        if not uids:
+            return {}
+        item_name = f"BODY[HEADER.FIELDS ({' '.join(fields)})]"
+        status, data = self._uid(
+            "FETCH", ",".join(uids), f"(UID {item_name.replace('BODY[', 'BODY.PEEK[')})")
+        if status != "OK":
+            return {}
+        found = {}
+        for item in parse_fetch(data):
+            raw = item.get(item_name)
+            if item.get("UID") and isinstance(raw, bytes):
+                found[item["UID"]] = email.message_from_bytes(raw)
+        return found
+
+    def peek(self, uids: list[str], preview_bytes: int = 32768) -> dict[str, Email]:
+        """Preview a batch of messages for classification, without downloading
+        them: one FETCH for headers, labels, size and BODYSTRUCTURE, then one
+        per distinct text section for its first `preview_bytes` bytes
+        (BODY.PEEK[n]<0.N>). Returns {uid: Email} with partial=True; UIDs the
+        server no longer has are missing."""
+        if not uids:
+            return {}
+        self._check_backoff()
+        status, data = self._uid("FETCH", ",".join(uids), PEEK_ITEMS)
         if status != "OK":
+            return {}
+        peeked: dict[str, tuple[dict, list[BodyPart], BodyPart | None]] = {}
+        by_section: dict[str, list[str]] = {}
+        for item in parse_fetch(data):
+            uid = item.get("UID")
+            if not uid or not isinstance(item.get("BODY[HEADER]"), bytes):
+                continue
+            structure = item.get("BODYSTRUCTURE")
+            parts = body_parts(structure) if isinstance(structure, list) else []
+            text_part = _preview_text_part(parts)
+            peeked[uid] = (item, parts, text_part)
+            if text_part is not None:
+                by_section.setdefault(text_part.section, []).append(uid)
+
+        texts: dict[str, bytes] = {}
+        for section, section_uids in by_section.items():
+            status, data = self._uid(
+                "FETCH", ",".join(section_uids),
+                f"(UID BODY.PEEK[{section}]<0.{preview_bytes}>)",
+            )
+            if status != "OK":
+                continue
+            for item in parse_fetch(data):
+                chunk = item.get(f"BODY[{section}]<0>")
+                if isinstance(chunk, bytes):
+                    texts[item.get("UID", "")] = chunk
+
+        previews = {}
+        for uid, (item, parts, text_part) in peeked.items():
+            text = ""
+            if text_part is not None and uid in texts:
+                text = _decode_text(
+                    _decode_truncated(texts[uid], text_part.encoding), text_part.charset)
+            previews[uid] = _build_preview(
+                uid, item["BODY[HEADER]"], item.get("X-GM-LABELS"), parts, text)
+        return previews
+
+    def _fetch_section(self, uid: str, part: BodyPart, sink) -> bool:
+        """Download one part in chunk_size pieces, passing the decoded bytes
+        to sink as they arrive. False if the server refused a chunk."""
+        decoder = _TransferDecoder(part.encoding)
+        offset = 0
+        while True:
+            status, data = self._uid(
+                "FETCH", uid, f"(BODY.PEEK[{part.section}]<{offset}.{self._chunk_size}>)")
+            if status != "OK":
+                return False
+            items = parse_fetch(data)
+            chunk = (items[0].get(f"BODY[{part.section}]<{offset}>") if items else None) or b""
+            sink(decoder.feed(chunk))
+            offset += len(chunk)
+            if len(chunk) < self._chunk_size or offset >= part.size:
+                break
+        sink(decoder.flush())
+        return True
+
+    def _fetch_attachment(self, part: BodyPart, fetch) -> Attachment | None:
+        filename = (decode_header_value(part.filename)
+                    or (_cid_filename(part.content_id) if part.is_embedded_image else "unnamed"))
+        if self._spool is None:
+            buf = bytearray()
+            if not fetch(part, buf.extend):
+                return None
+            return Attachment(filename, bytes(buf), content_id=part.content_id)
+        fd, path = tempfile.mkstemp(dir=self._spool)
+        with os.fdopen(fd, "wb") as f:
+            ok = fetch(part, f.write)
+        if not ok:
+            os.remove(path)
             return None
-        part = msg_data[0]
-        if not isinstance(part, tuple):
+        return Attachment(filename, path=path, content_id=part.content_id)
+
+    def _assemble(self, uid: str, item: dict, parts: Iterable[BodyPart],
+                  fetch: Callable[[BodyPart, Callable[[bytes], object]], bool]) -> Email | None:
+        """Build the Email from its parts, each downloaded by fetch(part, sink)
+        (False if that failed): texts decoded, attachments and inline images
+        spooled as they arrive."""
+        texts: list[str] = []
+        htmls: list[str] = []
+        attachments: list[Attachment] = []
+        inline: list[Attachment] = []
+        for part in parts:
+            if part.is_attachment or part.is_embedded_image:
+                attachment = self._fetch_attachment(part, fetch)
+                if attachment is None:
+                    return None
+                (attachments if part.is_attachment else inline).append(attachment)
+            elif part.content_type in ("text/plain", "text/html"):
+                buf = bytearray()
+                if not fetch(part, buf.extend):
+                    return None
+                decoded = _decode_text(bytes(buf), part.charset)
+                (texts if part.content_type == "text/plain" else htmls).append(decoded)
+
+        text, html = "\n".join(texts), "\n".join(htmls)
+        return Email(
+            uid=uid,
+            body=html or f"<pre>{escape(text)}</pre>",
+            attachments=attachments,
+            labels=[str(label) for label in item.get("X-GM-LABELS") or []],
+            text=text,
+            inline=inline,
+            **_header_fields(email.message_from_bytes(item["BODY[HEADER]"])),
+        )
+
+    def _get_raw(self, uid: str, item: dict, message_id: str) -> Email | None:
+        """get() through the raw cache: download the whole message (in chunks,
+        compressed into the cache as it arrives) unless it is already there,
+        then parse it as it streams back out of the cache."""
+        assert self._raw_cache is not None
+        if message_id not in self._raw_cache:
+            whole = BodyPart(section="", content_type="message/rfc822",
+                             size=int(item.get("RFC822.SIZE") or 0))
+            try:
+                with self._raw_cache.writer(message_id) as f:
+                    if not self._fetch_section(uid, whole, f.write):
+                        raise imaplib.IMAP4.error(f"FETCH of UID {uid} refused")
+            except imaplib.IMAP4.error:
+                return None
+        with self._raw_cache.open(message_id) as f:
+            parts = _RawParts(f)
+            return self._assemble(uid, item, parts, parts.read)
+
+    def get(self, uid: str) -> Email | None:
+        """Fetch a full email into an Email, one MIME part at a time (or whole,
+        through the raw cache when there is one). With a budget, raises
+        OverBudget rather than start a message it can't cover."""
+        self._check_backoff()
+        status, data = self._uid("FETCH", uid, PEEK_ITEMS)
+        if status != "OK":
             return None
-        raw = part[1]
-        if not isinstance(raw, bytes):
+        items = parse_fetch(data)
+        if not items or not isinstance(items[0].get("BODY[HEADER]"), bytes):
             return None
-        prefix = part[0].decode("utf-8", errors="replace") if isinstance(part[0], bytes) else ""
-        return _build_email(uid, raw, prefix)
+        item = items[0]
+        if self._raw_cache is not None:
+            message_id = email.message_from_bytes(item["BODY[HEADER]"])["Message-ID"] or ""
+            if message_id:
+                if message_id not in self._raw_cache:
+                    self._check_fits(uid, item)
+                return self._get_raw(uid, item, message_id)
+        self._check_fits(uid, item)
+        structure = item.get("BODYSTRUCTURE")
+        parts = body_parts(structure) if isinstance(structure, list) else []
+        return self._assemble(uid, item, parts,
+                              lambda part, sink: self._fetch_section(uid, part, sink))
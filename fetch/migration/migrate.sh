@@ -1,6 +1,11 @@
 #!/bin/bash
-# One-off migration: rewrite each receipt's body with the email's HTML part.
-# Usage: ./fetch/migration/migrate.sh <gmail-address> <app-password>
+# Archive rewrites (see archive_rewrite.py): migrate_html (default) refreshes
+# each receipt's body with the email's HTML part; add_message_id, check_uids
+# and backfill_derived (plain text / sanitized HTML beside each receipt, no
+# Gmail needed) are the others.
+# Usage: ./fetch/migration/migrate.sh <gmail-address> <app-password> [rewrite]
+#   REWRITE_DRY_RUN=1   report what would change, write nothing
+#   REWRITE_WORKERS=4   parallel transforms (each with its own Gmail connection)
 set -e
 
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
@@ -8,16 +13,17 @@ FETCH_DIR="$(cd "$SCRIPT_DIR/.." && pwd)"
 cd "$FETCH_DIR"
 
 if [ $# -lt 2 ]; then
-  echo "Usage: ./fetch/migration/migrate.sh <gmail-address> <app-password>"
+  echo "Usage: ./fetch/migration/migrate.sh <gmail-address> <app-password> [rewrite]"
   exit 1
 fi
+REWRITE="${3:-migrate_html}"
 
 # Build context is fetch/ so the image has fetch_emails.py and process_email.py;
 # the migration script is copied in from this subfolder.
 docker build -t gmail-migrate -f - "$FETCH_DIR" <<'EOF'
 FROM python:3.12-slim
 
-RUN pip install --no-cache-dir requests
+RUN pip install --no-cache-dir requests zstandard
 
 WORKDIR /app
 COPY *.py .
@@ -28,5 +34,10 @@ EOF
 docker run --rm \
   -e GMAIL_USER="$1" \
   -e GMAIL_APP_PASSWORD="$2" \
+  -e RAW_CACHE_DIR="$RAW_CACHE_DIR" \
+  -e RECEIPT_COMPRESSION="$RECEIPT_COMPRESSION" \
+  -e REWRITE_DRY_RUN="$REWRITE_DRY_RUN" \
+  -e REWRITE_WORKERS="$REWRITE_WORKERS" \
+  -e REWRITE_BATCH="$REWRITE_BATCH" \
   -v "$SCRIPT_DIR/../../output:/output" \
-  gmail-migrate python -u migrate_html.py
+  gmail-migrate python -u "$REWRITE.py"
@@ -1,6 +1,10 @@
 import json
 import os
-from dataclasses import dataclass
+import shutil
+from dataclasses import dataclass, field
+
+import compression
+from derived import write_derived
 
 # Email header -> receipt JSON key for the extra fields captured per email.
 HEADER_FIELDS = {
@@ -19,9 +23,80 @@ HEADER_FIELDS = {
 
 
 class Attachment:
-    def __init__(self, filename: str, content: bytes):
+    """An attachment's name and bytes. Mailbox.get can spool a large one to a
+    file (`path`) instead of holding it in memory; save() then moves it.
+    content_id is the part's Content-ID (without <>), which the HTML body can
+    reference as cid:<content_id>."""
+
+    def __init__(self, filename: str, content: bytes = b"", path: str | None = None,
+                 content_id: str = ""):
         self.filename = filename
-        self.content = content
+        self._content = content
+        self.path = path
+        self.content_id = content_id
+
+    @property
+    def content(self) -> bytes:
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        return self._content
+
+    def save(self, dest: str) -> None:
+        if self.path is not None:
+            shutil.move(self.path, dest)
+            self.path = dest
+            return
+        with open(dest, "wb") as f:
+            f.write(self._content)
+
+
+def inline_files(attachments: list[Attachment], inline: list[Attachment]) -> tuple[list[str], dict]:
+    """The file names inline images are saved under, and Content-ID -> file
+    name for every part the body can reference. Inline images share the
+    attachment folder; one named like an attachment is prefixed so neither
+    overwrites the other."""
+    taken = {a.filename for a in attachments}
+    names = []
+    for a in inline:
+        name = a.filename if a.filename not in taken else f"inline-{a.filename}"
+        taken.add(name)
+        names.append(name)
+    cids = {a.content_id: a.filename for a in attachments if a.content_id}
+    cids.update((a.content_id, name) for a, name in zip(inline, names))
+    return names, cids
+
+
+def read_receipt(path: str) -> dict:
+    """A receipt JSON as written, with "body" filled in from its compressed
+    body file when it has one (compression.py)."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    body_file = data.get("body_file")
+    if not body_file:
+        return data
+    body = compression.read_file(os.path.join(os.path.dirname(path), body_file)).decode("utf-8")
+    return {("body" if k == "body_file" else k): (body if k == "body_file" else v)
+            for k, v in data.items()}
+
+
+def write_receipt(path: str, data: dict) -> None:
+    """Write a receipt dict (with its "body") to <path>: the body inline, or
+    with RECEIPT_COMPRESSION=1 in a compressed <base_name>.body.html file
+    beside it, named by "body_file". A body file from an earlier write in the
+    other format is removed."""
+    body_path = os.path.splitext(path)[0] + ".body.html"
+    out, keep = dict(data), None
+    if compression.ENABLED and "body" in out:
+        keep = body_path + compression.EXT
+        compression.write_file(keep, out["body"].encode("utf-8"))
+        out = {("body_file" if k == "body" else k): (os.path.basename(keep) if k == "body" else v)
+               for k, v in out.items()}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+    compression.remove_variants(body_path, keep)
 
 
 @dataclass
@@ -37,10 +112,17 @@ class Email:
     headers: dict                   # to, cc, reply_to, ...
     classification: dict | None = None
     text: str = ""                  # plain text for the classifier; not persisted
+    account: str = ""               # mailbox it came from; "" for single-account runs
+    partial: bool = False           # a Mailbox.peek preview: no body, attachments by name only
+    inline: list[Attachment] = field(default_factory=list)  # images the body shows by cid:
 
     def write(self, path: str) -> None:
-        """Write the receipt JSON to <path>, with attachment files in a folder
-        of the same name beside it."""
+        """Write the receipt JSON to <path>, with attachment files (and the
+        body's inline images) in a folder of the same name beside it, and its
+        derived renditions (derived.py)."""
+        if self.partial:
+            raise ValueError(f"UID {self.uid}: a preview can't be written, fetch the full message")
+        inline_names, cids = inline_files(self.attachments, self.inline)
         data = {
             "uid": self.uid,
             "message_id": self.message_id,
@@ -53,26 +135,57 @@ class Email:
             "labels": self.labels,
             **self.headers,
         }
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        if self.account:
+            data["account"] = self.account
+        if inline_names:
+            data["inline"] = inline_names
+        if cids:
+            data["cids"] = cids
+        data.update(write_derived(path, data, cids))
+        write_receipt(path, data)
 
-        if self.attachments:
+        if self.attachments or self.inline:
             att_dir = os.path.splitext(path)[0]
             os.makedirs(att_dir, exist_ok=True)
             for a in self.attachments:
-                with open(os.path.join(att_dir, a.filename), "wb") as f:
-                    f.write(a.content)
+                a.save(os.path.join(att_dir, a.filename))
+            for a, name in zip(self.inline, inline_names):
+                a.save(os.path.join(att_dir, name))
+
+    def write_duplicate(self, path: str, original: str) -> None:
+        """Write the receipt JSON of a near-duplicate of a stored receipt
+        (fingerprint.py): this email's own fields, with no body or files of
+        its own, and "duplicate_of" naming the original (<month>/<base_name>),
+        whose body and attachments stand in for it. Works on a preview."""
+        data = {
+            "uid": self.uid,
+            "message_id": self.message_id,
+            "date": self.date,
+            "from": self.from_,
+            "subject": self.subject,
+            "body": "",
+            "classification": self.classification,
+            "attachments": [],
+            "labels": self.labels,
+            **self.headers,
+            "duplicate_of": original,
+        }
+        if self.account:
+            data["account"] = self.account
+        write_receipt(path, data)
 
     @classmethod
     def read(cls, path: str) -> "Email":
-        """Read back a receipt written by write()."""
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        """Read back a receipt written by write(), in either format."""
+        data = read_receipt(path)
         att_dir = os.path.splitext(path)[0]
-        attachments = []
-        for name in data.get("attachments", []):
+        content_ids = {name: cid for cid, name in data.get("cids", {}).items()}
+
+        def load(name: str) -> Attachment:
             with open(os.path.join(att_dir, name), "rb") as f:
-                attachments.append(Attachment(name, f.read()))
+                return Attachment(name, f.read(), content_id=content_ids.get(name, ""))
+
+        attachments = [load(name) for name in data.get("attachments", [])]
         headers = {k: data[k] for k in HEADER_FIELDS.values() if k in data}
         return cls(
             uid=data["uid"],
@@ -85,4 +198,6 @@ class Email:
             labels=data.get("labels", []),
             headers=headers,
             classification=data.get("classification"),
+            account=data.get("account", ""),
+            inline=[load(name) for name in data.get("inline", [])],
         )
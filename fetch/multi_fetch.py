@@ -0,0 +1,221 @@
+"""
+Fetch several Gmail accounts in one process.
+
+Accounts come from a JSON file named by GMAIL_ACCOUNTS_FILE:
+    [{"user": "a@gmail.com", "password": "<app password>"}, ...]
+
+Each account gets its own Mailbox in a fetcher thread that searches its date
+range (FETCH_SINCE / FETCH_BEFORE, narrowed by FETCH_QUERY if set), previews
+its emails in batches and skips already-processed Message-IDs. Every fetcher
+feeds one classification queue, drained by the main thread against a single
+shared Ollama server. The queue hands out emails round-robin across accounts,
+so a long backfill on one mailbox can't starve a short incremental run on
+another; each account's lane is bounded, so a fast fetcher only gets a few
+emails ahead of the classifier. Receipts are downloaded in full over their
+account's connection, which stays open until the classifier is done with that
+account's lane.
+
+All accounts write into the same OUTPUT_DIR; receipts and ledger entries carry
+an "account" field the viewer filters on. Each account is its own resumable
+job (<user>_<date range>, see checkpoint.py).
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import fetch_emails as fe
+import learned
+import priority
+import process_email as pe
+from bandwidth import OverBudget, QuotaExceeded
+from checkpoint import default_job_name
+from process_email import process_email, _get_seen_message_ids
+
+
+class FairQueue:
+    """Per-account lanes served round-robin by get()."""
+
+    def __init__(self, lane_size: int = 4):
+        self._lane_size = lane_size
+        self._lanes: dict[str, deque] = {}
+        self._open: set[str] = set()
+        self._outstanding: dict[str, int] = {}
+        self._order: deque[str] = deque()
+        self._cond = threading.Condition()
+
+    def register(self, account: str) -> None:
+        with self._cond:
+            self._lanes[account] = deque()
+            self._open.add(account)
+            self._outstanding[account] = 0
+            self._order.append(account)
+
+    def put(self, account: str, item) -> None:
+        """Queue an item, blocking while the account's lane is full."""
+        with self._cond:
+            lane = self._lanes[account]
+            while len(lane) >= self._lane_size:
+                self._cond.wait()
+            lane.append(item)
+            self._outstanding[account] += 1
+            self._cond.notify_all()
+
+    def close(self, account: str) -> None:
+        """The account's fetcher is done; get() drains what's left in its lane."""
+        with self._cond:
+            self._open.discard(account)
+            self._cond.notify_all()
+
+    def task_done(self, account: str) -> None:
+        """The consumer finished an item it got for this account."""
+        with self._cond:
+            self._outstanding[account] -= 1
+            self._cond.notify_all()
+
+    def join(self, account: str) -> None:
+        """Block until every item put for the account was marked task_done."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._outstanding[account] == 0)
+
+    def get(self) -> tuple[str, object] | None:
+        """Next (account, item), rotating across accounts. None once every
+        account is closed and drained."""
+        with self._cond:
+            while True:
+                for _ in range(len(self._order)):
+                    account = self._order[0]
+                    self._order.rotate(-1)
+                    lane = self._lanes[account]
+                    if lane:
+                        item = lane.popleft()
+                        self._cond.notify_all()
+                        return account, item
+                if not self._open:
+                    return None
+                self._cond.wait()
+
+
+def load_accounts(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+    if not accounts or not all(a.get("user") and a.get("password") for a in accounts):
+        raise ValueError(f"{path}: expected a list of {{user, password}} objects")
+    return accounts
+
+
+def _fetch_account(account: dict, since, before, query: str, queue: FairQueue, errors: dict,
+                   model=None) -> None:
+    """Fetcher thread: search, preview and dedup one account's emails."""
+    user = account["user"]
+    try:
+        checkpoint = fe.open_checkpoint(
+            f"{user}_{default_job_name(since, before, query)}", since, before, query)
+        with fe.open_mailbox(user, account["password"]) as mb:
+            uids = fe.snapshot_uids(mb, checkpoint, since, before, query)
+            total = len(uids)
+            try:
+                pending, sizes, _ = fe.schedule_pending(mb, checkpoint)
+            except QuotaExceeded as e:
+                print(f"[{user}] {e}. The rest waits for a later run.")
+                pending, sizes = [], {}
+            position = {uid: i for i, uid in enumerate(pending, total - len(pending) + 1)}
+            for batch in fe.batches(pending):
+                batch, rest = fe.affordable(mb, batch, sizes), batch
+                if not batch:
+                    print(f"[{user}] bandwidth {fe.budget_used_up(mb, rest[0], sizes)}.")
+                    break
+                try:
+                    previews = mb.peek(batch, fe.PREVIEW_BYTES)
+                except QuotaExceeded as e:
+                    print(f"[{user}] {e}. The rest waits for a later run.")
+                    break
+                learned.prejudge(model, previews)
+                for uid in batch:
+                    checkpoint.start(uid)
+                    em = previews.get(uid)
+                    if em is None:
+                        checkpoint.finish(uid)
+                        continue
+                    if em.message_id in _get_seen_message_ids():
+                        print(f"[{user} {position[uid]}/{total}] skip {em.message_id}")
+                        checkpoint.finish(uid)
+                        continue
+                    em.account = user
+                    queue.put(user, (em, position[uid], total, checkpoint, mb.get))
+            queue.close(user)
+            # Keep the connection up: the classifier fetches receipts over it.
+            queue.join(user)
+    except BaseException as e:  # reported by main; the other accounts carry on
+        errors[user] = e
+    finally:
+        queue.close(user)
+
+
+def main():
+    accounts_file = os.environ.get("GMAIL_ACCOUNTS_FILE")
+    if not accounts_file:
+        sys.exit("Set GMAIL_ACCOUNTS_FILE to a JSON list of {user, password}")
+    try:
+        accounts = load_accounts(accounts_file)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+
+    since, before = fe.date_range()
+    query = fe.candidate_query()
+    # Load the seen set and the sender history once, before the fetchers
+    # start sharing them (lazily, each thread would load its own).
+    _get_seen_message_ids()
+    if priority.PRIORITY or pe.SENDER_HISTORY:
+        pe._get_sender_history()
+    model = learned.maybe_retrain()
+
+    queue = FairQueue(lane_size=int(os.environ.get("FETCH_PREFETCH", "4")))
+    errors: dict[str, BaseException] = {}
+    threads = []
+    for account in accounts:
+        queue.register(account["user"])
+        t = threading.Thread(
+            target=_fetch_account,
+            args=(account, since, before, query, queue, errors, model),
+            name=f"fetch-{account['user']}",
+            daemon=True,
+        )
+        threads.append(t)
+
+    # Fetchers get going while the model loads.
+    for t in threads:
+        t.start()
+    ollama = fe.start_ollama()
+
+    counts = {a["user"]: 0 for a in accounts}
+    while (next_item := queue.get()) is not None:
+        user, (em, i, total, checkpoint, fetch_full) = next_item
+        t0 = time.time()
+        try:
+            ollama.call(process_email, em, index=i, total=total, fetch_full=fetch_full)
+            checkpoint.finish(em.uid)
+        except (OverBudget, QuotaExceeded) as e:
+            fe.defer(em, i, total, e)
+        finally:
+            queue.task_done(user)
+        counts[user] += 1
+        print(f"[{user}] classified in {time.time() - t0:.1f}s")
+
+    for t in threads:
+        t.join()
+    ollama.shutdown()
+
+    print("\nDone.")
+    print(pe.llm_stats_line())
+    for user, n in counts.items():
+        status = f"FAILED: {errors[user]}" if user in errors else "ok"
+        print(f"  {user}: {n} emails processed ({status})")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Lifecycle of the local Ollama server the classifier talks to.
+
+start() reuses a server that is already answering at the URL (a previous run
+left it up, or one runs on the host) and only spawns `ollama serve` when
+nothing is there. Either way it preloads the model with a keep_alive, so it
+stays resident between emails and, if the server is kept, between runs.
+Startup timings (server wait, model load, whether the server was reused) are
+printed and kept in `startup`.
+
+call() runs one classification against the server: it counts it as in flight,
+and if the server dropped the connection it health-checks, restarts a server
+this manager owns, and retries once. shutdown() stops taking new work, waits
+for in-flight calls to drain and then stops the server if this manager
+started it, unless OLLAMA_KEEP_SERVER=1 asks to leave it up for the next run.
+"""
+import os
+import signal
+import subprocess
+import threading
+import time
+
+import requests
+
+
+class OllamaManager:
+    def __init__(
+        self,
+        url: str,
+        model: str,
+        keep_alive: str = "30m",
+        startup_timeout: float = 120.0,
+        extra_models: tuple[str, ...] = (),
+    ):
+        self.url = url
+        self.model = model
+        # Loaded and kept alongside `model` (e.g. a cascade's fast model).
+        self.models = [model, *(m for m in extra_models if m and m != model)]
+        self.keep_alive = keep_alive
+        self.startup_timeout = startup_timeout
+        self.keep_server = os.environ.get("OLLAMA_KEEP_SERVER") == "1"
+        self.startup: dict = {}
+        self.restarts = 0
+        self.stopping = False
+        self._proc: subprocess.Popen | None = None
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    # --- health ------------------------------------------------------------
+
+    def healthy(self) -> bool:
+        try:
+            return requests.get(f"{self.url}/api/tags", timeout=2).ok
+        except requests.RequestException:
+            return False
+
+    def _wait_healthy(self) -> None:
+        deadline = time.time() + self.startup_timeout
+        delay = 0.05
+        while not self.healthy():
+            if self._proc is not None and self._proc.poll() is not None:
+                raise RuntimeError(f"ollama serve exited with {self._proc.returncode}")
+            if time.time() > deadline:
+                raise RuntimeError(f"Ollama not up at {self.url} after {self.startup_timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def _spawn(self) -> None:
+        # Own session, so a kept server outlives this process and its signals.
+        self._proc = subprocess.Popen(["ollama", "serve"], start_new_session=True)
+        self._wait_healthy()
+
+    def _warm(self) -> None:
+        """Load the models and pin them for keep_alive (an empty prompt only loads)."""
+        for model in self.models:
+            requests.post(
+                f"{self.url}/api/generate",
+                json={"model": model, "prompt": "", "keep_alive": self.keep_alive,
+                      "stream": False},
+                timeout=600,
+            ).raise_for_status()
+
+    # --- lifecycle ---------------------------------------------------------
+
+    def start(self) -> "OllamaManager":
+        t0 = time.time()
+        reused = self.healthy()
+        if not reused:
+            print("Starting ollama serve...")
+            self._spawn()
+        t_server = time.time()
+        self._warm()
+        t_model = time.time()
+        self.startup = {
+            "reused": reused,
+            "server_s": round(t_server - t0, 2),
+            "model_load_s": round(t_model - t_server, 2),
+        }
+        print(f"Ollama {'reused' if reused else 'started'} at {self.url}: "
+              f"server {self.startup['server_s']}s, {', '.join(self.models)} loaded in "
+              f"{self.startup['model_load_s']}s")
+        return self
+
+    def ensure_running(self) -> None:
+        """Health-check, restarting the server if it died (only one we own;
+        a server someone else runs is waited for, not replaced)."""
+        if self.healthy():
+            return
+        self.restarts += 1
+        print(f"Ollama at {self.url} is not answering; restarting (#{self.restarts})...")
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.terminate()
+                self._proc.wait()
+            self._spawn()
+        else:
+            self._wait_healthy()
+        self._warm()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn (a classification) as an in-flight call; on a dropped
+        connection, bring the server back and retry once."""
+        with self._cond:
+            self._in_flight += 1
+        try:
+            try:
+                return fn(*args, **kwargs)
+            except requests.ConnectionError:
+                self.ensure_running()
+                return fn(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def handle_signals(self) -> None:
+        """Turn SIGTERM/SIGINT into a graceful stop: the run loop sees
+        `stopping`, finishes the email in hand and shuts down."""
+        def stop(signum, frame):
+            print(f"\nSignal {signum}: finishing in-flight work, then stopping...")
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+    def shutdown(self, drain_timeout: float = 300.0) -> None:
+        self.stopping = True
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_flight == 0, drain_timeout):
+                print(f"Gave up waiting for {self._in_flight} in-flight classification(s)")
+        if self._proc is None:
+            return
+        if self.keep_server:
+            print(f"Leaving ollama serve (pid {self._proc.pid}) running for the next run")
+            return
+        self._proc.terminate()
+        self._proc.wait()
+
+    def __enter__(self) -> "OllamaManager":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
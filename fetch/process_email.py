@@ -1,16 +1,82 @@
+import contextlib
+import fcntl
 import glob
 import json
 import os
 import time
+from collections import Counter
 from datetime import datetime
+from typing import Any, Callable
 from email.utils import parsedate_to_datetime
 import requests
 
+import changes
+from features import ledger_features
+from fingerprint import DuplicateIndex, attachment_hashes, fingerprint
 from models import Email
+from sender_history import SenderHistory
 
 OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/output")
 
+# Where the Ollama server listens. Overridable so a stub server (benchmarks,
+# tests) or a remote GPU box can stand in for the local one.
+OLLAMA_URL = os.environ.get("OLLAMA_URL") or "http://localhost:11434"
+
+# The classifier's model, and how long Ollama keeps it loaded after a request
+# so consecutive emails (and runs) don't pay the model load again.
+CLASSIFY_MODEL = "llama3"
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE") or "30m"
+
+# Optional cascade: a small fast model (e.g. phi3.5) classifies first and only
+# emails whose receipt probability falls in the gray band [low, high] go on to
+# CLASSIFY_MODEL. CLASSIFY_CASCADE_CALIBRATE=1 runs both models on every email
+# (the full model decides) to gather data for calibrate_cascade.py.
+CLASSIFY_FAST_MODEL = os.environ.get("CLASSIFY_FAST_MODEL") or ""
+GRAY_BAND = tuple(float(x) for x in (os.environ.get("CLASSIFY_GRAY_BAND") or "0.2,0.8").split(","))
+CASCADE_CALIBRATE = os.environ.get("CLASSIFY_CASCADE_CALIBRATE") == "1"
+
+# Senders with a long, consistent history get their verdict from it instead
+# of the LLM (see sender_history.py): at least SENDER_HISTORY_MIN emails, at
+# least SENDER_HISTORY_AGREEMENT of them one way. SENDER_HISTORY=0 turns it off.
+SENDER_HISTORY = os.environ.get("SENDER_HISTORY") != "0"
+SENDER_HISTORY_MIN = int(os.environ.get("SENDER_HISTORY_MIN") or 5)
+SENDER_HISTORY_AGREEMENT = float(os.environ.get("SENDER_HISTORY_AGREEMENT") or 0.95)
+
+# Near-duplicates of an email already in the ledgers (see fingerprint.py) take
+# its verdict, and a receipt is stored as a link to the original: at most
+# DUPLICATE_MAX_DISTANCE differing SimHash bits, at most DUPLICATE_WINDOW_DAYS
+# apart. DUPLICATE_DETECTION=0 turns it off.
+DUPLICATES = os.environ.get("DUPLICATE_DETECTION") != "0"
+DUPLICATE_MAX_DISTANCE = int(os.environ.get("DUPLICATE_MAX_DISTANCE") or 3)
+DUPLICATE_WINDOW_DAYS = float(os.environ.get("DUPLICATE_WINDOW_DAYS") or 7)
+
+# Generation limits for classify(): the reply is a short JSON object, so a cap
+# on generated tokens stops a runaway reply early, and a fixed context size
+# keeps Ollama from reallocating the KV cache per prompt. The body preview is
+# trimmed to fit the context (at ~3 characters per token, leaving room for the
+# instructions and the reply).
+CLASSIFY_NUM_PREDICT = int(os.environ.get("CLASSIFY_NUM_PREDICT") or 128)
+CLASSIFY_NUM_CTX = int(os.environ.get("CLASSIFY_NUM_CTX") or 8192)
+PROMPT_RESERVE_TOKENS = 1024
+
+# Ollama constrains the reply to this JSON schema (structured outputs).
+CLASSIFY_SCHEMA: dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "is_receipt": {"type": "boolean"},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "reason": {"type": "string", "maxLength": 120},
+    },
+    "required": ["is_receipt", "confidence", "reason"],
+}
+
+# How classify() calls went this process: calls, retries (re-generations),
+# repaired (malformed replies fixed without one), failed (gave up).
+LLM_STATS: Counter = Counter()
+
 _seen_message_ids: set[str] | None = None
+_sender_history: SenderHistory | None = None
+_duplicate_index: tuple[str, DuplicateIndex] | None = None    # (OUTPUT_DIR, index)
 
 
 def _get_seen_message_ids() -> set[str]:
@@ -30,6 +96,52 @@ def _get_seen_message_ids() -> set[str]:
         print(f"Loaded {len(_seen_message_ids)} seen message IDs.")
     return _seen_message_ids
 
+
+def _get_sender_history() -> SenderHistory:
+    global _sender_history
+    if _sender_history is None:
+        _sender_history = SenderHistory(SENDER_HISTORY_MIN, SENDER_HISTORY_AGREEMENT)
+        for p in sorted(glob.glob(os.path.join(OUTPUT_DIR, "*", "*_processed.json"))):
+            with open(p, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    _sender_history.add_entry(entry)
+        print(f"Sender history: {len(_sender_history.counts)} senders and templates.")
+    return _sender_history
+
+
+def _get_duplicate_index() -> DuplicateIndex:
+    global _duplicate_index
+    if _duplicate_index is None or _duplicate_index[0] != OUTPUT_DIR:
+        index = DuplicateIndex(DUPLICATE_MAX_DISTANCE, DUPLICATE_WINDOW_DAYS)
+        for p in sorted(glob.glob(os.path.join(OUTPUT_DIR, "*", "*_processed.json"))):
+            with open(p, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    index.add_entry(entry)
+        print(f"Duplicate index: {index.size} fingerprints.")
+        _duplicate_index = (OUTPUT_DIR, index)
+    return _duplicate_index[1]
+
+
+def _email_datetime(email: Email) -> datetime:
+    try:
+        return parsedate_to_datetime(email.date)
+    except (ValueError, TypeError):
+        return datetime.fromisoformat(email.date)
+
+
+@contextlib.contextmanager
+def ledger_lock(path: str):
+    """Hold an exclusive lock on <path>.lock, so parallel fetch jobs whose
+    months overlap (or an archive rewrite) don't lose each other's ledger
+    entries."""
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
 PROMPT_TEMPLATE = """You are a JSON-only classifier. Reply with a single valid JSON object and nothing else.
 
 Task: decide whether this email is a financial transaction document.
@@ -62,13 +174,55 @@ Reply with ONLY valid JSON like this:
 {{"is_receipt": true, "confidence": 0.85, "reason": "order confirmation with total price"}}"""
 
 
-def classify(email: Email, attachment_names: list[str]) -> dict:
-    """Ask the local LLM whether the email is a financial document.
+def _repair(raw: str) -> dict:
+    """Parse a reply that isn't quite a JSON object: text or code fences around
+    it, or cut off by the num_predict cap mid-reason. Raises the original
+    JSONDecodeError if there is no object to recover."""
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        error = e
+    start = raw.find("{")
+    if start < 0:
+        raise error
+    body = raw[start:raw.rfind("}") + 1] if "}" in raw[start:] else raw[start:]
+    for tail in ("", "}", '"}'):
+        try:
+            result = json.loads(body + tail)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(result, dict):
+            return result
+    raise error
+
+
+def _checked(result: dict) -> tuple[dict, bool]:
+    """The reply, if it has a boolean is_receipt, and whether that took a
+    repair: the strings "true" and "false" are taken as booleans; anything
+    else is rejected."""
+    if not isinstance(result, dict):
+        raise ValueError(f"expected a JSON object, got {type(result).__name__}")
+    is_receipt = result["is_receipt"]
+    if isinstance(is_receipt, str) and is_receipt.strip().lower() in ("true", "false"):
+        return {**result, "is_receipt": is_receipt.strip().lower() == "true"}, True
+    if not isinstance(is_receipt, bool):
+        raise ValueError(f"is_receipt must be bool, got {type(is_receipt).__name__}: {is_receipt!r}")
+    return result, False
+
+
+def classify(email: Email, attachment_names: list[str], model: str = "", url: str = "") -> dict:
+    """Ask the local LLM (CLASSIFY_MODEL unless another model is given, at
+    OLLAMA_URL unless another server is) whether the email is a financial
+    document.
 
     Returns the classification dict ({is_receipt, confidence, reason}); raises
-    if the model never returns a usable reply within max_attempts.
+    if the model never returns a usable reply within max_attempts. A reply
+    that doesn't parse as-is is repaired when possible (_repair); one that
+    can't be, or has no usable is_receipt, is generated again. A reply counts
+    as repaired once, and only if it is then used.
     """
-    body_preview = " ".join(email.text.split()[:5000])
+    body_chars = max(1000, (CLASSIFY_NUM_CTX - CLASSIFY_NUM_PREDICT - PROMPT_RESERVE_TOKENS) * 3)
+    body_preview = " ".join(email.text.split()[:5000])[:body_chars]
     prompt = PROMPT_TEMPLATE.format(
         from_=email.from_,
         subject=email.subject,
@@ -78,28 +232,129 @@ def classify(email: Email, attachment_names: list[str]) -> dict:
 
     max_attempts = 3
     for attempt in range(1, max_attempts + 1):
+        LLM_STATS["calls"] += 1
+        if attempt > 1:
+            LLM_STATS["retries"] += 1
         resp = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": "llama3", "prompt": prompt, "stream": False, "format": "json"},
+            f"{url or OLLAMA_URL}/api/generate",
+            json={
+                "model": model or CLASSIFY_MODEL,
+                "prompt": prompt,
+                "stream": False,
+                "format": CLASSIFY_SCHEMA,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+                "options": {
+                    # Deterministic first; at temperature 0 a retry would
+                    # only repeat the bad reply, so retries sample.
+                    "temperature": 0 if attempt == 1 else 0.5,
+                    "seed": attempt,
+                    "num_predict": CLASSIFY_NUM_PREDICT,
+                    "num_ctx": CLASSIFY_NUM_CTX,
+                },
+            },
             timeout=200,
         )
         resp.raise_for_status()
         raw = resp.json()["response"].strip()
 
-        result = json.loads(raw)
         try:
-            is_receipt = result["is_receipt"]
-            if not isinstance(is_receipt, bool):
-                raise ValueError(f"is_receipt must be bool, got {type(is_receipt).__name__}: {is_receipt!r}")
+            try:
+                result, repaired = json.loads(raw), False
+            except json.JSONDecodeError:
+                result, repaired = _repair(raw), True
+            result, coerced = _checked(result)
+            if repaired or coerced:
+                LLM_STATS["repaired"] += 1
             return result
-        except (KeyError, ValueError) as e:
+        except (KeyError, ValueError) as e:     # JSONDecodeError included
             print(f"[attempt {attempt}/{max_attempts}] bad LLM response: {e} — raw: {raw[:200]}")
             if attempt == max_attempts:
+                LLM_STATS["failed"] += 1
                 raise
     raise RuntimeError("classification loop ended without a result")
 
 
-def process_email(email: Email, index: int = 0, total: int = 0):
+def llm_stats_line() -> str:
+    s = LLM_STATS
+    return (f"LLM: {s['calls']} calls, {s['retries']} retries, "
+            f"{s['repaired']} replies repaired, {s['failed']} failed")
+
+
+def receipt_probability(classification: dict) -> float:
+    """The verdict as P(receipt): confidence in whichever way it went."""
+    try:
+        confidence = min(1.0, max(0.0, float(classification.get("confidence", 0.5))))
+    except (TypeError, ValueError):
+        confidence = 0.5
+    return confidence if classification["is_receipt"] else 1.0 - confidence
+
+
+def classify_cascade(
+    email: Email, attachment_names: list[str], url: str = "",
+) -> tuple[dict, dict | None]:
+    """classify() through the fast model first, when one is configured.
+
+    Returns the classification, with "tier" ("fast" or "full") saying which
+    model decided, and a trace for the ledger (fast model's P(receipt) and the
+    seconds each tier took). Without a fast model: plain classify(), no trace.
+    """
+    if not CLASSIFY_FAST_MODEL:
+        return classify(email, attachment_names, url=url), None
+
+    t0 = time.time()
+    fast = classify(email, attachment_names, model=CLASSIFY_FAST_MODEL, url=url)
+    p = receipt_probability(fast)
+    trace = {"fast_p": round(p, 3), "fast_s": round(time.time() - t0, 2)}
+    low, high = GRAY_BAND
+    if not (low <= p <= high) and not CASCADE_CALIBRATE:
+        return {**fast, "tier": "fast"}, trace
+
+    t0 = time.time()
+    full = classify(email, attachment_names, url=url)
+    trace["full_s"] = round(time.time() - t0, 2)
+    return {**full, "tier": "full"}, trace
+
+
+def email_fingerprint(email: Email) -> dict:
+    """fingerprint.fingerprint(), with attachment hashes for a full email."""
+    fp = fingerprint(email)
+    if not email.partial and email.attachments:
+        fp["hashes"] = attachment_hashes(email)
+    return fp
+
+
+def needs_llm(email: Email, fp: dict | None = None) -> bool:
+    """Whether the email still needs the LLM: it is no near-duplicate of one
+    in the ledgers, carries no classification yet (the learned model's, see
+    learned.prejudge) and its sender's history doesn't settle it. A
+    duplicate's or history verdict is put on the email. `fp` is the email's
+    fingerprint, when the caller has it already."""
+    if DUPLICATES and (email.classification is None or email.classification.get("source") == "learned"):
+        match = _get_duplicate_index().find(fp or email_fingerprint(email), _email_datetime(email))
+        if match is not None:
+            email.classification = _get_duplicate_index().verdict(match)
+    if email.classification is None and SENDER_HISTORY:
+        email.classification = _get_sender_history().verdict(ledger_features(email))
+    return email.classification is None
+
+
+def process_email(
+    email: Email,
+    index: int = 0,
+    total: int = 0,
+    fetch_full: Callable[[str], Email | None] | None = None,
+    cascade: dict | None = None,
+):
+    """Classify an email, record it in its month's ledger and, if it is a
+    receipt, write it out. A partial email (a Mailbox.peek preview) is
+    classified as is; only a receipt is then downloaded in full through
+    fetch_full(uid). An email that already carries a classification (the
+    learned model's, a queue worker's with its cascade trace, see
+    work_queue.py) or whose sender's history settles it is recorded without
+    asking the LLM. So is a near-duplicate of an email in the ledgers
+    (fingerprint.py), which gets its original's verdict; a duplicate receipt
+    is not downloaded, only linked to the original. Both writes are published
+    to the change journal (changes.py) for the viewer."""
     seen = _get_seen_message_ids()
     if email.message_id in seen:
         print(f"[{index}/{total}] skip (already processed) {email.message_id}")
@@ -107,16 +362,37 @@ def process_email(email: Email, index: int = 0, total: int = 0):
     seen.add(email.message_id)
 
     attachment_names = [a.filename for a in email.attachments]
+    features = ledger_features(email)
+    fp = email_fingerprint(email) if DUPLICATES else None
 
     t0 = time.time()
-    email.classification = classify(email, attachment_names)
-    duration = time.time() - t0
-    is_receipt = email.classification["is_receipt"]
-
     try:
-        dt = parsedate_to_datetime(email.date)
-    except (ValueError, TypeError):
-        dt = datetime.fromisoformat(email.date)
+        if needs_llm(email, fp):
+            email.classification, cascade = classify_cascade(email, attachment_names)
+        classification = email.classification
+        assert classification is not None
+        duration = time.time() - t0
+        is_receipt = classification["is_receipt"]
+        duplicate = classification.get("source") == "duplicate"
+        original = classification.get("original") if duplicate else None
+
+        if is_receipt and email.partial and not original:
+            full = fetch_full(email.uid) if fetch_full else None
+            if full is None:
+                raise RuntimeError(
+                    f"UID {email.uid} is a receipt but its full message could not be fetched")
+            full.classification = email.classification
+            full.account = email.account
+            email = full
+            if fp is not None and email.attachments:
+                fp["hashes"] = attachment_hashes(email)
+    except BaseException:
+        # Nothing recorded yet: a retry (OllamaManager.call) or a later run
+        # must not take it for done.
+        seen.discard(email.message_id)
+        raise
+
+    dt = _email_datetime(email)
     month = dt.strftime("%Y-%m")
     timestamp = dt.strftime("%Y-%m-%dT%H-%M-%S")
 
@@ -137,20 +413,42 @@ def process_email(email: Email, index: int = 0, total: int = 0):
     os.makedirs(month_dir, exist_ok=True)
 
     processed_path = os.path.join(month_dir, f"{month}_processed.json")
-    processed = []
-    if os.path.exists(processed_path):
-        with open(processed_path, "r", encoding="utf-8") as f:
-            processed = json.load(f)
-    processed.append({
-        "uid": email.uid,
-        "message_id": email.message_id,
-        "timestamp": timestamp,
-        "is_receipt": is_receipt,
-    })
-    with open(processed_path, "w", encoding="utf-8") as f:
-        json.dump(processed, f, indent=2, ensure_ascii=False)
+    with ledger_lock(processed_path):
+        processed = []
+        if os.path.exists(processed_path):
+            with open(processed_path, "r", encoding="utf-8") as f:
+                processed = json.load(f)
+        entry = {
+            "uid": email.uid,
+            "message_id": email.message_id,
+            "timestamp": timestamp,
+            "is_receipt": is_receipt,
+            "features": features,
+        }
+        if classification.get("source"):
+            entry["source"] = classification["source"]
+        if email.account:
+            entry["account"] = email.account
+        if cascade:
+            entry["cascade"] = cascade
+        if fp is not None:
+            entry["fingerprint"] = fp
+        if duplicate:
+            entry["duplicate_of"] = classification["duplicate_of"]
+        processed.append(entry)
+        with open(processed_path, "w", encoding="utf-8") as f:
+            json.dump(processed, f, indent=2, ensure_ascii=False)
+    changes.publish(OUTPUT_DIR, "ledger", month)
+    if SENDER_HISTORY:
+        _get_sender_history().add_entry(entry)
+    if DUPLICATES:
+        _get_duplicate_index().add_entry(entry)
 
     if not is_receipt:
         return
     base_name = f"{timestamp}_{email.uid}"
-    email.write(os.path.join(month_dir, f"{base_name}.json"))
+    if original:
+        email.write_duplicate(os.path.join(month_dir, f"{base_name}.json"), original)
+    else:
+        email.write(os.path.join(month_dir, f"{base_name}.json"))
+    changes.publish(OUTPUT_DIR, "receipt", month, base_name=base_name)
@@ -0,0 +1,97 @@
+"""
+A local, compressed store of raw RFC822 messages, keyed by Message-ID.
+
+With RAW_CACHE_DIR set, Mailbox.get keeps the raw bytes of every message it
+downloads (the receipts) and answers later requests for the same Message-ID
+from disk. A parser change or a migration over the saved receipts then re-reads
+the archive locally instead of downloading it from Gmail again.
+
+Layout: <root>/<2 hex>/<sha1 of Message-ID>.eml.zst, one file per message
+(maildir-style, so a copy or rsync of the folder is the backup). Compressed
+with zstd when the zstandard package is installed, gzip otherwise; a cache
+written with one is still read (by extension) when the other is in use, except
+that zstd entries don't count as cached where zstandard is missing (the message
+is downloaded again, into a gzip entry). open() streams an entry back, for
+parsing a large message without holding it.
+"""
+import contextlib
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip is the fallback
+    zstandard = None
+
+
+class RawCache:
+    def __init__(self, root: str):
+        self.root = root
+        self.ext = ".eml.zst" if zstandard is not None else ".eml.gz"
+
+    @classmethod
+    def from_env(cls) -> "RawCache | None":
+        root = os.environ.get("RAW_CACHE_DIR")
+        return cls(root) if root else None
+
+    def _base(self, message_id: str) -> str:
+        digest = hashlib.sha1(message_id.strip().encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _existing(self, message_id: str) -> str | None:
+        """The entry's file, if there is one this process can read."""
+        base = self._base(message_id)
+        readable = (".eml.zst", ".eml.gz") if zstandard is not None else (".eml.gz",)
+        for ext in (self.ext, *readable):
+            if ext in readable and os.path.exists(base + ext):
+                return base + ext
+        return None
+
+    def __contains__(self, message_id: str) -> bool:
+        return bool(message_id) and self._existing(message_id) is not None
+
+    def open(self, message_id: str) -> io.BufferedIOBase:
+        """The entry's raw bytes as a binary file (readline() works), read and
+        decompressed as they are consumed. KeyError if it isn't cached."""
+        path = self._existing(message_id) if message_id else None
+        if path is None:
+            raise KeyError(message_id)
+        if path.endswith(".gz"):
+            return gzip.open(path, "rb")
+        assert zstandard is not None
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.BufferedReader(reader)
+
+    def get(self, message_id: str) -> bytes | None:
+        if message_id not in self:
+            return None
+        with self.open(message_id) as f:
+            return f.read()
+
+    @contextlib.contextmanager
+    def writer(self, message_id: str):
+        """A binary file to stream one message's raw bytes into, compressed on
+        the way. The entry appears once the block exits cleanly; on an
+        exception nothing is stored."""
+        path = self._base(message_id) + self.ext
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                if zstandard is not None:
+                    with zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=False) as f:
+                        yield f
+                else:
+                    with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as f:
+                        yield f
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def put(self, message_id: str, raw: bytes) -> None:
+        with self.writer(message_id) as f:
+            f.write(raw)
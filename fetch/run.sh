@@ -1,11 +1,47 @@
 #!/bin/bash
-# Usage: ./fetch/run.sh <gmail-address> <app-password> [skip]
+# Usage: ./fetch/run.sh <gmail-address> <app-password>
+#        ./fetch/run.sh --build-only      (just build the image; see run_multi.sh)
+#
+# Each run is a resumable job named FETCH_JOB (default: its FETCH_SINCE /
+# FETCH_BEFORE range) and checkpointed under output/.runs/; rerunning the same
+# job after a crash picks up where it stopped. Jobs over different ranges are
+# independent, so a backfill can be split into shards run side by side:
+#   FETCH_SINCE=2024-01-01 FETCH_BEFORE=2024-07-01 ./fetch/run.sh <gmail> <pw> &
+#   FETCH_SINCE=2024-07-01 FETCH_BEFORE=2025-01-01 ./fetch/run.sh <gmail> <pw> &
+#
+# FETCH_QUERY narrows the range server-side with a Gmail search, e.g.
+#   FETCH_QUERY='-category:social {category:purchases has:attachment subject:(invoice OR receipt OR חשבונית)}'
+# Check what it would drop first with ./fetch/coverage_audit/audit.sh.
+#
+# RAW_CACHE_DIR=/output/.raw keeps every downloaded receipt's raw message,
+# compressed, so migrations and parser changes can re-read it locally.
+#
+# RECEIPT_COMPRESSION=1 stores each receipt's body (and its sanitized page)
+# zstd-compressed beside the JSON; see compression.py. Readers take both forms.
+#
+# Near-duplicates of an email already processed (forwarded or resent copies)
+# take its verdict and are stored as links to it; DUPLICATE_DETECTION=0 turns
+# that off (fingerprint.py).
+#
+# Downloads are kept within FETCH_DAILY_MB (default 2000, under Gmail's daily
+# IMAP limit) per account per rolling day, counted across runs; what doesn't
+# fit waits for a later run, and a quota error from Gmail pauses the account
+# for FETCH_QUOTA_BACKOFF_MINUTES. FETCH_DAILY_MB=0 turns it off (bandwidth.py).
+#
+# Likely receipts are fetched first, ranked by sender history, subject words,
+# attachments and Gmail's inbox category; FETCH_PRIORITY=0 keeps server order
+# (priority.py).
+#
+# CLASSIFY_QUEUE=/output/.classify-queue.sqlite3 queues the LLM work for
+# ./fetch/run_worker.sh workers instead of classifying here (work_queue.py);
+# CLASSIFY_QUEUE_PORT=8765 also serves it to workers on other hosts (this
+# needs CLASSIFY_QUEUE_TOKEN too; give them http://<this host>:8765).
 set -e
 
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 
-if [ $# -lt 2 ]; then
-  echo "Usage: ./fetch/run.sh <gmail-address> <app-password> [skip]"
+if [ "$1" != "--build-only" ] && [ $# -lt 2 ]; then
+  echo "Usage: ./fetch/run.sh <gmail-address> <app-password>"
   exit 1
 fi
 
@@ -17,24 +53,72 @@ RUN apt-get update \
     && rm -rf /var/lib/apt/lists/* \
     && curl -fsSL https://ollama.com/install.sh | bash
 
-RUN pip install --no-cache-dir requests
+RUN pip install --no-cache-dir requests numpy zstandard
 
 WORKDIR /app
 COPY *.py .
 CMD ["python", "-u", "fetch_emails.py"]
 EOF
 
+if [ "$1" = "--build-only" ]; then
+  exit 0
+fi
+
 GPU_FLAG=""
 if docker info --format '{{.Runtimes}}' | grep -q nvidia; then
   GPU_FLAG="--gpus all"
 fi
 
-docker run --rm $GPU_FLAG \
+PORT_FLAG=""
+if [ -n "$CLASSIFY_QUEUE_PORT" ]; then
+  if [ -z "$CLASSIFY_QUEUE_TOKEN" ]; then
+    echo "CLASSIFY_QUEUE_PORT serves the queue to other hosts; set CLASSIFY_QUEUE_TOKEN too."
+    exit 1
+  fi
+  # Published on the host's port; inside the container it has to listen on
+  # every interface for Docker to reach it.
+  PORT_FLAG="-p $CLASSIFY_QUEUE_PORT:$CLASSIFY_QUEUE_PORT -e CLASSIFY_QUEUE_BIND=0.0.0.0"
+fi
+
+docker run --rm $GPU_FLAG $PORT_FLAG \
   -e GMAIL_USER="$1" \
   -e GMAIL_APP_PASSWORD="$2" \
   -e OLLAMA_NO_CLOUD=1 \
+  -e CLASSIFY_FAST_MODEL="$CLASSIFY_FAST_MODEL" \
+  -e CLASSIFY_GRAY_BAND="$CLASSIFY_GRAY_BAND" \
+  -e CLASSIFY_CASCADE_CALIBRATE="$CLASSIFY_CASCADE_CALIBRATE" \
+  -e CLASSIFY_NUM_PREDICT="$CLASSIFY_NUM_PREDICT" \
+  -e CLASSIFY_NUM_CTX="$CLASSIFY_NUM_CTX" \
+  -e LEARNED_CLASSIFIER="$LEARNED_CLASSIFIER" \
+  -e LEARNED_PRECISION="$LEARNED_PRECISION" \
+  -e LEARNED_RETRAIN_DAYS="$LEARNED_RETRAIN_DAYS" \
+  -e SENDER_HISTORY="$SENDER_HISTORY" \
+  -e SENDER_HISTORY_MIN="$SENDER_HISTORY_MIN" \
+  -e SENDER_HISTORY_AGREEMENT="$SENDER_HISTORY_AGREEMENT" \
+  -e DUPLICATE_DETECTION="$DUPLICATE_DETECTION" \
+  -e DUPLICATE_MAX_DISTANCE="$DUPLICATE_MAX_DISTANCE" \
+  -e DUPLICATE_WINDOW_DAYS="$DUPLICATE_WINDOW_DAYS" \
+  -e FETCH_DAILY_MB="$FETCH_DAILY_MB" \
+  -e FETCH_DEFER_MB="$FETCH_DEFER_MB" \
+  -e FETCH_QUOTA_BACKOFF_MINUTES="$FETCH_QUOTA_BACKOFF_MINUTES" \
+  -e FETCH_PRIORITY="$FETCH_PRIORITY" \
   -e FETCH_SINCE="$FETCH_SINCE" \
   -e FETCH_BEFORE="$FETCH_BEFORE" \
+  -e FETCH_QUERY="$FETCH_QUERY" \
+  -e FETCH_PEEK_BATCH="$FETCH_PEEK_BATCH" \
+  -e FETCH_PREVIEW_BYTES="$FETCH_PREVIEW_BYTES" \
+  -e FETCH_CHUNK_BYTES="$FETCH_CHUNK_BYTES" \
+  -e RAW_CACHE_DIR="$RAW_CACHE_DIR" \
+  -e RECEIPT_COMPRESSION="$RECEIPT_COMPRESSION" \
+  -e CLASSIFY_QUEUE="$CLASSIFY_QUEUE" \
+  -e CLASSIFY_QUEUE_AHEAD="$CLASSIFY_QUEUE_AHEAD" \
+  -e CLASSIFY_QUEUE_PORT="$CLASSIFY_QUEUE_PORT" \
+  -e CLASSIFY_QUEUE_TOKEN="$CLASSIFY_QUEUE_TOKEN" \
+  -e CLASSIFY_LEASE_SECONDS="$CLASSIFY_LEASE_SECONDS" \
+  -e CLASSIFY_MAX_ATTEMPTS="$CLASSIFY_MAX_ATTEMPTS" \
+  -e FETCH_JOB="$FETCH_JOB" \
+  -e OLLAMA_URL="$OLLAMA_URL" \
+  -e OLLAMA_KEEP_ALIVE="$OLLAMA_KEEP_ALIVE" \
   -v "$HOME/.ollama/models:/root/.ollama/models:ro" \
   -v "$SCRIPT_DIR/../output:/output" \
-  gmail-fetch python -u fetch_emails.py "${@:3}"
+  gmail-fetch python -u fetch_emails.py
@@ -0,0 +1,55 @@
+#!/bin/bash
+# Fetch several Gmail accounts in one container, sharing one Ollama server.
+# Usage: ./fetch/run_multi.sh <accounts.json>
+#   accounts.json: [{"user": "a@gmail.com", "password": "<app password>"}, ...]
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+if [ $# -lt 1 ]; then
+  echo "Usage: ./fetch/run_multi.sh <accounts.json>"
+  exit 1
+fi
+ACCOUNTS_FILE="$(cd "$(dirname "$1")" && pwd)/$(basename "$1")"
+
+# Same image as run.sh.
+"$SCRIPT_DIR/run.sh" --build-only
+
+GPU_FLAG=""
+if docker info --format '{{.Runtimes}}' | grep -q nvidia; then
+  GPU_FLAG="--gpus all"
+fi
+
+docker run --rm $GPU_FLAG \
+  -e GMAIL_ACCOUNTS_FILE=/accounts.json \
+  -e OLLAMA_NO_CLOUD=1 \
+  -e CLASSIFY_FAST_MODEL="$CLASSIFY_FAST_MODEL" \
+  -e CLASSIFY_GRAY_BAND="$CLASSIFY_GRAY_BAND" \
+  -e CLASSIFY_CASCADE_CALIBRATE="$CLASSIFY_CASCADE_CALIBRATE" \
+  -e CLASSIFY_NUM_PREDICT="$CLASSIFY_NUM_PREDICT" \
+  -e CLASSIFY_NUM_CTX="$CLASSIFY_NUM_CTX" \
+  -e LEARNED_CLASSIFIER="$LEARNED_CLASSIFIER" \
+  -e LEARNED_PRECISION="$LEARNED_PRECISION" \
+  -e LEARNED_RETRAIN_DAYS="$LEARNED_RETRAIN_DAYS" \
+  -e SENDER_HISTORY="$SENDER_HISTORY" \
+  -e SENDER_HISTORY_MIN="$SENDER_HISTORY_MIN" \
+  -e SENDER_HISTORY_AGREEMENT="$SENDER_HISTORY_AGREEMENT" \
+  -e DUPLICATE_DETECTION="$DUPLICATE_DETECTION" \
+  -e DUPLICATE_MAX_DISTANCE="$DUPLICATE_MAX_DISTANCE" \
+  -e DUPLICATE_WINDOW_DAYS="$DUPLICATE_WINDOW_DAYS" \
+  -e FETCH_DAILY_MB="$FETCH_DAILY_MB" \
+  -e FETCH_DEFER_MB="$FETCH_DEFER_MB" \
+  -e FETCH_QUOTA_BACKOFF_MINUTES="$FETCH_QUOTA_BACKOFF_MINUTES" \
+  -e FETCH_PRIORITY="$FETCH_PRIORITY" \
+  -e FETCH_SINCE="$FETCH_SINCE" \
+  -e FETCH_BEFORE="$FETCH_BEFORE" \
+  -e FETCH_QUERY="$FETCH_QUERY" \
+  -e FETCH_PEEK_BATCH="$FETCH_PEEK_BATCH" \
+  -e FETCH_PREVIEW_BYTES="$FETCH_PREVIEW_BYTES" \
+  -e FETCH_CHUNK_BYTES="$FETCH_CHUNK_BYTES" \
+  -e RAW_CACHE_DIR="$RAW_CACHE_DIR" \
+  -e RECEIPT_COMPRESSION="$RECEIPT_COMPRESSION" \
+  -v "$ACCOUNTS_FILE:/accounts.json:ro" \
+  -v "$HOME/.ollama/models:/root/.ollama/models:ro" \
+  -v "$SCRIPT_DIR/../output:/output" \
+  gmail-fetch python -u multi_fetch.py
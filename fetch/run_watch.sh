@@ -0,0 +1,53 @@
+#!/bin/bash
+# Keep receipts current: a detached container that waits in IMAP IDLE and
+# processes new mail as it arrives (see watch.py).
+# Usage: ./fetch/run_watch.sh <gmail-address> <app-password>
+#   docker logs -f gmail-watch      follow it
+#   docker stop gmail-watch         stop it (finishes the email in hand)
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+if [ $# -lt 2 ]; then
+  echo "Usage: ./fetch/run_watch.sh <gmail-address> <app-password>"
+  exit 1
+fi
+
+# Same image as run.sh.
+"$SCRIPT_DIR/run.sh" --build-only
+
+GPU_FLAG=""
+if docker info --format '{{.Runtimes}}' | grep -q nvidia; then
+  GPU_FLAG="--gpus all"
+fi
+
+docker run -d --name gmail-watch --restart unless-stopped $GPU_FLAG \
+  -e GMAIL_USER="$1" \
+  -e GMAIL_APP_PASSWORD="$2" \
+  -e OLLAMA_NO_CLOUD=1 \
+  -e RAW_CACHE_DIR="$RAW_CACHE_DIR" \
+  -e RECEIPT_COMPRESSION="$RECEIPT_COMPRESSION" \
+  -e CLASSIFY_FAST_MODEL="$CLASSIFY_FAST_MODEL" \
+  -e CLASSIFY_GRAY_BAND="$CLASSIFY_GRAY_BAND" \
+  -e CLASSIFY_CASCADE_CALIBRATE="$CLASSIFY_CASCADE_CALIBRATE" \
+  -e CLASSIFY_NUM_PREDICT="$CLASSIFY_NUM_PREDICT" \
+  -e CLASSIFY_NUM_CTX="$CLASSIFY_NUM_CTX" \
+  -e LEARNED_CLASSIFIER="$LEARNED_CLASSIFIER" \
+  -e LEARNED_PRECISION="$LEARNED_PRECISION" \
+  -e LEARNED_RETRAIN_DAYS="$LEARNED_RETRAIN_DAYS" \
+  -e SENDER_HISTORY="$SENDER_HISTORY" \
+  -e SENDER_HISTORY_MIN="$SENDER_HISTORY_MIN" \
+  -e SENDER_HISTORY_AGREEMENT="$SENDER_HISTORY_AGREEMENT" \
+  -e DUPLICATE_DETECTION="$DUPLICATE_DETECTION" \
+  -e DUPLICATE_MAX_DISTANCE="$DUPLICATE_MAX_DISTANCE" \
+  -e DUPLICATE_WINDOW_DAYS="$DUPLICATE_WINDOW_DAYS" \
+  -e FETCH_DAILY_MB="$FETCH_DAILY_MB" \
+  -e FETCH_DEFER_MB="$FETCH_DEFER_MB" \
+  -e FETCH_QUOTA_BACKOFF_MINUTES="$FETCH_QUOTA_BACKOFF_MINUTES" \
+  -e WATCH_LOOKBACK_DAYS="$WATCH_LOOKBACK_DAYS" \
+  -e WATCH_SYNC_MINUTES="$WATCH_SYNC_MINUTES" \
+  -e WATCH_IDLE_MINUTES="$WATCH_IDLE_MINUTES" \
+  -e OLLAMA_KEEP_ALIVE="${OLLAMA_KEEP_ALIVE:-24h}" \
+  -v "$HOME/.ollama/models:/root/.ollama/models:ro" \
+  -v "$SCRIPT_DIR/../output:/output" \
+  gmail-fetch python -u watch.py
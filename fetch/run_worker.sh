@@ -0,0 +1,49 @@
+#!/bin/bash
+# A classification worker for a fetch run in queue mode (classify_worker.py):
+# its own Ollama in its own container, classifying what the run queues.
+# Usage: ./fetch/run_worker.sh <queue>
+#   <queue> is the run's CLASSIFY_QUEUE file under output/ for a worker on the
+#   same host, e.g. /output/.classify-queue.sqlite3, or http://<host>:<port>
+#   when the run serves it (CLASSIFY_QUEUE_PORT) to workers on other hosts.
+#
+#   CLASSIFY_QUEUE=/output/.classify-queue.sqlite3 ./fetch/run.sh <gmail> <pw> &
+#   ./fetch/run_worker.sh /output/.classify-queue.sqlite3 &
+#   ./fetch/run_worker.sh /output/.classify-queue.sqlite3 &
+#
+# Give workers on one host different OLLAMA_URLs (or one GPU each) to gain
+# anything; WORKER_EXIT_IDLE=1 stops a worker once the queue is empty.
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+if [ $# -lt 1 ]; then
+  echo "Usage: ./fetch/run_worker.sh <queue file or URL>"
+  exit 1
+fi
+
+# Same image as run.sh.
+"$SCRIPT_DIR/run.sh" --build-only
+
+GPU_FLAG=""
+if docker info --format '{{.Runtimes}}' | grep -q nvidia; then
+  GPU_FLAG="--gpus all"
+fi
+
+docker run --rm $GPU_FLAG \
+  -e CLASSIFY_QUEUE="$1" \
+  -e CLASSIFY_QUEUE_TOKEN="$CLASSIFY_QUEUE_TOKEN" \
+  -e CLASSIFY_LEASE_SECONDS="$CLASSIFY_LEASE_SECONDS" \
+  -e CLASSIFY_MAX_ATTEMPTS="$CLASSIFY_MAX_ATTEMPTS" \
+  -e WORKER_ID="$WORKER_ID" \
+  -e WORKER_EXIT_IDLE="$WORKER_EXIT_IDLE" \
+  -e OLLAMA_NO_CLOUD=1 \
+  -e CLASSIFY_FAST_MODEL="$CLASSIFY_FAST_MODEL" \
+  -e CLASSIFY_GRAY_BAND="$CLASSIFY_GRAY_BAND" \
+  -e CLASSIFY_CASCADE_CALIBRATE="$CLASSIFY_CASCADE_CALIBRATE" \
+  -e CLASSIFY_NUM_PREDICT="$CLASSIFY_NUM_PREDICT" \
+  -e CLASSIFY_NUM_CTX="$CLASSIFY_NUM_CTX" \
+  -e OLLAMA_URL="$OLLAMA_URL" \
+  -e OLLAMA_KEEP_ALIVE="$OLLAMA_KEEP_ALIVE" \
+  -v "$HOME/.ollama/models:/root/.ollama/models:ro" \
+  -v "$SCRIPT_DIR/../output:/output" \
+  gmail-fetch python -u classify_worker.py
@@ -0,0 +1,91 @@
+"""
+Per-sender verdict memory: utilities, ride-hailing apps, banks and newsletters
+write every month, and their emails keep getting the same verdict.
+
+SenderHistory counts receipts and non-receipts per sender at three levels, from
+most to least specific: address + subject template (features.subject_template,
+numbers blanked), address, and domain. verdict() looks at the most specific
+level with at least min_count emails (three times that for a whole domain,
+which freemail domains like gmail.com never count as): if at least
+`agreement` of them went one way, that is the verdict, with "source":
+"sender_history"; if they are split, or no level has enough history, the
+email goes to the LLM.
+
+Only the LLM's verdicts and manual corrections are counted, never the
+shortcuts' own (learned model, sender history, duplicates), so a mistake can't feed
+itself. process_email builds it from the ledgers' features on first use and
+adds each email it classifies. receipt_rate() is the softer reading the fetch
+order (priority.py) uses: how often the sender's emails were receipts, for
+however much history there is.
+"""
+from collections import defaultdict
+
+from features import AUTOMATIC_SOURCES, sender, subject_template
+
+# Domains anyone can have an address at: a domain's history says nothing about
+# a new sender there (a relative forwarding an invoice from @gmail.com).
+SHARED_DOMAINS = {
+    "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "live.com", "msn.com",
+    "yahoo.com", "ymail.com", "icloud.com", "me.com", "mac.com", "aol.com", "proton.me",
+    "protonmail.com", "gmx.com", "gmx.de", "gmx.net", "web.de", "mail.com", "yandex.ru",
+    "mail.ru", "zoho.com", "walla.co.il", "walla.com", "012.net.il", "bezeqint.net",
+    "netvision.net.il",
+}
+
+
+def _keys(features: dict) -> list[tuple[str, int]]:
+    """(key, how many emails it needs relative to min_count), most specific first."""
+    address, domain = sender(features.get("from", ""))
+    if not address:
+        return []
+    keys = [
+        (f"addr:{address}|{subject_template(features.get('subject', ''))}", 1),
+        (f"addr:{address}", 1),
+    ]
+    if domain not in SHARED_DOMAINS:
+        keys.append((f"dom:{domain}", 3))
+    return keys
+
+
+class SenderHistory:
+    def __init__(self, min_count: int = 5, agreement: float = 0.95):
+        self.min_count = min_count
+        self.agreement = agreement
+        self.counts: dict[str, list[int]] = defaultdict(lambda: [0, 0])   # [not receipt, receipt]
+
+    def add(self, features: dict, is_receipt: bool) -> None:
+        for key, _ in _keys(features):
+            self.counts[key][bool(is_receipt)] += 1
+
+    def add_entry(self, entry: dict) -> None:
+        """Count a ledger entry, if it has features and a trusted verdict."""
+        if entry.get("features") and entry.get("source") not in AUTOMATIC_SOURCES:
+            self.add(entry["features"], bool(entry.get("is_receipt")))
+
+    def receipt_rate(self, features: dict) -> tuple[float, int] | None:
+        """(share of receipts, smoothed towards a half, emails it rests on) at
+        the most specific level with any history; None for a new sender."""
+        for key, _ in _keys(features):
+            counts = self.counts.get(key)
+            if counts is not None and sum(counts) > 0:
+                n = sum(counts)
+                return (counts[1] + 1) / (n + 2), n
+        return None
+
+    def verdict(self, features: dict) -> dict | None:
+        for key, scale in _keys(features):
+            counts = self.counts.get(key)
+            if counts is None or sum(counts) < self.min_count * scale:
+                continue
+            n = sum(counts)
+            is_receipt = counts[1] > counts[0]
+            share = counts[is_receipt] / n
+            if share < self.agreement:
+                return None
+            return {
+                "is_receipt": is_receipt,
+                "confidence": round(share, 3),
+                "reason": f"sender history: {counts[is_receipt]}/{n} for {key}",
+                "source": "sender_history",
+            }
+        return None
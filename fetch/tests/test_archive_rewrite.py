@@ -0,0 +1,169 @@
+import json
+from email.message import EmailMessage
+
+import pytest
+
+import add_message_id
+import archive_rewrite as ar
+import check_uids
+import migration.migrate_html as migrate_html
+from bench.fake_imap import FakeIMAPServer
+from mailbox_wrapper import Mailbox
+from raw_cache import RawCache
+
+
+def _raw(uid):
+    msg = EmailMessage()
+    msg["Subject"] = f"Order {uid}"
+    msg["From"] = "shop@example.com"
+    msg["Date"] = "Mon, 03 Mar 2025 10:00:00 +0000"
+    msg["Message-ID"] = f"<m{uid}@x>"
+    msg.set_content("plain")
+    msg.add_alternative(f"<b>order {uid}</b>", subtype="html")
+    return msg.as_bytes()
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """Three receipts and a ledger on disk, the same emails on a fake Gmail."""
+    out = tmp_path / "out"
+    month = out / "2025-03"
+    month.mkdir(parents=True)
+    monkeypatch.setattr(ar, "OUTPUT_DIR", str(out))
+    monkeypatch.delenv("RAW_CACHE_DIR", raising=False)
+
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    for uid in ("1", "2", "3"):
+        (corpus / f"{uid}.eml").write_bytes(_raw(uid))
+        (month / f"r{uid}.json").write_text(json.dumps({
+            "uid": uid, "from": "shop@example.com", "date": "Mon, 03 Mar 2025 10:00:00 +0000",
+            "subject": f"Order {uid}", "body": "old", "labels": []}))
+    (corpus / "manifest.json").write_text(json.dumps({"1": ["Receipts"], "2": [], "3": []}))
+    (month / "2025-03_processed.json").write_text(json.dumps([
+        {"uid": "1", "is_receipt": True}, {"uid": "2", "message_id": "<m2@x>", "is_receipt": True}]))
+
+    server = FakeIMAPServer(str(corpus))
+    monkeypatch.setattr("mailbox_wrapper.imaplib.IMAP4_SSL", server.connect)
+    return out, server
+
+
+def _connect():
+    return Mailbox("user@x", "pw")
+
+
+def test_dry_run_reports_changes_and_writes_nothing(archive):
+    out, server = archive
+    before = {p: p.read_text() for p in out.rglob("*.json")}
+    report = ar.run(add_message_id.AddMessageId(), _connect, dry_run=True)
+
+    assert report["changed"] == 4 and report["failed"] == []
+    assert report["fields"] == {"message_id": 3, "[].message_id": 1}
+    assert {p: p.read_text() for p in out.rglob("*.json")} == before
+    assert not (out / ".runs").exists()
+
+
+def test_add_message_id_batches_lookups(archive):
+    out, server = archive
+    report = ar.run(add_message_id.AddMessageId(), _connect, batch_size=10)
+    assert report["changed"] == 4 and report["visited"] == 4
+
+    ledger = json.loads((out / "2025-03" / "2025-03_processed.json").read_text())
+    assert [e["message_id"] for e in ledger] == ["<m1@x>", "<m2@x>"]
+    assert json.loads((out / "2025-03" / "r3.json").read_text())["message_id"] == "<m3@x>"
+    assert server.commands == 1                  # one header FETCH for the batch
+
+    # Done: the next run starts over and finds nothing to change.
+    assert ar.run(add_message_id.AddMessageId(), _connect)["changed"] == 0
+
+
+def test_failures_are_reported_and_retried_on_resume(archive):
+    out, _ = archive
+    (out / "2025-03" / "r2.json").write_text("{broken")
+
+    class Upper(ar.Rewrite):
+        name = "upper"
+
+        def apply(self, data, ctx):
+            if data["uid"] == "3":
+                raise ar.RewriteError("refusing uid 3")
+            return {**data, "subject": data["subject"].upper()}
+
+    report = ar.run(Upper(), workers=2)
+    assert report["changed"] == 1
+    assert sorted(f["path"] for f in report["failed"]) == ["2025-03/r2.json", "2025-03/r3.json"]
+    assert "refusing uid 3" in str(report["failed"])
+
+    # The rerun visits only what failed.
+    (out / "2025-03" / "r2.json").write_text(json.dumps({"uid": "2", "subject": "fixed"}))
+    report = ar.run(Upper())
+    assert report["visited"] == 2 and report["changed"] == 1
+    assert json.loads((out / "2025-03" / "r2.json").read_text())["subject"] == "FIXED"
+
+
+def test_check_uids_lists_mismatches(archive):
+    out, _ = archive
+    r3 = out / "2025-03" / "r3.json"
+    r3.write_text(json.dumps({**json.loads(r3.read_text()), "from": "someone@else.example"}))
+
+    report = ar.run(check_uids.CheckUids(), _connect)
+    assert report["changed"] == 0
+    [failure] = report["failed"]
+    assert failure["path"] == "2025-03/r3.json" and "someone@else.example" in failure["error"]
+
+
+def test_migrate_html_from_the_raw_cache_needs_no_gmail(archive, tmp_path, monkeypatch):
+    out, server = archive
+    for uid in ("1", "2", "3"):
+        path = out / "2025-03" / f"r{uid}.json"
+        path.write_text(json.dumps({**json.loads(path.read_text()), "message_id": f"<m{uid}@x>"}))
+    monkeypatch.setenv("RAW_CACHE_DIR", str(tmp_path / "raw"))
+    cache = RawCache(str(tmp_path / "raw"))
+    cache.put("<m1@x>", _raw("1"))
+    cache.put("<m2@x>", _raw("2"))
+
+    report = ar.run(migrate_html.MigrateHtml(), connect=None)
+    assert report["changed"] == 2
+    [failure] = report["failed"]                 # not cached, and no credentials
+    assert failure["path"] == "2025-03/r3.json" and "credentials" in failure["error"]
+    assert "<b>order 1</b>" in json.loads((out / "2025-03" / "r1.json").read_text())["body"]
+    assert server.commands == 0
+
+    # With Gmail, the rerun fetches (and caches) the missing one.
+    report = ar.run(migrate_html.MigrateHtml(), connect=lambda: Mailbox("u", "p", raw_cache=cache))
+    assert report["visited"] == 1 and report["changed"] == 1
+    assert "<m3@x>" in cache
+    assert json.loads((out / "2025-03" / "r3.json").read_text())["labels"] == []
+
+
+def test_migrate_html_reports_uid_mismatch(archive):
+    out, _ = archive
+    path = out / "2025-03" / "r1.json"
+    path.write_text(json.dumps({**json.loads(path.read_text()), "message_id": "<m2@x>"}))
+
+    class Searching(Mailbox):
+        def search_message_id(self, message_id):
+            return message_id[2]                 # "<m2@x>" -> "2"
+
+    report = ar.run(migrate_html.MigrateHtml(), connect=lambda: Searching("u", "p"))
+    failures = {f["path"]: f["error"] for f in report["failed"]}
+    assert "uid mismatch (stored 1, found 2)" in failures["2025-03/r1.json"]
+    assert json.loads(path.read_text())["body"] == "old"
+
+
+def test_migrate_html_reports_a_failed_fetch(archive):
+    out, _ = archive
+    path = out / "2025-03" / "r1.json"
+    path.write_text(json.dumps({**json.loads(path.read_text()), "message_id": "<m1@x>"}))
+
+    class Refusing(Mailbox):
+        def search_message_id(self, message_id):
+            return "1"
+
+        def get(self, uid):
+            return None
+
+    report = ar.run(migrate_html.MigrateHtml(), connect=lambda: Refusing("u", "p"))
+    failures = {f["path"]: f["error"] for f in report["failed"]}
+    assert "fetch failed (uid 1)" in failures["2025-03/r1.json"]
+    assert json.loads(path.read_text())["body"] == "old"
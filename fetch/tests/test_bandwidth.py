@@ -0,0 +1,169 @@
+import glob
+import json
+import os
+from datetime import date
+
+import pytest
+
+import bandwidth
+import fetch_emails as fe
+import mailbox_wrapper
+import process_email as pe
+from bandwidth import MB, BandwidthBudget, OverBudget, QuotaExceeded, is_quota_error, schedule
+from bench.corpus import generate
+from bench.fake_imap import FakeIMAPServer
+from bench.fake_ollama import FakeOllama
+
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = [1_000_000.0]
+    monkeypatch.setattr("bandwidth.time.time", lambda: clock[0])
+    return clock
+
+
+def test_budget_counts_a_rolling_day(tmp_path, now):
+    budget = BandwidthBudget(str(tmp_path / "bw.sqlite3"), "Me@x", daily_bytes=100)
+    budget.charge(60)
+    now[0] += 3600
+    budget.charge(30)
+    assert budget.used() == 90 and budget.remaining() == 10
+    assert budget.fits(10) and not budget.fits(11)
+    assert budget.free_at(10) == now[0]
+    assert budget.free_at(40) == 1_000_000.0 + 24 * 3600      # once the 60 ages out
+    assert budget.free_at(101) == float("inf")
+
+    other = BandwidthBudget(str(tmp_path / "bw.sqlite3"), "other@x", daily_bytes=100)
+    assert other.used() == 0                                   # per account
+    again = BandwidthBudget(str(tmp_path / "bw.sqlite3"), "me@x", daily_bytes=100)
+    assert again.used() == 90                                  # persisted across runs
+
+    now[0] += 24 * 3600 - 1
+    assert again.used() == 30
+
+
+def test_back_off_persists_until_it_ends(tmp_path, now):
+    path = str(tmp_path / "bw.sqlite3")
+    until = BandwidthBudget(path, "me@x").back_off("[OVERQUOTA]", seconds=600)
+    assert BandwidthBudget(path, "me@x").backed_off() == (until, "[OVERQUOTA]")
+    assert BandwidthBudget(path, "other@x").backed_off() is None
+    now[0] += 601
+    assert BandwidthBudget(path, "me@x").backed_off() is None
+
+
+def test_schedule_puts_large_messages_last():
+    sizes = {"1": 5 * MB, "2": 40 * MB, "3": 1000, "4": 20 * MB}
+    assert schedule(["1", "2", "3", "4", "5"], sizes, defer_bytes=10 * MB) == ["1", "3", "5", "4", "2"]
+
+
+def test_is_quota_error():
+    assert is_quota_error([b"[OVERQUOTA] Account exceeded command or bandwidth limits"])
+    assert is_quota_error("[THROTTLED] slow down")
+    assert not is_quota_error([b"Invalid credentials"])
+    assert not is_quota_error([None])
+
+
+@pytest.fixture
+def served(tmp_path, monkeypatch):
+    corpus = tmp_path / "corpus"
+    generate(str(corpus), messages=10, large_pdf_mb=0.1, seed=3)
+    server = FakeIMAPServer(str(corpus))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    return server
+
+
+def _box(tmp_path, daily_bytes):
+    budget = BandwidthBudget(str(tmp_path / "bw.sqlite3"), "u@x", daily_bytes=daily_bytes)
+    box = mailbox_wrapper.Mailbox("u@x", "pw", budget=budget)
+    box.connect()
+    return box
+
+
+def test_mailbox_charges_fetches_and_refuses_what_does_not_fit(tmp_path, served):
+    box = _box(tmp_path, daily_bytes=20_000)
+    uids = box.search_dates(date(2025, 1, 1))
+    sizes = box.sizes(uids)
+    assert sorted(sizes) == sorted(uids) and max(sizes.values()) > 50_000
+    charged = box.budget.used()
+    assert 0 < charged < 1000 * len(uids)                      # sizes are cheap
+
+    big = max(sizes, key=sizes.get)
+    with pytest.raises(OverBudget) as e:
+        box.get(big)
+    assert e.value.uid == big and e.value.size == sizes[big]
+    assert served.bytes_sent < sizes[big]                      # never started the download
+
+    small = min(sizes, key=sizes.get)
+    assert box.get(small) is not None
+    assert box.budget.used() >= charged + sizes[small]
+
+
+def test_quota_error_backs_off_without_reconnecting(tmp_path, served, monkeypatch):
+    box = _box(tmp_path, daily_bytes=100 * MB)
+    uids = box.search_dates(date(2025, 1, 1))
+    commands = served.commands
+    monkeypatch.setattr(served, "uid", lambda *a: ("NO", [b"[OVERQUOTA] Account exceeded bandwidth limits"]))
+    with pytest.raises(QuotaExceeded):
+        box.peek(uids[:3])
+    assert box.budget.backed_off()[1].startswith("[OVERQUOTA]")
+
+    monkeypatch.undo()
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", served.connect)
+    later = _box(tmp_path, daily_bytes=100 * MB)                # the next run
+    with pytest.raises(QuotaExceeded):
+        later.get(uids[0])
+    assert served.commands == commands                         # didn't even ask
+
+
+@pytest.fixture
+def run_env(tmp_path, monkeypatch):
+    corpus, out = tmp_path / "corpus", tmp_path / "out"
+    generate(str(corpus), messages=30, large_pdf_mb=0.1, seed=5)
+    server = FakeIMAPServer(str(corpus))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    monkeypatch.setattr(fe.OllamaManager, "handle_signals", lambda self: None)
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(out))
+    monkeypatch.setattr(pe, "_seen_message_ids", None)
+    monkeypatch.setattr(pe, "SENDER_HISTORY", False)
+    monkeypatch.setattr(pe, "DUPLICATES", False)
+    monkeypatch.setenv("GMAIL_USER", "u@example.com")
+    monkeypatch.setenv("GMAIL_APP_PASSWORD", "x")
+    monkeypatch.setenv("FETCH_SINCE", "2025-01-01")
+    for name in ("FETCH_BEFORE", "FETCH_JOB", "FETCH_QUERY"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(fe, "QUEUE_PATH", "")
+    return corpus, out, server
+
+
+def _ledger(out):
+    return [e for p in glob.glob(str(out / "*" / "*_processed.json"))
+            for e in json.loads(open(p).read())]
+
+
+def test_main_stops_at_the_budget_and_the_next_run_finishes(run_env, monkeypatch):
+    corpus, out, server = run_env
+    total = sum(os.path.getsize(p) for p in glob.glob(str(corpus / "*.eml")))
+    monkeypatch.setattr(bandwidth, "DAILY_BYTES", total // 3)
+
+    with FakeOllama(latency=0) as stub:
+        monkeypatch.setattr(pe, "OLLAMA_URL", stub.url)
+        fe.main()
+        assert 0 < len(_ledger(out)) < 30
+        assert server.bytes_sent <= total // 3
+
+        monkeypatch.setattr(bandwidth, "DAILY_BYTES", 10 * total)
+        monkeypatch.setattr(pe, "_seen_message_ids", None)
+        fe.main()
+    assert len(_ledger(out)) == 30
+    assert len({e["uid"] for e in _ledger(out)}) == 30
+
+
+def test_main_waits_out_a_back_off_without_fetching(run_env, monkeypatch, capsys):
+    corpus, out, server = run_env
+    BandwidthBudget.from_env(str(out), "u@example.com").back_off("[THROTTLED]")
+    with FakeOllama(latency=0) as stub:
+        monkeypatch.setattr(pe, "OLLAMA_URL", stub.url)
+        fe.main()
+    assert _ledger(out) == [] and server.bytes_sent == 0
+    printed = capsys.readouterr().out
+    assert "[THROTTLED]; backing off until" in printed and "Stopped; 30 emails left" in printed
@@ -0,0 +1,95 @@
+import json
+from argparse import Namespace
+from datetime import date
+
+import pytest
+
+import mailbox_wrapper
+import process_email as pe
+from bench import bench_fetch
+from bench.corpus import generate
+from bench.fake_imap import FakeIMAPServer
+from bench.fake_ollama import FakeOllama, verdict_for
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    d = tmp_path_factory.mktemp("corpus")
+    generate(str(d), messages=40, large_pdf_mb=0.2, seed=3)
+    return d
+
+
+def test_corpus_is_deterministic(tmp_path, corpus):
+    generate(str(tmp_path), messages=40, large_pdf_mb=0.2, seed=3)
+    assert (tmp_path / "1001.eml").read_bytes() == (corpus / "1001.eml").read_bytes()
+    assert json.loads((tmp_path / "manifest.json").read_text()) == json.loads(
+        (corpus / "manifest.json").read_text())
+
+
+def test_fake_imap_serves_mailbox(monkeypatch, corpus):
+    server = FakeIMAPServer(str(corpus))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    mb = mailbox_wrapper.Mailbox("u", "p")
+
+    uids = mb.search_dates(date(2025, 1, 1))
+    assert len(uids) == 40
+    assert mb.message_id_of(uids[0]) == "<bench-1@corpus.example>"
+    em = mb.get(uids[0])
+    assert em is not None and em.subject
+    labels = json.loads((corpus / "manifest.json").read_text())[uids[0]]
+    assert em.labels == labels
+
+
+def test_corpus_decodes_visual_hebrew(corpus):
+    subjects = []
+    for p in corpus.glob("*.eml"):
+        raw = p.read_bytes()
+        if b"iso-8859-8-" in raw:
+            subjects.append(mailbox_wrapper._build_email("1", raw, "").subject)
+    assert subjects, "corpus should contain -i/-e charset messages"
+    assert all(any("֐" <= c <= "׿" for c in s) for s in subjects)
+
+
+def test_fake_ollama_drives_classify(monkeypatch):
+    with FakeOllama() as stub:
+        monkeypatch.setattr(pe, "OLLAMA_URL", stub.url)
+        em = pe.Email(
+            uid="1", message_id="<m>", date="", from_="a@b", subject="Invoice #3",
+            body="", attachments=[], labels=[], headers={}, text="hi",
+        )
+        assert pe.classify(em, [])["is_receipt"] is True
+        assert stub.generate_calls == 1
+
+
+def test_verdict_for_uses_subject_only():
+    assert verdict_for("From: receipts@x\nSubject: Weekly news\n")["is_receipt"] is False
+    assert verdict_for("Subject: קבלה על תשלום 4\n")["is_receipt"] is True
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert bench_fetch._percentile(values, 50) == 50.0
+    assert bench_fetch._percentile(values, 95) == 95.0
+    assert bench_fetch._percentile([], 95) == 0.0
+
+
+def test_run_target_main(corpus):
+    args = Namespace(llm_latency=0.0, rtt=0.0)
+    result = bench_fetch.run_target("main", str(corpus), args)
+    assert result["messages"] == 40
+    assert result["stages"]["classify"]["count"] == 40
+    # only the receipts are downloaded in full
+    assert 0 < result["stages"]["fetch"]["count"] < 40
+    assert result["imap_bytes"] > 0
+    assert result["peak_rss_mb"] > 0
+
+
+def test_compare_flags_regressions():
+    base = {"targets": {"parse": {
+        "messages_per_sec": 100.0, "peak_rss_mb": 50.0,
+        "stages": {"parse": {"p95_ms": 2.0}}}}}
+    cur = {"targets": {"parse": {
+        "messages_per_sec": 70.0, "peak_rss_mb": 50.0,
+        "stages": {"parse": {"p95_ms": 2.1}}}}}
+    regressions = bench_fetch.compare(cur, base, tolerance=0.15)
+    assert regressions == ["parse: messages/sec 100.0 -> 70.0"]
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+import calibrate_cascade as cc
+import process_email as pe
+
+
+def _entry(is_receipt, fast_p, fast_s=1.0, full_s=4.0):
+    return {"uid": "1", "is_receipt": is_receipt,
+            "cascade": {"fast_p": fast_p, "fast_s": fast_s, "full_s": full_s}}
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))
+    month = tmp_path / "2025-03"
+    month.mkdir()
+    entries = [
+        _entry(True, 0.95),      # fast right
+        _entry(False, 0.05),     # fast right
+        _entry(True, 0.45),      # fast wrong, in any band from t=0.4 down
+        _entry(False, 0.7),      # fast wrong, in bands from t=0.3 down
+        {"uid": "9", "is_receipt": True},                          # no trace
+        {"uid": "8", "is_receipt": False, "cascade": {"fast_p": 0.1, "fast_s": 1.0}},
+    ]
+    (month / "2025-03_processed.json").write_text(json.dumps(entries))
+    return tmp_path
+
+
+def test_load_traces_keeps_calibration_entries_only(ledger):
+    assert len(cc.load_traces()) == 4
+
+
+def test_replay_endpoints_and_middle(ledger):
+    entries = cc.load_traces()
+    fast_only = cc.replay(entries, 0.5)
+    assert fast_only["accuracy"] == 0.5 and fast_only["escalated"] == 0.0
+    assert fast_only["llm_s_saved"] == 12.0     # 4 x 4s full, 4 x 1s fast
+
+    full_only = cc.replay(entries, 0.0)
+    assert full_only["accuracy"] == 1.0 and full_only["escalated"] == 1.0
+    assert full_only["llm_s_saved"] == -4.0     # the fast pass is pure overhead
+
+    middle = cc.replay(entries, 0.3)            # band [0.3, 0.7]
+    assert middle["accuracy"] == 1.0 and middle["escalated"] == 0.5
+    assert middle["recall"] == 1.0
+    assert middle["llm_s_saved"] == 4.0
@@ -0,0 +1,64 @@
+import json
+import threading
+
+import changes
+import process_email as pe
+from models import Email
+
+
+def _events(root):
+    with open(changes.journal_path(str(root)), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_publish_appends_one_line_per_change(tmp_path):
+    changes.publish(str(tmp_path), "ledger", "2025-03")
+    changes.publish(str(tmp_path), "receipt", "2025-03", base_name="2025-03-03T10-00-00_1")
+    events = _events(tmp_path)
+    assert [(e["event"], e["month"]) for e in events] == [("ledger", "2025-03"), ("receipt", "2025-03")]
+    assert events[1]["base_name"] == "2025-03-03T10-00-00_1"
+
+
+def test_concurrent_writers_never_interleave(tmp_path):
+    def write(n):
+        for i in range(200):
+            changes.publish(str(tmp_path), "receipt", "2025-03", base_name=f"{n}_{i}_" + "x" * 500)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(_events(tmp_path)) == 800
+
+
+def test_rotates_past_max_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(changes, "MAX_BYTES", 200)
+    for i in range(5):
+        changes.publish(str(tmp_path), "ledger", f"2025-0{i + 1}")
+    path = changes.journal_path(str(tmp_path))
+    with open(path + ".1", encoding="utf-8") as f:
+        rotated = [json.loads(line) for line in f]
+    assert [e["month"] for e in rotated + _events(tmp_path)][-2:] == ["2025-04", "2025-05"]
+    assert len(rotated) + len(_events(tmp_path)) <= 5
+
+
+def test_unwritable_journal_does_not_raise(tmp_path, capsys):
+    changes.publish(str(tmp_path / "missing"), "ledger", "2025-03")
+    assert "could not record ledger 2025-03" in capsys.readouterr().out
+
+
+def test_process_email_publishes_ledger_then_receipt(tmp_path, monkeypatch):
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(pe, "_seen_message_ids", set())
+    monkeypatch.setattr(pe, "SENDER_HISTORY", False)
+    verdicts = iter([{"is_receipt": True, "confidence": 0.9, "reason": "order"},
+                     {"is_receipt": False, "confidence": 0.9, "reason": "news"}])
+    monkeypatch.setattr(pe, "classify_cascade", lambda email, names: (next(verdicts), None))
+
+    for uid in ("1", "2"):
+        pe.process_email(Email(uid=uid, message_id=f"<{uid}@x>", subject="s", from_="a@b.com",
+                               date="Mon, 03 Mar 2025 10:00:00 +0000", body="b",
+                               attachments=[], labels=[], headers={}))
+    assert [(e["event"], e.get("base_name")) for e in _events(tmp_path)] == [
+        ("ledger", None), ("receipt", "2025-03-03T10-00-00_1"), ("ledger", None)]
@@ -0,0 +1,73 @@
+from datetime import date
+
+import pytest
+
+from checkpoint import RunCheckpoint, default_job_name
+
+PARAMS = {"since": "2025-01-01", "before": "2025-02-01"}
+
+
+def test_default_job_name():
+    assert default_job_name(date(2025, 1, 1), date(2025, 2, 1)) == "2025-01-01_2025-02-01"
+    assert default_job_name(date(2025, 1, 1), None) == "2025-01-01_open"
+
+
+def test_default_job_name_hashes_query():
+    a = default_job_name(date(2025, 1, 1), None, "has:attachment")
+    b = default_job_name(date(2025, 1, 1), None, "category:purchases")
+    assert a.startswith("2025-01-01_open_q") and len(a) == len("2025-01-01_open_q") + 8
+    assert a != b
+
+
+def test_new_job_has_no_snapshot(tmp_path):
+    cp = RunCheckpoint(str(tmp_path), "job", PARAMS)
+    assert cp.uids is None
+
+
+def test_progress_survives_restart(tmp_path):
+    cp = RunCheckpoint(str(tmp_path), "job", PARAMS)
+    cp.set_uids(["1", "2", "3", "4"])
+    cp.start("1")
+    cp.finish("1")
+    cp.start("2")                       # crash while uid 2 is in flight
+
+    again = RunCheckpoint(str(tmp_path), "job", PARAMS)
+    assert again.uids == ["1", "2", "3", "4"]
+    assert again.done == {"1"}
+    assert again.pending() == ["2", "3", "4"]
+
+
+def test_interrupted_uid_goes_first(tmp_path):
+    cp = RunCheckpoint(str(tmp_path), "job", PARAMS)
+    cp.set_uids(["1", "2", "3"])
+    cp.start("3")
+
+    assert RunCheckpoint(str(tmp_path), "job", PARAMS).pending() == ["3", "1", "2"]
+
+
+def test_completed_job_starts_fresh(tmp_path):
+    cp = RunCheckpoint(str(tmp_path), "job", PARAMS)
+    cp.set_uids(["1"])
+    cp.start("1")
+    cp.finish("1")
+
+    again = RunCheckpoint(str(tmp_path), "job", PARAMS)
+    assert again.uids is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_param_mismatch_raises(tmp_path):
+    RunCheckpoint(str(tmp_path), "job", PARAMS).set_uids(["1"])
+    with pytest.raises(ValueError):
+        RunCheckpoint(str(tmp_path), "job", {"since": "2024-01-01", "before": None})
+
+
+def test_jobs_are_independent(tmp_path):
+    a = RunCheckpoint(str(tmp_path), "a", PARAMS)
+    b = RunCheckpoint(str(tmp_path), "b", {"since": "2025-02-01", "before": None})
+    a.set_uids(["1", "2"])
+    b.set_uids(["7"])
+    a.finish("1")
+
+    assert RunCheckpoint(str(tmp_path), "a", PARAMS).pending() == ["2"]
+    assert RunCheckpoint(str(tmp_path), "b", b.params).pending() == ["7"]
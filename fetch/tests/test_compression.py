@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import archive_rewrite as ar
+import compression
+from models import Email, read_receipt
+
+BODY = "<html><body><p>Thanks for your order</p>" + "<div>promo</div>" * 2000 + "</body></html>"
+
+
+@pytest.fixture(params=[".gz", ".zst"])
+def compressed(request, monkeypatch):
+    """RECEIPT_COMPRESSION=1, with each codec."""
+    if request.param == ".zst" and compression.zstandard is None:
+        pytest.skip("zstandard not installed")
+    monkeypatch.setattr(compression, "ENABLED", True)
+    monkeypatch.setattr(compression, "EXT", request.param)
+    return request.param
+
+
+def _email():
+    return Email(uid="7", message_id="<m7@x>", date="Mon, 03 Mar 2025 10:00:00 +0000",
+                 from_="shop@x.com", subject="Order", body=BODY, attachments=[], labels=[],
+                 headers={})
+
+
+def test_body_goes_to_a_compressed_file_and_reads_back(tmp_path, compressed):
+    path = tmp_path / "r.json"
+    _email().write(str(path))
+
+    data = json.loads(path.read_text())
+    assert "body" not in data and data["body_file"] == f"r.body.html{compressed}"
+    assert list(data)[:6] == ["uid", "message_id", "date", "from", "subject", "body_file"]
+    assert (tmp_path / f"r.body.html{compressed}").stat().st_size < len(BODY) / 20
+    assert (tmp_path / f"r.html{compressed}").exists() and not (tmp_path / "r.html").exists()
+    assert path.stat().st_size < 1000
+
+    assert Email.read(str(path)).body == BODY
+    assert list(read_receipt(str(path)))[:6] == ["uid", "message_id", "date", "from", "subject", "body"]
+
+
+def test_uncompressed_receipts_still_read(tmp_path):
+    path = tmp_path / "r.json"
+    _email().write(str(path))
+    assert json.loads(path.read_text())["body"] == BODY
+    assert read_receipt(str(path))["body"] == BODY
+
+
+def test_rewriting_in_the_other_format_cleans_up(tmp_path, compressed, monkeypatch):
+    path = tmp_path / "r.json"
+    _email().write(str(path))
+    monkeypatch.setattr(compression, "ENABLED", False)
+    _email().write(str(path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["r.html", "r.json", "r.txt"]
+    assert json.loads(path.read_text())["body"] == BODY
+
+
+def test_archive_rewrites_see_the_body_and_keep_the_format(tmp_path, compressed, monkeypatch):
+    month = tmp_path / "2025-03"
+    month.mkdir()
+    monkeypatch.setattr(ar, "OUTPUT_DIR", str(tmp_path))
+    _email().write(str(month / "r.json"))
+
+    class Shorten(ar.Rewrite):
+        name = "shorten"
+
+        def apply(self, data, ctx):
+            return {**data, "body": data["body"][:40]}
+
+    assert ar.run(Shorten())["fields"] == {"body": 1}
+    assert "body" not in json.loads((month / "r.json").read_text())
+    assert read_receipt(str(month / "r.json"))["body"] == BODY[:40]
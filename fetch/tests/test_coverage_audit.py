@@ -0,0 +1,88 @@
+import json
+from datetime import date
+
+import pytest
+
+import coverage_audit.coverage_audit as ca
+import process_email as pe
+from models import Email
+
+
+class FakeMailbox:
+    """uids 1..10; the query keeps 1..4. Subjects mark the receipts."""
+
+    subjects = {str(u): "newsletter" for u in range(1, 11)}
+    subjects.update({"2": "invoice", "6": "invoice", "7": "invoice"})
+
+    def __init__(self):
+        self.peeked = []
+
+    def search_dates(self, since, before):
+        return [str(u) for u in range(1, 11)]
+
+    def search_raw(self, query, since, before):
+        return ["1", "2", "3", "4"]
+
+    def peek(self, uids, preview_bytes):
+        self.peeked.extend(uids)
+        return {
+            uid: Email(uid=uid, message_id=f"<{uid}>", date="d", from_="f",
+                       subject=self.subjects[uid], body="", attachments=[],
+                       labels=[], headers={}, partial=True)
+            for uid in uids
+        }
+
+
+@pytest.fixture
+def out(tmp_path, monkeypatch):
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))
+    month = tmp_path / "2025-03"
+    month.mkdir()
+    # uid 6 is a receipt on record; uid 8 a recorded non-receipt.
+    (month / "2025-03_processed.json").write_text(json.dumps([
+        {"uid": "2", "message_id": "<2>", "is_receipt": True},
+        {"uid": "6", "message_id": "<6>", "is_receipt": True},
+        {"uid": "8", "message_id": "<8>", "is_receipt": False},
+    ]))
+    return tmp_path
+
+
+def test_audit_counts_ledger_and_sampled_misses(out):
+    classified = []
+
+    def classify_preview(em):
+        classified.append(em.uid)
+        return {"is_receipt": em.subject == "invoice"}
+
+    mb = FakeMailbox()
+    r = ca.audit(mb, "has:attachment", date(2025, 1, 1), None, 100, 0, classify_preview)
+
+    assert (r["total"], r["candidates"], r["excluded"]) == (10, 4, 6)
+    assert (r["ledger_receipts"], r["ledger_receipts_excluded"]) == (2, 1)
+    assert r["ledger_recall"] == 0.5
+    # the whole excluded set fits in the sample: the estimate is exact
+    assert sorted(mb.peeked) == ["10", "5", "6", "7", "8", "9"]
+    assert sorted(rec["uid"] for rec in r["sampled_receipts"]) == ["6", "7"]
+    assert r["est_missed_receipts"] == 2.0
+    assert "6" not in classified and "8" not in classified   # ledger verdicts reused
+    assert r["sampled_classified"] == 4
+
+
+def test_audit_sample_is_seeded_and_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))     # no ledgers
+    verdict = lambda em: {"is_receipt": False}
+    first, second = FakeMailbox(), FakeMailbox()
+    r = ca.audit(first, "q", date(2025, 1, 1), None, 3, 7, verdict)
+    ca.audit(second, "q", date(2025, 1, 1), None, 3, 7, verdict)
+
+    assert r["sampled"] == 3
+    assert first.peeked == second.peeked and len(first.peeked) == 3
+    assert r["ledger_recall"] is None
+    assert r["est_missed_receipts"] == 0.0
+    assert r["est_missed_receipts_95"] > 0          # none seen is not none missed
+
+
+def test_wilson_upper():
+    assert ca.wilson_upper(0, 0) == 1.0
+    assert 0.0 < ca.wilson_upper(0, 100) < 0.05
+    assert ca.wilson_upper(50, 100) > 0.5
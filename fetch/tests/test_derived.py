@@ -0,0 +1,99 @@
+import json
+from email.message import EmailMessage
+
+import archive_rewrite as ar
+import backfill_derived
+from derived import html_to_text, sanitize_html, sender_domain
+from mailbox_wrapper import email_from_raw
+from models import Attachment, Email
+from raw_cache import RawCache
+
+BODY = """<html><head><title>t</title><style>p {color: red}</style>
+<script>alert(1)</script></head>
+<body onload="steal()"><p>Thanks for your order&nbsp;#12</p>
+<table><tr><td>Total</td><td>&#8362;120</td></tr></table>
+<img src="cid:logo@shop"><a href="javascript:go()">x</a><iframe src="https://e.x"></iframe>
+</body></html>"""
+
+
+def _email(**over):
+    base = dict(uid="7", message_id="<m7@x>", date="Mon, 03 Mar 2025 10:00:00 +0000",
+                from_="Shop <Orders@Shop.Example>", subject="Order", body=BODY,
+                attachments=[], labels=[], headers={})
+    base.update(over)
+    return Email(**base)
+
+
+def test_text_keeps_blocks_and_drops_head_and_scripts():
+    assert html_to_text(BODY) == "Thanks for your order #12\nTotal ₪120\nx"
+
+
+def test_sanitize_removes_active_content_and_resolves_cids():
+    html = sanitize_html(BODY, {"logo@shop": "r/logo.png"})
+    assert "script" not in html and "alert" not in html and "iframe" not in html
+    assert "onload" not in html and "javascript:" not in html
+    assert '<img src="r/logo.png">' in html
+    assert "p {color: red}" in html and "&#8362;120" in html
+    assert 'src="cid:other"' in sanitize_html('<img src="cid:other">')
+
+
+def test_sender_domain():
+    assert sender_domain("Shop <Orders@Shop.Example>") == "shop.example"
+    assert sender_domain("undisclosed") == ""
+
+
+def test_write_stores_renditions_and_inline_images(tmp_path):
+    em = _email(attachments=[Attachment("logo.png", b"pdf-ish")],
+                inline=[Attachment("logo.png", b"PNG", content_id="logo@shop")])
+    path = tmp_path / "2025-03-03T10-00-00_7.json"
+    em.write(str(path))
+
+    data = json.loads(path.read_text())
+    assert data["snippet"] == "Thanks for your order #12 Total ₪120 x"
+    assert data["sender_domain"] == "shop.example"
+    assert data["inline"] == ["inline-logo.png"]
+    assert data["cids"] == {"logo@shop": "inline-logo.png"}
+    assert (tmp_path / "2025-03-03T10-00-00_7" / "inline-logo.png").read_bytes() == b"PNG"
+    assert (tmp_path / "2025-03-03T10-00-00_7.txt").read_text().startswith("Thanks")
+    assert '<img src="2025-03-03T10-00-00_7/inline-logo.png">' in (
+        tmp_path / "2025-03-03T10-00-00_7.html").read_text()
+
+    back = Email.read(str(path))
+    assert [(a.filename, a.content_id) for a in back.inline] == [("inline-logo.png", "logo@shop")]
+
+
+def _raw_with_inline_image():
+    msg = EmailMessage()
+    msg["Subject"], msg["From"], msg["Message-ID"] = "Order", "shop@x.com", "<m7@x>"
+    msg["Date"] = "Mon, 03 Mar 2025 10:00:00 +0000"
+    msg.set_content("plain")
+    msg.add_alternative(BODY, subtype="html")
+    msg.get_payload()[1].add_related(b"PNG", maintype="image", subtype="png", cid="<logo@shop>")
+    return msg.as_bytes()
+
+
+def test_parsed_email_keeps_embedded_images():
+    em = email_from_raw("7", _raw_with_inline_image())
+    assert em.attachments == []
+    assert [(a.filename, a.content_id, a.content) for a in em.inline] == [("logo", "logo@shop", b"PNG")]
+
+
+def test_backfill_recovers_inline_images_from_the_raw_cache(tmp_path, monkeypatch):
+    out = tmp_path / "out"
+    (out / "2025-03").mkdir(parents=True)
+    monkeypatch.setattr(ar, "OUTPUT_DIR", str(out))
+    monkeypatch.setenv("RAW_CACHE_DIR", str(tmp_path / "raw"))
+    RawCache(str(tmp_path / "raw")).put("<m7@x>", _raw_with_inline_image())
+    old = {"uid": "7", "message_id": "<m7@x>", "from": "shop@x.com", "body": BODY,
+           "attachments": [], "labels": []}
+    receipt = out / "2025-03" / "2025-03-03T10-00-00_7.json"
+    receipt.write_text(json.dumps(old))
+
+    report = ar.run(backfill_derived.BackfillDerived(), dry_run=True)
+    assert report["fields"] == {"cids": 1, "derived": 1, "inline": 1, "sender_domain": 1, "snippet": 1}
+    assert not (out / "2025-03" / "2025-03-03T10-00-00_7.txt").exists()
+
+    assert ar.run(backfill_derived.BackfillDerived())["changed"] == 1
+    assert (out / "2025-03" / "2025-03-03T10-00-00_7" / "logo").read_bytes() == b"PNG"
+    assert 'src="2025-03-03T10-00-00_7/logo"' in (out / "2025-03" / "2025-03-03T10-00-00_7.html").read_text()
+    assert ar.run(backfill_derived.BackfillDerived())["changed"] == 0
@@ -1,58 +1,188 @@
+import pytest
+
 import fetch_emails as fe
 from models import Email
 
 
-class FakeProc:
-    def terminate(self):
+class FakeOllama:
+    stopping = False
+
+    def call(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def handle_signals(self):
         pass
 
-    def wait(self):
+    def shutdown(self):
         pass
 
 
+MESSAGE_IDS = {"1": "<seen>", "2": "<new>", "3": "<new3>"}
+
+
 class FakeMailbox:
     """Two messages: uid 1 already seen, uid 2 new."""
 
+    budget = None
+
     def __init__(self, *a, **k):
         self.logged_out = False
+        self.searches = 0
+        self.fetched = []
 
     def search_dates(self, since, before):
+        self.searches += 1
         return ["1", "2"]
 
-    def message_id_of(self, uid):
-        return {"1": "<seen>", "2": "<new>"}[uid]
+    def search_raw(self, query, since, before):
+        self.searches += 1
+        self.query = query
+        return ["2"]
+
+    def envelopes(self, uids):
+        return {uid: {"from": "f", "subject": "s", "labels": [], "size": 100,
+                      "attachments": False} for uid in uids}
+
+    def categories(self, uids, names):
+        return {}
+
+    def peek(self, uids, preview_bytes):
+        self.fetched.extend(uids)
+        return {uid: self._email(uid, partial=True) for uid in uids}
 
     def get(self, uid):
+        return self._email(uid)
+
+    @staticmethod
+    def _email(uid, partial=False):
         return Email(
-            uid=uid, message_id=self.message_id_of(uid), date="d",
-            from_="f", subject="s", body="b",
-            attachments=[], labels=[], headers={}, text="t",
+            uid=uid, message_id=MESSAGE_IDS[uid], date="d",
+            from_="f", subject="s", body="" if partial else "b",
+            attachments=[], labels=[], headers={}, text="t", partial=partial,
         )
 
     def logout(self):
         self.logged_out = True
 
 
-def test_main_skips_seen_and_processes_new(monkeypatch):
+@pytest.fixture
+def env(tmp_path, monkeypatch):
     monkeypatch.setenv("GMAIL_USER", "u")
     monkeypatch.setenv("GMAIL_APP_PASSWORD", "p")
     monkeypatch.delenv("FETCH_SINCE", raising=False)
     monkeypatch.delenv("FETCH_BEFORE", raising=False)
-    monkeypatch.setattr("sys.argv", ["fetch_emails.py"])  # skip = 0
+    monkeypatch.delenv("FETCH_JOB", raising=False)
+    monkeypatch.delenv("FETCH_QUERY", raising=False)
+    monkeypatch.setattr(fe.pe, "OUTPUT_DIR", str(tmp_path))
+    return tmp_path
 
+
+def test_main_skips_seen_and_processes_new(env, monkeypatch):
     fake_mb = FakeMailbox()
     monkeypatch.setattr(fe, "Mailbox", lambda *a, **k: fake_mb)
     monkeypatch.setattr(fe, "_get_seen_message_ids", lambda: {"<seen>"})
-    monkeypatch.setattr(fe.subprocess, "Popen", lambda *a, **k: FakeProc())
-    monkeypatch.setattr(fe.requests, "get", lambda *a, **k: None)
-    monkeypatch.setattr(fe.requests, "post", lambda *a, **k: None)
+    monkeypatch.setattr(fe, "start_ollama", lambda: FakeOllama())
 
     processed = []
     monkeypatch.setattr(
-        fe, "process_email", lambda em, index, total: processed.append(em.uid)
+        fe, "process_email", lambda em, index, total, fetch_full: processed.append(em.uid)
     )
 
     fe.main()
 
     assert processed == ["2"]        # uid 1 was already seen and skipped
     assert fake_mb.logged_out
+
+
+def test_main_classifies_previews_and_fetches_receipts_in_full(env, monkeypatch):
+    fake_mb = FakeMailbox()
+    calls = []
+
+    def process(em, index, total, fetch_full):
+        calls.append((em.uid, em.partial, fetch_full(em.uid).body))
+
+    _install(monkeypatch, fake_mb, [])
+    monkeypatch.setattr(fe, "process_email", process)
+    fe.main()
+
+    assert calls == [("2", True, "b")]  # preview in, full message on demand
+
+
+def _install(monkeypatch, fake_mb, processed):
+    monkeypatch.setattr(fe, "Mailbox", lambda *a, **k: fake_mb)
+    monkeypatch.setattr(fe, "_get_seen_message_ids", lambda: {"<seen>"})
+    monkeypatch.setattr(fe, "start_ollama", lambda: FakeOllama())
+    monkeypatch.setattr(
+        fe, "process_email", lambda em, index, total, fetch_full: processed.append(em.uid)
+    )
+
+
+def test_main_resumes_from_checkpoint(env, monkeypatch):
+    # A crashed run: snapshot [1, 2, 3], uid 1 done, uid 2 started not finished.
+    runs = env / ".runs"
+    runs.mkdir()
+    (runs / "2025-01-24_open.json").write_text(
+        '{"params": {"since": "2025-01-24", "before": null}, "uids": ["1", "2", "3"]}')
+    (runs / "2025-01-24_open.progress").write_text("start 1\ndone 1\nstart 2\n")
+
+    fake_mb = FakeMailbox()
+    processed = []
+    _install(monkeypatch, fake_mb, processed)
+    fe.main()
+
+    assert fake_mb.searches == 0          # the snapshot replaces the search
+    assert fake_mb.fetched == ["2", "3"]  # uid 1 is never looked at again
+    assert processed == ["2", "3"]
+
+
+def test_main_finished_job_searches_again(env, monkeypatch):
+    fake_mb = FakeMailbox()
+    _install(monkeypatch, fake_mb, [])
+    fe.main()
+    fe.main()
+    assert fake_mb.searches == 2
+
+
+def test_main_rejects_checkpoint_with_other_params(env, monkeypatch):
+    monkeypatch.setenv("FETCH_JOB", "shard")
+    runs = env / ".runs"
+    runs.mkdir()
+    (runs / "shard.json").write_text(
+        '{"params": {"since": "2024-01-01", "before": null}, "uids": ["1"]}')
+    _install(monkeypatch, FakeMailbox(), [])
+    with pytest.raises(SystemExit):
+        fe.main()
+
+
+def test_main_stops_between_emails_on_signal(env, monkeypatch):
+    fake_mb = FakeMailbox()
+    fake_mb.search_dates = lambda since, before: ["2", "3"]
+    ollama = FakeOllama()
+    processed = []
+    _install(monkeypatch, fake_mb, processed)
+    monkeypatch.setattr(fe, "start_ollama", lambda: ollama)
+
+    def process_then_signal(em, index, total, fetch_full):
+        processed.append(em.uid)
+        ollama.stopping = True           # SIGTERM arrives mid-email
+
+    monkeypatch.setattr(fe, "process_email", process_then_signal)
+    fe.main()
+
+    assert processed == ["2"]            # the email in hand finished, no more
+    progress = (env / ".runs" / "2025-01-24_open.progress").read_text()
+    assert "done 2" in progress and "3" not in progress
+
+
+def test_main_narrows_search_with_candidate_query(env, monkeypatch):
+    monkeypatch.setenv("FETCH_QUERY", "has:attachment")
+    fake_mb = FakeMailbox()
+    processed = []
+    _install(monkeypatch, fake_mb, processed)
+    fe.main()
+
+    assert fake_mb.query == "has:attachment"
+    assert fake_mb.fetched == ["2"]
+    # a query makes its own job, recorded with the query
+    [snapshot] = (env / ".runs").glob("2025-01-24_open_q*.json")
+    assert '"query": "has:attachment"' in snapshot.read_text()
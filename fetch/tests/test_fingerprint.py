@@ -0,0 +1,107 @@
+import hashlib
+import json
+from datetime import datetime
+
+import pytest
+
+import process_email as pe
+from fingerprint import DuplicateIndex, attachment_hashes, fingerprint, normalize_subject
+from models import Attachment, Email, read_receipt
+
+BODY = ("Thank you for shopping with Example Store. We have received your order "
+        "and it is being prepared for shipping to the address on your account. "
+        "Order number 88412, total charged 149.90 to the card ending 4242. "
+        "Questions about this order? Reply to this email and we will help.")
+
+
+def _email(uid, subject="Your order 88412", text=BODY, from_="Store <orders@store.example>",
+           date="Mon, 03 Mar 2025 10:00:00 +0000", attachments=(), partial=True):
+    return Email(uid=uid, message_id=f"<{uid}@x>", date=date, from_=from_, subject=subject,
+                 body=f"<p>{text}</p>", attachments=[Attachment(n, c) for n, c in attachments],
+                 labels=[], headers={}, text=text, partial=partial)
+
+
+def _entry(email, timestamp="2025-03-03T10-00-00", is_receipt=True, **fp):
+    return {"uid": email.uid, "message_id": email.message_id, "timestamp": timestamp,
+            "is_receipt": is_receipt, "fingerprint": {**fingerprint(email), **fp}}
+
+
+def _forwarded(uid, text=BODY, **kw):
+    header = ("---------- Forwarded message ---------\nFrom: Store <orders@store.example>\n"
+              "Date: Mon, 3 Mar 2025 at 10:00\nSubject: Your order 88412\nTo: me@example.com\n\n")
+    return _email(uid, subject="Fwd: Your order 88412", from_="Me <me@example.com>",
+                  text=header + text, date="Tue, 04 Mar 2025 09:00:00 +0000", **kw)
+
+
+def test_normalize_subject():
+    assert normalize_subject("FW: Re:  [EXT] Your  Order 1") == "your order 1"
+
+
+def test_forwarded_copy_is_a_duplicate_but_next_months_bill_is_not():
+    index = DuplicateIndex()
+    original = _email("1")
+    index.add_entry(_entry(original))
+    when = datetime(2025, 3, 4, 9)
+
+    match = index.find(fingerprint(_forwarded("2")), when)
+    assert match["message_id"] == "<1@x>" and match["distance"] <= 3
+    assert match["original"] == "2025-03/2025-03-03T10-00-00_1"
+    verdict = index.verdict(match)
+    assert verdict["is_receipt"] is True and verdict["source"] == "duplicate"
+
+    april = _email("3", text=BODY.replace("149.90", "162.30").replace("88412", "90117"),
+                   subject="Your order 90117")
+    assert index.find(fingerprint(april), when) is None
+    assert index.find(fingerprint(_forwarded("4")), datetime(2025, 4, 20)) is None   # out of window
+    assert index.find(fingerprint(_email("5", text="Thanks! 149.90")), when) is None  # too short
+
+
+def test_attachments_must_match():
+    index = DuplicateIndex()
+    index.add_entry(_entry(_email("1", attachments=[("a.pdf", b"A")], partial=False),
+                           hashes=["aa"]))
+    when = datetime(2025, 3, 3, 11)
+    assert index.find(fingerprint(_email("2")), when) is None                       # no PDF
+    same = fingerprint(_email("3", attachments=[("a.pdf", b"")]))
+    assert index.find(same, when)                                                    # preview: by name
+    assert index.find({**same, "hashes": ["bb"]}, when) is None                     # other bytes
+
+
+def test_spooled_attachment_is_hashed_from_its_file(tmp_path, monkeypatch):
+    spooled = tmp_path / "statement.pdf"
+    spooled.write_bytes(b"%PDF" * 1000)
+    email = _email("1", partial=False)
+    email.attachments = [Attachment("statement.pdf", path=str(spooled))]
+    monkeypatch.setattr(Attachment, "content", property(lambda self: pytest.fail("read whole")))
+    monkeypatch.setattr("fingerprint.HASH_CHUNK_BYTES", 1000)
+    assert attachment_hashes(email) == [hashlib.sha256(b"%PDF" * 1000).hexdigest()]
+
+
+@pytest.fixture
+def out(tmp_path, monkeypatch):
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(pe, "_seen_message_ids", set())
+    monkeypatch.setattr(pe, "_sender_history", None)
+    monkeypatch.setattr(pe, "_duplicate_index", None)
+    return tmp_path
+
+
+def test_process_email_links_a_duplicate_receipt(out, monkeypatch):
+    calls, fetched = [], []
+    verdict = {"is_receipt": True, "confidence": 0.9, "reason": "order"}
+    monkeypatch.setattr(pe, "classify_cascade", lambda email, names: calls.append(1) or (verdict, None))
+
+    pe.process_email(_email("1", partial=False))
+    pe.process_email(_forwarded("2"), fetch_full=lambda uid: fetched.append(uid))
+
+    assert len(calls) == 1 and fetched == []
+    month = out / "2025-03"
+    ledger = json.loads((month / "2025-03_processed.json").read_text())
+    assert [e.get("duplicate_of") for e in ledger] == [None, "<1@x>"]
+    assert ledger[1]["source"] == "duplicate" and ledger[1]["fingerprint"]["simhash"]
+
+    copy = read_receipt(str(month / "2025-03-04T09-00-00_2.json"))
+    assert copy["duplicate_of"] == "2025-03/2025-03-03T10-00-00_1"
+    assert copy["body"] == "" and copy["attachments"] == []
+    assert not (month / "2025-03-04T09-00-00_2").exists()
+    assert read_receipt(str(month / "2025-03-03T10-00-00_1.json"))["body"] == f"<p>{BODY}</p>"
@@ -0,0 +1,102 @@
+import pytest
+
+from imap_response import body_parts, parse_fetch
+
+# A receipt as Gmail describes it: multipart/mixed of an alternative text+html
+# body and a PDF whose name is RFC 2231-encoded.
+RECEIPT_STRUCTURE = (
+    b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 120 4 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 800 10 NIL NIL NIL)'
+    b' "ALTERNATIVE" ("BOUNDARY" "x") NIL NIL)'
+    b'("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 4000 NIL'
+    b' ("ATTACHMENT" ("FILENAME*" "utf-8\'\'%D7%97%D7%A9.pdf")) NIL)'
+    b' "MIXED" ("BOUNDARY" "y") NIL NIL)'
+)
+
+
+def test_parse_fetch_splits_messages_and_literals():
+    data = [
+        (b'1 (UID 1001 X-GM-LABELS ("\\\\Inbox" Receipts) RFC822.SIZE 5000 BODY[HEADER] {15}',
+         b"Subject: hi\r\n\r\n"),
+        b")",
+        (b"2 (UID 1002 BODY[1]<0> {5}", b"hello"),
+        b" RFC822.SIZE 7)",
+    ]
+    first, second = parse_fetch(data)
+    assert first == {
+        "UID": "1001",
+        "X-GM-LABELS": ["\\Inbox", "Receipts"],
+        "RFC822.SIZE": "5000",
+        "BODY[HEADER]": b"Subject: hi\r\n\r\n",
+    }
+    assert second == {"UID": "1002", "BODY[1]<0>": b"hello", "RFC822.SIZE": "7"}
+
+
+def test_parse_fetch_keeps_parentheses_inside_literals_and_quotes():
+    data = [(b'1 (UID 1 X-GM-LABELS ("a (b)") BODY[1]<0> {3}', b"(((")]
+    data.append(b")")
+    [msg] = parse_fetch(data)
+    assert msg["X-GM-LABELS"] == ["a (b)"]
+    assert msg["BODY[1]<0>"] == b"((("
+
+
+def test_parse_fetch_rejects_unbalanced_response():
+    with pytest.raises(ValueError):
+        parse_fetch([b"1 (UID 1"])
+
+
+def test_body_parts_numbers_nested_sections():
+    [msg] = parse_fetch([b"1 (BODYSTRUCTURE " + RECEIPT_STRUCTURE + b")"])
+    parts = body_parts(msg["BODYSTRUCTURE"])
+
+    assert [(p.section, p.content_type) for p in parts] == [
+        ("1.1", "text/plain"), ("1.2", "text/html"), ("2", "application/pdf")]
+    text, _, pdf = parts
+    assert (text.charset, text.encoding, text.size) == ("utf-8", "quoted-printable", 120)
+    assert not text.is_attachment
+    assert pdf.is_attachment
+    assert pdf.filename == "חש.pdf"     # RFC 2231 filename* wins over NAME
+
+
+def test_body_parts_walks_into_an_attached_message():
+    envelope = b"(NIL " + b'"Fwd"' + b" NIL NIL NIL NIL NIL NIL NIL NIL)"
+    [msg] = parse_fetch([
+        b'1 (BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 5000 ' + envelope + b" " + RECEIPT_STRUCTURE
+        + b' 80 NIL ("ATTACHMENT" NIL) NIL NIL)'
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 50 ' + envelope
+        + b' ("TEXT" "HTML" NIL NIL NIL "7BIT" 20 1 NIL NIL NIL) 2 NIL NIL NIL NIL)'
+        b' "MIXED" ("BOUNDARY" "z") NIL NIL))'])
+    parts = body_parts(msg["BODYSTRUCTURE"])
+    assert [(p.section, p.content_type) for p in parts] == [
+        ("1", "text/plain"),
+        ("2.1.1", "text/plain"), ("2.1.2", "text/html"), ("2.2", "application/pdf"),
+        ("3.1", "text/html"),
+    ]
+
+
+def test_body_parts_single_part_is_section_1():
+    [msg] = parse_fetch([
+        b'1 (BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "iso-8859-8-i") NIL NIL "7BIT" 5 1 NIL NIL NIL))'])
+    [part] = body_parts(msg["BODYSTRUCTURE"])
+    assert (part.section, part.charset, part.disposition) == ("1", "iso-8859-8-i", "")
+
+
+def test_literal_inside_bodystructure_is_a_string():
+    # Gmail sends a filename with quotes or 8-bit bytes as a literal.
+    data = [
+        (b'1 (UID 7 BODYSTRUCTURE ("APPLICATION" "PDF" NIL NIL NIL "BASE64" 10 NIL'
+         b' ("ATTACHMENT" ("FILENAME" {12}', 'קבלה.pdf'.encode()),
+        b')) NIL NIL))',
+    ]
+    [msg] = parse_fetch(data)
+    [part] = body_parts(msg["BODYSTRUCTURE"])
+    assert part.filename == "קבלה.pdf"
+
+
+def test_body_parts_filename_from_content_type_name():
+    [msg] = parse_fetch([
+        b'1 (BODYSTRUCTURE ("APPLICATION" "PDF" ("NAME" "=?utf-8?b?15DXkS5wZGY=?=") NIL NIL'
+        b' "BASE64" 10 NIL ("ATTACHMENT" NIL) NIL NIL))'])
+    [part] = body_parts(msg["BODYSTRUCTURE"])
+    assert part.filename == "=?utf-8?b?15DXkS5wZGY=?="   # decoded by the caller
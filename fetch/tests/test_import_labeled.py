@@ -61,7 +61,7 @@ def test_imports_new_receipt(env, monkeypatch):
     ledger = json.loads((env / "2025-03" / "2025-03_processed.json").read_text())
     assert ledger == [{
         "uid": "10", "message_id": "<m10>",
-        "timestamp": "2025-03-03T10-00-00", "is_receipt": True}]
+        "timestamp": "2025-03-03T10-00-00", "is_receipt": True, "source": "manual"}]
 
 
 def test_skips_already_saved(env, monkeypatch):
@@ -91,6 +91,7 @@ def test_flips_existing_ledger_entry(env, monkeypatch):
     ledger = json.loads((month / "2025-03_processed.json").read_text())
     assert len(ledger) == 1               # flipped, not appended
     assert ledger[0]["is_receipt"] is True
+    assert ledger[0]["source"] == "manual"
 
 
 def test_abort_on_fetch_fail(env, monkeypatch):
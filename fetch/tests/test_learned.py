@@ -0,0 +1,163 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+import learned
+import process_email as pe
+from models import Email
+
+
+def _features(i, receipt):
+    if receipt:
+        vendor = ["electric", "taxi", "shop", "phone"][i % 4]
+        return {"from": f"Billing <billing@{vendor}.example.com>",
+                "subject": f"Your invoice #{1000 + i} for March",
+                "attachments": [f"invoice_{i}.pdf"], "headers": ["to"],
+                "snippet": f"Thank you for your payment. Total charged {i}.90 USD."}
+    topic = ["news", "deals", "social", "updates"][i % 4]
+    return {"from": f"{topic}@letters{i % 7}.example.org",
+            "subject": f"This week in {topic}: {i} stories",
+            "attachments": [], "headers": ["list_unsubscribe", "to"],
+            "snippet": f"Read the latest {topic} and unsubscribe any time."}
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    """A ledger with features for 300 emails, a third of them receipts."""
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(pe, "_seen_message_ids", None)
+    monkeypatch.setattr(pe, "_sender_history", None)
+    month = tmp_path / "2025-03"
+    month.mkdir()
+    entries = [{"uid": str(i), "message_id": f"<{i}@x>", "is_receipt": i % 3 == 0,
+                "features": _features(i, i % 3 == 0)} for i in range(300)]
+    (month / "2025-03_processed.json").write_text(json.dumps(entries))
+    return tmp_path
+
+
+def _email(uid, receipt):
+    f = _features(int(uid), receipt)
+    return Email(uid=uid, message_id=f"<new{uid}@x>", date="Mon, 03 Mar 2025 10:00:00 +0000",
+                 from_=f["from"], subject=f["subject"], body="", attachments=[],
+                 labels=[], headers={h: "x" for h in f["headers"]}, text=f["snippet"],
+                 partial=True)
+
+
+def test_load_examples_skips_automatic_verdicts_and_reads_receipt_files(history):
+    month = history / "2025-03"
+    ledger = json.loads((month / "2025-03_processed.json").read_text())
+    ledger.append({"uid": "900", "message_id": "<900@x>", "is_receipt": True,
+                   "source": "learned", "features": _features(900, True)})
+    # An older receipt with no features in the ledger, and a manual import
+    # that flipped an entry the LLM had called a non-receipt.
+    ledger.append({"uid": "901", "message_id": "<901@x>", "is_receipt": True})
+    ledger[1]["is_receipt"] = True
+    (month / "2025-03_processed.json").write_text(json.dumps(ledger))
+    (month / "r901.json").write_text(json.dumps({
+        "message_id": "<901@x>", "from": "a@shop.com", "subject": "Receipt",
+        "body": "<p>Total&nbsp;12</p>", "attachments": ["r.pdf"], "to": "me@x",
+        "classification": {"is_receipt": True}}))
+    (month / "r1.json").write_text(json.dumps({
+        "message_id": "<1@x>", "from": "x", "subject": "y", "body": "",
+        "classification": {"is_receipt": True, "source": "manual"}}))
+
+    examples = {mid: (f, y) for mid, f, y in learned.load_examples()}
+    assert "<900@x>" not in examples
+    assert examples["<901@x>"][0]["snippet"] == "Total 12"
+    assert examples["<901@x>"][0]["headers"] == ["to"]
+    assert examples["<1@x>"] == (_features(1, False), True)
+    assert len(examples) == 301
+
+
+def test_thresholds_meet_precision_on_each_side():
+    p = np.array([0.02, 0.1, 0.3, 0.45, 0.6, 0.8, 0.95, 0.99])
+    y = np.array([0, 0, 1, 0, 1, 0, 1, 1], dtype=float)
+    lo, hi = learned.thresholds(p, y, 0.99)
+    assert (lo, hi) == (0.1, 0.95)
+    assert learned.thresholds(p, 1 - y, 0.99) == (-0.01, 1.01)
+
+
+def test_train_reports_held_out_accuracy_and_decides_confident_cases(history):
+    model = learned.train(learned.load_examples())
+    r = model.report
+    assert r["examples"] == 300 and r["receipts"] == 100
+    assert 0 < r["held_out"] < 300
+    assert r["accuracy"] >= 0.95 and r["coverage"] > 0.5
+
+    path = model.save()
+    loaded = learned.LearnedModel.load()
+    assert path.endswith("learned.npz")
+    assert (loaded.lo, loaded.hi) == (model.lo, model.hi)
+    assert loaded.report["accuracy"] == r["accuracy"]
+
+    previews = {str(i): _email(str(i), i % 2 == 0) for i in range(1000, 1010)}
+    decided = learned.prejudge(loaded, previews)
+    assert decided > 0
+    for uid, em in previews.items():
+        if em.classification:
+            assert em.classification["source"] == "learned"
+            assert em.classification["is_receipt"] == (int(uid) % 2 == 0)
+
+
+def test_thresholds_come_from_a_split_the_report_does_not_use(history, monkeypatch):
+    examples = learned.load_examples()
+    splits = {mid: learned._split(mid) for mid, _, _ in examples}
+    calibrated = []
+    real = learned.thresholds
+
+    def thresholds(p, y, precision):
+        calibrated.append(len(p))
+        return real(p, y, precision)
+    monkeypatch.setattr(learned, "thresholds", thresholds)
+
+    r = learned.train(examples).report
+    assert calibrated == [r["calibration"]] == [list(splits.values()).count("calibrate")]
+    assert r["held_out"] == list(splits.values()).count("test")
+    assert r["calibration"] > 0 and r["held_out"] > 0
+    assert r["calibration"] + r["held_out"] < len(examples) / 2
+
+
+def test_train_needs_enough_history(history):
+    examples = learned.load_examples()
+    assert learned.train(examples[:100]) is None
+    assert learned.train([e for e in examples if not e[2]]) is None
+
+
+def test_maybe_retrain_when_missing_or_stale(history, monkeypatch):
+    model = learned.maybe_retrain(7)
+    trained_at = model.report["trained_at"]
+    assert (history / ".model" / "learned.json").exists()
+    assert learned.maybe_retrain(7).report["trained_at"] == trained_at
+
+    monkeypatch.setattr(learned.time, "time", lambda: trained_at + 8 * 86400)
+    assert learned.maybe_retrain(7).report["trained_at"] == trained_at + 8 * 86400
+
+    monkeypatch.setattr(learned, "ENABLED", False)
+    assert learned.maybe_retrain(7) is None
+
+
+def test_prejudged_email_skips_the_llm_and_is_marked_in_the_ledger(history, monkeypatch):
+    def no_llm(*a, **k):
+        raise AssertionError("LLM called for a prejudged email")
+    monkeypatch.setattr(pe.requests, "post", no_llm)
+
+    em = _email("2000", False)
+    em.classification = {"is_receipt": False, "confidence": 0.998,
+                         "reason": "learned model", "source": "learned"}
+    pe.process_email(em)
+
+    ledger = json.loads((history / "2025-03" / "2025-03_processed.json").read_text())
+    entry = ledger[-1]
+    assert entry["source"] == "learned" and entry["is_receipt"] is False
+    assert entry["features"]["subject"] == em.subject
+    assert "cascade" not in entry
+
+
+def test_predict_is_one_batch_for_many_emails(history):
+    model = learned.train(learned.load_examples())
+    rng = random.Random(0)
+    batch = [_features(i, rng.random() < 0.5) for i in range(500)]
+    p = model.predict(batch)
+    assert p.shape == (500,) and ((p >= 0) & (p <= 1)).all()
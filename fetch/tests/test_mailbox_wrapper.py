@@ -1,11 +1,18 @@
+import base64
 import imaplib
+import json
+import quopri
+import socket
+import time
 from datetime import date
 from email.message import EmailMessage
 
 import pytest
 
 import mailbox_wrapper
+from bench.fake_imap import FakeIMAPServer
 from mailbox_wrapper import _parse_labels, _parse_full_email, decode_header_value
+from raw_cache import RawCache
 
 
 class FakeIMAP:
@@ -95,6 +102,15 @@ def test_search_label_criteria(fake):
         "SINCE", "1-Jan-2025", "BEFORE", "1-Feb-2025")
 
 
+def test_search_raw_sends_query_as_utf8_literal(fake):
+    fake.script = [("OK", [b"4 5"])]
+    mb = _box(fake)
+    assert mb.search_raw("subject:חשבונית", date(2025, 3, 1)) == ["4", "5"]
+    assert fake.uid_calls()[-1] == (
+        "uid", "SEARCH", "CHARSET", "UTF-8", "SINCE", "1-Mar-2025", "X-GM-RAW")
+    assert fake.literal == "subject:חשבונית".encode()
+
+
 def test_search_failure_raises(fake):
     fake.script = [("NO", [None])]
     with pytest.raises(RuntimeError):
@@ -115,12 +131,30 @@ def _raw_email():
     return msg.as_bytes()
 
 
-def test_get_parses_email(fake):
-    raw = _raw_email()
-    prefix = r'1 (X-GM-LABELS ("Receipts" \Important) RFC822 {%d}' % len(raw)
-    fake.script = [("OK", [(prefix.encode(), raw), b")"])]
+@pytest.fixture
+def served(tmp_path, monkeypatch):
+    """Serve raw messages through the bench's fake Gmail, which answers the
+    BODYSTRUCTURE and partial-section fetches get() makes. Returns a function
+    uid, raw, labels -> FakeIMAPServer."""
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    manifest = {}
+
+    def serve(uid, raw, labels=()):
+        (corpus / f"{uid}.eml").write_bytes(raw)
+        manifest[uid] = list(labels)
+        (corpus / "manifest.json").write_text(json.dumps(manifest))
+        server = FakeIMAPServer(str(corpus))
+        monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+        return server
 
-    em = _box(fake).get("42")
+    return serve
+
+
+def test_get_parses_email(served):
+    served("42", _raw_email(), ["Receipts", "\\Important"])
+
+    em = _box(None).get("42")
     assert em is not None
     assert em.uid == "42"                       # comes from the requested uid
     assert em.message_id == "<order@x>"
@@ -131,7 +165,122 @@ def test_get_parses_email(fake):
     assert em.labels == ["Receipts", "\\Important"]
     assert em.headers["to"] == "me@x"
     assert em.classification is None
-    assert fake.uid_calls()[-1] == ("uid", "FETCH", "42", "(X-GM-LABELS RFC822)")
+
+
+def _invoice(pdf: bytes) -> bytes:
+    msg = EmailMessage()
+    msg["Subject"] = "Statement"
+    msg["Message-ID"] = "<big@x>"
+    msg.set_content("see attached")
+    msg.add_attachment(pdf, maintype="application", subtype="pdf", filename="statement.pdf")
+    return msg.as_bytes()
+
+
+def test_get_downloads_attachment_in_chunks_to_spool(served, tmp_path):
+    pdf = bytes(range(256)) * 40                # ~10 KB, ~14 KB as base64
+    server = served("9", _invoice(pdf))
+
+    mb = mailbox_wrapper.Mailbox("user@x", "pw", spool_dir=str(tmp_path / "spool"),
+                                 chunk_size=1000)
+    em = mb.get("9")
+    assert em is not None and em.text.strip() == "see attached"
+    [att] = em.attachments
+    assert att.filename == "statement.pdf"
+    assert att.path is not None and att.path.startswith(str(tmp_path / "spool"))
+    assert att.content == pdf
+    # structure + 1 text chunk + ~14 attachment chunks, never the whole message
+    assert server.commands > 14
+
+    att.save(str(tmp_path / "statement.pdf"))
+    assert (tmp_path / "statement.pdf").read_bytes() == pdf
+    mb.logout()
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def test_get_without_spool_keeps_attachments_in_memory(served):
+    pdf = b"%PDF-1.4 " + b"x" * 3000
+    served("9", _invoice(pdf))
+    em = mailbox_wrapper.Mailbox("user@x", "pw", chunk_size=512).get("9")
+    assert em is not None
+    assert em.attachments[0].path is None
+    assert em.attachments[0].content == pdf
+
+
+def test_get_keeps_embedded_images(served):
+    msg = EmailMessage()
+    msg["Subject"], msg["Message-ID"] = "Order", "<img@x>"
+    msg.set_content("plain")
+    msg.add_alternative('<img src="cid:logo@shop">', subtype="html")
+    msg.get_payload()[1].add_related(b"PNG", maintype="image", subtype="png", cid="<logo@shop>")
+    served("5", msg.as_bytes())
+
+    em = _box(None).get("5")
+    assert em.attachments == []
+    assert [(a.filename, a.content_id, a.content) for a in em.inline] == [("logo", "logo@shop", b"PNG")]
+
+
+def test_get_through_raw_cache_downloads_once(served, tmp_path):
+    pdf = bytes(range(256)) * 40
+    raw = _invoice(pdf)
+    server = served("9", raw, ["Receipts"])
+    cache = RawCache(str(tmp_path / "raw"))
+
+    mb = mailbox_wrapper.Mailbox("user@x", "pw", chunk_size=1000, raw_cache=cache)
+    first = mb.get("9")
+    assert first is not None and first.attachments[0].content == pdf
+    assert first.labels == ["Receipts"]
+    assert cache.get(first.message_id) == raw
+    sent = server.bytes_sent
+
+    again = mb.get("9")
+    assert again.attachments[0].content == pdf and again.text == first.text
+    assert server.bytes_sent - sent < 1000      # headers and structure only
+
+
+def test_get_from_raw_cache_streams_and_spools(served, tmp_path, monkeypatch):
+    inner = EmailMessage()
+    inner["Subject"] = "Your receipt"
+    inner.set_content("Total: 120 \u20aa", cte="quoted-printable")
+    inner.add_alternative('<p>Total</p><img src="cid:logo@shop">', subtype="html")
+    inner.get_payload()[1].add_related(b"PNG" * 100, maintype="image", subtype="png",
+                                       cid="<logo@shop>")
+    inner.add_attachment(bytes(range(256)) * 40, maintype="application", subtype="pdf",
+                         filename="receipt.pdf")
+    outer = EmailMessage()
+    outer["Subject"], outer["Message-ID"] = "Fwd: Your receipt", "<fwd@x>"
+    outer.set_content("forwarding this")
+    outer.add_attachment(inner)
+    raw = outer.as_bytes()
+    served("9", raw)
+    cache = RawCache(str(tmp_path / "raw"))
+    cache.put("<fwd@x>", raw)
+    monkeypatch.setattr(RawCache, "get", None)      # never read whole
+
+    mb = mailbox_wrapper.Mailbox("user@x", "pw", spool_dir=str(tmp_path / "spool"),
+                                 raw_cache=cache)
+    em = mb.get("9")
+    whole = mailbox_wrapper.email_from_raw("9", raw)
+    assert em.text == whole.text and em.body == whole.body and "\u20aa" in em.text
+    assert [(a.filename, a.content) for a in em.attachments] == \
+        [(a.filename, a.content) for a in whole.attachments] == [("receipt.pdf", bytes(range(256)) * 40)]
+    assert em.attachments[0].path.startswith(str(tmp_path / "spool"))
+    assert [(a.filename, a.content_id, a.content) for a in em.inline] == \
+        [("logo", "logo@shop", b"PNG" * 100)]
+
+
+@pytest.mark.parametrize("encoding", ["base64", "quoted-printable", "8bit"])
+@pytest.mark.parametrize("chunk", [1, 3, 7, 64])
+def test_transfer_decoder_matches_one_shot_decoding(encoding, chunk):
+    data = "Total: 120 \u20aa = paid \u05e7\u05d1\u05dc\u05d4\n".encode() * 20
+    if encoding == "base64":
+        encoded = base64.encodebytes(data)
+    elif encoding == "quoted-printable":
+        encoded = quopri.encodestring(data)
+    else:
+        encoded = data
+    decoder = mailbox_wrapper._TransferDecoder(encoding)
+    out = b"".join(decoder.feed(encoded[i:i + chunk]) for i in range(0, len(encoded), chunk))
+    assert out + decoder.flush() == data
 
 
 def test_get_bad_status_returns_none(fake):
@@ -148,6 +297,103 @@ def test_message_id_of(fake):
         "uid", "FETCH", "1", "(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])")
 
 
+def test_peek_previews_batch_in_two_round_trips(fake):
+    header = b"Message-ID: <order@x>\r\nFrom: shop@example.com\r\nSubject: Your order\r\n\r\n"
+    structure = (
+        b'(("TEXT" "PLAIN" ("CHARSET" "iso-8859-8-i") NIL NIL "BASE64" 20 1 NIL NIL NIL)'
+        b'("APPLICATION" "PDF" ("NAME" "=?utf-8?q?invoice.pdf?=") NIL NIL "BASE64" 9000 NIL'
+        b' ("ATTACHMENT" NIL) NIL NIL) "MIXED" ("BOUNDARY" "b") NIL NIL)'
+    )
+    hebrew = "\u05e7\u05d1\u05dc\u05d4 total".encode("iso-8859-8")  # "receipt total"
+    encoded = __import__("base64").b64encode(hebrew)
+    fake.script = [
+        ("OK", [
+            (b'1 (UID 42 X-GM-LABELS (Receipts) RFC822.SIZE 9500 BODYSTRUCTURE '
+             + structure + b" BODY[HEADER] {%d}" % len(header), header),
+            b")",
+            (b'2 (UID 43 X-GM-LABELS () RFC822.SIZE 80 BODYSTRUCTURE '
+             b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+             b" BODY[HEADER] {%d}" % len(header), header),
+            b")",
+        ]),
+        # cut mid-quantum: the incomplete tail is dropped, not mis-decoded
+        ("OK", [(b"1 (UID 42 BODY[1]<0> {%d}" % (len(encoded) - 2), encoded[:-2]), b")"]),
+    ]
+
+    previews = _box(fake).peek(["42", "43"], preview_bytes=64)
+
+    em = previews["42"]
+    assert em.partial
+    assert (em.message_id, em.subject, em.labels) == ("<order@x>", "Your order", ["Receipts"])
+    assert [a.filename for a in em.attachments] == ["invoice.pdf"]
+    assert em.text.startswith("\u05e7\u05d1\u05dc\u05d4")
+    assert previews["43"].text == ""        # HTML only: nothing for the classifier
+    assert fake.uid_calls() == [
+        ("uid", "FETCH", "42,43",
+         "(UID X-GM-LABELS RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER])"),
+        ("uid", "FETCH", "42", "(UID BODY.PEEK[1]<0.64>)"),
+    ]
+
+
+def test_peek_nothing_to_do(fake):
+    assert _box(fake).peek([]) == {}
+    assert fake.uid_calls() == []
+
+
+# --- IDLE ------------------------------------------------------------------
+
+@pytest.fixture
+def idling(fake):
+    """Give the fake a real socket whose far end plays the server."""
+    client, server = socket.socketpair()
+    fake.sock = client
+    fake.sent = []
+    fake.tagged_commands = {}
+    fake._new_tag = lambda: b"A7"
+    fake.send = lambda data: fake.sent.append(data)
+    yield server
+    client.close()
+    server.close()
+
+
+def test_idle_returns_on_exists(fake, idling):
+    idling.sendall(b"+ idling\r\n* 3 EXPUNGE\r\n* 12 EXISTS\r\nA7 OK IDLE terminated\r\n")
+    assert _box(fake).idle(5) is True
+    assert fake.sent == [b"A7 IDLE\r\n", b"DONE\r\n"]
+
+
+def test_idle_times_out_quietly(fake, idling):
+    idling.sendall(b"+ idling\r\n")
+
+    def reply_to_done(data):
+        fake.sent.append(data)
+        if data == b"DONE\r\n":
+            idling.sendall(b"A7 OK IDLE terminated\r\n")
+
+    fake.send = reply_to_done
+    assert _box(fake).idle(0.2) is False
+
+
+def test_idle_stops_early_when_asked(fake, idling):
+    idling.sendall(b"+ idling\r\nA7 OK IDLE terminated\r\n")
+    t0 = time.monotonic()
+    assert _box(fake).idle(60, stop=lambda: True) is False
+    assert time.monotonic() - t0 < 5
+
+
+def test_idle_reconnects_when_dropped(fake, idling):
+    idling.sendall(b"+ idling\r\n")
+    idling.shutdown(socket.SHUT_WR)                 # server hangs up
+    assert _box(fake).idle(5) is True               # caller should re-sync
+    assert sum(1 for c in fake.calls if c[0] == "login") == 2
+
+
+def test_search_after_drops_the_star_match(fake):
+    fake.script = [("OK", [b"40"])]                 # "41:*" with nothing new
+    assert _box(fake).search_after(40) == []
+    assert fake.uid_calls()[-1] == ("uid", "SEARCH", None, "UID", "41:*")
+
+
 # --- reconnect -------------------------------------------------------------
 
 def test_reconnect_on_abort(fake):
@@ -203,18 +449,16 @@ def test_parse_full_email_splits_text_html_attachments():
     assert attachments[0].content == b"%PDF-1.4 fake"
 
 
-def test_get_wraps_plain_text_as_html(fake):
+def test_get_wraps_plain_text_as_html(served):
     msg = EmailMessage()
     msg["Subject"] = "Text only"
     msg["From"] = "a@b.com"
     msg["Date"] = "Mon, 03 Mar 2025 10:00:00 +0000"
     msg["Message-ID"] = "<t@x>"
     msg.set_content("just text & <stuff>")
-    raw = msg.as_bytes()
+    served("7", msg.as_bytes())
 
-    prefix = r'1 (X-GM-LABELS () RFC822 {%d}' % len(raw)
-    fake.script = [("OK", [(prefix.encode(), raw), b")"])]
-    em = _box(fake).get("7")
+    em = _box(None).get("7")
     assert em is not None
     # no HTML part -> body is the escaped text wrapped in <pre>
     assert em.body.startswith("<pre>")
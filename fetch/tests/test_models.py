@@ -1,5 +1,7 @@
 import json
 
+import pytest
+
 from models import Attachment, Email
 
 
@@ -60,3 +62,32 @@ def test_write_null_classification_and_no_attachments(tmp_path):
     assert data["classification"] is None
     assert not (tmp_path / "rec").exists()
     assert Email.read(path).classification is None
+
+
+def test_account_round_trips_and_is_omitted_when_unset(tmp_path):
+    path = str(tmp_path / "rec.json")
+    _sample(account="a@gmail.com").write(path)
+    assert json.loads((tmp_path / "rec.json").read_text())["account"] == "a@gmail.com"
+    assert Email.read(path).account == "a@gmail.com"
+
+    _sample().write(path)
+    assert "account" not in json.loads((tmp_path / "rec.json").read_text())
+    assert Email.read(path).account == ""
+
+
+def test_write_refuses_partial_preview(tmp_path):
+    with pytest.raises(ValueError):
+        _sample(partial=True).write(str(tmp_path / "receipt.json"))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_moves_spooled_attachment(tmp_path):
+    spooled = tmp_path / "spool-1"
+    spooled.write_bytes(b"%PDF big")
+    em = _sample(attachments=[Attachment("statement.pdf", path=str(spooled))])
+    em.write(str(tmp_path / "receipt.json"))
+
+    saved = tmp_path / "receipt" / "statement.pdf"
+    assert saved.read_bytes() == b"%PDF big"
+    assert not spooled.exists()                 # moved, not copied
+    assert em.attachments[0].path == str(saved)
@@ -0,0 +1,162 @@
+import json
+import threading
+
+import pytest
+
+import fetch_emails as fe
+import multi_fetch as mf
+from models import Email
+
+
+class FakeOllama:
+    def call(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def shutdown(self):
+        pass
+
+
+def _email(uid, message_id):
+    return Email(
+        uid=uid, message_id=message_id, date="d", from_="f", subject="s",
+        body="b", attachments=[], labels=[], headers={}, text="t",
+    )
+
+
+class FakeMailbox:
+    """Per-user mailboxes keyed by user; message ids are <user:uid>."""
+
+    boxes = {"a@x": ["1", "2", "3"], "b@x": ["1"]}
+    budget = None
+
+    def __init__(self, user, password, **kwargs):
+        self.user = user
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def search_dates(self, since, before):
+        return list(self.boxes[self.user])
+
+    def envelopes(self, uids):
+        return {uid: {"from": "f", "subject": "s", "labels": [], "size": 100,
+                      "attachments": False} for uid in uids}
+
+    def categories(self, uids, names):
+        return {}
+
+    def peek(self, uids, preview_bytes):
+        return {uid: _email(uid, f"<{self.user}:{uid}>") for uid in uids}
+
+    def get(self, uid):
+        return _email(uid, f"<{self.user}:{uid}>")
+
+
+# --- FairQueue ---------------------------------------------------------------
+
+def test_fair_queue_round_robins_accounts():
+    q = mf.FairQueue(lane_size=10)
+    for account in ("a", "b"):
+        q.register(account)
+    for n in range(3):
+        q.put("a", f"a{n}")
+    q.put("b", "b0")
+    q.close("a")
+    q.close("b")
+
+    served = []
+    while (item := q.get()) is not None:
+        served.append(item[1])
+    assert served == ["a0", "b0", "a1", "a2"]
+
+
+def test_fair_queue_lane_is_bounded():
+    q = mf.FairQueue(lane_size=1)
+    q.register("a")
+    q.put("a", 1)
+    blocked = threading.Thread(target=q.put, args=("a", 2), daemon=True)
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()           # lane full: the producer waits
+    assert q.get() == ("a", 1)
+    blocked.join(1)
+    assert not blocked.is_alive()
+
+
+def test_fair_queue_get_returns_none_when_drained():
+    q = mf.FairQueue()
+    q.register("a")
+    q.close("a")
+    assert q.get() is None
+
+
+def test_fair_queue_join_waits_for_task_done():
+    q = mf.FairQueue()
+    q.register("a")
+    q.put("a", 1)
+    joined = threading.Thread(target=q.join, args=("a",), daemon=True)
+    joined.start()
+    q.get()
+    joined.join(0.1)
+    assert joined.is_alive()            # taken but not yet finished
+    q.task_done("a")
+    joined.join(1)
+    assert not joined.is_alive()
+
+
+# --- main --------------------------------------------------------------------
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    accounts = tmp_path / "accounts.json"
+    accounts.write_text(json.dumps([
+        {"user": "a@x", "password": "pa"},
+        {"user": "b@x", "password": "pb"},
+    ]))
+    monkeypatch.setenv("GMAIL_ACCOUNTS_FILE", str(accounts))
+    monkeypatch.delenv("FETCH_SINCE", raising=False)
+    monkeypatch.delenv("FETCH_BEFORE", raising=False)
+    monkeypatch.setattr(fe.pe, "OUTPUT_DIR", str(tmp_path / "out"))
+    monkeypatch.setattr(fe, "Mailbox", FakeMailbox)
+    monkeypatch.setattr(mf, "_get_seen_message_ids", lambda: {"<a@x:2>"})
+    monkeypatch.setattr(fe, "start_ollama", lambda: FakeOllama())
+    return tmp_path
+
+
+def test_main_processes_every_account_tagged(env, monkeypatch):
+    processed = []
+    monkeypatch.setattr(
+        mf, "process_email",
+        lambda em, index, total, fetch_full: processed.append((em.account, em.uid)))
+    mf.main()
+
+    assert sorted(processed) == [("a@x", "1"), ("a@x", "3"), ("b@x", "1")]
+    # each account is its own checkpointed job
+    runs = sorted(p.name for p in (env / "out" / ".runs").glob("*.json"))
+    assert runs == ["a@x_2025-01-24_open.json", "b@x_2025-01-24_open.json"]
+
+
+def test_main_reports_failed_account(env, monkeypatch):
+    def boom(self, since, before):
+        if self.user == "b@x":
+            raise RuntimeError("IMAP search failed")
+        return ["1"]
+
+    monkeypatch.setattr(FakeMailbox, "search_dates", boom)
+    processed = []
+    monkeypatch.setattr(
+        mf, "process_email", lambda em, index, total, fetch_full: processed.append(em.account))
+
+    with pytest.raises(SystemExit):
+        mf.main()
+    assert processed == ["a@x"]         # the healthy account still ran
+
+
+def test_load_accounts_rejects_bad_file(tmp_path):
+    path = tmp_path / "accounts.json"
+    path.write_text('[{"user": "a@x"}]')
+    with pytest.raises(ValueError):
+        mf.load_accounts(str(path))
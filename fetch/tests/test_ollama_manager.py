@@ -0,0 +1,124 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import ollama_manager as om
+from bench.fake_ollama import FakeOllama
+
+
+class FakeServe:
+    """Stands in for the `ollama serve` process: starts the stub server."""
+
+    def __init__(self, stub):
+        self.stub = stub
+        self.terminated = False
+        self.returncode = None
+        stub.start()
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+        self.stub.stop()
+
+    def wait(self):
+        self.returncode = 0
+
+
+def _free_port():
+    # A port nothing listens on: take a free one and let it go.
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_reuses_running_server(monkeypatch):
+    monkeypatch.setattr(om.subprocess, "Popen", lambda *a, **k: pytest.fail("spawned"))
+    with FakeOllama() as stub:
+        mgr = om.OllamaManager(stub.url, "llama3").start()
+        assert mgr.startup["reused"] is True
+        assert stub.generate_calls == 1          # the warm-up load
+        mgr.shutdown()
+
+
+def test_spawns_when_nothing_answers(monkeypatch):
+    port = _free_port()
+    spawned = []
+
+    def popen(*a, **k):
+        spawned.append(FakeServe(FakeOllama(port=port)))
+        return spawned[-1]
+
+    monkeypatch.setattr(om.subprocess, "Popen", popen)
+    mgr = om.OllamaManager(f"http://127.0.0.1:{port}", "llama3").start()
+    assert mgr.startup["reused"] is False
+    assert len(spawned) == 1
+    mgr.shutdown()
+    assert spawned[0].terminated                 # we own it, so we stop it
+
+
+def test_keep_server_leaves_owned_server_running(monkeypatch):
+    monkeypatch.setenv("OLLAMA_KEEP_SERVER", "1")
+    with FakeOllama() as stub:
+        mgr = om.OllamaManager(stub.url, "llama3")
+        proc = FakeServe.__new__(FakeServe)
+        proc.terminated = False
+        proc.pid = 4242
+        mgr._proc = proc
+        mgr.shutdown()
+        assert not proc.terminated
+
+
+def test_call_restarts_and_retries_on_dropped_connection(monkeypatch):
+    with FakeOllama() as stub:
+        mgr = om.OllamaManager(stub.url, "llama3")
+        calls = []
+
+        def classify():
+            calls.append(1)
+            if len(calls) == 1:
+                raise requests.ConnectionError("connection reset")
+            return "verdict"
+
+        assert mgr.call(classify) == "verdict"
+        assert len(calls) == 2
+        assert mgr.restarts == 0                 # server was healthy: just retried
+
+
+def test_start_times_out_when_server_never_comes_up(monkeypatch):
+    mgr = om.OllamaManager(f"http://127.0.0.1:{_free_port()}", "llama3",
+                           startup_timeout=0.2)
+
+    class NeverUp:
+        returncode = None
+
+        def poll(self):
+            return None
+
+    monkeypatch.setattr(om.subprocess, "Popen", lambda *a, **k: NeverUp())
+    with pytest.raises(RuntimeError):
+        mgr.start()
+
+
+def test_shutdown_drains_in_flight_calls():
+    with FakeOllama() as stub:
+        mgr = om.OllamaManager(stub.url, "llama3")
+        started = threading.Event()
+        finished = []
+
+        def slow():
+            started.set()
+            time.sleep(0.2)
+            finished.append(1)
+
+        t = threading.Thread(target=mgr.call, args=(slow,))
+        t.start()
+        started.wait()
+        mgr.shutdown()
+        assert finished == [1]                   # shutdown waited for it
+        assert mgr.stopping
+        t.join()
@@ -0,0 +1,138 @@
+import glob
+import imaplib
+import json
+import re
+from datetime import date
+
+import pytest
+
+import fetch_emails as fe
+import mailbox_wrapper
+import priority
+import process_email as pe
+from bench.corpus import generate
+from checkpoint import RunCheckpoint
+from bench.fake_imap import FakeIMAPServer
+from bench.fake_ollama import FakeOllama, verdict_for
+from sender_history import SenderHistory
+
+
+def _env(subject="Hello", from_="Shop <shop@store.example>", labels=(), attachments=False):
+    return {"from": from_, "subject": subject, "labels": list(labels), "size": 1000,
+            "attachments": attachments}
+
+
+def test_score_adds_up_the_signals():
+    assert priority.score(_env()) == 0
+    assert priority.score(_env("Your invoice #12")) == 2
+    assert priority.score(_env("חשבונית מס קבלה 7")) == 2
+    assert priority.score(_env("Weekly newsletter")) == -1
+    assert priority.score(_env(labels=["Receipts"], attachments=True)) == 2.5
+    assert priority.score(_env(), ["purchases"]) == 2
+    assert priority.score(_env(), ["promotions", "social"]) == -3
+
+    history = SenderHistory()
+    for _ in range(8):
+        history.add(_env(), True)
+    assert priority.score(_env(), history=history) == pytest.approx(4 * (9 / 10 - 0.5))
+    assert priority.score(_env(from_="new@else.example"), history=history) == 0
+
+
+def test_order_is_stable_among_equals():
+    envelopes = {"1": _env(), "2": _env("Receipt"), "3": _env(), "4": _env("sale today")}
+    ordered, scores = priority.order(["1", "2", "3", "4", "5"], envelopes, {"3": ["purchases"]})
+    assert ordered == ["2", "3", "1", "5", "4"]
+    assert scores == {"1": 0, "2": 2, "3": 2, "4": -1}
+
+
+def test_rank_puts_the_receipts_first(tmp_path, monkeypatch):
+    generate(str(tmp_path), messages=60, large_pdf_mb=0.1, seed=5)
+    server = FakeIMAPServer(str(tmp_path))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    mb = mailbox_wrapper.Mailbox("u@x", "pw")
+    mb.connect()
+    uids = mb.search_dates(date(2025, 1, 1))
+
+    ordered, envelopes, scores = priority.rank(mb, uids)
+    assert sorted(ordered) == sorted(uids) and set(envelopes) == set(uids)
+    first = envelopes[ordered[0]]
+    assert first["size"] > 0 and first["from"] and "Receipts" in first["labels"]
+    receipts = [u for u in uids if verdict_for(f"Subject: {envelopes[u]['subject']}")["is_receipt"]]
+    assert receipts and set(ordered[:len(receipts)]) == set(receipts)
+    assert "likely receipts first" in priority.describe(ordered, envelopes, scores)
+
+
+def test_rank_without_categories_when_the_search_is_refused(tmp_path, monkeypatch, capsys):
+    generate(str(tmp_path), messages=20, large_pdf_mb=0.1, seed=5)
+    server = FakeIMAPServer(str(tmp_path))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    mb = mailbox_wrapper.Mailbox("u@x", "pw")
+    mb.connect()
+    uids = mb.search_dates(date(2025, 1, 1))
+
+    uid = server.uid
+    monkeypatch.setattr(server, "uid", lambda command, *args: (
+        ("NO", [b"X-GM-RAW not supported"]) if command == "SEARCH" else uid(command, *args)))
+    assert mb.categories(uids, priority.CATEGORY_WEIGHTS) == {}
+    ordered, envelopes, _ = priority.rank(mb, uids)
+    assert sorted(ordered) == sorted(uids) and set(envelopes) == set(uids)
+    assert "ranking without them" in capsys.readouterr().out
+
+    def bad(command, *args):        # imaplib raises on a BAD reply
+        if command == "SEARCH":
+            raise imaplib.IMAP4.error("SEARCH command error: BAD [b'Could not parse command']")
+        return uid(command, *args)
+    monkeypatch.setattr(server, "uid", bad)
+    assert mb.categories(uids, priority.CATEGORY_WEIGHTS) == {}
+
+
+def test_interrupted_uids_stay_ahead_of_the_ranking(tmp_path, monkeypatch):
+    generate(str(tmp_path / "corpus"), messages=20, large_pdf_mb=0.1, seed=5)
+    server = FakeIMAPServer(str(tmp_path / "corpus"))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    monkeypatch.setattr(pe, "_sender_history", SenderHistory())
+    mb = mailbox_wrapper.Mailbox("u@x", "pw")
+    mb.connect()
+    uids = mb.search_dates(date(2025, 1, 1))
+    ranked, _, _ = priority.rank(mb, uids)
+
+    checkpoint = RunCheckpoint(str(tmp_path / "runs"), "job", {})
+    checkpoint.set_uids(uids)
+    checkpoint.start(ranked[-1])                  # the run died on the least likely one
+    resumed = RunCheckpoint(str(tmp_path / "runs"), "job", {})
+    pending, _, _ = fe.schedule_pending(mb, resumed)
+    assert pending == [ranked[-1]] + ranked[:-1]
+
+
+def test_main_processes_likely_receipts_first(tmp_path, monkeypatch, capsys):
+    corpus, out = tmp_path / "corpus", tmp_path / "out"
+    generate(str(corpus), messages=30, large_pdf_mb=0.1, seed=5)
+    server = FakeIMAPServer(str(corpus))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    monkeypatch.setattr(fe.OllamaManager, "handle_signals", lambda self: None)
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(out))
+    monkeypatch.setattr(pe, "_seen_message_ids", None)
+    monkeypatch.setattr(pe, "_sender_history", None)
+    monkeypatch.setattr(pe, "SENDER_HISTORY", False)
+    monkeypatch.setattr(pe, "DUPLICATES", False)
+    monkeypatch.setenv("GMAIL_USER", "u@example.com")
+    monkeypatch.setenv("GMAIL_APP_PASSWORD", "x")
+    monkeypatch.setenv("FETCH_SINCE", "2025-01-01")
+    for name in ("FETCH_BEFORE", "FETCH_JOB", "FETCH_QUERY"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(fe, "QUEUE_PATH", "")
+
+    with FakeOllama(latency=0) as stub:
+        monkeypatch.setattr(pe, "OLLAMA_URL", stub.url)
+        fe.main()
+
+    printed = capsys.readouterr().out
+    assert "Priority: 30 emails" in printed
+    ledger = {e["message_id"]: e["is_receipt"]
+              for p in glob.glob(str(out / "*" / "*_processed.json"))
+              for e in json.loads(open(p).read())}
+    order = re.findall(r"^\[\d+/30\] processing (\S+)", printed, re.MULTILINE)
+    assert len(order) == 30
+    found = sum(ledger.values())
+    assert found and all(ledger[m] for m in order[:found])
+    assert f"{found} receipts in this run" in printed
@@ -1,8 +1,10 @@
 import json
 
 import pytest
+import requests
 
 import process_email as pe
+from ollama_manager import OllamaManager
 from process_email import process_email, classify
 from models import Attachment, Email
 
@@ -12,6 +14,7 @@ def out(tmp_path, monkeypatch):
     """Point process_email at a temp output dir with an empty seen-cache."""
     monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))
     monkeypatch.setattr(pe, "_seen_message_ids", set())
+    monkeypatch.setattr(pe, "_sender_history", None)
     return tmp_path
 
 
@@ -164,6 +167,25 @@ def test_already_seen_skips(out, monkeypatch):
     assert list(out.iterdir()) == []  # nothing written
 
 
+def test_retry_after_dropped_connection_still_records(out, monkeypatch):
+    verdicts = iter([requests.ConnectionError("dropped"), {"is_receipt": False, "confidence": 0.9}])
+
+    def classify_cascade(email, names):
+        verdict = next(verdicts)
+        if isinstance(verdict, Exception):
+            raise verdict
+        return verdict, None
+
+    monkeypatch.setattr(pe, "classify_cascade", classify_cascade)
+    ollama = OllamaManager("http://localhost:1", "llama3")
+    monkeypatch.setattr(ollama, "ensure_running", lambda: None)
+    email = Email(uid="7", message_id="<r@x>", date="Mon, 03 Mar 2025 10:00:00 +0000",
+                  from_="a@b", subject="Hi", body="b", attachments=[], labels=[], headers={})
+    ollama.call(process_email, email)
+    ledger = json.loads((out / "2025-03" / "2025-03_processed.json").read_text())
+    assert [e["message_id"] for e in ledger] == ["<r@x>"]
+
+
 @pytest.mark.parametrize(
     "bad_verdict",
     [
@@ -243,9 +265,180 @@ def test_classify_non_bool_is_rejected(monkeypatch):
         classify(_email(), [])
 
 
-def test_classify_invalid_json_not_retried(monkeypatch):
+def test_classify_invalid_json_retried_then_raised(monkeypatch):
     import json as _json
-    calls = _mock_llm_raw(monkeypatch, "not json at all")
+    calls = _mock_llm_raw(monkeypatch, *["not json at all"] * 3)
     with pytest.raises(_json.JSONDecodeError):
         classify(_email(), [])
-    assert calls["n"] == 1  # JSON errors propagate immediately, no retry
+    assert calls["n"] == 3  # nothing to repair: generated again, then given up
+
+
+def test_account_is_recorded_in_ledger_and_receipt(out, monkeypatch):
+    _mock_llm(monkeypatch, RECEIPTS[0]["verdict"])
+    email = _email()
+    email.account = "a@gmail.com"
+    process_email(email)
+
+    month = out / "2025-03"
+    ledger = json.loads((month / "2025-03_processed.json").read_text())
+    assert ledger[0]["account"] == "a@gmail.com"
+    rec = json.loads((month / "2025-03-03T10-00-00_1.json").read_text())
+    assert rec["account"] == "a@gmail.com"
+
+
+def test_partial_receipt_is_fetched_in_full_before_writing(out, monkeypatch):
+    _mock_llm(monkeypatch, RECEIPTS[0]["verdict"])
+    preview = _email()
+    preview.partial = True
+    preview.body = ""
+    preview.account = "a@gmail.com"
+    full = _email()
+    full.body = "<b>full</b>"
+    fetched = []
+
+    process_email(preview, fetch_full=lambda uid: fetched.append(uid) or full)
+
+    assert fetched == ["1"]
+    rec = json.loads((out / "2025-03" / "2025-03-03T10-00-00_1.json").read_text())
+    assert rec["body"] == "<b>full</b>"
+    assert rec["classification"] == RECEIPTS[0]["verdict"]
+    assert rec["account"] == "a@gmail.com"
+
+
+def test_partial_non_receipt_is_never_fetched(out, monkeypatch):
+    _mock_llm(monkeypatch, NON_RECEIPTS[0]["verdict"])
+    preview = _email()
+    preview.partial = True
+
+    def fetch_full(uid):
+        raise AssertionError("only receipts are downloaded")
+
+    process_email(preview, fetch_full=fetch_full)
+    ledger = json.loads((out / "2025-03" / "2025-03_processed.json").read_text())
+    assert ledger[0]["is_receipt"] is False
+
+
+def _mock_models(monkeypatch, verdicts):
+    """Per-model verdicts; returns the list of models asked, in order."""
+    asked = []
+
+    def post(url, json=None, **k):
+        asked.append(json["model"])
+        return _Resp(verdicts[json["model"]])
+
+    monkeypatch.setattr(pe.requests, "post", post)
+    return asked
+
+
+@pytest.mark.parametrize("fast_verdict, models, tier", [
+    ({"is_receipt": True, "confidence": 0.95}, ["phi3.5"], "fast"),
+    ({"is_receipt": False, "confidence": 0.9}, ["phi3.5"], "fast"),
+    ({"is_receipt": True, "confidence": 0.6}, ["phi3.5", "llama3"], "full"),   # gray
+])
+def test_cascade_escalates_only_the_gray_band(monkeypatch, fast_verdict, models, tier):
+    monkeypatch.setattr(pe, "CLASSIFY_FAST_MODEL", "phi3.5")
+    monkeypatch.setattr(pe, "GRAY_BAND", (0.2, 0.8))
+    asked = _mock_models(monkeypatch, {
+        "phi3.5": fast_verdict,
+        "llama3": {"is_receipt": True, "confidence": 0.7, "reason": "full"},
+    })
+    result, trace = pe.classify_cascade(_email(), [])
+    assert asked == models
+    assert result["tier"] == tier
+    assert ("full_s" in trace) == (tier == "full")
+
+
+def test_cascade_calibration_runs_both_and_full_decides(monkeypatch):
+    monkeypatch.setattr(pe, "CLASSIFY_FAST_MODEL", "phi3.5")
+    monkeypatch.setattr(pe, "CASCADE_CALIBRATE", True)
+    asked = _mock_models(monkeypatch, {
+        "phi3.5": {"is_receipt": False, "confidence": 0.99},
+        "llama3": {"is_receipt": True, "confidence": 0.8},
+    })
+    result, trace = pe.classify_cascade(_email(), [])
+    assert asked == ["phi3.5", "llama3"]
+    assert result["is_receipt"] is True and result["tier"] == "full"
+    assert trace["fast_p"] == 0.01
+
+
+def test_cascade_trace_goes_to_the_ledger(out, monkeypatch):
+    monkeypatch.setattr(pe, "CLASSIFY_FAST_MODEL", "phi3.5")
+    _mock_models(monkeypatch, {"phi3.5": {"is_receipt": False, "confidence": 0.9}})
+    process_email(_email())
+    [entry] = json.loads((out / "2025-03" / "2025-03_processed.json").read_text())
+    assert entry["is_receipt"] is False
+    assert entry["cascade"]["fast_p"] == 0.1
+
+
+def test_no_fast_model_is_a_plain_classify(out, monkeypatch):
+    asked = _mock_models(monkeypatch, {"llama3": RECEIPTS[0]["verdict"]})
+    result, trace = pe.classify_cascade(_email(), [])
+    assert asked == ["llama3"] and trace is None and "tier" not in result
+
+
+def test_classify_sends_schema_and_caps(monkeypatch):
+    sent = []
+
+    def post(url, json=None, **k):
+        sent.append(json)
+        return _RawResp('{"is_receipt": false, "confidence": 0.8, "reason": "news"}')
+
+    monkeypatch.setattr(pe.requests, "post", post)
+    monkeypatch.setattr(pe, "CLASSIFY_NUM_CTX", 2048)
+    classify(_email("word " * 5000), [])
+    body = sent[0]
+    assert body["format"] == pe.CLASSIFY_SCHEMA
+    assert body["options"]["temperature"] == 0
+    assert body["options"]["num_predict"] == pe.CLASSIFY_NUM_PREDICT
+    assert body["options"]["num_ctx"] == 2048
+    # The body is trimmed to what fits the context window.
+    assert body["prompt"].count("word") < 5000
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        '```json\n{"is_receipt": true, "confidence": 0.9, "reason": "order"}\n```',
+        'Sure! {"is_receipt": true, "confidence": 0.9, "reason": "order"} Hope this helps.',
+        '{"is_receipt": true, "confidence": 0.9, "reason": "order confirmation with a tot',
+        '{"is_receipt": "true", "confidence": 0.9, "reason": "order"}',
+    ],
+)
+def test_classify_repairs_malformed_reply_without_retrying(monkeypatch, raw):
+    monkeypatch.setattr(pe, "LLM_STATS", pe.Counter())
+    calls = _mock_llm_raw(monkeypatch, raw)
+    assert classify(_email(), [])["is_receipt"] is True
+    assert calls["n"] == 1
+    assert pe.LLM_STATS["repaired"] == 1 and pe.LLM_STATS["retries"] == 0
+
+
+def test_classify_retries_an_unrepairable_reply_and_counts_each_repair_once(monkeypatch):
+    monkeypatch.setattr(pe, "LLM_STATS", pe.Counter())
+    replies = iter(["I cannot answer that.",
+                    '```{"is_receipt": "maybe"}```',
+                    '```{"is_receipt": "true", "confidence": 0.9, "reason": "order"}```'])
+    monkeypatch.setattr(pe.requests, "post", lambda url, json=None, **k: _RawResp(next(replies)))
+    assert classify(_email(), [])["is_receipt"] is True
+    assert pe.LLM_STATS == {"calls": 3, "retries": 2, "repaired": 1}
+
+    monkeypatch.setattr(pe, "LLM_STATS", pe.Counter())
+    monkeypatch.setattr(pe.requests, "post", lambda url, json=None, **k: _RawResp("no JSON here"))
+    with pytest.raises(ValueError):
+        classify(_email(), [])
+    assert pe.LLM_STATS == {"calls": 3, "retries": 2, "failed": 1}
+
+
+def test_classify_counts_retries_and_samples_on_retry(monkeypatch):
+    monkeypatch.setattr(pe, "LLM_STATS", pe.Counter())
+    temps = []
+    replies = iter(['{"confidence": 0.1}', '{"is_receipt": false, "confidence": 0.7, "reason": "x"}'])
+
+    def post(url, json=None, **k):
+        temps.append(json["options"]["temperature"])
+        return _RawResp(next(replies))
+
+    monkeypatch.setattr(pe.requests, "post", post)
+    classify(_email(), [])
+    assert temps == [0, 0.5]
+    assert pe.LLM_STATS == {"calls": 2, "retries": 1}
+    assert pe.llm_stats_line() == "LLM: 2 calls, 1 retries, 0 replies repaired, 0 failed"
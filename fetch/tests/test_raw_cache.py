@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+import raw_cache
+from raw_cache import RawCache
+
+
+@pytest.fixture(params=["zstd", "gzip"])
+def cache(request, tmp_path, monkeypatch):
+    if request.param == "gzip":
+        monkeypatch.setattr(raw_cache, "zstandard", None)
+    elif raw_cache.zstandard is None:
+        pytest.skip("zstandard not installed")
+    return RawCache(str(tmp_path / "raw"))
+
+
+def test_put_get_roundtrip(cache):
+    raw = b"Message-ID: <a@x>\r\n\r\n" + b"body line\r\n" * 1000
+    assert "<a@x>" not in cache
+    cache.put("<a@x>", raw)
+    assert "<a@x>" in cache and " <a@x> " in cache    # key is the stripped id
+    assert cache.get("<a@x>") == raw
+    assert cache.get("<b@x>") is None and "" not in cache
+
+
+def test_writer_streams_and_stores_nothing_on_error(cache, tmp_path):
+    with cache.writer("<a@x>") as f:
+        for i in range(100):
+            f.write(b"chunk %d\r\n" % i)
+    assert cache.get("<a@x>").count(b"chunk") == 100
+
+    with pytest.raises(RuntimeError):
+        with cache.writer("<b@x>") as f:
+            f.write(b"partial")
+            raise RuntimeError("connection dropped")
+    assert "<b@x>" not in cache
+    assert not list((tmp_path / "raw").rglob("*.tmp"))
+
+
+def test_unreadable_zstd_entry_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(raw_cache, "zstandard", None)
+    cache = RawCache(str(tmp_path / "raw"))
+    path = cache._base("<a@x>") + ".eml.zst"
+    os.makedirs(os.path.dirname(path))
+    open(path, "wb").write(b"written where zstandard was installed")
+    assert "<a@x>" not in cache and cache.get("<a@x>") is None
+    cache.put("<a@x>", b"raw")
+    assert "<a@x>" in cache and cache.get("<a@x>") == b"raw"
+
+
+def test_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv("RAW_CACHE_DIR", raising=False)
+    assert RawCache.from_env() is None
+    monkeypatch.setenv("RAW_CACHE_DIR", str(tmp_path))
+    assert RawCache.from_env().root == str(tmp_path)
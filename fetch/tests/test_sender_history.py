@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+import process_email as pe
+from models import Email
+from sender_history import SenderHistory
+
+
+def _f(from_, subject="Your bill for March 2025"):
+    return {"from": from_, "subject": subject}
+
+
+def test_consistent_sender_gets_a_verdict():
+    h = SenderHistory(min_count=3, agreement=1.0)
+    for month in ("January", "February"):
+        h.add(_f("Bills <bills@power.example>", f"Your bill for {month}"), True)
+    assert h.verdict(_f("bills@power.example")) is None           # 2 < 3
+    h.add(_f("bills@power.example", "Your bill for March"), True)
+
+    v = h.verdict(_f("BILLS@power.example", "Your bill for April"))
+    assert v["is_receipt"] is True and v["source"] == "sender_history"
+    assert v["confidence"] == 1.0 and "3/3" in v["reason"]
+
+
+def test_split_history_goes_to_the_llm():
+    h = SenderHistory(min_count=3, agreement=0.95)
+    for is_receipt in (True, True, False, True):
+        h.add(_f("shop@store.example", "Hello"), is_receipt)
+    assert h.verdict(_f("shop@store.example", "Hello")) is None
+
+
+def test_subject_template_beats_a_mixed_address():
+    h = SenderHistory(min_count=3, agreement=1.0)
+    for i in range(3):
+        h.add(_f("noreply@ride.example", f"Your trip on {i + 1}/03 receipt #{900 + i}"), True)
+        h.add(_f("noreply@ride.example", "Ride with us this weekend"), False)
+
+    v = h.verdict(_f("noreply@ride.example", "Fwd: Your trip on 12/04 receipt #2001"))
+    assert v["is_receipt"] is True
+    assert h.verdict(_f("noreply@ride.example", "Something new")) is None
+
+
+def test_domain_needs_more_history_than_an_address():
+    h = SenderHistory(min_count=2, agreement=1.0)
+    for i in range(5):
+        h.add(_f(f"user{i}@news.example", f"Issue {i}"), False)
+    assert h.verdict(_f("new@news.example", "Hello")) is None       # 5 < 6
+    h.add(_f("user9@news.example", "Issue 9"), False)
+    assert h.verdict(_f("new@news.example", "Hello"))["is_receipt"] is False
+
+
+def test_automatic_verdicts_are_not_counted():
+    h = SenderHistory(min_count=1, agreement=1.0)
+    h.add_entry({"is_receipt": True, "source": "learned", "features": _f("a@b.example")})
+    h.add_entry({"is_receipt": True, "source": "sender_history", "features": _f("a@b.example")})
+    h.add_entry({"is_receipt": True})
+    assert h.verdict(_f("a@b.example")) is None
+    h.add_entry({"is_receipt": True, "source": "manual", "features": _f("a@b.example")})
+    assert h.verdict(_f("a@b.example"))["is_receipt"] is True
+
+
+@pytest.fixture
+def out(tmp_path, monkeypatch):
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(pe, "_seen_message_ids", set())
+    monkeypatch.setattr(pe, "_sender_history", None)
+    monkeypatch.setattr(pe, "SENDER_HISTORY_MIN", 3)
+    return tmp_path
+
+
+def _email(uid):
+    return Email(uid=uid, message_id=f"<{uid}@x>", date="Mon, 03 Mar 2025 10:00:00 +0000",
+                 from_="news@letters.example", subject=f"Weekly digest #{uid}", body="",
+                 attachments=[], labels=[], headers={}, text="this week", partial=True)
+
+
+def test_process_email_learns_a_sender_and_stops_asking(out, monkeypatch):
+    month = out / "2025-03"
+    month.mkdir()
+    (month / "2025-03_processed.json").write_text(json.dumps([
+        {"uid": "1", "message_id": "<1@x>", "is_receipt": False,
+         "features": {"from": "news@letters.example", "subject": "Weekly digest #1"}}]))
+
+    calls = []
+
+    class _Resp:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"response": json.dumps({"is_receipt": False, "confidence": 0.9, "reason": "news"})}
+
+    monkeypatch.setattr(pe.requests, "post", lambda *a, **k: calls.append(1) or _Resp())
+
+    for uid in ("2", "3", "4", "5"):
+        pe.process_email(_email(uid))
+
+    assert len(calls) == 2                  # 1 from the ledger + 2 classified = 3
+    ledger = json.loads((month / "2025-03_processed.json").read_text())
+    assert [e.get("source") for e in ledger] == [None, None, None, "sender_history", "sender_history"]
+    assert all(e["is_receipt"] is False for e in ledger)
+
+
+def test_receipt_rate_reads_any_history():
+    h = SenderHistory()
+    assert h.receipt_rate(_f("shop@store.example")) is None
+    for is_receipt in (True, True, False):
+        h.add(_f("shop@store.example"), is_receipt)
+    assert h.receipt_rate(_f("shop@store.example")) == (3 / 5, 3)
+    assert h.receipt_rate(_f("other@store.example"))[1] == 3      # the domain's
+
+
+def test_freemail_domain_history_never_decides():
+    h = SenderHistory(min_count=2, agreement=0.95)
+    for n in range(10):
+        h.add(_f(f"friend{n}@gmail.com", f"Hi {n}"), False)
+    assert h.verdict(_f("dad@gmail.com", "Fwd: חשבונית מס 77")) is None
+    assert h.receipt_rate(_f("dad@gmail.com")) is None
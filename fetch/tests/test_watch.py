@@ -0,0 +1,84 @@
+import pytest
+
+import watch
+from models import Email
+
+
+def _email(uid):
+    return Email(uid=uid, message_id=f"<{uid}>", date="d", from_="f", subject="s",
+                 body="", attachments=[], labels=[], headers={}, partial=True)
+
+
+class FakeOllama:
+    stopping = False
+
+    def call(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+class FakeMailbox:
+    """Scripted IDLE wakes; `arrivals` are the UIDs each wake brings."""
+
+    def __init__(self, ollama, recent, arrivals):
+        self.ollama = ollama
+        self.recent = list(recent)
+        self.arrivals = list(arrivals)
+        self.searches_after = []
+
+    def search_dates(self, since, before=None):
+        return list(self.recent)
+
+    def search_after(self, uid):
+        self.searches_after.append(uid)
+        return [u for u in self.recent if int(u) > uid]
+
+    def idle(self, timeout, stop=None):
+        if not self.arrivals:
+            self.ollama.stopping = True
+            return False
+        self.recent += self.arrivals.pop(0)
+        return True
+
+    def peek(self, uids, preview_bytes):
+        return {uid: _email(uid) for uid in uids}
+
+    def get(self, uid):
+        return _email(uid)
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    seen = {"<1>"}
+    done = []
+
+    def process(em, fetch_full):
+        done.append(em.uid)
+        seen.add(em.message_id)
+
+    monkeypatch.setattr(watch, "process_email", process)
+    monkeypatch.setattr(watch, "_get_seen_message_ids", lambda: seen)
+    return done
+
+
+def test_watch_catches_up_then_processes_each_arrival(processed):
+    ollama = FakeOllama()
+    mb = FakeMailbox(ollama, recent=["1", "2"], arrivals=[["3"], ["4", "5"]])
+    watch.watch(mb, ollama, lookback_days=3, sync_every=3600, idle_max=60)
+
+    assert processed == ["2", "3", "4", "5"]    # uid 1 was already processed
+    assert mb.searches_after == [2, 3]          # only what's above the last UID
+
+
+def test_watch_periodic_sync_skips_what_was_seen(processed):
+    ollama = FakeOllama()
+    mb = FakeMailbox(ollama, recent=["1", "2"], arrivals=[[], ["3"]])
+    # sync_every=0: every loop also does a catch-up over the lookback window
+    watch.watch(mb, ollama, lookback_days=3, sync_every=0, idle_max=60)
+    assert processed == ["2", "3"]
+
+
+def test_process_uids_stops_when_asked(processed):
+    ollama = FakeOllama()
+    ollama.stopping = True
+    assert watch.process_uids(FakeMailbox(ollama, [], []), ollama, ["2", "3"]) == 0
+    assert processed == []
@@ -0,0 +1,161 @@
+import glob
+import json
+import threading
+
+import pytest
+import requests
+
+import classify_worker
+import fetch_emails as fe
+import mailbox_wrapper
+import process_email as pe
+from bench.corpus import generate
+from bench.fake_imap import FakeIMAPServer
+from bench.fake_ollama import FakeOllama
+from work_queue import QueueServer, RemoteQueue, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / "queue.sqlite3"), lease_seconds=60, max_attempts=2)
+
+
+def test_lease_ack_and_finish(queue):
+    assert queue.put("<a>", {"n": 1}) == "pending"
+    assert queue.put("<b>", {"n": 2}) == "pending"
+    assert queue.put("<a>", {"n": 1}) == "pending"       # already queued: no second copy
+
+    assert queue.lease("w1") == ("<a>", {"n": 1})         # oldest first
+    assert queue.lease("w2") == ("<b>", {"n": 2})
+    assert queue.lease("w3") is None
+    assert queue.finished(["<a>", "<b>"]) == {}
+
+    assert queue.ack("<a>", "w1", {"verdict": True})
+    assert not queue.ack("<a>", "w1", {"verdict": False})  # done already
+    assert queue.finished(["<a>", "<b>"]) == {"<a>": ("classified", {"verdict": True})}
+    assert queue.put("<a>", {"n": 1}) == "classified"      # a resumed run finds the verdict
+
+    queue.remove("<a>")
+    assert queue.counts() == {"leased": 1}
+
+
+def test_expired_lease_goes_to_the_next_worker(queue, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("work_queue.time.time", lambda: now[0])
+    queue.put("<a>", {})
+    assert queue.lease("w1")
+    now[0] += 61                                           # w1 hung
+    assert queue.lease("w2") == ("<a>", {})
+    assert queue.ack("<a>", "w1", {"late": True})          # a late verdict still counts
+    now[0] += 61
+    assert queue.lease("w3") is None
+
+
+def test_failures_retry_then_fail_until_requeued(queue):
+    queue.put("<a>", {})
+    queue.lease("w1")
+    queue.fail("<a>", "w1", "HTTPError: 500")
+    assert queue.counts() == {"pending": 1}
+    queue.lease("w2")
+    queue.fail("<a>", "w2", "HTTPError: 500")              # out of attempts
+    assert queue.finished(["<a>"]) == {"<a>": ("failed", "HTTPError: 500")}
+    assert queue.lease("w3") is None
+
+    assert queue.put("<a>", {}) == "pending"               # the next run tries again
+    assert queue.lease("w3") == ("<a>", {})
+
+
+def test_remote_queue_over_http(queue):
+    queue.put("<a>", {"text": "חשבונית"})
+    with QueueServer(queue, token="s3cret") as server:
+        with pytest.raises(requests.HTTPError):
+            RemoteQueue(server.url).lease("w1")
+        remote = RemoteQueue(server.url, token="s3cret")
+        assert remote.lease("w1") == ("<a>", {"text": "חשבונית"})
+        assert remote.lease("w1") is None
+        assert remote.ack("<a>", "w1", {"ok": 1})
+    assert queue.finished(["<a>"]) == {"<a>": ("classified", {"ok": 1})}
+
+
+def test_server_answers_a_bad_request_with_400(queue):
+    with QueueServer(queue) as server:
+        assert requests.post(f"{server.url}/lease", data=b"{not json").status_code == 400
+        assert requests.post(f"{server.url}/ack", json={"key": "<a>"}).status_code == 400
+        assert requests.post(f"{server.url}/lease", json={"worker": "w1"}).status_code == 200
+
+
+def test_worker_outlives_an_unreachable_queue(queue):
+    with QueueServer(queue) as server:
+        url = server.url
+    stops = iter([False, False, False, True])              # three refused leases, then stop
+    assert classify_worker.run(RemoteQueue(url), "w1", stop=lambda: next(stops), poll=0) == 0
+    assert next(stops, None) is None
+
+
+def test_server_needs_a_token_off_loopback(queue):
+    with pytest.raises(ValueError):
+        QueueServer(queue, "0.0.0.0")
+    with QueueServer(queue, "0.0.0.0", token="s3cret"), QueueServer(queue, "localhost"):
+        pass
+
+
+def test_worker_fails_items_it_cannot_classify(queue, monkeypatch):
+    def broken(*a, **k):
+        raise requests.ConnectionError("refused")
+
+    monkeypatch.setattr(pe, "classify_cascade", broken)
+    queue.put("<a>", {"uid": "1", "message_id": "<a>", "from": "f", "subject": "s",
+                      "attachments": [], "text": ""})
+    assert classify_worker.run(queue, "w1", exit_idle=True) == 0
+    assert queue.finished(["<a>"])["<a>"][0] == "failed"   # two attempts, both failed
+
+
+def test_end_to_end_with_local_and_remote_workers(tmp_path, monkeypatch):
+    corpus, out = tmp_path / "corpus", tmp_path / "out"
+    generate(str(corpus), messages=30, large_pdf_mb=0.1, seed=5)
+    server = FakeIMAPServer(str(corpus))
+    monkeypatch.setattr(mailbox_wrapper.imaplib, "IMAP4_SSL", server.connect)
+    monkeypatch.setattr(fe.OllamaManager, "handle_signals", lambda self: None)
+    monkeypatch.setattr(pe, "OUTPUT_DIR", str(out))
+    monkeypatch.setattr(pe, "_seen_message_ids", None)
+    monkeypatch.setattr(pe, "SENDER_HISTORY", False)
+    monkeypatch.setattr(pe, "DUPLICATES", False)
+    monkeypatch.setenv("GMAIL_USER", "u@example.com")
+    monkeypatch.setenv("GMAIL_APP_PASSWORD", "x")
+    monkeypatch.setenv("FETCH_SINCE", "2025-01-01")
+    monkeypatch.delenv("FETCH_BEFORE", raising=False)
+    monkeypatch.delenv("FETCH_JOB", raising=False)
+    monkeypatch.delenv("FETCH_QUERY", raising=False)
+    path = str(tmp_path / "queue.sqlite3")
+    monkeypatch.setattr(fe, "QUEUE_PATH", path)
+    monkeypatch.setattr(fe, "QUEUE_AHEAD", 8)
+    monkeypatch.setattr(fe, "QUEUE_POLL_SECONDS", 0.01)
+
+    done = threading.Event()
+    with (FakeOllama(latency=0.01) as local, FakeOllama(latency=0.01) as remote,
+          QueueServer(WorkQueue(path)) as queue_server):
+        workers = [
+            threading.Thread(target=classify_worker.run, kwargs=dict(
+                queue=WorkQueue(path), worker="local", url=local.url, stop=done.is_set,
+                poll=0.01)),
+            threading.Thread(target=classify_worker.run, kwargs=dict(
+                queue=RemoteQueue(queue_server.url), worker="remote", url=remote.url,
+                stop=done.is_set, poll=0.01)),
+        ]
+        for w in workers:
+            w.start()
+        try:
+            fe.main()
+        finally:
+            done.set()
+            for w in workers:
+                w.join()
+
+    assert local.generate_calls and remote.generate_calls
+    assert local.generate_calls + remote.generate_calls == 30
+    ledger = [e for p in glob.glob(str(out / "*" / "*_processed.json"))
+              for e in json.loads(open(p).read())]
+    assert len(ledger) == 30
+    receipts = [p for p in glob.glob(str(out / "*" / "*.json")) if "_processed" not in p]
+    assert len(receipts) == sum(e["is_receipt"] for e in ledger) > 0
+    assert WorkQueue(path).counts() == {}
@@ -0,0 +1,116 @@
+"""
+Long-running fetch: receipts land in OUTPUT_DIR within seconds of arriving.
+
+Holds one Mailbox on All Mail in IMAP IDLE. When the server announces new mail
+(EXISTS) it fetches the UIDs above the last one seen, previews and classifies
+them like a normal run, and downloads the receipts. IDLE is renewed every
+WATCH_IDLE_MINUTES (default 25; Gmail drops idlers after ~29) and a dropped
+connection is re-established.
+
+Every WATCH_SYNC_MINUTES (default 30) and at startup it also does a catch-up
+sync over the last WATCH_LOOKBACK_DAYS days (default 3), the same search a
+batch run does. Anything IDLE missed (a reconnect gap, downtime) is picked up
+there; what was already processed is skipped by Message-ID, so the sync costs
+one search and a preview of the few unseen emails.
+
+SIGTERM/SIGINT stop it after the email in hand.
+"""
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import fetch_emails as fe
+import learned
+import process_email as pe
+from bandwidth import OverBudget, QuotaExceeded
+from mailbox_wrapper import Mailbox
+from ollama_manager import OllamaManager
+from process_email import process_email, _get_seen_message_ids
+
+
+def process_uids(mb: Mailbox, ollama: OllamaManager, uids: list[str], model=None) -> int:
+    """Preview, dedup and classify; returns how many emails were processed."""
+    processed = 0
+    for batch in fe.batches(uids):
+        try:
+            previews = mb.peek(batch, fe.PREVIEW_BYTES)
+        except QuotaExceeded as e:
+            print(f"{e}. Trying again at the next sync.")
+            return processed
+        learned.prejudge(model, previews)
+        for uid in batch:
+            if ollama.stopping:
+                return processed
+            em = previews.get(uid)
+            if em is None or em.message_id in _get_seen_message_ids():
+                continue
+            try:
+                ollama.call(process_email, em, fetch_full=mb.get)
+            except (OverBudget, QuotaExceeded) as e:
+                # Not in the ledger, so the next catch-up finds it again.
+                fe.defer(em, 0, 0, e)
+                continue
+            processed += 1
+    return processed
+
+
+def catch_up(mb: Mailbox, ollama: OllamaManager, lookback_days: int, model=None) -> list[str]:
+    since = date.today() - timedelta(days=lookback_days)
+    uids = mb.search_dates(since)
+    n = process_uids(mb, ollama, uids, model)
+    print(f"Catch-up since {since}: {len(uids)} emails, {n} new")
+    return uids
+
+
+def watch(mb: Mailbox, ollama: OllamaManager, lookback_days: int,
+          sync_every: float, idle_max: float) -> None:
+    """Run until ollama.stopping: IDLE, process new UIDs, sync periodically.
+    The learned model is retrained, when due, at each sync."""
+    model = learned.maybe_retrain()
+    uids = catch_up(mb, ollama, lookback_days, model)
+    last_uid = max((int(u) for u in uids), default=0)
+    next_sync = time.monotonic() + sync_every
+
+    while not ollama.stopping:
+        wait = max(0.0, min(idle_max, next_sync - time.monotonic()))
+        if mb.idle(wait, stop=lambda: ollama.stopping):
+            new = mb.search_after(last_uid) if last_uid else mb.search_dates(date.today())
+            if new:
+                t0 = time.time()
+                n = process_uids(mb, ollama, new, model)
+                last_uid = max([last_uid] + [int(u) for u in new])
+                print(f"{len(new)} new emails, {n} processed in {time.time() - t0:.1f}s")
+        if time.monotonic() >= next_sync and not ollama.stopping:
+            model = learned.maybe_retrain()
+            uids = catch_up(mb, ollama, lookback_days, model)
+            last_uid = max([last_uid] + [int(u) for u in uids])
+            next_sync = time.monotonic() + sync_every
+
+
+def main():
+    user = os.environ.get("GMAIL_USER")
+    password = os.environ.get("GMAIL_APP_PASSWORD")
+    if not user or not password:
+        print("Set GMAIL_USER and GMAIL_APP_PASSWORD environment variables", file=sys.stderr)
+        sys.exit(1)
+
+    lookback_days = int(os.environ.get("WATCH_LOOKBACK_DAYS") or 3)
+    sync_every = float(os.environ.get("WATCH_SYNC_MINUTES") or 30) * 60
+    idle_max = float(os.environ.get("WATCH_IDLE_MINUTES") or 25) * 60
+
+    ollama = fe.start_ollama()
+    ollama.handle_signals()
+    print(f"Connecting to Gmail as {user}...")
+    mb = fe.open_mailbox(user, password)
+    print(f"Watching for new mail (catch-up every {sync_every / 60:g} min)")
+    try:
+        watch(mb, ollama, lookback_days, sync_every, idle_max)
+    finally:
+        mb.logout()
+        ollama.shutdown()
+    print(f"Stopped. {pe.llm_stats_line()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+A durable classification queue in SQLite, so the LLM work of a fetch run can be
+shared by any number of worker processes (classify_worker.py), on this host or
+others, each with its own Ollama.
+
+The fetch run (fetch_emails.py with CLASSIFY_QUEUE set) stays the only writer
+of results: it enqueues the previews that need the LLM and applies each verdict
+to the ledger (process_email) as it comes back. Workers only lease, classify
+and ack. An item moves
+
+    pending -> leased -> classified -> (applied: deleted)
+
+A lease lasts LEASE_SECONDS; a worker that dies or hangs loses it, and the item
+goes to the next worker that asks. A classification that fails goes back to
+pending, up to MAX_ATTEMPTS leases, then to failed: the fetch run reports it
+and leaves the email for its next run, whose put() makes it pending again.
+Items are keyed by Message-ID, so a fetch run resumed after a crash picks up
+the verdicts its predecessor never applied instead of asking again.
+
+Workers on other hosts reach the queue over HTTP: the fetch run serves it on
+CLASSIFY_QUEUE_PORT (QueueServer), and a worker given an http:// URL instead of
+a path uses RemoteQueue, which has the same lease / ack / fail methods. With
+CLASSIFY_QUEUE_TOKEN set, the server only answers requests carrying it; it
+won't listen anywhere but loopback without one.
+"""
+import contextlib
+import ipaddress
+import json
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+LEASE_SECONDS = float(os.environ.get("CLASSIFY_LEASE_SECONDS") or 600)
+MAX_ATTEMPTS = int(os.environ.get("CLASSIFY_MAX_ATTEMPTS") or 3)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key         TEXT PRIMARY KEY,
+    payload     TEXT NOT NULL,
+    state       TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    lease_until REAL,
+    result      TEXT,
+    error       TEXT,
+    enqueued    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, enqueued);
+"""
+
+# SQLite's default cap on host parameters is 999 in older builds.
+_IN_CHUNK = 500
+
+
+class WorkQueue:
+    """The queue in one SQLite file. Safe to share between threads and
+    between processes on one host (not over a network file system: use
+    QueueServer for other hosts)."""
+
+    def __init__(self, path: str, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with contextlib.closing(sqlite3.connect(path, timeout=30)) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """A connection in a write transaction, committed on success."""
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    # --- the fetch run's side ------------------------------------------------
+
+    def put(self, key: str, payload: dict) -> str:
+        """Enqueue an item unless it is already queued, and return its state.
+        An item that failed before is given a fresh set of attempts."""
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO items (key, payload, enqueued) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = 'pending', attempts = 0, "
+                "worker = NULL, lease_until = NULL, error = NULL WHERE state = 'failed'",
+                (key, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            return db.execute("SELECT state FROM items WHERE key = ?", (key,)).fetchone()[0]
+
+    def finished(self, keys: list[str]) -> dict[str, tuple[str, dict | str]]:
+        """Of `keys`, those done with: key -> ("classified", result) or
+        ("failed", error)."""
+        done = {}
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            for start in range(0, len(keys), _IN_CHUNK):
+                chunk = keys[start:start + _IN_CHUNK]
+                rows = db.execute(
+                    f"SELECT key, state, result, error FROM items WHERE key IN "
+                    f"({','.join('?' * len(chunk))}) AND state IN ('classified', 'failed')",
+                    chunk,
+                )
+                for key, state, result, error in rows:
+                    done[key] = (state, json.loads(result) if state == "classified" else error)
+        finally:
+            db.close()
+        return done
+
+    def remove(self, key: str) -> None:
+        """Forget an item whose result was applied."""
+        with self._transaction() as db:
+            db.execute("DELETE FROM items WHERE key = ?", (key,))
+
+    def counts(self) -> dict[str, int]:
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            return dict(db.execute("SELECT state, COUNT(*) FROM items GROUP BY state"))
+        finally:
+            db.close()
+
+    # --- the workers' side ---------------------------------------------------
+
+    def lease(self, worker: str, seconds: float | None = None) -> tuple[str, dict] | None:
+        """The oldest item waiting (pending, or leased to a worker whose lease
+        ran out), now leased to `worker`; None when there is none. An item out
+        of attempts is marked failed instead of handed out again."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE items SET state = 'failed', error = COALESCE(error, 'lease expired') "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT key, payload FROM items WHERE state = 'pending' "
+                "OR (state = 'leased' AND lease_until < ?) ORDER BY enqueued LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE items SET state = 'leased', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE key = ?",
+                (worker, now + (seconds or self.lease_seconds), row[0]),
+            )
+        return row[0], json.loads(row[1])
+
+    def ack(self, key: str, worker: str, result: dict) -> bool:
+        """Store an item's result. A late ack (the lease ran out and the item
+        went back in line) still counts: the verdict is as good as the next
+        one would be. False if the item is already done or gone."""
+        with self._transaction() as db:
+            return db.execute(
+                "UPDATE items SET state = 'classified', worker = ?, result = ?, "
+                "lease_until = NULL WHERE key = ? AND state IN ('leased', 'pending')",
+                (worker, json.dumps(result, ensure_ascii=False), key),
+            ).rowcount == 1
+
+    def fail(self, key: str, worker: str, error: str) -> None:
+        """Give an item back after a failed classification: to the next
+        worker, or to failed when it is out of attempts."""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, lease_until = NULL WHERE key = ? AND state = 'leased' AND worker = ?",
+                (self.max_attempts, error[:500], key, worker),
+            )
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class QueueServer:
+    """Serves a WorkQueue's worker side (lease / ack / fail) over HTTP on
+    host:port, in a background thread, for workers on other hosts. ValueError
+    for a host other than loopback without a token: anyone who can reach it
+    could read the queued emails."""
+
+    def __init__(self, queue: WorkQueue, host: str = "127.0.0.1", port: int = 0,
+                 token: str = ""):
+        if not token and not _is_loopback(host):
+            raise ValueError(f"Won't serve the classification queue on {host} "
+                             f"without CLASSIFY_QUEUE_TOKEN")
+        self.queue = queue
+        self.token = token
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        assert isinstance(host, str)
+        return f"http://{host}:{port}"
+
+    def start(self) -> "QueueServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "QueueServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, payload) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if server.token and self.headers.get("Authorization") != f"Bearer {server.token}":
+                    self._reply(401, {"error": "bad token"})
+                    return
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                    if not isinstance(request, dict):
+                        raise ValueError("not a JSON object")
+                except ValueError as e:
+                    self._reply(400, {"error": f"bad request: {e}"})
+                    return
+                q = server.queue
+                try:
+                    if self.path == "/lease":
+                        item = q.lease(request["worker"], request.get("seconds"))
+                        self._reply(200, item and {"key": item[0], "payload": item[1]})
+                    elif self.path == "/ack":
+                        self._reply(200, q.ack(request["key"], request["worker"], request["result"]))
+                    elif self.path == "/fail":
+                        q.fail(request["key"], request["worker"], request["error"])
+                        self._reply(200, None)
+                    else:
+                        self._reply(404, {"error": f"no such call: {self.path}"})
+                except KeyError as e:
+                    self._reply(400, {"error": f"bad request: missing {e}"})
+                except Exception as e:  # the queue's own failure, not the worker's
+                    self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+        return Handler
+
+
+class RemoteQueue:
+    """A worker's view of a queue served by QueueServer at `url`."""
+
+    def __init__(self, url: str, token: str = ""):
+        self.url = url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    def _call(self, name: str, request: dict):
+        resp = requests.post(f"{self.url}/{name}", json=request, headers=self.headers, timeout=30)
+        resp.raise_for_status()
+        return resp.json()
+
+    def lease(self, worker: str, seconds: float | None = None) -> tuple[str, dict] | None:
+        item = self._call("lease", {"worker": worker, "seconds": seconds})
+        return (item["key"], item["payload"]) if item else None
+
+    def ack(self, key: str, worker: str, result: dict) -> bool:
+        return self._call("ack", {"key": key, "worker": worker, "result": result})
+
+    def fail(self, key: str, worker: str, error: str) -> None:
+        self._call("fail", {"key": key, "worker": worker, "error": error})
+
+
+def open_queue(location: str, token: str = "") -> WorkQueue | RemoteQueue:
+    """A queue by file path, or by the http:// URL of a QueueServer."""
+    if location.startswith(("http://", "https://")):
+        return RemoteQueue(location, token)
+    return WorkQueue(location)
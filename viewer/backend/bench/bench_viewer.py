@@ -0,0 +1,310 @@
+"""
+Latency and load benchmark for the viewer backend.
+
+Builds a synthetic archive (generate_archive.py), points main.py's OUTPUT_DIR
+at it, and measures the API in two phases:
+
+  sequential  each route N times through FastAPI's TestClient (no network),
+              giving per-route latency and response size
+  revalidate  the same, each request carrying the ETag of the first response
+              (If-None-Match), as a browser revalidating its cached copy does
+  load        a real uvicorn server on a local port hammered by --concurrency
+              client threads for --duration seconds, giving throughput and
+              latency under contention
+
+Reports p50/p95/p99 per route, wire bytes per response and process memory,
+stores the run as results/<timestamp>.json, and with --baseline compares
+against an earlier run, exiting non-zero when a route's p95 or the load
+throughput regressed past --tolerance.
+
+Needs httpx (`pip install httpx`) on top of the backend's requirements; the
+PDF route is only measured with --pdf and a working Playwright install.
+
+Usage (from viewer/backend/):
+    python -m bench.bench_viewer [--months N] [--receipts M] [--pdf] \
+        [--baseline bench/results/baseline.json]
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bench.generate_archive import generate
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)), 1) - 1]
+
+
+def _memory() -> dict:
+    """Current and peak RSS of this process, in MB (Linux)."""
+    with open("/proc/self/statm") as f:
+        rss_pages = int(f.read().split()[1])
+    return {
+        "rss_mb": round(rss_pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _routes(output_dir: str, with_pdf: bool) -> dict[str, list[str]]:
+    """Route name -> concrete URLs to cycle through, sampled from the archive."""
+    months = sorted(
+        (m for m in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, m))),
+        reverse=True,
+    )
+    rng = random.Random(7)
+    receipts, attachments = [], []
+    for month in months:
+        for name in sorted(os.listdir(os.path.join(output_dir, month))):
+            if not name.endswith(".json") or name.endswith("_processed.json"):
+                continue
+            base = name[: -len(".json")]
+            receipts.append(f"/api/months/{month}/receipts/{base}")
+            att_dir = os.path.join(output_dir, month, base)
+            if os.path.isdir(att_dir):
+                for att in os.listdir(att_dir):
+                    attachments.append(f"/api/months/{month}/attachments/{base}/{att}")
+    routes = {
+        "months": ["/api/months"],
+        "labels": ["/api/labels"],
+        "receipts": [f"/api/months/{m}/receipts" for m in months],
+        "ledger": [f"/api/months/{m}/ledger" for m in months],
+        "receipt": rng.sample(receipts, min(len(receipts), 50)),
+        "attachment": rng.sample(attachments, min(len(attachments), 50)),
+        "marks": ["/api/marks"],
+    }
+    if with_pdf:
+        routes["pdf"] = [u + "/pdf" for u in routes["receipt"][:5]]
+    return routes
+
+
+def _stats(latencies: list[float], sizes: list[int], errors: int) -> dict:
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "mean_bytes": int(sum(sizes) / len(sizes)) if sizes else 0,
+    }
+
+
+def run_sequential(app, routes: dict[str, list[str]], iterations: int, encoding: str,
+                   revalidate: bool = False) -> dict:
+    """
+    Each route `iterations` times through the in-process TestClient. With
+    revalidate, every URL is fetched once untimed and then requested with its
+    ETag, so the timings are of 304s wherever a route supports them.
+    """
+    from fastapi.testclient import TestClient
+
+    results = {}
+    with TestClient(app) as client:
+        for name, urls in routes.items():
+            if not urls:
+                continue
+            etags = {}
+            if revalidate:
+                for url in urls[:iterations]:
+                    etags[url] = client.get(url, headers={"Accept-Encoding": encoding}).headers.get("etag")
+            latencies, sizes, errors = [], [], 0
+            n = min(iterations, 3) if name == "pdf" else iterations
+            for i in range(n):
+                url = urls[i % len(urls)]
+                headers = {"Accept-Encoding": encoding}
+                if etags.get(url):
+                    headers["If-None-Match"] = etags[url]
+                t0 = time.perf_counter()
+                resp = client.get(url, headers=headers)
+                latencies.append(time.perf_counter() - t0)
+                sizes.append(resp.num_bytes_downloaded)
+                errors += resp.status_code >= 400
+            results[name] = _stats(latencies, sizes, errors)
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_load(app, routes: dict[str, list[str]], concurrency: int, duration: float,
+             encoding: str) -> dict:
+    """Concurrent HTTP load against a real uvicorn server in this process."""
+    import httpx
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    # Weighted like a real session: list views dominate, attachments follow.
+    mix = [name for name, weight in (
+        ("months", 1), ("labels", 1), ("receipts", 4), ("ledger", 2),
+        ("receipt", 4), ("attachment", 2), ("marks", 1),
+    ) if routes.get(name) for _ in range(weight)]
+    samples: dict[str, list[tuple[float, int, bool]]] = {name: [] for name in routes}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            while time.perf_counter() < deadline:
+                name = rng.choice(mix)
+                url = rng.choice(routes[name])
+                t0 = time.perf_counter()
+                try:
+                    resp = client.get(url, headers={"Accept-Encoding": encoding})
+                    sample = (time.perf_counter() - t0, resp.num_bytes_downloaded,
+                              resp.status_code >= 400)
+                except httpx.HTTPError:
+                    sample = (time.perf_counter() - t0, 0, True)
+                with lock:
+                    samples[name].append(sample)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    server.should_exit = True
+    thread.join()
+
+    total = sum(len(s) for s in samples.values())
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "requests": total,
+        "requests_per_sec": round(total / elapsed, 1),
+        "routes": {
+            name: _stats([s[0] for s in ss], [s[1] for s in ss], sum(s[2] for s in ss))
+            for name, ss in samples.items() if ss
+        },
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Human-readable regressions of `current` against `baseline`."""
+    regressions = []
+    for phase in ("sequential", "revalidate"):
+        for name, cur in current.get(phase, {}).items():
+            base = baseline.get(phase, {}).get(name)
+            if base and base["p95_ms"] and cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{phase}/{name}: p95 {base['p95_ms']} ms -> {cur['p95_ms']} ms")
+    cur_load, base_load = current.get("load"), baseline.get("load")
+    if cur_load and base_load and (
+        cur_load["requests_per_sec"] < base_load["requests_per_sec"] * (1 - tolerance)
+    ):
+        regressions.append(
+            f"load: {base_load['requests_per_sec']} -> {cur_load['requests_per_sec']} req/s")
+    return regressions
+
+
+def _print_table(title: str, routes: dict) -> None:
+    print(f"\n{title}")
+    for name, s in routes.items():
+        print(f"  {name:<11} n={s['count']:<6} p50 {s['p50_ms']:>8.2f}  p95 {s['p95_ms']:>8.2f}"
+              f"  p99 {s['p99_ms']:>8.2f} ms  {s['mean_bytes']:>9} B  errors {s['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--receipts", type=int, default=200, help="receipts per month")
+    parser.add_argument("--body-kb", type=int, default=40)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="load phase seconds")
+    parser.add_argument("--no-load", action="store_true", help="skip the HTTP load phase")
+    parser.add_argument("--pdf", action="store_true", help="also time the PDF route")
+    parser.add_argument("--encoding", default="gzip, br",
+                        help="Accept-Encoding to send; 'identity' measures uncompressed responses")
+    parser.add_argument("--archive", help="reuse an existing archive instead of generating")
+    parser.add_argument("--out", default=RESULTS_DIR)
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-archive-") as scratch:
+        archive = args.archive or scratch
+        if not args.archive:
+            print(f"Generating {args.months} months x {args.receipts} receipts...")
+            generate(archive, args.months, args.receipts, args.body_kb)
+
+        # main.py reads OUTPUT_DIR at import time, so set it first.
+        os.environ["OUTPUT_DIR"] = archive
+        main_module = importlib.import_module("main")
+
+        result = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "params": {k: getattr(args, k) for k in (
+                "months", "receipts", "body_kb", "iterations", "concurrency", "duration",
+                "encoding")},
+            "memory": {"start": _memory()},
+        }
+        routes = _routes(archive, args.pdf)
+
+        print("Sequential phase...")
+        result["sequential"] = run_sequential(main_module.app, routes, args.iterations,
+                                              args.encoding)
+        result["memory"]["after_sequential"] = _memory()
+
+        print("Revalidate phase...")
+        result["revalidate"] = run_sequential(main_module.app, routes, args.iterations,
+                                              args.encoding, revalidate=True)
+
+        if not args.no_load:
+            print(f"Load phase ({args.concurrency} clients, {args.duration:.0f}s)...")
+            result["load"] = run_load(main_module.app, routes, args.concurrency, args.duration,
+                                      args.encoding)
+            result["memory"]["after_load"] = _memory()
+
+    _print_table("Sequential (TestClient)", result["sequential"])
+    _print_table("Revalidate (If-None-Match)", result["revalidate"])
+    if "load" in result:
+        load = result["load"]
+        _print_table(
+            f"Load: {load['requests']} requests in {load['seconds']}s "
+            f"({load['requests_per_sec']} req/s)", load["routes"])
+    print(f"\nMemory: {result['memory']}")
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) vs {args.baseline}:")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print(f"\nNo regressions vs {args.baseline} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Synthetic OUTPUT_DIR for benchmarking the viewer backend.
+
+Writes N month folders with M receipts each, in the layout the fetch pipeline
+produces: <base_name>.json receipts (with a realistic HTML body), a
+<base_name>/ attachment folder for some of them, the month's
+<month>_processed.json ledger (about ten seen emails per receipt), and a
+marks.json at the root marking a slice of the receipts.
+
+Deterministic for a given seed.
+
+Usage (from viewer/backend/):
+    python -m bench.generate_archive <dir> [--months N] [--receipts M]
+"""
+import argparse
+import json
+import os
+import random
+
+SENDERS = [
+    "Example Store <orders@store.example.com>",
+    "Ride Co <receipts@ride.example.net>",
+    "חברת החשמל <bills@iec.example.co.il>",
+    "Cloud Host <billing@cloud.example.io>",
+]
+LABELS = ["\\Important", "\\Inbox", "Receipts", "Travel", "Tax", "Work"]
+
+
+def _body(rng: random.Random, kb: int) -> str:
+    row = "<tr><td>Item {i}</td><td dir='auto'>פריט {i}</td><td>{p:.2f}</td></tr>"
+    rows = []
+    size = 0
+    i = 0
+    while size < kb * 1024:
+        r = row.format(i=i, p=rng.uniform(1, 500))
+        rows.append(r)
+        size += len(r.encode())
+        i += 1
+    return f"<html><body><table>{''.join(rows)}</table></body></html>"
+
+
+def _month_names(months: int) -> list[str]:
+    names = []
+    year, month = 2025, 12
+    for _ in range(months):
+        names.append(f"{year}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return names
+
+
+def generate(
+    out_dir: str,
+    months: int = 12,
+    receipts: int = 200,
+    body_kb: int = 40,
+    attachment_kb: int = 120,
+    seed: int = 1,
+) -> None:
+    """Write the archive into out_dir (created if missing)."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    marks: dict[str, dict[str, str]] = {}
+    uid = 100000
+
+    for month in _month_names(months):
+        month_dir = os.path.join(out_dir, month)
+        os.makedirs(month_dir, exist_ok=True)
+        ledger = []
+        for n in range(receipts * 10):
+            uid += 1
+            day = 1 + n * 27 // (receipts * 10)
+            timestamp = f"{month}-{day:02d}T{n % 24:02d}-{n % 60:02d}-{(n * 7) % 60:02d}"
+            is_receipt = n % 10 == 0
+            ledger.append({
+                "uid": str(uid),
+                "message_id": f"<bench-{uid}@archive.example>",
+                "timestamp": timestamp,
+                "is_receipt": is_receipt,
+            })
+            if not is_receipt:
+                continue
+
+            base_name = f"{timestamp}_{uid}"
+            attachments = []
+            if rng.random() < 0.6:
+                attachments = [f"invoice-{uid}.pdf"]
+                att_dir = os.path.join(month_dir, base_name)
+                os.makedirs(att_dir, exist_ok=True)
+                with open(os.path.join(att_dir, attachments[0]), "wb") as f:
+                    f.write(b"%PDF-1.4\n" + rng.randbytes(attachment_kb * 1024))
+            data = {
+                "uid": str(uid),
+                "message_id": f"<bench-{uid}@archive.example>",
+                "date": f"Mon, {day:02d} Jan 2025 10:00:00 +0000",
+                "from": rng.choice(SENDERS),
+                "subject": f"Your receipt #{uid}",
+                "body": _body(rng, body_kb),
+                "classification": {
+                    "is_receipt": True,
+                    "confidence": round(rng.uniform(0.5, 1.0), 2),
+                    "reason": "order confirmation",
+                },
+                "attachments": attachments,
+                "labels": rng.sample(LABELS, rng.randint(0, 3)),
+                "to": "me@example.com",
+                "cc": "",
+            }
+            with open(os.path.join(month_dir, f"{base_name}.json"), "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+
+            roll = rng.random()
+            if roll < 0.15:
+                marks.setdefault(month, {})[base_name] = "export" if roll < 0.1 else "hide"
+
+        with open(os.path.join(month_dir, f"{month}_processed.json"), "w", encoding="utf-8") as f:
+            json.dump(ledger, f, indent=2, ensure_ascii=False)
+
+    with open(os.path.join(out_dir, "marks.json"), "w", encoding="utf-8") as f:
+        json.dump(marks, f, indent=2, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--receipts", type=int, default=200, help="receipts per month")
+    parser.add_argument("--body-kb", type=int, default=40)
+    parser.add_argument("--attachment-kb", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    generate(args.out_dir, args.months, args.receipts, args.body_kb,
+             args.attachment_kb, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compression of the API's JSON responses, chosen per request from
+Accept-Encoding: brotli when the optional brotli package is installed and the
+client takes it, gzip otherwise.
+
+A month's receipt list is mostly text and repeated field names, and shrinks
+several times over. Only JSON is touched: attachments and PDFs are compressed
+already and answer Range requests, the export ZIP has a fixed length for
+resuming, the event stream must not be held back, and a stored page that is
+compressed on disk says so itself (Content-Encoding).
+
+A compressed response is a different set of bytes from the plain one, so its
+strong ETag gets the coding appended ("<tag>-br"); etag_matches() takes either
+form when a route checks If-None-Match.
+"""
+import gzip
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is the fallback
+    brotli = None
+
+MINIMUM_SIZE = 1024    # smaller bodies aren't worth the header and the CPU
+BROTLI_QUALITY = 5     # of 11: most of the gain at a fraction of the time
+GZIP_LEVEL = 4         # as small as 6 on receipt JSON, a third faster
+
+
+def accepts(accept_encoding: str | None, coding: str) -> bool:
+    """Whether an Accept-Encoding header allows `coding` (q=0 refuses it)."""
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() in (coding, "*"):
+            q = params.strip().replace(" ", "")
+            return q.rstrip("0").rstrip(".") not in ("q=0", "q=")
+    return False
+
+
+def choose(accept_encoding: str | None) -> str | None:
+    """The coding to compress with for this client, or None."""
+    if brotli is not None and accepts(accept_encoding, "br"):
+        return "br"
+    if accepts(accept_encoding, "gzip"):
+        return "gzip"
+    return None
+
+
+def compress(data: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _with_coding(etag: str, coding: str) -> str:
+    return f'{etag[:-1]}-{coding}"' if etag.endswith('"') else etag
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether If-None-Match names `etag`, in any of its encodings (weak
+    comparison, as If-None-Match uses)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    forms = {etag, _with_coding(etag, "br"), _with_coding(etag, "gzip")}
+    return any(tag.strip().removeprefix("W/") in forms for tag in if_none_match.split(","))
+
+
+class CompressJSON:
+    """ASGI middleware compressing application/json responses (see above)."""
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        coding = choose(request_headers.get("accept-encoding"))
+        start = None            # the held-back response start while buffering
+        body: list[bytes] = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                is_json = headers.get("content-type", "").startswith("application/json")
+                if is_json or message["status"] == 304:
+                    headers.add_vary_header("Accept-Encoding")
+                if message["status"] == 304 and coding and "etag" in headers:
+                    # Answer with the tag of the copy the client holds.
+                    tag = _with_coding(headers["etag"], coding)
+                    if tag in request_headers.get("if-none-match", ""):
+                        headers["etag"] = tag
+                if coding and is_json and "content-encoding" not in headers:
+                    start = message
+                    return
+                await send(message)
+                return
+            if start is None:
+                await send(message)
+                return
+            body.append(message.get("body", b""))
+            if message.get("more_body"):
+                return
+            data = b"".join(body)
+            headers = MutableHeaders(raw=start["headers"])
+            if len(data) >= self.minimum_size:
+                # A large month takes a while; keep the event loop (and the
+                # event stream) running meanwhile.
+                data = await run_in_threadpool(compress, data, coding)
+                headers["content-encoding"] = coding
+                if "etag" in headers:
+                    headers["etag"] = _with_coding(headers["etag"], coding)
+            headers["content-length"] = str(len(data))
+            await send(start)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,11 +1,30 @@
+import asyncio
 import collections
+import csv
+import functools
 import glob
+import gzip
+import hashlib
+import io
 import json
 import os
+import re
+import threading
+from datetime import date
 
-from fastapi import Body, FastAPI, HTTPException, Response
+from fastapi import Body, FastAPI, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+
+import compress
+import zip_stream
+from marks_store import MarksStore
+
+try:
+    import zstandard
+except ImportError:  # only needed for archives written with zstd
+    zstandard = None
 
 # Where the fetch pipeline writes its month folders. Same env var the
 # pipeline uses; defaults to the repo's output/ at the project root.
@@ -15,15 +34,46 @@ OUTPUT_DIR = os.environ.get(
 )
 OUTPUT_DIR = os.path.abspath(OUTPUT_DIR)
 
-# Hand-picked marks live in a single file at the output root, kept entirely
+# Hand-picked marks live in a SQLite file at the output root, kept entirely
 # separate from the per-month receipt folders so they survive re-fetches and
 # never touch the pipeline's output. Each mark is a kind, "export" or "hide".
-# Shape: month -> {base_name: kind}, e.g.
-# {"2025-01": {"2025-01-24T03-23-27_407402": "export"}}.
-MARKS_PATH = os.path.join(OUTPUT_DIR, "marks.json")
+# The API shape is month -> {base_name: kind}, e.g.
+# {"2025-01": {"2025-01-24T03-23-27_407402": "export"}}. An older marks.json
+# (same shape) is imported on first start.
+MARKS_PATH = os.path.join(OUTPUT_DIR, "marks.sqlite3")
+LEGACY_MARKS_PATH = os.path.join(OUTPUT_DIR, "marks.json")
+MARK_KINDS = ("export", "hide")
+
+# The fetch pipeline's change journal (fetch/changes.py): a JSON line per
+# ledger update or receipt written, streamed to the browser by /api/events.
+CHANGES_PATH = os.path.join(OUTPUT_DIR, ".changes.jsonl")
+EVENTS_POLL_SECONDS = 0.5
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# With RECEIPT_COMPRESSION=1 the pipeline (fetch/compression.py) keeps a
+# receipt's body in <base_name>.body.html.zst|.gz, named by "body_file" in its
+# JSON, and the sanitized page as <base_name>.html.zst|.gz. Extension ->
+# Content-Encoding for sending those as they are.
+COMPRESSED = {".zst": "zstd", ".gz": "gzip"}
+
+# Cache-Control by kind of route. Lists, receipts and marks change while the
+# pipeline runs, so the browser revalidates them each time; with the ETag that
+# is a 304 costing a few stats instead of the full response. Stored files
+# (attachments, pages, PDFs) only change with an archive migration and may be
+# reused for an hour before asking. Exports are downloads and aren't cached.
+CACHE_REVALIDATE = "no-cache"
+CACHE_FILES = "private, max-age=3600"
+CACHE_NONE = "no-store"
+
+# Rendered PDFs kept in memory, by ETag, so a viewer fetching one in ranges
+# renders it once.
+PDF_CACHE_SIZE = 16
 
 app = FastAPI(title="Gmail Receipts Viewer")
 
+# gzip/brotli for JSON responses (compress.py).
+app.add_middleware(compress.CompressJSON)
+
 # The Vite dev server runs on a different port, so allow it to call us.
 app.add_middleware(
     CORSMiddleware,
@@ -41,9 +91,108 @@ def _month_dir(month: str) -> str:
     return path
 
 
+def _stat_etag(*paths: str | None) -> str:
+    """
+    A strong ETag from the inode, mtime and size of each path (None or a
+    missing file counts as absent). The pipeline replaces files whole -- a
+    .tmp written, then renamed over -- so every rewrite changes all three.
+    """
+    parts = []
+    for path in paths:
+        if path is None:
+            parts.append("-")
+            continue
+        try:
+            st = os.stat(path)
+            parts.append(f"{st.st_ino}-{st.st_mtime_ns}-{st.st_size}")
+        except OSError:
+            parts.append("-")
+    digest = hashlib.sha1("\n".join(parts).encode()).hexdigest()
+    return f'"{digest[:24]}"'
+
+
+def _dir_etag(*dirs: str) -> str:
+    """
+    A strong ETag over every file in `dirs` (name, mtime, size), for the
+    responses built from a whole month: any receipt written, rewritten or
+    deleted changes it. A stat per file, against reading and parsing them all.
+    """
+    digest = hashlib.sha1()
+    for d in dirs:
+        with os.scandir(d) as it:
+            for entry in sorted(it, key=lambda e: e.name):
+                if entry.is_file():
+                    st = entry.stat()
+                    digest.update(f"{d}/{entry.name}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+    return f'"{digest.hexdigest()[:24]}"'
+
+
+def _not_modified(
+    response: Response, if_none_match: str | None, etag: str, cache_control: str = CACHE_REVALIDATE,
+) -> Response | None:
+    """
+    Put a route's ETag and Cache-Control on `response`, or return a 304 to
+    send instead when the client's copy (If-None-Match) is still current.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if compress.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def _send_file(
+    path: str, if_none_match: str | None, cache_control: str = CACHE_FILES, **kwargs,
+) -> Response:
+    """
+    A stored file with Starlette's ETag (from its mtime and size) and
+    Cache-Control, as a 304 when the client's copy is current. FileResponse
+    answers Range and If-Range itself.
+    """
+    response = FileResponse(path, stat_result=os.stat(path), **kwargs)
+    response.headers["Cache-Control"] = cache_control
+    if compress.etag_matches(if_none_match, response.headers["etag"]):
+        return Response(status_code=304, headers={
+            k: response.headers[k] for k in ("etag", "last-modified", "cache-control")})
+    return response
+
+
+def _byte_range(
+    range_header: str | None, if_range: str | None, etag: str, total: int,
+) -> tuple[int, int] | None:
+    """
+    The byte range (start, end; inclusive) a Range header asks of a
+    `total`-byte response, or None for the whole of it: no Range, one that
+    isn't a single bytes range, or an If-Range naming an older version. A
+    range past the end is a 416.
+    """
+    if not range_header or (if_range is not None and if_range != etag):
+        return None
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if match and match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+    elif match and match.group(2):                # a suffix: the last N bytes
+        start, end = max(total - int(match.group(2)), 0), total - 1
+    else:
+        return None
+    if start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{total}"})
+    return start, end
+
+
 @app.get("/api/months")
-def list_months() -> list[str]:
+def list_months(
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+):
     """Every month folder that has data, newest first."""
+    not_modified = _not_modified(response, if_none_match, _stat_etag(OUTPUT_DIR))
+    return not_modified or _months()
+
+
+def _months() -> list[str]:
     months = [
         os.path.basename(p)
         for p in glob.glob(os.path.join(OUTPUT_DIR, "*"))
@@ -52,13 +201,24 @@ def list_months() -> list[str]:
     return sorted(months, reverse=True)
 
 
+def _archive_etag() -> str:
+    """ETag of the responses that read every month's receipts."""
+    return _dir_etag(*(os.path.join(OUTPUT_DIR, m) for m in _months()))
+
+
 @app.get("/api/labels")
-def list_labels() -> list[dict]:
+def list_labels(
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+):
     """
     Every label found across all months, with how many emails carry it.
     Walks every receipt file (skipping the _processed.json ledgers) and
     tallies the labels. Sorted by count, most common first.
     """
+    not_modified = _not_modified(response, if_none_match, _archive_etag())
+    if not_modified:
+        return not_modified
     counts: collections.Counter = collections.Counter()
     for path in glob.glob(os.path.join(OUTPUT_DIR, "*", "*.json")):
         if path.endswith("_processed.json"):
@@ -73,57 +233,226 @@ def list_labels() -> list[dict]:
     ]
 
 
+@app.get("/api/accounts")
+def list_accounts(
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+):
+    """
+    Every mailbox receipts were fetched from, with how many receipts each has.
+    Receipts from a single-account run carry no "account" and are left out, so
+    an archive that was only ever fetched from one mailbox returns [].
+    """
+    not_modified = _not_modified(response, if_none_match, _archive_etag())
+    if not_modified:
+        return not_modified
+    counts: collections.Counter = collections.Counter()
+    for path in glob.glob(os.path.join(OUTPUT_DIR, "*", "*.json")):
+        if path.endswith("_processed.json"):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("account"):
+            counts[data["account"]] += 1
+    return [
+        {"account": account, "count": count}
+        for account, count in counts.most_common()
+    ]
+
+
 @app.get("/api/months/{month}/receipts")
-def list_receipts(month: str) -> list[dict]:
+def list_receipts(
+    month: str,
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+):
     """
     The receipts saved for a month. Each receipt is a self-describing
     <base_name>.json file; we skip the _processed.json ledger and return a
     trimmed summary (no full body) for the list view.
     """
     month_dir = _month_dir(month)
+    not_modified = _not_modified(response, if_none_match, _dir_etag(month_dir))
+    if not_modified:
+        return not_modified
     receipts = []
     for path in sorted(glob.glob(os.path.join(month_dir, "*.json"))):
         if path.endswith("_processed.json"):
             continue
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        receipts.append({
-            "base_name": os.path.basename(path)[: -len(".json")],
-            "uid": data.get("uid"),
-            "date": data.get("date"),
-            "from": data.get("from"),
-            "subject": data.get("subject"),
-            "attachments": data.get("attachments", []),
-            "classification": data.get("classification"),
-            "labels": data.get("labels", []),
-            "to": data.get("to"),
-            "cc": data.get("cc"),
-            "body": data.get("body"),
-        })
+        receipts.append(_summary(path))
     return receipts
 
 
+def _stored(path: str) -> str | None:
+    """`path` itself or its compressed version, whichever the pipeline wrote."""
+    for candidate in (path, *(path + ext for ext in COMPRESSED)):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def _read_stored(path: str) -> bytes:
+    """A stored file's content, decompressed."""
+    with open(path, "rb") as f:
+        data = f.read()
+    ext = os.path.splitext(path)[1]
+    if ext == ".gz":
+        return gzip.decompress(data)
+    if ext == ".zst":
+        if zstandard is None:
+            raise HTTPException(status_code=500, detail="reading .zst files needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def _read_receipt(path: str) -> dict:
+    """A receipt JSON with its "body", whether stored inline or compressed
+    in its own file."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    body_file = data.pop("body_file", None)
+    if body_file:
+        data["body"] = _read_stored(os.path.join(os.path.dirname(path), body_file)).decode("utf-8")
+    return data
+
+
+def _summary(path: str) -> dict:
+    """
+    One receipt file as a list-view row. For searching, the row carries the
+    plain-text rendition the pipeline stored beside it (<base_name>.txt) as
+    "text"; a receipt from before those were written has its HTML "body".
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    text = None
+    text_path = path[: -len(".json")] + ".txt"
+    if os.path.isfile(text_path):
+        with open(text_path, "r", encoding="utf-8") as f:
+            text = f.read()
+    elif "body_file" in data:
+        data = _read_receipt(path)
+    return {
+        "base_name": os.path.basename(path)[: -len(".json")],
+        "uid": data.get("uid"),
+        "date": data.get("date"),
+        "from": data.get("from"),
+        "subject": data.get("subject"),
+        "attachments": data.get("attachments", []),
+        "classification": data.get("classification"),
+        "labels": data.get("labels", []),
+        "account": data.get("account"),
+        "to": data.get("to"),
+        "cc": data.get("cc"),
+        "snippet": data.get("snippet"),
+        "sender_domain": data.get("sender_domain"),
+        "text": text,
+        "body": data.get("body") if text is None else None,
+        "duplicate_of": data.get("duplicate_of"),
+    }
+
+
 @app.get("/api/months/{month}/receipts/{base_name}")
-def get_receipt(month: str, base_name: str) -> dict:
+def get_receipt(
+    month: str,
+    base_name: str,
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+):
     """The full metadata file for one receipt, body included."""
+    path, page = _receipt_files(month, base_name)
+    not_modified = _not_modified(response, if_none_match, _stat_etag(path, page))
+    return not_modified or _receipt(month, base_name)
+
+
+def _receipt_files(month: str, base_name: str) -> tuple[str, str | None]:
+    """A receipt's JSON file and its sanitized page, if it has one."""
     month_dir = _month_dir(month)
     path = os.path.abspath(os.path.join(month_dir, f"{base_name}.json"))
     if os.path.dirname(path) != month_dir or not os.path.isfile(path):
         raise HTTPException(status_code=404, detail="No such receipt")
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    return path, _stored(os.path.join(month_dir, f"{base_name}.html"))
+
+
+def _receipt(month: str, base_name: str) -> dict:
+    path, page = _receipt_files(month, base_name)
+    data = _read_receipt(path)
     # base_name lives in the filename, not the file; add it for the client.
     data["base_name"] = base_name
+    # A near-duplicate stores no body of its own; "duplicate_of" names the
+    # original (<month>/<base_name>), whose body stands in for it.
+    if data.get("duplicate_of"):
+        original_month, _, original_base = data["duplicate_of"].partition("/")
+        try:
+            original_path, page = _receipt_files(original_month, original_base)
+        except HTTPException:
+            page = None
+        else:
+            data["body"] = _read_receipt(original_path).get("body", "")
+            month, base_name = original_month, original_base
+    # The sanitized body, when the pipeline stored one (see get_view_file).
+    if page:
+        data["html_url"] = f"/api/months/{month}/view/{base_name}.html"
     return data
 
 
+@app.get("/api/months/{month}/view/{name}")
+@app.get("/api/months/{month}/view/{base_name}/{name}")
+def get_view_file(
+    month: str,
+    name: str,
+    base_name: str | None = None,
+    accept_encoding: str | None = Header(default=None),
+    if_none_match: str | None = Header(default=None),
+) -> Response:
+    """
+    A receipt's sanitized HTML body (<base_name>.html, written with the
+    receipt: no scripts, cid: images pointing at <base_name>/<file>) and,
+    under the same prefix, the files it links to, so its relative image
+    URLs resolve as they do on disk. A page stored compressed goes out as
+    stored, with Content-Encoding, to a browser that accepts the encoding,
+    and decompressed to one that doesn't.
+    """
+    if base_name is not None:
+        return get_attachment(month, base_name, name, if_none_match)
+    month_dir = _month_dir(month)
+    path = os.path.abspath(os.path.join(month_dir, name))
+    stored = _stored(path) if name.endswith(".html") and os.path.dirname(path) == month_dir else None
+    if stored is None:
+        raise HTTPException(status_code=404, detail="No such page")
+    # Stored sanitized, but served as a page of our own origin: forbid
+    # scripts outright in case anything got through.
+    headers = {"Content-Security-Policy": "script-src 'none'; object-src 'none'",
+               "Vary": "Accept-Encoding"}
+    coding = COMPRESSED.get(os.path.splitext(stored)[1])
+    if coding is None or compress.accepts(accept_encoding, coding):
+        if coding:
+            headers["Content-Encoding"] = coding
+        return _send_file(stored, if_none_match, media_type="text/html; charset=utf-8",
+                          headers=headers)
+    # Decompressed for this client: a different representation, its own tag.
+    etag = _stat_etag(stored)
+    headers.update({"ETag": etag, "Cache-Control": CACHE_FILES})
+    if compress.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(_read_stored(stored), media_type="text/html; charset=utf-8", headers=headers)
+
+
 @app.get("/api/months/{month}/ledger")
-def get_ledger(month: str) -> dict:
+def get_ledger(
+    month: str,
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+):
     """
     How many emails were seen this month and how many are receipts. A receipt is
     counted by the presence of its per-receipt file, not the ledger's is_receipt
     flag, so deleting a file correctly drops it from the count.
     """
+    not_modified = _not_modified(response, if_none_match, _dir_etag(_month_dir(month)))
+    return not_modified or _ledger(month)
+
+
+def _ledger(month: str) -> dict:
     month_dir = _month_dir(month)
     receipts = sum(
         1 for p in glob.glob(os.path.join(month_dir, "*.json"))
@@ -138,28 +467,210 @@ def get_ledger(month: str) -> dict:
     return {"seen": seen, "receipts": receipts}
 
 
+def _event_payloads(lines: list[str]) -> list[tuple[str, dict]]:
+    """
+    Turn journal lines into (event, data) pairs for the browser: a "receipt"
+    carries its list row and the month's fresh ledger counts, a "ledger" just
+    the counts. Only the last ledger line per month in a batch is kept, and a
+    receipt whose file is already gone is dropped.
+    """
+    changes = []
+    for line in lines:
+        try:
+            changes.append(json.loads(line))
+        except ValueError:
+            continue
+    last_ledger = {c.get("month"): i for i, c in enumerate(changes) if c.get("event") == "ledger"}
+    payloads = []
+    for i, change in enumerate(changes):
+        month = change.get("month") or ""
+        try:
+            month_dir = _month_dir(month)
+            if change.get("event") == "receipt":
+                path = os.path.join(month_dir, f"{change.get('base_name')}.json")
+                payloads.append(("receipt", {
+                    "month": month,
+                    "receipt": _summary(path),
+                    "ledger": _ledger(month),
+                }))
+            elif change.get("event") == "ledger" and last_ledger[month] == i:
+                payloads.append(("ledger", {"month": month, "ledger": _ledger(month)}))
+        except (HTTPException, OSError, ValueError):
+            continue
+    return payloads
+
+
+async def _journal_events(request: Request, last_event_id: str | None):
+    """
+    Follow the change journal like `tail -f` and yield it as Server-Sent
+    Events. Event ids are "<inode>:<offset>", so a reconnecting EventSource
+    resumes right after the last event it saw; if the journal it was reading
+    has since been rotated away, a "reset" event tells it to reload instead.
+    Without an id the stream starts at the journal's current end.
+    """
+    yield "retry: 3000\n\n"
+    resume = None
+    if last_event_id and ":" in last_event_id:
+        last_inode, _, offset = last_event_id.partition(":")
+        if last_inode.isdigit() and offset.isdigit():
+            resume = (int(last_inode), int(offset))
+    inode = 0
+    journal = None
+    from_start = False
+    pending = b""
+    idle = 0.0
+    try:
+        while not await request.is_disconnected():
+            if journal is None:
+                try:
+                    journal = open(CHANGES_PATH, "rb")
+                except FileNotFoundError:
+                    from_start = True       # whatever gets written is new
+                    await asyncio.sleep(EVENTS_POLL_SECONDS)
+                    continue
+                stat = os.fstat(journal.fileno())
+                if resume and resume[0] == stat.st_ino and resume[1] <= stat.st_size:
+                    journal.seek(resume[1])
+                elif resume:
+                    yield "event: reset\ndata: {}\n\n"
+                    journal.seek(0, os.SEEK_END)
+                elif not from_start:
+                    journal.seek(0, os.SEEK_END)
+                resume = None
+                inode = stat.st_ino
+
+            chunk = journal.read()
+            if chunk:
+                pending += chunk
+                complete, _, pending = pending.rpartition(b"\n")
+                if complete:
+                    event_id = f"{inode}:{journal.tell() - len(pending)}"
+                    lines = complete.decode("utf-8", errors="replace").split("\n")
+                    for event, data in await run_in_threadpool(_event_payloads, lines):
+                        yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    idle = 0.0
+                continue
+
+            # Caught up. A journal rotated away has been read to its end, so
+            # go on with the new one from its start -- unless it rotated twice
+            # meanwhile and a whole journal went by unread.
+            try:
+                rotated = os.stat(CHANGES_PATH).st_ino != inode
+            except FileNotFoundError:
+                rotated = False
+            if rotated:
+                journal.close()
+                journal, from_start, pending = None, True, b""
+                try:
+                    skipped = os.stat(CHANGES_PATH + ".1").st_ino != inode
+                except FileNotFoundError:
+                    skipped = True
+                if skipped:
+                    yield "event: reset\ndata: {}\n\n"
+                continue
+
+            await asyncio.sleep(EVENTS_POLL_SECONDS)
+            idle += EVENTS_POLL_SECONDS
+            if idle >= EVENTS_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield ": keepalive\n\n"
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+@app.get("/api/events")
+async def stream_events(
+    request: Request,
+    last_event_id: str | None = Header(default=None),
+) -> StreamingResponse:
+    """
+    Live changes from the fetch pipeline as Server-Sent Events: "receipt"
+    (a receipt written: {month, receipt, ledger}), "ledger" (a month's counts
+    changed: {month, ledger}) and "reset" (events were missed; reload).
+    """
+    return StreamingResponse(
+        _journal_events(request, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/api/months/{month}/attachments/{base_name}/{filename}")
-def get_attachment(month: str, base_name: str, filename: str) -> FileResponse:
-    """Serve a receipt's attachment from its <base_name>/ sibling folder."""
+def get_attachment(
+    month: str,
+    base_name: str,
+    filename: str,
+    if_none_match: str | None = Header(default=None),
+) -> Response:
+    """
+    Serve a receipt's attachment from its <base_name>/ sibling folder, with
+    Range requests for viewers that load a large PDF in parts.
+    """
     month_dir = _month_dir(month)
     att_dir = os.path.abspath(os.path.join(month_dir, base_name))
     path = os.path.abspath(os.path.join(att_dir, filename))
     if os.path.dirname(path) != att_dir or not os.path.isfile(path):
         raise HTTPException(status_code=404, detail="No such attachment")
-    return FileResponse(path)
+    return _send_file(path, if_none_match)
+
+
+_pdfs: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+_pdfs_lock = threading.Lock()
 
 
 @app.get("/api/months/{month}/receipts/{base_name}/pdf")
-def render_receipt_pdf(month: str, base_name: str) -> Response:
+def render_receipt_pdf(
+    month: str,
+    base_name: str,
+    range_header: str | None = Header(default=None, alias="Range"),
+    if_range: str | None = Header(default=None),
+    if_none_match: str | None = Header(default=None),
+) -> Response:
     """
     Render just this email's HTML to a vector PDF with headless Chromium, with
     no attachments -- the frontend merges those. Needs Playwright
     (`pip install playwright` + `playwright install chromium`).
+
+    The PDF follows from the receipt's files, so their ETag is its ETag: a
+    current copy gets a 304 without rendering. The last PDF_CACHE_SIZE
+    renders are kept, so Range requests for parts of one are cheap.
     """
+    etag = _stat_etag(*_receipt_files(month, base_name))
+    headers = {"ETag": etag, "Cache-Control": CACHE_FILES, "Accept-Ranges": "bytes",
+               "Content-Disposition": f'inline; filename="{base_name}.pdf"'}
+    if compress.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    with _pdfs_lock:
+        pdf = _pdfs.get(etag)
+        if pdf is not None:
+            _pdfs.move_to_end(etag)
+    if pdf is None:
+        pdf = _render_pdf(month, base_name)
+        with _pdfs_lock:
+            _pdfs[etag] = pdf
+            while len(_pdfs) > PDF_CACHE_SIZE:
+                _pdfs.popitem(last=False)
+
+    byte_range = _byte_range(range_header, if_range, etag, len(pdf))
+    if byte_range is None:
+        return Response(content=pdf, media_type="application/pdf", headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(pdf)}"
+    return Response(content=pdf[start:end + 1], status_code=206, media_type="application/pdf",
+                    headers=headers)
+
+
+def _render_pdf(month: str, base_name: str) -> bytes:
+    """The receipt's email as PDF bytes (see render_receipt_pdf)."""
     from html import escape
     from playwright.sync_api import sync_playwright
 
-    data = get_receipt(month, base_name)
+    data = _receipt(month, base_name)
+    # Prefer the sanitized body the pipeline stored: no scripts to run.
+    sanitized = _stored(os.path.join(_month_dir(month), f"{base_name}.html"))
+    if sanitized:
+        data["body"] = _read_stored(sanitized).decode("utf-8")
 
     # A small header block (from / to / date / subject) above the email's saved
     # HTML body. dir="auto" lets each line pick its own direction, so
@@ -199,52 +710,276 @@ def render_receipt_pdf(month: str, base_name: str) -> Response:
                     "left": "10mm", "right": "10mm"},
         )
         browser.close()
+    return pdf_bytes
+
+
+# Columns of the export's CSV manifest, one row per receipt.
+MANIFEST_FIELDS = [
+    "date", "from", "subject", "account", "labels", "attachments",
+    "is_receipt", "confidence", "reason", "mark", "month", "base_name", "file",
+]
 
-    return Response(
-        content=pdf_bytes,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f'inline; filename="{base_name}.pdf"'},
+
+def _export_selection(
+    since: str | None, before: str | None, label: str | None, mark: str | None,
+):
+    """
+    (month, base_name, path, data) for every receipt in the export selection,
+    oldest first: received on or after `since` and before `before`
+    (YYYY-MM-DD, by the date in the base_name), carrying `label` if given, and
+    marked `mark` if given -- otherwise anything not marked "hide". The
+    parameters are checked now, the receipts read as the result is iterated.
+    Near-duplicates of another receipt ("duplicate_of") are left out; their
+    original is exported once.
+    """
+    for value in (since, before):
+        if value:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=422, detail=f"not a YYYY-MM-DD date: {value}")
+    _check_kinds([mark])
+    return _selected_receipts(since, before, label, mark, _marks_store().all()[1])
+
+
+def _selected_receipts(since, before, label, mark, marks):
+    for month in sorted(_months()):
+        if (since and month < since[:7]) or (before and month > before[:7]):
+            continue
+        for path in sorted(glob.glob(os.path.join(OUTPUT_DIR, month, "*.json"))):
+            if path.endswith("_processed.json"):
+                continue
+            base_name = os.path.basename(path)[: -len(".json")]
+            day = base_name[:10]
+            if (since and day < since) or (before and day >= before):
+                continue
+            kind = marks.get(month, {}).get(base_name)
+            if (kind != mark) if mark else (kind == "hide"):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if label and label not in (data.get("labels") or []):
+                continue
+            if data.get("duplicate_of"):
+                continue
+            yield month, base_name, path, data
+
+
+def _manifest_row(month: str, base_name: str, data: dict, mark: str | None) -> dict:
+    classification = data.get("classification") or {}
+    return {
+        "date": data.get("date"),
+        "from": data.get("from"),
+        "subject": data.get("subject"),
+        "account": data.get("account"),
+        "labels": ";".join(data.get("labels") or []),
+        "attachments": ";".join(data.get("attachments") or []),
+        "is_receipt": classification.get("is_receipt"),
+        "confidence": classification.get("confidence"),
+        "reason": classification.get("reason"),
+        "mark": mark,
+        "month": month,
+        "base_name": base_name,
+        "file": f"{month}/{base_name}.json",
+    }
+
+
+def _export_name(since: str | None, before: str | None, ext: str) -> str:
+    span = "_".join(v for v in (since, before) if v) or "all"
+    return f"receipts_{span}.{ext}"
+
+
+@app.get("/api/export.csv")
+def export_csv(
+    since: str | None = None,
+    before: str | None = None,
+    label: str | None = None,
+    mark: str | None = None,
+) -> StreamingResponse:
+    """
+    The export manifest alone: one CSV row per selected receipt (same
+    selection as /api/export.zip), streamed as the receipts are read.
+    """
+    selection = _export_selection(since, before, label, mark)
+    marks = _marks_store().all()[1]
+
+    def rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for month, base_name, _, data in selection:
+            writer.writerow(_manifest_row(month, base_name, data, marks.get(month, {}).get(base_name)))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{_export_name(since, before, "csv")}"',
+                 "Cache-Control": CACHE_NONE},
+    )
+
+
+@app.get("/api/export.zip")
+def export_zip(
+    since: str | None = None,
+    before: str | None = None,
+    label: str | None = None,
+    mark: str | None = None,
+    pdf: bool = False,
+    range_header: str | None = Header(default=None, alias="Range"),
+    if_range: str | None = Header(default=None),
+) -> Response:
+    """
+    A ZIP of the selected receipts (see _export_selection) for handing on:
+    manifest.csv first, then per receipt <month>/<base_name>.json (and its
+    compressed body file beside it, if it has one, as stored), its
+    attachments under <month>/<base_name>/ and, with pdf=true, the rendered
+    email as <month>/<base_name>.pdf. The archive is written as it is sent,
+    file by file, so memory stays flat however many receipts it holds.
+
+    Without PDFs every size is known before the first byte, so the response
+    has a Content-Length and an ETag and honours Range (with If-Range) for
+    resuming a broken download. Rendered PDFs only get a size once made, so
+    pdf=true archives stream without either (each PDF is dropped once sent;
+    the UI's ZIP button leaves them out for that reason).
+    """
+    marks = _marks_store().all()[1]
+    entries: list[zip_stream.Entry] = []
+    manifest = io.StringIO()
+    writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+    for month, base_name, path, data in _export_selection(since, before, label, mark):
+        writer.writerow(_manifest_row(month, base_name, data, marks.get(month, {}).get(base_name)))
+        stat = os.stat(path)
+        entries.append(zip_stream.Entry(f"{month}/{base_name}.json", path=path,
+                                        size=stat.st_size, mtime=stat.st_mtime))
+        body_file = data.get("body_file")
+        body_path = os.path.join(OUTPUT_DIR, month, body_file) if body_file else None
+        if body_path and os.path.isfile(body_path):
+            body_stat = os.stat(body_path)
+            entries.append(zip_stream.Entry(f"{month}/{body_file}", path=body_path,
+                                            size=body_stat.st_size, mtime=body_stat.st_mtime))
+        if pdf:
+            entries.append(zip_stream.Entry(
+                f"{month}/{base_name}.pdf", mtime=stat.st_mtime,
+                render=functools.partial(_render_pdf, month, base_name)))
+        for filename in data.get("attachments") or []:
+            att = os.path.join(OUTPUT_DIR, month, base_name, filename)
+            if os.path.isfile(att):
+                att_stat = os.stat(att)
+                entries.append(zip_stream.Entry(f"{month}/{base_name}/{filename}", path=att,
+                                                size=att_stat.st_size, mtime=att_stat.st_mtime))
+    manifest_bytes = manifest.getvalue().encode("utf-8")
+    entries.insert(0, zip_stream.Entry("manifest.csv", data=manifest_bytes))
+
+    headers = {"Content-Disposition": f'attachment; filename="{_export_name(since, before, "zip")}"',
+               "Cache-Control": CACHE_NONE}
+    total = zip_stream.archive_size(entries)
+    if total is None:
+        headers["Accept-Ranges"] = "none"
+        return StreamingResponse(zip_stream.stream(entries), media_type="application/zip", headers=headers)
+
+    # The same selection of the same files gives the same bytes.
+    digest = hashlib.sha1()
+    for e in entries:
+        digest.update(e.name + f"\0{e.size}\0{e.mtime}\n".encode())
+    digest.update(manifest_bytes)
+    etag = f'"{digest.hexdigest()}"'
+    headers.update({"ETag": etag, "Accept-Ranges": "bytes"})
+
+    byte_range = _byte_range(range_header, if_range, etag, total)
+    start, end = byte_range or (0, total - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    return StreamingResponse(
+        zip_stream.stream(entries, start, end),
+        status_code=206 if byte_range else 200,
+        media_type="application/zip",
+        headers=headers,
     )
 
 
+_marks: MarksStore | None = None
+
+
+def _marks_store() -> MarksStore:
+    """The marks database, opened (and migrated from marks.json) on first use."""
+    global _marks
+    if _marks is None:
+        _marks = MarksStore(MARKS_PATH, LEGACY_MARKS_PATH)
+    return _marks
+
+
+def _marks_etag(version: int) -> str:
+    return f'"marks-{version}"'
+
+
+def _check_kinds(kinds) -> None:
+    bad = sorted({k for k in kinds if k is not None and k not in MARK_KINDS})
+    if bad:
+        raise HTTPException(status_code=422, detail=f"unknown mark kind: {', '.join(bad)}")
+
+
 @app.get("/api/marks")
-def get_marks() -> dict[str, dict[str, str]]:
+def get_marks(
+    response: Response,
+    if_none_match: str | None = Header(default=None),
+):
     """
     Every marked receipt, grouped by month, each month a {base_name: kind} map:
-    {"2025-01": {"2025-01-24T03-23-27_407402": "export"}}.
+    {"2025-01": {"2025-01-24T03-23-27_407402": "export"}}. The ETag is the
+    store's change version; send it back as If-None-Match to get a bodiless
+    304 when nothing changed since.
     """
-    if not os.path.isfile(MARKS_PATH):
-        return {}
-    with open(MARKS_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+    store = _marks_store()
+    not_modified = _not_modified(response, if_none_match, _marks_etag(store.version()))
+    if not_modified:
+        return not_modified
+    version, marks = store.all()
+    response.headers["ETag"] = _marks_etag(version)
+    return marks
 
 
 @app.put("/api/marks")
 def set_marks(
+    response: Response,
     updates: dict[str, dict[str, str | None]] = Body(...),
 ) -> dict[str, dict[str, str]]:
     """
-    Set a batch of marks in one write and return the full marks dict. The body
-    is the same shape as the marks file -- month -> {base_name: kind} -- where
-    kind is "export", "hide", or null to clear that receipt's mark. Applies
-    every update, then drops any cleared mark or emptied month.
+    Set a batch of marks in one transaction and return the full marks dict.
+    The body has the same shape -- month -> {base_name: kind} -- where kind is
+    "export", "hide", or null to clear that receipt's mark. Only the named
+    receipts are touched, so concurrent batches from other tabs are kept.
     """
-    marks = get_marks()
-
-    # Apply every update: a kind sets the mark, None clears it.
-    for month, month_updates in updates.items():
-        for base_name, kind in month_updates.items():
-            if kind is None:
-                marks.get(month, {}).pop(base_name, None)
-            else:
-                marks.setdefault(month, {})[base_name] = kind
+    _check_kinds(k for items in updates.values() for k in items.values())
+    store = _marks_store()
+    store.update(updates)
+    version, marks = store.all()
+    response.headers["ETag"] = _marks_etag(version)
+    return marks
 
-    # Drop any month left with no marks.
-    marks = {m: items for m, items in marks.items() if items}
 
-    with open(MARKS_PATH, "w", encoding="utf-8") as f:
-        json.dump(marks, f, indent=2, ensure_ascii=False)
-    return marks
+@app.post("/api/marks/bulk")
+def set_marks_bulk(
+    response: Response,
+    kind: str | None = Body(...),
+    receipts: dict[str, list[str]] = Body(...),
+) -> dict:
+    """
+    Give many receipts the same mark (or clear it, kind null) in one
+    transaction: {"kind": "hide", "receipts": {month: [base_name, ...]}}.
+    Returns only {version, count}, not the full marks, so selecting a whole
+    month stays cheap; refetch GET /api/marks when the ETag moved.
+    """
+    _check_kinds([kind])
+    version = _marks_store().update(
+        {month: dict.fromkeys(names, kind) for month, names in receipts.items()})
+    response.headers["ETag"] = _marks_etag(version)
+    return {"version": version, "count": sum(len(n) for n in receipts.values())}
 
 
 if __name__ == "__main__":
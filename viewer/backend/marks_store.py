@@ -0,0 +1,111 @@
+"""
+Hand-picked marks, in SQLite instead of a JSON file rewritten per change.
+
+One row per marked receipt, keyed by (month, base_name), with its kind
+("export" or "hide"). A batch of changes is one transaction of per-row upserts
+and deletes, so concurrent tabs never lose each other's marks and a toggle
+costs the same however many marks there are. Every transaction that changes
+something bumps a version number, which the API exposes as an ETag.
+
+The first open imports an existing marks.json (month -> {base_name: kind}) from
+the same folder, once; the file is left in place.
+"""
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS marks (
+    month     TEXT NOT NULL,
+    base_name TEXT NOT NULL,
+    kind      TEXT NOT NULL,
+    PRIMARY KEY (month, base_name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+
+class MarksStore:
+    def __init__(self, path: str, legacy_json: str | None = None):
+        self.path = path
+        db = sqlite3.connect(path, timeout=10)
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+        with self._connect(write=True) as db:
+            imported = db.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone()
+            if not imported and legacy_json and os.path.isfile(legacy_json):
+                with open(legacy_json, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+                self._apply(db, legacy)
+                print(f"Imported {sum(len(v) for v in legacy.values())} marks from {legacy_json}")
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', 1)")
+
+    def _connect(self, write: bool = False) -> "_Transaction":
+        # A connection per call: FastAPI runs sync endpoints on a thread pool.
+        # Writers take the lock up front (IMMEDIATE) so two batches serialize
+        # instead of failing on upgrade; readers see a WAL snapshot.
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        return _Transaction(db)
+
+    def version(self) -> int:
+        with self._connect() as db:
+            return _version(db)
+
+    def all(self) -> tuple[int, dict[str, dict[str, str]]]:
+        """(version, month -> {base_name: kind}), read in one snapshot."""
+        with self._connect() as db:
+            version = _version(db)
+            marks: dict[str, dict[str, str]] = {}
+            for month, base_name, kind in db.execute(
+                    "SELECT month, base_name, kind FROM marks ORDER BY month, base_name"):
+                marks.setdefault(month, {})[base_name] = kind
+        return version, marks
+
+    def update(self, updates: dict[str, dict[str, str | None]]) -> int:
+        """Apply month -> {base_name: kind or None} in one transaction; None
+        clears a mark. Returns the version after it."""
+        with self._connect(write=True) as db:
+            return self._apply(db, updates)
+
+    @staticmethod
+    def _apply(db, updates: dict[str, dict[str, str | None]]) -> int:
+        sets = [(m, b, k) for m, items in updates.items() for b, k in items.items() if k is not None]
+        clears = [(m, b) for m, items in updates.items() for b, k in items.items() if k is None]
+        before = db.total_changes
+        db.executemany(
+            "INSERT INTO marks (month, base_name, kind) VALUES (?, ?, ?) "
+            "ON CONFLICT (month, base_name) DO UPDATE SET kind = excluded.kind "
+            "WHERE kind != excluded.kind", sets)
+        db.executemany("DELETE FROM marks WHERE month = ? AND base_name = ?", clears)
+        if db.total_changes != before:
+            db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return _version(db)
+
+
+def _version(db: sqlite3.Connection) -> int:
+    return db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+
+class _Transaction:
+    """Commit on a clean exit, roll back on an exception, close either way."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self._db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self._db
+
+    def __exit__(self, exc_type, *exc) -> None:
+        try:
+            self._db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._db.close()
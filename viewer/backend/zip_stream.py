@@ -0,0 +1,184 @@
+"""
+A ZIP archive written as a stream, for downloads too big to build in memory.
+
+Entries are stored, not deflated (receipts are mostly PDFs and images that
+don't compress), and each one's CRC goes in a data descriptor after its data,
+so nothing is read ahead. Memory stays at one read buffer plus the entry list,
+whatever the archive's size.
+
+When every entry's size is known up front (files on disk, bytes in hand), the
+whole layout is known too, so the archive has a fixed length and any byte range
+of it can be produced on its own: the parts before the range are skipped
+without being read, except for the CRCs the range still needs. An entry
+rendered on the fly (render=...) has no size until it is made, and makes the
+archive's length unknown. Its bytes are held only while it is being sent;
+the entry keeps just their size and CRC for the central directory.
+
+No ZIP64: an archive past 4 GiB raises ArchiveTooLarge.
+"""
+import struct
+import zlib
+from datetime import datetime
+from typing import Callable, Iterable, Iterator
+
+CHUNK = 64 * 1024
+ZIP32_LIMIT = 0xFFFFFFFF
+
+_LOCAL = struct.Struct("<IHHHHHIIIHH")
+_DESCRIPTOR = struct.Struct("<IIII")
+_CENTRAL = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END = struct.Struct("<IHHHHIIH")
+
+# Bit 3: sizes and CRC follow the data; bit 11: the name is UTF-8.
+_FLAGS = 0x0808
+
+
+class ArchiveTooLarge(Exception):
+    """The archive would need ZIP64 (an offset or size past 4 GiB)."""
+
+
+class Entry:
+    """One file in the archive: from a path, from bytes, or rendered when the
+    stream reaches it."""
+
+    def __init__(self, name: str, *, path: str | None = None, data: bytes | None = None,
+                 render: Callable[[], bytes] | None = None, size: int | None = None,
+                 mtime: float = 0.0):
+        self.name = name.encode("utf-8")
+        self.path = path
+        self.data = data
+        self.render = render
+        self.size = len(data) if data is not None else size
+        self.mtime = mtime
+        self.crc: int | None = None
+        self.offset = 0
+
+    def _dos_time(self) -> tuple[int, int]:
+        t = datetime.fromtimestamp(self.mtime) if self.mtime else datetime(1980, 1, 1)
+        t = max(t, datetime(1980, 1, 1))
+        return ((t.hour << 11) | (t.minute << 5) | (t.second // 2),
+                ((t.year - 1980) << 9) | (t.month << 5) | t.day)
+
+    def chunks(self) -> Iterator[bytes]:
+        """The entry's data, computing its CRC on the way."""
+        crc = 0
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                while chunk := f.read(CHUNK):
+                    crc = zlib.crc32(chunk, crc)
+                    yield chunk
+        else:
+            assert self.data is not None
+            crc = zlib.crc32(self.data)
+            yield self.data
+        self.crc = crc
+
+    def checksum(self) -> int:
+        """The CRC, reading the data for it if it was skipped."""
+        if self.crc is None:
+            for _ in self.chunks():
+                pass
+        assert self.crc is not None
+        return self.crc
+
+    def local_header(self) -> bytes:
+        time, date = self._dos_time()
+        return _LOCAL.pack(0x04034B50, 20, _FLAGS, 0, time, date, 0, self.size, self.size,
+                           len(self.name), 0) + self.name
+
+    def descriptor(self) -> bytes:
+        return _DESCRIPTOR.pack(0x08074B50, self.checksum(), self.size, self.size)
+
+    def central_header(self) -> bytes:
+        time, date = self._dos_time()
+        return _CENTRAL.pack(0x02014B50, 20, 20, _FLAGS, 0, time, date, self.checksum(),
+                             self.size, self.size, len(self.name), 0, 0, 0, 0, 0,
+                             self.offset) + self.name
+
+
+def _pieces(data: bytes) -> Iterator[bytes]:
+    for i in range(0, len(data), CHUNK):
+        yield data[i:i + CHUNK]
+
+
+def archive_size(entries: list[Entry]) -> int | None:
+    """The archive's exact length, or None if an entry's size isn't known yet."""
+    total = _END.size
+    for e in entries:
+        if e.size is None:
+            return None
+        total += _LOCAL.size + len(e.name) + e.size + _DESCRIPTOR.size   # the entry
+        total += _CENTRAL.size + len(e.name)                             # its directory record
+    return total
+
+
+def stream(entries: list[Entry], start: int = 0, end: int | None = None) -> Iterator[bytes]:
+    """
+    The archive's bytes start..end (inclusive; end None means to the last
+    byte), as a series of chunks. A range other than the whole archive needs
+    every size known (archive_size not None).
+    """
+    pos = 0
+
+    def clip(chunk: bytes) -> bytes:
+        # The part of chunk (which begins at pos) that falls in the range.
+        lo = max(start - pos, 0)
+        hi = len(chunk) if end is None else min(len(chunk), end + 1 - pos)
+        return chunk[lo:hi] if lo < hi else b""
+
+    def past_end() -> bool:
+        return end is not None and pos > end
+
+    for entry in entries:
+        body: Iterable[bytes] | None = None
+        if entry.size is None:
+            assert entry.render is not None
+            rendered = entry.render()
+            entry.size, entry.crc = len(rendered), zlib.crc32(rendered)
+            body = _pieces(rendered)
+            del rendered
+        entry.offset = pos
+        if pos > ZIP32_LIMIT or entry.size > ZIP32_LIMIT:
+            raise ArchiveTooLarge(f"{entry.name.decode()} is past 4 GiB into the archive")
+
+        header = entry.local_header()
+        if out := clip(header):
+            yield out
+        pos += len(header)
+        if past_end():
+            return
+
+        if pos + entry.size <= start:
+            pos += entry.size                    # skipped; CRC read later if needed
+        else:
+            for chunk in body if body is not None else entry.chunks():
+                if out := clip(chunk):
+                    yield out
+                pos += len(chunk)
+                if past_end():
+                    return
+        body = None                              # a rendered entry's bytes go with it
+
+        if pos + _DESCRIPTOR.size > start:
+            if out := clip(entry.descriptor()):
+                yield out
+        pos += _DESCRIPTOR.size
+        if past_end():
+            return
+
+    directory_offset = pos
+    for entry in entries:
+        header_len = _CENTRAL.size + len(entry.name)
+        if pos + header_len > start:
+            if out := clip(entry.central_header()):
+                yield out
+        pos += header_len
+        if past_end():
+            return
+    if directory_offset > ZIP32_LIMIT or pos - directory_offset > ZIP32_LIMIT:
+        raise ArchiveTooLarge("central directory is past 4 GiB into the archive")
+    if len(entries) > 0xFFFF:
+        raise ArchiveTooLarge(f"{len(entries)} entries")
+    if out := clip(_END.pack(0x06054B50, 0, 0, len(entries), len(entries),
+                             pos - directory_offset, directory_offset, 0)):
+        yield out
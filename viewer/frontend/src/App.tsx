@@ -1,6 +1,7 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { Box, Typography } from "@mui/material";
 import {
+  fetchAccounts,
   fetchLabels,
   fetchLedger,
   fetchMarks,
@@ -9,7 +10,9 @@ import {
   fetchReceipts,
   saveMarks,
   setMark,
+  subscribeChanges,
   MarkKind,
+  type AccountCount,
   type LabelCount,
   type Ledger,
   type Marks,
@@ -19,6 +22,7 @@ import {
 } from "./api";
 import { ViewMode, nextViewMode } from "./components/ViewModeButton";
 import { CURRENT_YEAR, pad } from "./constants";
+import { AccountFilter } from "./components/AccountFilter";
 import { AppHeader } from "./components/AppHeader";
 import { ExportMarked } from "./components/ExportMarked";
 import { LabelChips, type LabelState } from "./components/LabelChips";
@@ -34,11 +38,17 @@ export const App = () => {
   const [selectedMonths, setSelectedMonths] = useState<Set<number>>(
     new Set([new Date().getMonth() + 1]),
   );
-  const [ledger, setLedger] = useState<Ledger | null>(null);
+  // Ledger counts per month; the list shows the sum over the chosen months.
+  const [ledgers, setLedgers] = useState<Record<string, Ledger>>({});
   const [receipts, setReceipts] = useState<ReceiptRow[]>([]);
   const [selected, setSelected] = useState<Receipt | null>(null);
   const [selectedMonth, setSelectedMonth] = useState<string>("");
+  // Bumped when the live change stream missed events, to reload the months.
+  const [reloadKey, setReloadKey] = useState<number>(0);
   const [labels, setLabels] = useState<LabelCount[]>([]);
+  const [accounts, setAccounts] = useState<AccountCount[]>([]);
+  // The mailbox the list is narrowed to; "" shows every account.
+  const [account, setAccount] = useState<string>("");
   const [marks, setMarks] = useState<Marks>({});
   const [labelStates, setLabelStates] = useState<Record<string, LabelState>>({});
   // When the "show only" dot is active, this holds that label plus the label
@@ -55,6 +65,9 @@ export const App = () => {
   const [markedView, setMarkedView] = useState<ViewMode>(ViewMode.All);
   const [hiddenView, setHiddenView] = useState<ViewMode>(ViewMode.Without);
   const [filterText, setFilterText] = useState<string>("");
+  // Near-duplicates (forwarded or resent copies) are collapsed into their
+  // original unless switched on.
+  const [showDuplicates, setShowDuplicates] = useState<boolean>(false);
   const [filterFields, setFilterFields] = useState<Set<FilterField>>(
     new Set(["subject", "body", "addresses"]),
   );
@@ -77,6 +90,19 @@ export const App = () => {
     .map((m) => `${year}-${pad(m)}`)
     .filter((m) => months.includes(m))
     .sort();
+  // The same list for the change-stream handlers, which outlive renders.
+  const activeMonthsRef = useRef(activeMonths);
+  useEffect(() => {
+    activeMonthsRef.current = activeMonths;
+  });
+
+  const ledger =
+    activeMonths.length > 0 && activeMonths.every((m) => ledgers[m])
+      ? {
+          seen: activeMonths.reduce((sum, m) => sum + ledgers[m].seen, 0),
+          receipts: activeMonths.reduce((sum, m) => sum + ledgers[m].receipts, 0),
+        }
+      : null;
 
   const toggleMonth = (monthNum: number) => {
     setSelectedMonths((prev) => {
@@ -101,6 +127,11 @@ export const App = () => {
     });
   }, []);
 
+  // The mailboxes receipts came from, for the account filter.
+  useEffect(() => {
+    fetchAccounts().then(setAccounts);
+  }, []);
+
   // Load the marks once on startup so earlier sessions' picks are already
   // ticked when the list opens.
   useEffect(() => {
@@ -171,13 +202,16 @@ export const App = () => {
       .map(([label]) => label),
   );
 
-  // Hide a receipt only when it has labels and every one of them is set to
-  // "hidden". A receipt with no labels, or with at least one shown/highlighted
-  // label, stays in the list.
+  // Keep only the chosen account's receipts (and duplicates only when shown),
+  // then hide a receipt only when it has labels and every one of them is set
+  // to "hidden". A receipt with no labels, or with at least one
+  // shown/highlighted label, stays in the list.
   const labelFiltered = receipts.filter(
     (r) =>
-      r.labels.length === 0 ||
-      r.labels.some((l) => (labelStates[l] ?? "shown") !== "hidden"),
+      (account === "" || r.account === account) &&
+      (showDuplicates || !r.duplicate_of) &&
+      (r.labels.length === 0 ||
+        r.labels.some((l) => (labelStates[l] ?? "shown") !== "hidden")),
   );
 
   // Then narrow by the text box: an empty box shows everything; otherwise a
@@ -188,7 +222,7 @@ export const App = () => {
     if (needle === "") return true;
     const haystacks: (string | null)[] = [];
     if (filterFields.has("subject")) haystacks.push(r.subject);
-    if (filterFields.has("body")) haystacks.push(r.body);
+    if (filterFields.has("body")) haystacks.push(r.text ?? r.body);
     if (filterFields.has("addresses")) haystacks.push(r.from, r.to, r.cc);
     return haystacks.some((h) => h?.toLowerCase().includes(needle));
   });
@@ -235,7 +269,6 @@ export const App = () => {
     setSelected(null);
     if (activeMonths.length === 0) {
       setReceipts([]);
-      setLedger(null);
       return;
     }
     let cancelled = false;
@@ -256,10 +289,10 @@ export const App = () => {
 
     Promise.all(activeMonths.map((m) => fetchLedger(m))).then((perMonth) => {
       if (cancelled) return;
-      setLedger({
-        seen: perMonth.reduce((sum, l) => sum + l.seen, 0),
-        receipts: perMonth.reduce((sum, l) => sum + l.receipts, 0),
-      });
+      setLedgers((prev) => ({
+        ...prev,
+        ...Object.fromEntries(activeMonths.map((m, i) => [m, perMonth[i]])),
+      }));
     });
 
     return () => {
@@ -267,7 +300,41 @@ export const App = () => {
     };
     // activeMonths is rebuilt each render; join it to a stable dependency.
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [activeMonths.join(",")]);
+  }, [activeMonths.join(","), reloadKey]);
+
+  // Follow the fetch pipeline live: a receipt written into a month on screen
+  // is slotted into the list (or replaced, if it was rewritten), a new month
+  // shows up in the picker, and ledger counts update in place -- no refetch of
+  // whole months. If the stream missed events, reload instead.
+  useEffect(() => {
+    const addMonth = (month: string) =>
+      setMonths((prev) =>
+        prev.includes(month) ? prev : [...prev, month].sort().reverse(),
+      );
+    return subscribeChanges({
+      onReceipt: ({ month, receipt, ledger }) => {
+        addMonth(month);
+        setLedgers((prev) => ({ ...prev, [month]: ledger }));
+        if (!activeMonthsRef.current.includes(month)) return;
+        setReceipts((prev) =>
+          [
+            ...prev.filter(
+              (r) => !(r.month === month && r.base_name === receipt.base_name),
+            ),
+            { ...receipt, month },
+          ].sort((a, b) => a.base_name.localeCompare(b.base_name)),
+        );
+      },
+      onLedger: ({ month, ledger }) => {
+        addMonth(month);
+        setLedgers((prev) => ({ ...prev, [month]: ledger }));
+      },
+      onReset: () => {
+        fetchMonths().then(setMonths);
+        setReloadKey((k) => k + 1);
+      },
+    });
+  }, []);
 
   const openReceipt = (m: string, baseName: string) => {
     fetchReceipt(m, baseName).then((r) => {
@@ -323,11 +390,19 @@ export const App = () => {
             onRunFetch={runFetch}
           />
 
+          <AccountFilter
+            accounts={accounts}
+            account={account}
+            onChange={setAccount}
+          />
+
           <ReceiptFilter
             text={filterText}
             fields={filterFields}
+            showDuplicates={showDuplicates}
             onTextChange={setFilterText}
             onToggleField={toggleFilterField}
+            onToggleDuplicates={() => setShowDuplicates((on) => !on)}
           />
 
           <ReceiptList
@@ -352,7 +427,11 @@ export const App = () => {
 
         <Box component="main" sx={{ flex: 1, overflowY: "auto", p: 3 }}>
           {selected ? (
-            <ReceiptDetail month={selectedMonth} receipt={selected} />
+            <ReceiptDetail
+              month={selectedMonth}
+              receipt={selected}
+              onOpen={openReceipt}
+            />
           ) : (
             <Typography color="text.disabled" sx={{ mt: 8, textAlign: "center" }}>
               Select a receipt
@@ -6,7 +6,9 @@ export type Classification = {
   reason: string;
 };
 
-// Summary rows for the list view (no email body).
+// Summary rows for the list view. "text" is the stored plain-text rendition
+// of the body, for search; receipts saved before those existed carry their
+// HTML "body" instead.
 export type ReceiptSummary = {
   base_name: string;
   uid: string;
@@ -16,9 +18,18 @@ export type ReceiptSummary = {
   attachments: string[];
   classification: Classification | null;
   labels: string[];
+  // The mailbox it was fetched from; null for single-account fetches.
+  account: string | null;
   to: string | null;
   cc: string | null;
+  snippet: string | null;
+  sender_domain: string | null;
+  text: string | null;
   body: string | null;
+  // A near-duplicate of another receipt (the same email forwarded or sent
+  // twice): the original's "<month>/<base_name>". It stores no body or
+  // attachments of its own.
+  duplicate_of: string | null;
 };
 
 // A summary row tagged with the month it came from, so a merged list spanning
@@ -33,6 +44,12 @@ export type LabelCount = {
   count: number;
 };
 
+// One mailbox and how many receipts were fetched from it.
+export type AccountCount = {
+  account: string;
+  count: number;
+};
+
 // Full metadata for one receipt.
 export type Receipt = ReceiptSummary & {
   message_id: string;
@@ -49,6 +66,9 @@ export type Receipt = ReceiptSummary & {
   references?: string;
   list_unsubscribe?: string;
   list_id?: string;
+  // The sanitized body page (scripts removed, cid: images resolved), when
+  // the pipeline stored one; otherwise show `body`.
+  html_url?: string;
 };
 
 export type Ledger = {
@@ -84,6 +104,8 @@ export const fetchMonths = () => getJson<string[]>("/api/months");
 
 export const fetchLabels = () => getJson<LabelCount[]>("/api/labels");
 
+export const fetchAccounts = () => getJson<AccountCount[]>("/api/accounts");
+
 export const fetchReceipts = (month: string) =>
   getJson<ReceiptSummary[]>(`/api/months/${month}/receipts`);
 
@@ -117,6 +139,65 @@ export const setMark = (
   kind: MarkKind | null,
 ): Promise<Marks> => saveMarks({ [month]: { [baseName]: kind } });
 
+// Live changes from the fetch pipeline, pushed over Server-Sent Events.
+// A receipt event carries the new (or rewritten) receipt's list row and its
+// month's fresh ledger counts; a ledger event just the counts. A reset means
+// events were missed and everything should be reloaded.
+export type ReceiptChange = {
+  month: string;
+  receipt: ReceiptSummary;
+  ledger: Ledger;
+};
+
+export type LedgerChange = {
+  month: string;
+  ledger: Ledger;
+};
+
+export type ChangeHandlers = {
+  onReceipt: (change: ReceiptChange) => void;
+  onLedger: (change: LedgerChange) => void;
+  onReset: () => void;
+};
+
+// Open the change stream; EventSource reconnects by itself, resuming after the
+// last event it saw. Returns a function that closes it.
+export const subscribeChanges = (handlers: ChangeHandlers): (() => void) => {
+  const source = new EventSource("/api/events");
+  source.addEventListener("receipt", (e) =>
+    handlers.onReceipt(JSON.parse((e as MessageEvent).data)),
+  );
+  source.addEventListener("ledger", (e) =>
+    handlers.onLedger(JSON.parse((e as MessageEvent).data)),
+  );
+  source.addEventListener("reset", () => handlers.onReset());
+  return () => source.close();
+};
+
+// Download links for a streamed ZIP (manifest.csv, receipt JSON, attachments
+// and, with pdf, each rendered email) or the CSV manifest alone. since/before
+// are YYYY-MM-DD; mark narrows to receipts with that mark.
+export type ExportQuery = {
+  since?: string;
+  before?: string;
+  label?: string;
+  mark?: MarkKind;
+  pdf?: boolean;
+};
+
+const exportParams = (query: ExportQuery) =>
+  new URLSearchParams(
+    Object.entries(query)
+      .filter(([, v]) => v !== undefined && v !== false)
+      .map(([k, v]) => [k, String(v)]),
+  ).toString();
+
+export const exportZipUrl = (query: ExportQuery) =>
+  `/api/export.zip?${exportParams(query)}`;
+
+export const exportCsvUrl = (query: ExportQuery) =>
+  `/api/export.csv?${exportParams(query)}`;
+
 // The backend renders this email to a vector PDF (body only, no attachments).
 export const receiptPdfUrl = (month: string, baseName: string) =>
   `/api/months/${month}/receipts/${encodeURIComponent(baseName)}/pdf`;
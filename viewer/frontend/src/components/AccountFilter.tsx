@@ -0,0 +1,33 @@
+import { MenuItem, TextField } from "@mui/material";
+import { type AccountCount } from "../api";
+
+// Narrows the list to one mailbox. Only shown once receipts from more than one
+// account exist; "" means every account.
+export const AccountFilter = ({
+  accounts,
+  account,
+  onChange,
+}: {
+  accounts: AccountCount[],
+  account: string,
+  onChange: (account: string) => void,
+}) => {
+  if (accounts.length < 2) return null;
+  return (
+    <TextField
+      select
+      size="small"
+      label="Account"
+      value={account}
+      onChange={(e) => onChange(e.target.value)}
+      sx={{ mb: 1 }}
+    >
+      <MenuItem value="">All accounts</MenuItem>
+      {accounts.map(({ account: a, count }) => (
+        <MenuItem key={a} value={a}>
+          {a} ({count})
+        </MenuItem>
+      ))}
+    </TextField>
+  );
+};
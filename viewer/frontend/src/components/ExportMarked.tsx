@@ -1,6 +1,7 @@
 import { Button } from "@mui/material";
+import FolderZipIcon from "@mui/icons-material/FolderZip";
 import PictureAsPdfIcon from "@mui/icons-material/PictureAsPdf";
-import { MarkKind, type Marks } from "../api";
+import { MarkKind, exportZipUrl, type Marks } from "../api";
 import { usePdfExport } from "../usePdfExport";
 
 // Name the file after the marked receipts' date span, read from their
@@ -34,6 +35,27 @@ export const ExportMarked = ({ marks }: { marks: Marks }) => {
       >
         {busy ? "Exporting…" : `Export marked (${targets.length})`}
       </Button>
+      {/* The same receipts as a ZIP the backend streams: JSON, original
+          attachments and a CSV manifest. It has a known length, so a broken
+          download resumes; with the rendered emails added it can't. */}
+      <Button
+        color="inherit"
+        size="small"
+        startIcon={<FolderZipIcon />}
+        disabled={targets.length === 0}
+        href={exportZipUrl({ mark: MarkKind.Export })}
+      >
+        ZIP
+      </Button>
+      <Button
+        color="inherit"
+        size="small"
+        startIcon={<FolderZipIcon />}
+        disabled={targets.length === 0}
+        href={exportZipUrl({ mark: MarkKind.Export, pdf: true })}
+      >
+        ZIP + PDFs
+      </Button>
       {dialogs}
     </>
   );
@@ -1,4 +1,13 @@
-import { Box, Button, Chip, Divider, Link, Stack, Typography } from "@mui/material";
+import {
+  Alert,
+  Box,
+  Button,
+  Chip,
+  Divider,
+  Link,
+  Stack,
+  Typography,
+} from "@mui/material";
 import PictureAsPdfIcon from "@mui/icons-material/PictureAsPdf";
 import { attachmentUrl, type Receipt } from "../api";
 import { usePdfExport } from "../usePdfExport";
@@ -7,11 +16,14 @@ import { isImage, isPdf } from "../constants";
 export const ReceiptDetail = ({
   month,
   receipt,
+  onOpen,
 }: {
   month: string,
   receipt: Receipt,
+  onOpen: (month: string, baseName: string) => void,
 }) => {
   const c = receipt.classification;
+  const [originalMonth, originalBase] = receipt.duplicate_of?.split("/") ?? [];
   const { busy, start, dialogs } = usePdfExport();
 
   return (
@@ -43,6 +55,25 @@ export const ReceiptDetail = ({
 
       {dialogs}
 
+      {receipt.duplicate_of && (
+        <Alert
+          severity="info"
+          sx={{ mb: 2 }}
+          action={
+            <Button
+              color="inherit"
+              size="small"
+              onClick={() => onOpen(originalMonth, originalBase)}
+            >
+              Open original
+            </Button>
+          }
+        >
+          A copy of a receipt already stored; the body shown is the
+          original's, and its attachments are there.
+        </Alert>
+      )}
+
       <Box
         sx={{
           display: "grid",
@@ -112,7 +143,11 @@ export const ReceiptDetail = ({
       </Typography>
       <Box
         component="iframe"
-        srcDoc={receipt.body}
+        // The stored sanitized page when there is one; its cid: images
+        // resolve against the view URL. Older receipts show the raw body.
+        {...(receipt.html_url
+          ? { src: receipt.html_url }
+          : { srcDoc: receipt.body })}
         title="email body"
         sandbox="allow-same-origin"
         onLoad={(e) => {
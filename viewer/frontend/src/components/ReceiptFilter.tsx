@@ -9,6 +9,7 @@ import SubjectIcon from "@mui/icons-material/Subject";
 import NotesIcon from "@mui/icons-material/Notes";
 import AlternateEmailIcon from "@mui/icons-material/AlternateEmail";
 import ClearIcon from "@mui/icons-material/Clear";
+import FileCopyIcon from "@mui/icons-material/FileCopy";
 
 // Which parts of an email the text filter looks in. "addresses" covers the
 // to, from and cc fields together.
@@ -27,13 +28,17 @@ const FIELDS: { field: FilterField, label: string, icon: React.ReactNode }[] = [
 export const ReceiptFilter = ({
   text,
   fields,
+  showDuplicates,
   onTextChange,
   onToggleField,
+  onToggleDuplicates,
 }: {
   text: string,
   fields: Set<FilterField>,
+  showDuplicates: boolean,
   onTextChange: (text: string) => void,
   onToggleField: (field: FilterField) => void,
+  onToggleDuplicates: () => void,
 }) => {
   return (
     <Stack direction="row" spacing={1} sx={{ mb: 1, alignItems: "center" }}>
@@ -74,6 +79,16 @@ export const ReceiptFilter = ({
           </Tooltip>
         );
       })}
+      <Tooltip title={showDuplicates ? "Collapse duplicates" : "Show duplicates"}>
+        <IconButton
+          size="small"
+          color={showDuplicates ? "primary" : "default"}
+          onClick={onToggleDuplicates}
+          sx={{ opacity: showDuplicates ? 1 : 0.4 }}
+        >
+          <FileCopyIcon fontSize="small" />
+        </IconButton>
+      </Tooltip>
     </Stack>
   );
 };
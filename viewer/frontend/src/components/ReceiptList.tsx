@@ -327,6 +327,21 @@ export const ReceiptList = ({
               >
                 {shortFrom(r.from)}
               </Box>
+              {r.duplicate_of && (
+                <Tooltip title="Duplicate of another receipt">
+                  <Box
+                    component="span"
+                    sx={{
+                      flexShrink: 0,
+                      color: "text.secondary",
+                      fontSize: "0.8rem",
+                      whiteSpace: "nowrap",
+                    }}
+                  >
+                    copy
+                  </Box>
+                </Tooltip>
+              )}
               {r.attachments.length > 0 && (
                 <Box
                   component="span"
@@ -383,6 +398,7 @@ export const ReceiptList = ({
                       }}
                     >
                       <span>{r.date}</span>
+                      {r.duplicate_of && <span>copy</span>}
                       {r.attachments.length > 0 && (
                         <span>📎 {r.attachments.length}</span>
                       )}